@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import psycopg
 from psycopg.rows import dict_row
@@ -9,7 +9,11 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from auth.auth_utils import get_current_user, require_admin
-from utils.download_helpers import fetch_plan_bundle, build_plan_zip
+from auth.password_hashing import hashing_metrics
+from auth.profile_cache import invalidate_user_profile
+from utils.download_helpers import fetch_plan_bundle, build_plan_zip, priced_deliverable_keys
+from utils.file_serving import send_package
+from utils.http_clients import http_client_metrics
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -537,15 +541,7 @@ def admin_download_plan(plan_id):
         if files_added == 0:
             return jsonify(message="Plan files could not be located on the server"), 404
 
-        zip_buffer.seek(0)
-        response = send_file(
-            zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=download_name
-        )
-        response.headers['Cache-Control'] = 'no-store'
-        return response
+        return send_package(zip_buffer, download_name)
 
     except Exception as e:
         return jsonify(error=str(e)), 500
@@ -674,22 +670,7 @@ def list_purchases():
             record = dict(row)
 
             # Normalize deliverable_prices + selected_deliverables and compute full/partial purchase.
-            deliverable_prices = record.get('deliverable_prices')
-            if isinstance(deliverable_prices, str):
-                try:
-                    deliverable_prices = json.loads(deliverable_prices)
-                except Exception:
-                    deliverable_prices = None
-
-            priced_keys = set()
-            if isinstance(deliverable_prices, dict):
-                for k, v in deliverable_prices.items():
-                    try:
-                        n = 0 if v is None or v == '' else float(v)
-                    except Exception:
-                        n = 0
-                    if isinstance(k, str) and n > 0:
-                        priced_keys.add(k)
+            priced_keys = priced_deliverable_keys(record.get('deliverable_prices'))
 
             raw_sel = record.get('selected_deliverables')
             if isinstance(raw_sel, str):
@@ -933,6 +914,7 @@ def update_user(user_id):
             return jsonify(message="User not found"), 404
         
         conn.commit()
+        invalidate_user_profile(user_id)
         
         return jsonify(message="User updated successfully"), 200
         
@@ -980,6 +962,7 @@ def delete_user(user_id):
         """, (user_id,))
         
         conn.commit()
+        invalidate_user_profile(user_id)
         
         return jsonify(message="User deactivated successfully"), 200
         
@@ -1140,6 +1123,80 @@ def delete_plan(plan_id):
         conn.close()
 
 
+@admin_bp.route('/storage/usage', methods=['GET'])
+@jwt_required()
+@require_admin
+def storage_usage():
+    """
+    Disk usage per designer (or per plan with ?scope=plan), largest first.
+    Counters are refreshed by `manage.py storage-gc` at the end of each pass.
+    """
+    scope = request.args.get('scope', 'designer')
+    if scope not in ('designer', 'plan'):
+        return jsonify(message="scope must be 'designer' or 'plan'"), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        if scope == 'designer':
+            cur.execute("""
+                SELECT su.scope_id, su.file_count, su.bytes, su.unique_bytes, su.updated_at,
+                       u.username AS name
+                FROM storage_usage su
+                LEFT JOIN users u ON u.id::text = su.scope_id
+                WHERE su.scope = 'designer'
+                ORDER BY su.unique_bytes DESC
+                LIMIT %s
+            """, (limit,))
+        else:
+            cur.execute("""
+                SELECT su.scope_id, su.file_count, su.bytes, su.unique_bytes, su.updated_at,
+                       p.name
+                FROM storage_usage su
+                LEFT JOIN plans p ON p.id::text = su.scope_id
+                WHERE su.scope = 'plan'
+                ORDER BY su.unique_bytes DESC
+                LIMIT %s
+            """, (limit,))
+        rows = [dict(row) for row in cur.fetchall()]
+
+        cur.execute("""
+            SELECT COALESCE(SUM(size_bytes), 0) AS bytes, COUNT(*) AS files
+            FROM storage_quarantine
+        """)
+        quarantine = dict(cur.fetchone())
+
+        return jsonify(scope=scope, usage=rows, quarantine=quarantine), 200
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
+@admin_bp.route('/metrics/password-hashing', methods=['GET'])
+@jwt_required()
+@require_admin
+def password_hashing_metrics():
+    """
+    Queue-wait and bcrypt compute latency histograms for this worker process,
+    plus how many hash/verify calls were refused because the pool was full.
+    """
+    return jsonify(hashing_metrics()), 200
+
+
+@admin_bp.route('/metrics/http-clients', methods=['GET'])
+@jwt_required()
+@require_admin
+def outbound_http_metrics():
+    """
+    Latency histograms, status classes, errors, retries and keep-alive reuse
+    for each outbound upstream (paystack, llm, assets) in this worker process.
+    """
+    return jsonify(http_client_metrics()), 200
+
+
 @admin_bp.route('/analytics/revenue', methods=['GET'])
 @jwt_required()
 @require_admin
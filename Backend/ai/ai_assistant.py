@@ -2,10 +2,11 @@ from flask import Blueprint, request, jsonify, current_app
 import os
 import re
 import json
-import requests
 import psycopg
 from psycopg.rows import dict_row
 
+from utils import http_clients
+
 try:
     from .site_knowledge import SITE_KNOWLEDGE
 except Exception:
@@ -111,6 +112,19 @@ def _general_chat_reply(message: str) -> str:
     )
 
 
+def _read_on_fresh_connection(read, *args, **kwargs):
+    """Run a read helper on a short-lived connection.
+
+    chat() closes its own connection before the LLM call; branches that need
+    the database after that point use this instead.
+    """
+    conn = get_db()
+    try:
+        return read(conn, *args, **kwargs)
+    finally:
+        conn.close()
+
+
 def _top_selling_plans(conn, limit: int = 6) -> list[dict]:
     limit = max(1, min(int(limit or 6), 10))
     cur = conn.cursor(row_factory=dict_row)
@@ -170,7 +184,7 @@ def _call_local_llm(messages: list[dict], temperature: float = 0.4, max_tokens:
         "stream": False,
     }
     try:
-        resp = requests.post(url, json=payload, timeout=12)
+        resp = http_clients.request('llm', 'POST', url, json=payload)
         if resp.status_code != 200:
             try:
                 current_app.logger.warning(f"LLM non-200: {resp.status_code} body={resp.text[:400]}")
@@ -1310,6 +1324,9 @@ def chat():
 
         focused_plan = _get_plan_public_details(conn, plan_id) if plan_id else None
         focused_plan_question = bool(focused_plan and _is_focused_plan_question(routed_message))
+        # The rest is prompt building and the LLM call; don't hold a database
+        # connection (and its open transaction) while waiting on the model.
+        conn.close()
 
         if _env_bool('AI_ROUTING_DEBUG', False):
             try:
@@ -2144,7 +2161,7 @@ def chat():
                 q_parts.append(str(focused_plan.get('project_type')))
             query = " ".join([p for p in q_parts if p]).strip() or (focused_plan.get('name') or '')
 
-            similar = _search_plans(conn, query, limit=limit)
+            similar = _read_on_fresh_connection(_search_plans, query, limit=limit)
             # Remove the current plan from results if present.
             fid = str(focused_plan.get('id')) if focused_plan.get('id') is not None else None
             similar = [p for p in (similar or []) if str(p.get('id')) != fid]
@@ -2319,7 +2336,7 @@ def chat():
                 }), 200
 
             if _is_top_selling_question(routed_message):
-                top = _top_selling_plans(conn, limit=6)
+                top = _read_on_fresh_connection(_top_selling_plans, limit=6)
                 top_facts = []
                 for p in top:
                     pid = p.get('id')
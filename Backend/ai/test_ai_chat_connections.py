@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from ai import ai_assistant  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+_FOCUSED = {'id': 'plan-1', 'name': 'Coastal Villa', 'description': 'Open plan', 'price': 400,
+            'category': 'Residential', 'project_type': 'Villa', 'area': 180, 'bedrooms': 3,
+            'bathrooms': 2, 'floors': 2, 'includes_boq': True, 'created_at': None}
+
+
+def _plan(plan_id, name):
+    return {'id': plan_id, 'name': name, 'price': 300, 'category': 'Residential', 'bedrooms': 3,
+            'floors': 2, 'includes_boq': True, 'deliverable_prices': None, 'sales_count': 4}
+
+
+def _respond(sql, params):
+    if 'WHERE p.id = %s' in sql:
+        return [dict(_FOCUSED)]
+    return [_plan('plan-1', 'Coastal Villa'), _plan('plan-2', 'Hillside House'), _plan('plan-3', 'Garden Cottage')]
+
+
+class ChatConnectionTests(unittest.TestCase):
+    """chat() closes its connection before the LLM call; later reads must not reuse it."""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['DATABASE_URL'] = 'postgresql://unused'
+        app.register_blueprint(ai_assistant.ai_bp)
+        self.client = app.test_client()
+        self.connections = []
+
+        def get_db():
+            conn = FakeConnection(respond=_respond)
+            self.connections.append(conn)
+            return conn
+
+        for patcher in (
+            mock.patch.object(ai_assistant, 'get_db', side_effect=get_db),
+            mock.patch.object(ai_assistant, '_call_local_llm', return_value=None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _chat(self, **body):
+        resp = self.client.post('/ai/chat', json=body)
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        self.assertTrue(all(conn.closed for conn in self.connections), 'every connection is closed')
+        return resp.get_json()
+
+    def test_similar_plans_on_a_focused_plan(self):
+        # Most "similar" phrasings are caught by the edge-case router first; take it out of the way.
+        with mock.patch.object(ai_assistant, '_edge_case_intent_key', return_value=None):
+            body = self._chat(message='show similar ones', plan_id='plan-1')
+
+        ids = [plan['id'] for plan in body['suggested_plans']]
+        self.assertTrue(ids)
+        self.assertNotIn('plan-1', ids)
+        self.assertGreater(len(self.connections), 1, 'the search ran on a fresh connection')
+
+    def test_top_selling_fallback_when_the_llm_is_down(self):
+        body = self._chat(message='what is best selling right now')
+
+        self.assertFalse(body['llm_used'])
+        self.assertEqual([plan['id'] for plan in body['suggested_plans']], ['plan-1', 'plan-2', 'plan-3'])
+        self.assertTrue(any(conn.statements('ORDER BY COALESCE(p.sales_count, 0) DESC') for conn in self.connections))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,8 @@ from functools import wraps
 import psycopg
 from psycopg.rows import dict_row
 
+from auth.profile_cache import get_user_profile
+
 
 def get_current_user():
     """
@@ -118,21 +120,11 @@ def get_user_info(user_id, conn):
     Get complete user information
     Returns: dict with user info or None
     """
-    cur = conn.cursor(row_factory=dict_row)
-    
-    try:
-        cur.execute("""
-            SELECT id, username, email, role, created_at,
-                   is_active, last_login
-            FROM users
-            WHERE id = %s
-        """, (user_id,))
-        
-        result = cur.fetchone()
-        return dict(result) if result else None
-        
-    finally:
-        cur.close()
+    result = get_user_profile(user_id, conn=conn)
+    if not result:
+        return None
+    fields = ('id', 'username', 'email', 'role', 'created_at', 'is_active', 'last_login')
+    return {field: result[field] for field in fields}
 
 
 def log_user_activity(user_id, activity_type, details, conn):
@@ -0,0 +1,150 @@
+"""
+Password hashing off the request thread.
+
+bcrypt is deliberately slow, so a burst of logins or signups can tie up every
+web worker. Hashes run on a small dedicated pool instead; when too many are
+already queued or running, callers get PasswordHashingBusy (mapped to 429)
+straight away rather than waiting behind the burst.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+from utils.metrics import LatencyHistogram
+
+
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(2, os.cpu_count() or 1))))
+# Hashes queued or running at once; the rest are refused with a 429.
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', '16'))
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv('PASSWORD_HASH_TIMEOUT_SECONDS', '10'))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 2
+
+# bcrypt only looks at the first 72 bytes; older library versions truncated
+# silently, newer ones raise, so truncate explicitly to keep existing hashes valid.
+_BCRYPT_MAX_BYTES = 72
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE_LIMIT)
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated; the request should be retried later."""
+
+
+class _Metrics:
+    def __init__(self):
+        self.queue_wait = {}
+        self.compute = {}
+        self.rejected = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, table, operation):
+        with self._lock:
+            if operation not in table:
+                table[operation] = LatencyHistogram()
+            return table[operation]
+
+    def reject(self, operation):
+        with self._lock:
+            self.rejected[operation] = self.rejected.get(operation, 0) + 1
+
+
+_metrics = _Metrics()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    thread_name_prefix='plancave-password-hash',
+                )
+    return _executor
+
+
+def _run(operation, fn, *args):
+    if not _slots.acquire(blocking=False):
+        _metrics.reject(operation)
+        raise PasswordHashingBusy(f"Too many password {operation} operations in progress")
+
+    submitted = time.monotonic()
+
+    def task():
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            _metrics.histogram(_metrics.queue_wait, operation).observe(started - submitted)
+            _metrics.histogram(_metrics.compute, operation).observe(time.monotonic() - started)
+            _slots.release()
+
+    try:
+        future = _get_executor().submit(task)
+    except RuntimeError:
+        # Interpreter shutdown
+        _slots.release()
+        raise
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        # The hash keeps its slot until it actually finishes.
+        _metrics.reject(operation)
+        raise PasswordHashingBusy(f"Password {operation} timed out waiting for the hashing pool")
+
+
+def _encode(password):
+    return password.encode('utf-8')[:_BCRYPT_MAX_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(hashed_password, password):
+    try:
+        return bcrypt.checkpw(_encode(password), hashed_password.encode('utf-8'))
+    except ValueError:
+        # Malformed or non-bcrypt hash
+        return False
+
+
+def hash_password(password, rounds=None):
+    """bcrypt hash of `password` at BCRYPT_LOG_ROUNDS (or `rounds`); raises PasswordHashingBusy."""
+    return _run('hash', _hash, password, rounds or BCRYPT_LOG_ROUNDS)
+
+
+def verify_password(hashed_password, password):
+    """True if `password` matches; raises PasswordHashingBusy."""
+    if not hashed_password or password is None:
+        return False
+    return _run('verify', _verify, hashed_password, password)
+
+
+def hash_cost(hashed_password):
+    """Cost factor stored in a bcrypt hash ($2b$12$...), or None if it is not one."""
+    parts = (hashed_password or '').split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def needs_rehash(hashed_password, rounds=None):
+    return hash_cost(hashed_password) != (rounds or BCRYPT_LOG_ROUNDS)
+
+
+def hashing_metrics():
+    return {
+        'workers': PASSWORD_HASH_WORKERS,
+        'queue_limit': PASSWORD_HASH_QUEUE_LIMIT,
+        'cost': BCRYPT_LOG_ROUNDS,
+        'queue_wait': {op: h.snapshot() for op, h in sorted(_metrics.queue_wait.items())},
+        'compute': {op: h.snapshot() for op, h in sorted(_metrics.compute.items())},
+        'rejected': dict(_metrics.rejected),
+    }
@@ -0,0 +1,107 @@
+"""
+Per-process cache of user profile rows.
+
+The SPA asks for the current user's profile on nearly every page, so rows
+are kept in memory for PROFILE_CACHE_TTL_SECONDS. Every handler that writes
+to users calls invalidate_user_profile(). Other worker processes can serve
+the old row until their TTL runs out, so keep the TTL short.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import jsonify, request
+from psycopg.rows import dict_row
+
+
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv('PROFILE_CACHE_TTL_SECONDS', '30'))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', '10000'))
+
+PROFILE_COLUMNS = (
+    'id', 'username', 'email', 'role', 'first_name', 'middle_name', 'last_name',
+    'profile_picture_url', 'phone', 'profile_image', 'created_at', 'is_active',
+    'last_login', 'email_verified',
+)
+
+_entries = OrderedDict()  # user_id -> (expires_at, row)
+_generations = {}  # user_id -> bumped on every invalidation
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _load(user_id, conn):
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(f"SELECT {', '.join(PROFILE_COLUMNS)} FROM users WHERE id = %s", (user_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+    finally:
+        cur.close()
+
+
+def get_user_profile(user_id, connect=None, conn=None):
+    """The users row for `user_id` (PROFILE_COLUMNS), or None if there is no such user.
+
+    On a miss the row is read through `conn`, or through a connection from
+    `connect()` that is opened only then. Returns a copy the caller may modify.
+    """
+    user_id = int(user_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry and entry[0] > now:
+            _entries.move_to_end(user_id)
+            _stats['hits'] += 1
+            return dict(entry[1]) if entry[1] is not None else None
+        _stats['misses'] += 1
+        generation = _generations.get(user_id, 0)
+
+    if conn is not None:
+        row = _load(user_id, conn)
+    else:
+        owned = connect()
+        try:
+            row = _load(user_id, owned)
+        finally:
+            owned.close()
+
+    with _lock:
+        # An invalidation while we were reading means this row may already be stale.
+        if _generations.get(user_id, 0) == generation:
+            _entries[user_id] = (time.monotonic() + PROFILE_CACHE_TTL_SECONDS, row)
+            _entries.move_to_end(user_id)
+            while len(_entries) > PROFILE_CACHE_MAX_ENTRIES:
+                _entries.popitem(last=False)
+    return dict(row) if row is not None else None
+
+
+def invalidate_user_profile(user_id):
+    """Drop the cached row; call after any change to the user's row is committed."""
+    user_id = int(user_id)
+    with _lock:
+        _entries.pop(user_id, None)
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+
+
+def clear_profile_cache():
+    with _lock:
+        _entries.clear()
+        _generations.clear()
+
+
+def profile_cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries))
+
+
+def conditional_json(payload):
+    """JSON response carrying an ETag of `payload`; 304 when the client already has it."""
+    body = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    resp = jsonify(payload)
+    resp.set_etag(hashlib.sha256(body).hexdigest()[:32], weak=True)
+    # Private to this user, and always revalidated so profile edits show up at once.
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
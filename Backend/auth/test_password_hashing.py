@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from auth import password_hashing  # noqa: E402
+
+
+class PasswordHashingTests(unittest.TestCase):
+    def test_hash_and_verify_round_trip(self):
+        hashed = password_hashing.hash_password('correct horse', rounds=4)
+
+        self.assertTrue(password_hashing.verify_password(hashed, 'correct horse'))
+        self.assertFalse(password_hashing.verify_password(hashed, 'wrong'))
+        self.assertFalse(password_hashing.verify_password('not-a-hash', 'correct horse'))
+        self.assertFalse(password_hashing.verify_password(None, 'correct horse'))
+
+    def test_passwords_longer_than_72_bytes_still_work(self):
+        long_password = 'x' * 100
+        hashed = password_hashing.hash_password(long_password, rounds=4)
+
+        self.assertTrue(password_hashing.verify_password(hashed, long_password))
+
+    def test_rehash_is_needed_only_when_the_cost_changed(self):
+        hashed = password_hashing.hash_password('pw', rounds=4)
+
+        self.assertEqual(password_hashing.hash_cost(hashed), 4)
+        self.assertFalse(password_hashing.needs_rehash(hashed, rounds=4))
+        self.assertTrue(password_hashing.needs_rehash(hashed, rounds=5))
+        self.assertTrue(password_hashing.needs_rehash('plaintext', rounds=4))
+
+    def test_saturated_pool_refuses_instead_of_queueing(self):
+        hashed = password_hashing.hash_password('pw', rounds=4)
+        slots = threading.BoundedSemaphore(1)
+
+        with mock.patch.object(password_hashing, '_slots', slots):
+            slots.acquire()  # another request's hash is in flight
+            with self.assertRaises(password_hashing.PasswordHashingBusy):
+                password_hashing.verify_password(hashed, 'pw')
+            slots.release()
+
+            self.assertTrue(password_hashing.verify_password(hashed, 'pw'))
+            # The finished task handed its slot back.
+            self.assertTrue(slots.acquire(blocking=False))
+        self.assertGreaterEqual(password_hashing.hashing_metrics()['rejected']['verify'], 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = password_hashing.LatencyHistogram(buckets_ms=(10, 100))
+        for seconds in (0.001, 0.05, 0.05, 2):
+            histogram.observe(seconds)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['buckets_ms'], {'10': 1, '100': 3, '+Inf': 4})
+        self.assertEqual(snapshot['count'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
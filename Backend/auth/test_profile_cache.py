@@ -0,0 +1,87 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from auth import profile_cache  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+def _profile_connection(db, on_select=None):
+    def respond(sql, params):
+        db['queries'] += 1
+        if on_select:
+            on_select()
+        return db['rows'].get(params[0])
+    return FakeConnection(respond=respond)
+
+
+class ProfileCacheTests(unittest.TestCase):
+    def setUp(self):
+        profile_cache.clear_profile_cache()
+        self.db = {'queries': 0, 'rows': {7: {'id': 7, 'username': 'a@x.com', 'first_name': 'Ann'}}}
+
+    def _connect(self):
+        return _profile_connection(self.db)
+
+    def test_repeat_reads_are_memory_hits_until_invalidated(self):
+        first = profile_cache.get_user_profile(7, connect=self._connect)
+        first['first_name'] = 'mutated by caller'
+        second = profile_cache.get_user_profile('7', connect=self._connect)
+
+        self.assertEqual(second['first_name'], 'Ann')
+        self.assertEqual(self.db['queries'], 1)
+
+        self.db['rows'][7]['first_name'] = 'Anne'
+        profile_cache.invalidate_user_profile(7)
+        self.assertEqual(profile_cache.get_user_profile(7, connect=self._connect)['first_name'], 'Anne')
+        self.assertEqual(self.db['queries'], 2)
+
+    def test_entries_expire_after_the_ttl(self):
+        with mock.patch.object(profile_cache, 'PROFILE_CACHE_TTL_SECONDS', 30), \
+                mock.patch.object(profile_cache.time, 'monotonic', side_effect=[100, 100, 120, 131, 131]):
+            profile_cache.get_user_profile(7, connect=self._connect)
+            profile_cache.get_user_profile(7, connect=self._connect)
+            profile_cache.get_user_profile(7, connect=self._connect)
+
+        self.assertEqual(self.db['queries'], 2)
+
+    def test_row_read_during_an_invalidation_is_not_cached(self):
+        conn = _profile_connection(self.db, on_select=lambda: profile_cache.invalidate_user_profile(7))
+        profile_cache.get_user_profile(7, conn=conn)
+        profile_cache.get_user_profile(7, connect=self._connect)
+
+        self.assertEqual(self.db['queries'], 2)
+        self.assertFalse(conn.closed, 'a borrowed connection is left open')
+
+    def test_missing_users_are_cached_too(self):
+        self.assertIsNone(profile_cache.get_user_profile(99, connect=self._connect))
+        self.assertIsNone(profile_cache.get_user_profile(99, connect=self._connect))
+        self.assertEqual(self.db['queries'], 1)
+
+    def test_matching_etag_gets_a_304(self):
+        app = Flask(__name__)
+        payload = {'id': 7, 'email': 'a@x.com'}
+
+        with app.test_request_context('/me'):
+            first = profile_cache.conditional_json(payload)
+        etag = first.headers['ETag']
+        with app.test_request_context('/me', headers={'If-None-Match': etag}):
+            revalidated = profile_cache.conditional_json(payload)
+        with app.test_request_context('/me', headers={'If-None-Match': etag}):
+            changed = profile_cache.conditional_json(dict(payload, email='b@x.com'))
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn('no-cache', first.headers['Cache-Control'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from auth import usernames  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+def _user(user_id, username, verified=True, active=True, last_login=None):
+    return {'id': user_id, 'username': username, 'email_verified': verified,
+            'is_active': active, 'last_login': last_login}
+
+
+class UsernameTests(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(usernames.normalize_username('  Bob@Example.COM '), 'bob@example.com')
+        self.assertEqual(usernames.normalize_username(None), '')
+
+    def test_keeper_is_the_verified_most_recently_used_account(self):
+        conn = FakeConnection([[
+            _user(1, 'Bob@x.com', verified=False),
+            _user(2, 'bob@x.com', last_login=datetime(2024, 1, 1)),
+            _user(3, 'BOB@x.com', last_login=datetime(2025, 1, 1)),
+            _user(4, 'amy@x.com'),
+            _user(5, 'Amy@x.com'),
+        ]])
+
+        groups = usernames.find_case_duplicates(conn.cursor())
+
+        self.assertEqual([[u['id'] for u in group] for group in groups], [[4, 5], [3, 2, 1]])
+
+    def test_report_only_changes_nothing(self):
+        conn = FakeConnection([[_user(1, 'a@x.com'), _user(2, 'A@x.com')]])
+
+        groups = usernames.resolve_case_duplicates(conn)
+
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(len(conn.executed), 1)
+        self.assertTrue(conn.rolled_back)
+        self.assertFalse(conn.committed)
+
+    def test_apply_renames_losers_and_builds_the_unique_index(self):
+        conn = FakeConnection([[_user(1, 'a@x.com'), _user(2, 'A@x.com')]])
+
+        usernames.resolve_case_duplicates(conn, apply=True)
+
+        renames = [params for sql, params in conn.executed if sql.startswith('UPDATE users')]
+        self.assertEqual(renames, [('dup2+a@x.com', 2)])
+        self.assertTrue(any('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lower' in sql for sql, _ in conn.executed))
+        self.assertTrue(conn.committed)
+
+
+if __name__ == '__main__':
+    unittest.main()
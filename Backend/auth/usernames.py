@@ -0,0 +1,143 @@
+"""
+Case-insensitive usernames.
+
+Usernames are emails, compared case-insensitively through the
+LOWER(username) expression index (see database/migrations.sql). Accounts
+created before registration lowercased its input can collide on that index;
+resolve_case_duplicates() settles those so the index can be made unique.
+"""
+import time
+from statistics import median
+
+from psycopg import sql
+from psycopg.rows import dict_row
+
+
+USERNAME_MAX_LENGTH = 150
+UNIQUE_INDEX = 'idx_users_username_lower'
+FALLBACK_INDEX = 'idx_users_username_lower_nonunique'
+
+
+def normalize_username(value):
+    return (value or '').strip().lower()
+
+
+def _keeper_rank(user):
+    """Prefer the account people actually use: verified, active, most recently logged in, oldest."""
+    last_login = user.get('last_login')
+    return (
+        not user.get('email_verified'),
+        not user.get('is_active'),
+        -(last_login.timestamp() if last_login else float('-inf')),
+        user['id'],
+    )
+
+
+def renamed_username(user):
+    return f"dup{user['id']}+{user['username'].lower()}"[:USERNAME_MAX_LENGTH]
+
+
+def find_case_duplicates(cur):
+    """Groups of accounts whose usernames differ only by case, keeper first."""
+    cur.execute(
+        """
+        SELECT id, username, email_verified, is_active, last_login
+        FROM users
+        WHERE LOWER(username) IN (
+            SELECT LOWER(username) FROM users GROUP BY LOWER(username) HAVING COUNT(*) > 1
+        )
+        ORDER BY LOWER(username), id
+        """
+    )
+    groups = {}
+    for user in cur.fetchall():
+        groups.setdefault(user['username'].lower(), []).append(user)
+    return [sorted(group, key=_keeper_rank) for _, group in sorted(groups.items())]
+
+
+def resolve_case_duplicates(conn, apply=False, log=None):
+    """Rename every account but the keeper in each duplicate group, then make the index unique.
+
+    Renamed accounts keep their data and can be merged or restored by an
+    admin; username_case_duplicates records what each was called. Returns the
+    groups found.
+    """
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        groups = find_case_duplicates(cur)
+        for keeper, *others in groups:
+            for user in others:
+                new_name = renamed_username(user)
+                if log:
+                    log(f"{user['username']} (id {user['id']}) -> {new_name}; keeping id {keeper['id']}")
+                if not apply:
+                    continue
+                cur.execute(
+                    """
+                    INSERT INTO username_case_duplicates (user_id, original_username, kept_user_id)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id) DO NOTHING
+                    """,
+                    (user['id'], user['username'], keeper['id'])
+                )
+                cur.execute("UPDATE users SET username = %s WHERE id = %s", (new_name, user['id']))
+
+        if apply:
+            cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON users (LOWER(username))")
+            cur.execute(f"DROP INDEX IF EXISTS {FALLBACK_INDEX}")
+            conn.commit()
+        else:
+            conn.rollback()
+        return groups
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def benchmark_username_lookup(conn, sizes, lookups=200):
+    """Time the login lookup against throwaway tables of each size.
+
+    Each table mirrors users(username) with the same expression index, so the
+    numbers show how the query scales without touching real accounts. Returns
+    one row per size with p50/p95 latency and the plan node Postgres chose.
+    """
+    results = []
+    cur = conn.cursor()
+    try:
+        for size in sizes:
+            cur.execute("DROP TABLE IF EXISTS pg_temp.bench_users")
+            cur.execute("CREATE TEMP TABLE bench_users (id SERIAL PRIMARY KEY, username VARCHAR(150) NOT NULL)")
+            cur.execute(
+                "INSERT INTO bench_users (username) SELECT 'User' || g || '@Example.com' FROM generate_series(1, %s) g",
+                (size,)
+            )
+            cur.execute("CREATE UNIQUE INDEX ON bench_users (LOWER(username))")
+            cur.execute("ANALYZE bench_users")
+
+            query = "SELECT id FROM bench_users WHERE LOWER(username) = LOWER(%s)"
+            cur.execute(sql.SQL("EXPLAIN SELECT id FROM bench_users WHERE LOWER(username) = LOWER({})").format(
+                sql.Literal('user1@example.com')
+            ))
+            plan = cur.fetchone()[0]
+
+            timings = []
+            step = max(size // lookups, 1)
+            for n in range(lookups):
+                probe = f"USER{(n * step) % size + 1}@example.COM"
+                started = time.perf_counter()
+                cur.execute(query, (probe,))
+                cur.fetchone()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results.append({
+                'users': size,
+                'p50_ms': round(median(timings), 3),
+                'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+                'plan': plan.strip(),
+            })
+        return results
+    finally:
+        conn.rollback()
+        cur.close()
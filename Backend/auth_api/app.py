@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
@@ -9,7 +9,6 @@ from flask_jwt_extended import (
     set_refresh_cookies,
     unset_jwt_cookies,
 )
-from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flasgger import Swagger
 import psycopg
@@ -17,8 +16,6 @@ from psycopg.rows import dict_row
 import os
 from datetime import datetime
 import sys
-import smtplib
-from email.message import EmailMessage
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from dotenv import load_dotenv
 from config import Config
@@ -29,11 +26,25 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dashboards.dashboard import dashboard_bp
 from plans.plans import plans_bp
 from plans.enhanced_uploads import enhanced_uploads_bp
+from plans.upload_sessions import upload_sessions_bp
+from plans.direct_uploads import direct_uploads_bp
 from teams.teams import teams_bp
 from creator.creator_tools import creator_tools_bp
 from admin.admin_management import admin_bp
 from customer.customer_actions import customer_bp
 from ai.ai_assistant import ai_bp
+from utils.file_serving import serve_upload
+from utils.email_outbox import enqueue_email, schedule_outbox_flush
+from utils.background import submit_background
+from auth.usernames import normalize_username
+from auth.profile_cache import get_user_profile, invalidate_user_profile, conditional_json
+from auth.password_hashing import (
+    PasswordHashingBusy,
+    PASSWORD_HASH_RETRY_AFTER_SECONDS,
+    hash_password,
+    verify_password,
+    needs_rehash,
+)
 
 load_dotenv()
 
@@ -41,13 +52,6 @@ app = Flask(__name__)
 app.config.from_object(Config)
 
 
-def _get_env_bool(name: str, default: bool = False) -> bool:
-    val = os.getenv(name)
-    if val is None:
-        return default
-    return str(val).strip().lower() in {"1", "true", "yes", "y", "on"}
-
-
 def _get_email_serializer() -> URLSafeTimedSerializer:
     secret = os.getenv("EMAIL_TOKEN_SECRET") or app.config.get("SECRET_KEY")
     if not secret:
@@ -91,41 +95,6 @@ def _wrap_email_html(title: str, body_html: str) -> str:
     )
 
 
-def _send_email(to_email: str, subject: str, html_body: str) -> None:
-    mail_server = os.getenv("MAIL_SERVER")
-    mail_port = int(os.getenv("MAIL_PORT", "587"))
-    mail_username = os.getenv("MAIL_USERNAME")
-    mail_password = os.getenv("MAIL_PASSWORD")
-    default_sender = os.getenv("MAIL_DEFAULT_SENDER") or mail_username
-    use_tls = _get_env_bool("MAIL_USE_TLS", True)
-    use_ssl = _get_env_bool("MAIL_USE_SSL", False)
-
-    if not mail_server or not mail_username or not mail_password or not default_sender:
-        raise RuntimeError("SMTP env vars not configured (MAIL_SERVER, MAIL_USERNAME, MAIL_PASSWORD, MAIL_DEFAULT_SENDER)")
-
-    msg = EmailMessage()
-    msg["From"] = default_sender
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content("This email requires an HTML-capable client.")
-    msg.add_alternative(html_body, subtype="html")
-
-    if use_ssl:
-        server = smtplib.SMTP_SSL(mail_server, mail_port, timeout=20)
-    else:
-        server = smtplib.SMTP(mail_server, mail_port, timeout=20)
-
-    try:
-        if use_tls and not use_ssl:
-            server.starttls()
-        server.login(mail_username, mail_password)
-        server.send_message(msg)
-    finally:
-        try:
-            server.quit()
-        except Exception:
-            pass
-
 # Enable CORS for frontend
 # CORS configuration - allows frontend from any origin in production
 # In production, set FRONTEND_URL env variable for security
@@ -151,9 +120,15 @@ CORS(app,
      allow_headers=["Content-Type", "Authorization"],
      supports_credentials=True)
 
-bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
 
+
+@app.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(e):
+    resp = jsonify(message="Too many sign-in attempts right now. Please try again shortly.")
+    resp.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER_SECONDS)
+    return resp, 429
+
 swagger_template = {
     "swagger": "2.0",
     "info": {
@@ -192,6 +167,8 @@ swagger = Swagger(app, template=swagger_template, config=swagger_config)
 app.register_blueprint(dashboard_bp)
 app.register_blueprint(plans_bp)
 app.register_blueprint(enhanced_uploads_bp)
+app.register_blueprint(upload_sessions_bp)
+app.register_blueprint(direct_uploads_bp)
 app.register_blueprint(teams_bp)
 app.register_blueprint(creator_tools_bp)
 app.register_blueprint(admin_bp)
@@ -218,9 +195,7 @@ def serve_uploads(filename):
     This makes URLs like /uploads/plans/<plan_id>/images/<file> accessible
     from the frontend using the backend base URL.
     """
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-    upload_root = os.path.join(project_root, 'uploads')
-    return send_from_directory(upload_root, filename)
+    return serve_upload(filename)
 
 
 def get_db():
@@ -255,19 +230,16 @@ def register_user(data, role):
     Returns:
         Response: JSON response indicating success or failure of the registration process.
     """
-    username = (data.get('username') or '').strip()
+    username_lc = normalize_username(data.get('username'))
     password = data.get('password')
     first_name = data.get('first_name', '')
     middle_name = data.get('middle_name', '')
     last_name = data.get('last_name', '')
 
-    if not username or not password:
+    if not username_lc or not password:
         return jsonify(message="Username and password are required"), 400
 
-    # Normalize username (email) to lowercase for consistency
-    username_lc = username.lower()
-
-    hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
+    hashed_pw = hash_password(password)
 
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
@@ -295,22 +267,25 @@ def register_user(data, role):
             (username_lc, hashed_pw, role, first_name, middle_name, last_name)
         )
         row = cur.fetchone()
-        conn.commit()
         user_id = row['id'] if row else None
 
-        # Send verification email (best-effort; do not block registration if SMTP is down)
+        # Queue the verification email with the new user (best-effort; a savepoint keeps
+        # an outbox failure from rolling back the registration). Sent in the background.
         try:
-            serializer = _get_email_serializer()
-            token = serializer.dumps({"user_id": int(user_id), "email": username_lc, "purpose": "verify_email"})
-            verify_url = _build_app_url(f"/verify-email?token={token}")
-            body = (
-                "<p style='margin:0 0 10px'>Please confirm your email address to activate your account.</p>"
-                f"<p style='margin:14px 0 14px'><a href='{verify_url}' style='display:inline-block;padding:12px 16px;background:#0f766e;color:#fff;text-decoration:none;border-radius:12px;font-weight:700'>Verify email</a></p>"
-                "<p style='margin:0;color:#475569;font-size:12px'>If you did not create this account, you can ignore this email.</p>"
-            )
-            _send_email(username_lc, "Verify your Ramanicave email", _wrap_email_html("Verify your email", body))
+            with conn.transaction():
+                serializer = _get_email_serializer()
+                token = serializer.dumps({"user_id": int(user_id), "email": username_lc, "purpose": "verify_email"})
+                verify_url = _build_app_url(f"/verify-email?token={token}")
+                body = (
+                    "<p style='margin:0 0 10px'>Please confirm your email address to activate your account.</p>"
+                    f"<p style='margin:14px 0 14px'><a href='{verify_url}' style='display:inline-block;padding:12px 16px;background:#0f766e;color:#fff;text-decoration:none;border-radius:12px;font-weight:700'>Verify email</a></p>"
+                    "<p style='margin:0;color:#475569;font-size:12px'>If you did not create this account, you can ignore this email.</p>"
+                )
+                enqueue_email(cur, username_lc, "Verify your Ramanicave email", _wrap_email_html("Verify your email", body), kind='verify_email')
         except Exception as e:
-            app.logger.error(f"Failed to send verification email to {username_lc}: {e}")
+            app.logger.error(f"Failed to queue verification email to {username_lc}: {e}")
+        conn.commit()
+        schedule_outbox_flush()
 
         return jsonify({
             "id": user_id,
@@ -379,6 +354,7 @@ def upload_avatar():
 
         if not row:
             return jsonify(message="User not found"), 404
+        invalidate_user_profile(user_id)
 
         return jsonify({
             "id": row["id"],
@@ -528,14 +504,16 @@ def login():
               type: string
       401:
         description: Invalid credentials
+      429:
+        description: Too many logins being checked at once; retry after the Retry-After delay
     """
     data = request.get_json()
-    username = data.get('username')
+    username = normalize_username(data.get('username'))
     password = data.get('password')
 
     conn = get_db()
     cur = conn.cursor()
-    # Make username lookup case-insensitive so existing mixed-case usernames still work
+    # Case-insensitive match, served by the idx_users_username_lower expression index
     cur.execute("SELECT id, password, role, is_active, COALESCE(email_verified, FALSE) FROM users WHERE LOWER(username) = LOWER(%s);", (username,))
     result = cur.fetchone()
     cur.close()
@@ -553,7 +531,10 @@ def login():
     if not email_verified and (role or "").lower() != "admin":
         return jsonify(message="Please verify your email before login."), 403
 
-    if bcrypt.check_password_hash(hashed_pw, password):
+    if verify_password(hashed_pw, password):
+        if needs_rehash(hashed_pw):
+            submit_background(_rehash_password, user_id, hashed_pw, password)
+
         access_token = create_access_token(
             identity=str(user_id),
             additional_claims={"role": role, "email": username}
@@ -571,15 +552,31 @@ def login():
         return jsonify(message="Invalid credentials"), 401
 
 
+def _rehash_password(user_id, old_hash, password):
+    """Upgrade a hash made at an older BCRYPT_LOG_ROUNDS after a successful login."""
+    new_hash = hash_password(password)
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        # Skip if the password changed since the login read it.
+        cur.execute(
+            "UPDATE users SET password = %s WHERE id = %s AND password = %s",
+            (new_hash, user_id, old_hash),
+        )
+        conn.commit()
+        invalidate_user_profile(user_id)
+    finally:
+        cur.close()
+        conn.close()
+
+
 @app.route('/auth/resend-verification', methods=['POST'])
 def resend_verification_email():
     data = request.get_json() or {}
-    username = (data.get('username') or '').strip()
-    if not username:
+    username_lc = normalize_username(data.get('username'))
+    if not username_lc:
         return jsonify(message="username is required"), 400
 
-    username_lc = username.lower()
-
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
     try:
@@ -603,9 +600,12 @@ def resend_verification_email():
                 f"<p style='margin:14px 0 14px'><a href='{verify_url}' style='display:inline-block;padding:12px 16px;background:#0f766e;color:#fff;text-decoration:none;border-radius:12px;font-weight:700'>Verify email</a></p>"
                 "<p style='margin:0;color:#475569;font-size:12px'>If you didn't request this email, you can ignore it.</p>"
             )
-            _send_email(username_lc, "Verify your Ramanicave email", _wrap_email_html("Verify your email", body))
+            enqueue_email(cur, username_lc, "Verify your Ramanicave email", _wrap_email_html("Verify your email", body), kind='verify_email')
+            conn.commit()
+            schedule_outbox_flush()
         except Exception as e:
-            app.logger.error(f"Failed to resend verification email to {username_lc}: {e}")
+            conn.rollback()
+            app.logger.error(f"Failed to queue verification email to {username_lc}: {e}")
 
         return jsonify(message="If the account exists, a verification email has been sent."), 200
     finally:
@@ -646,6 +646,7 @@ def verify_email():
         conn.commit()
         if not row:
             return jsonify(message="User not found"), 404
+        invalidate_user_profile(user_id)
         return jsonify(message="Email verified successfully"), 200
     except Exception as e:
         conn.rollback()
@@ -658,12 +659,10 @@ def verify_email():
 @app.route('/auth/password-reset/request', methods=['POST'])
 def request_password_reset():
     data = request.get_json() or {}
-    username = (data.get('username') or '').strip()
-    if not username:
+    username_lc = normalize_username(data.get('username'))
+    if not username_lc:
         return jsonify(message="username is required"), 400
 
-    username_lc = username.lower()
-
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
     try:
@@ -683,9 +682,12 @@ def request_password_reset():
                 f"<p style='margin:14px 0 14px'><a href='{reset_url}' style='display:inline-block;padding:12px 16px;background:#111827;color:#fff;text-decoration:none;border-radius:12px;font-weight:700'>Reset password</a></p>"
                 "<p style='margin:0;color:#475569;font-size:12px'>If you didn't request this, you can safely ignore this email.</p>"
             )
-            _send_email(username_lc, "Reset your Ramanicave password", _wrap_email_html("Reset your password", body))
+            enqueue_email(cur, username_lc, "Reset your Ramanicave password", _wrap_email_html("Reset your password", body), kind='password_reset')
+            conn.commit()
+            schedule_outbox_flush()
         except Exception as e:
-            app.logger.error(f"Failed to send password reset email to {username_lc}: {e}")
+            conn.rollback()
+            app.logger.error(f"Failed to queue password reset email to {username_lc}: {e}")
 
         return jsonify(message="If the account exists, a password reset email has been sent."), 200
     finally:
@@ -717,7 +719,7 @@ def confirm_password_reset():
     if not user_id or not email:
         return jsonify(message="Invalid reset token"), 400
 
-    hashed_pw = bcrypt.generate_password_hash(new_password).decode('utf-8')
+    hashed_pw = hash_password(new_password)
 
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
@@ -730,6 +732,7 @@ def confirm_password_reset():
         conn.commit()
         if not row:
             return jsonify(message="User not found"), 404
+        invalidate_user_profile(user_id)
         return jsonify(message="Password updated successfully"), 200
     except Exception as e:
         conn.rollback()
@@ -808,33 +811,25 @@ def init_db():
 @app.route('/me', methods=['GET'])
 @jwt_required()
 def get_profile():
-    """Return the current user's profile (name, email/username, role, avatar)."""
+    """Return the current user's profile (name, email/username, role, avatar).
+
+    Served from the profile cache; supports If-None-Match revalidation.
+    """
     user_id, role = get_current_user()
 
-    conn = get_db()
-    cur = conn.cursor(row_factory=dict_row)
-    try:
-        cur.execute(
-            "SELECT id, username, role, first_name, middle_name, last_name, profile_picture_url "
-            "FROM users WHERE id = %s;",
-            (user_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            return jsonify(message="User not found"), 404
+    row = get_user_profile(user_id, connect=get_db)
+    if not row:
+        return jsonify(message="User not found"), 404
 
-        return jsonify({
-            "id": row["id"],
-            "email": row["username"],
-            "role": row["role"],
-            "first_name": row.get("first_name"),
-            "middle_name": row.get("middle_name"),
-            "last_name": row.get("last_name"),
-            "profile_picture_url": row.get("profile_picture_url"),
-        }), 200
-    finally:
-        cur.close()
-        conn.close()
+    return conditional_json({
+        "id": row["id"],
+        "email": row["username"],
+        "role": row["role"],
+        "first_name": row.get("first_name"),
+        "middle_name": row.get("middle_name"),
+        "last_name": row.get("last_name"),
+        "profile_picture_url": row.get("profile_picture_url"),
+    })
 
 
 @app.route('/me', methods=['PUT', 'PATCH'])
@@ -866,6 +861,7 @@ def update_profile():
 
         if not row:
             return jsonify(message="User not found"), 404
+        invalidate_user_profile(user_id)
 
         return jsonify({
             "id": row["id"],
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for the outbound tier.
+
+nginx sends the endpoints that mostly wait on another service here (Paystack
+initialize/verify, the AI chat LLM call, avatar uploads to Cloudinary). The
+rest of the site stays on the sync workers. Each gevent worker runs requests
+as greenlets. While one waits on the network, others run, so a couple of
+workers can hold hundreds of upstream calls without tying up catalog traffic.
+
+gunicorn's gevent worker monkey-patches the standard library before the app
+is imported. That makes `requests` (and the connection pools behind it)
+cooperative. psycopg 3 detects the patching and waits on its sockets the
+same way.
+
+    gunicorn -c gunicorn_outbound.conf.py -b 127.0.0.1:8001 app:app
+"""
+import os
+
+worker_class = 'gevent'
+workers = int(os.getenv('OUTBOUND_WORKERS', '2'))
+# Concurrent requests per worker. Handlers open a database connection only
+# around their queries (not while waiting upstream). Even so, keep
+# workers * worker_connections within what Postgres can absorb in a burst.
+worker_connections = int(os.getenv('OUTBOUND_WORKER_CONNECTIONS', '200'))
+# Upstream calls time out after 10-20 s; leave room for the database work after them.
+timeout = int(os.getenv('OUTBOUND_TIMEOUT_SECONDS', '60'))
+graceful_timeout = 30
+keepalive = 5
@@ -3,10 +3,13 @@ from flask import Flask
 from flask_bcrypt import Bcrypt
 import psycopg
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 app = Flask(__name__)
 bcrypt = Bcrypt(app)
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -57,5 +60,300 @@ def create_admin():
         cur.close()
         conn.close()
 
+@cli.command("storage-backfill")
+@click.option("--batch-size", default=200, show_default=True, help="Rows processed per transaction.")
+def storage_backfill(batch_size):
+    """
+    Persist storage descriptors (backend, key, size, checksum, mtime) on plan_files
+    rows uploaded before descriptors were recorded.
+    """
+    from utils.storage_maintenance import backfill_storage_descriptors
+
+    conn = get_db()
+    try:
+        result = backfill_storage_descriptors(conn, batch_size=batch_size, log=click.echo)
+    finally:
+        conn.close()
+    click.echo(f"Backfilled {result['updated']} rows; {result['missing']} files could not be located.")
+
+
+@cli.command("storage-verify")
+@click.option("--checksums", is_flag=True, help="Re-hash files and compare against the stored SHA-256.")
+def storage_verify(checksums):
+    """
+    Verify that plan_files storage descriptors still match the files on disk.
+    """
+    from utils.storage_maintenance import verify_storage_descriptors
+
+    conn = get_db()
+    try:
+        result = verify_storage_descriptors(conn, check_checksums=checksums, log=click.echo)
+    finally:
+        conn.close()
+    click.echo(
+        f"Checked {result['checked']} files; {result['problems']} problems found; "
+        f"{result['mtime_changed']} modified since upload."
+    )
+    if result['problems']:
+        sys.exit(1)
+
+@cli.command("media-derivatives")
+@click.option("--plan-id", default=None, help="Only process this plan.")
+@click.option("--force", is_flag=True, help="Regenerate derivatives that already exist.")
+def media_derivatives(plan_id, force):
+    """
+    Generate responsive image derivatives (WebP/AVIF widths and blur placeholders)
+    for plan thumbnails and gallery images.
+    """
+    from utils.image_derivatives import generate_plan_media_derivatives
+
+    conn = get_db()
+    try:
+        if plan_id:
+            plan_ids = [plan_id]
+        else:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id FROM plans ORDER BY created_at")
+                plan_ids = [str(row[0]) for row in cur.fetchall()]
+
+        total = 0
+        for current_plan_id in plan_ids:
+            generated = generate_plan_media_derivatives(conn, current_plan_id, force=force)
+            total += generated
+            if generated:
+                click.echo(f"{current_plan_id}: {generated} asset(s)")
+    finally:
+        conn.close()
+    click.echo(f"Generated derivatives for {total} asset(s) across {len(plan_ids)} plan(s).")
+
+@cli.command("file-metadata")
+@click.option("--plan-id", default=None, help="Only process this plan.")
+@click.option("--force", is_flag=True, help="Re-extract files that already have metadata.")
+@click.option("--batch-size", default=100, show_default=True, help="Rows processed per transaction.")
+def file_metadata(plan_id, force, batch_size):
+    """
+    Extract technical-file metadata (PDF pages and sheet sizes, DXF/DWG version,
+    image dimensions, checksum) into plan_files.metadata.
+    """
+    from utils.file_metadata import extract_plan_file_metadata
+
+    conn = get_db()
+    try:
+        result = extract_plan_file_metadata(conn, plan_id=plan_id, force=force, batch_size=batch_size, log=click.echo)
+    finally:
+        conn.close()
+    click.echo(f"Extracted metadata for {result['processed']} file(s); {result['failed']} failed.")
+
+@cli.command("pdf-previews")
+@click.option("--plan-id", default=None, help="Only process this plan.")
+@click.option("--force", is_flag=True, help="Re-render previews that already exist.")
+@click.option("--prune", is_flag=True, help="Only evict previews beyond PDF_PREVIEW_CACHE_MAX_BYTES.")
+def pdf_previews(plan_id, force, prune):
+    """
+    Render watermarked page previews for architectural PDFs and trim the preview cache.
+    """
+    from utils.pdf_previews import enforce_preview_cache_limit, generate_plan_pdf_previews
+
+    conn = get_db()
+    try:
+        if prune:
+            evicted = enforce_preview_cache_limit(conn, log=click.echo)
+            click.echo(f"Evicted {evicted} preview set(s).")
+            return
+        result = generate_plan_pdf_previews(conn, plan_id=plan_id, force=force, log=click.echo)
+    finally:
+        conn.close()
+    click.echo(f"Rendered previews for {result['generated']} file(s); {result['failed']} failed.")
+
+@cli.command("storage-gc")
+@click.option("--limit", default=5000, show_default=True, help="Files examined this run; the next run resumes after them.")
+@click.option("--grace-days", default=None, type=float, help="Only quarantine files older than this (default: STORAGE_GC_GRACE_SECONDS).")
+@click.option("--dry-run", is_flag=True, help="List orphans without moving anything.")
+def storage_gc(limit, grace_days, dry_run):
+    """
+    Quarantine upload files that no database row references, purge expired
+    quarantine entries and refresh per-plan/per-designer disk usage.
+    """
+    from utils.storage_gc import collect_garbage
+
+    grace_seconds = int(grace_days * 86400) if grace_days is not None else None
+    conn = get_db()
+    try:
+        stats = collect_garbage(conn, limit=limit, grace_seconds=grace_seconds, dry_run=dry_run, log=click.echo)
+    finally:
+        conn.close()
+    click.echo(
+        f"Examined {stats['examined']} file(s); "
+        f"{'would quarantine' if dry_run else 'quarantined'} {stats['quarantined']} "
+        f"({stats['quarantined_bytes']} bytes)."
+    )
+    if stats['pass_completed']:
+        click.echo(
+            f"Pass complete: purged {stats['purged']} expired file(s), removed "
+            f"{stats['staging_removed']} stale staging file(s), usage counters refreshed."
+        )
+
+@cli.command("storage-restore")
+@click.argument("storage_key")
+def storage_restore(storage_key):
+    """
+    Move a quarantined file (e.g. plans/<plan_id>/architectural/a.pdf) back into place.
+    """
+    from utils.storage_gc import restore_quarantined
+
+    conn = get_db()
+    try:
+        restored = restore_quarantined(conn, storage_key)
+    finally:
+        conn.close()
+    if not restored:
+        click.echo(f"{storage_key} is not in quarantine.", err=True)
+        sys.exit(1)
+    click.echo(f"Restored {storage_key}.")
+
+@cli.command("email-outbox")
+@click.option("--batch-size", default=None, type=int, help="Messages claimed per batch (default: MAIL_OUTBOX_BATCH_SIZE).")
+@click.option("--requeue-dead", is_flag=True, help="Give messages that exhausted their retries another round first.")
+@click.option("--status", "status_only", is_flag=True, help="Only print message counts by status.")
+def email_outbox(batch_size, requeue_dead, status_only):
+    """
+    Deliver queued emails that are due (the web process normally does this in the background).
+    """
+    from utils.email_outbox import flush_outbox, requeue_dead as requeue, outbox_counts
+
+    conn = get_db()
+    try:
+        if not status_only:
+            if requeue_dead:
+                click.echo(f"Requeued {requeue(conn)} dead message(s).")
+            stats = flush_outbox(conn, batch_size=batch_size, log=click.echo)
+            click.echo(f"Sent {stats['sent']}; {stats['retry']} will retry; {stats['dead']} gave up.")
+        counts = outbox_counts(conn)
+    finally:
+        conn.close()
+    click.echo(", ".join(f"{status}: {count}" for status, count in counts.items()) or "Outbox is empty.")
+
+@cli.command("paystack-webhooks")
+@click.option("--replay", "replay_ids", multiple=True, type=int, help="Queue this inbox event id again (repeatable).")
+@click.option("--replay-status", multiple=True, type=click.Choice(["dead", "rejected", "ignored", "done"]),
+              help="Queue every event in this status again (repeatable).")
+@click.option("--batch-size", default=None, type=int, help="Events claimed per batch (default: WEBHOOK_INBOX_BATCH_SIZE).")
+@click.option("--status", "status_only", is_flag=True, help="Only print event counts by status.")
+def paystack_webhooks(replay_ids, replay_status, batch_size, status_only):
+    """
+    Apply queued Paystack webhook events (the web process normally does this in the background).
+    """
+    from utils.webhook_inbox import replay, inbox_counts
+    from customer.customer_actions import process_paystack_webhooks
+
+    conn = get_db()
+    try:
+        if not status_only:
+            if replay_ids or replay_status:
+                count = replay(conn, 'paystack', ids=replay_ids, statuses=replay_status)
+                click.echo(f"Requeued {count} event(s).")
+            with app.app_context():
+                stats = process_paystack_webhooks(conn, batch_size=batch_size, log=click.echo)
+            click.echo(", ".join(f"{outcome}: {count}" for outcome, count in stats.items()))
+        counts = inbox_counts(conn, 'paystack')
+    finally:
+        conn.close()
+    click.echo(", ".join(f"{status}: {count}" for status, count in counts.items()) or "Inbox is empty.")
+
+@cli.command("paystack-reconcile")
+@click.option("--batch-size", default=None, type=int, help="References per batch (default: PAYSTACK_RECONCILE_BATCH_SIZE).")
+@click.option("--concurrency", default=None, type=int, help="Parallel Paystack calls (default: PAYSTACK_RECONCILE_CONCURRENCY).")
+@click.option("--rate", "rate_per_second", default=None, type=float, help="Max Paystack calls per second (default: PAYSTACK_RECONCILE_RATE_PER_SECOND).")
+@click.option("--limit", default=None, type=int, help="Stop after checking this many references.")
+@click.option("--min-age-seconds", default=None, type=int, help="Skip purchases younger than this.")
+@click.option("--max-age-hours", default=None, type=int, help="Skip purchases older than this.")
+def paystack_reconcile(batch_size, concurrency, rate_per_second, limit, min_age_seconds, max_age_hours):
+    """
+    Ask Paystack about pending purchases and complete the ones that were paid.
+    """
+    from customer.paystack_reconciliation import reconcile_pending_purchases
+
+    conn = get_db()
+    try:
+        with app.app_context():
+            stats = reconcile_pending_purchases(
+                conn, batch_size=batch_size, concurrency=concurrency, rate_per_second=rate_per_second,
+                limit=limit, min_age_seconds=min_age_seconds, max_age_hours=max_age_hours, log=click.echo,
+            )
+    finally:
+        conn.close()
+    click.echo(", ".join(f"{outcome}: {count}" for outcome, count in stats.items()))
+
+@cli.command("users-dedupe-usernames")
+@click.option("--apply", is_flag=True, help="Rename the duplicates and build the unique index (default: report only).")
+def users_dedupe_usernames(apply):
+    """
+    Resolve accounts whose usernames differ only by case so LOWER(username) can be unique.
+    """
+    from auth.usernames import resolve_case_duplicates
+
+    conn = get_db()
+    try:
+        groups = resolve_case_duplicates(conn, apply=apply, log=click.echo)
+    finally:
+        conn.close()
+    renamed = sum(len(group) - 1 for group in groups)
+    if apply:
+        click.echo(f"Renamed {renamed} account(s) in {len(groups)} group(s); idx_users_username_lower is unique.")
+    else:
+        click.echo(f"{renamed} account(s) in {len(groups)} group(s) would be renamed; re-run with --apply.")
+
+@cli.command("bench-username-lookup")
+@click.option("--size", "sizes", multiple=True, type=int, default=(1000, 100000, 1000000), show_default=True,
+              help="Table sizes to test (repeatable).")
+@click.option("--lookups", default=200, show_default=True)
+def bench_username_lookup(sizes, lookups):
+    """
+    Time the login username lookup against temporary tables of increasing size.
+    """
+    from auth.usernames import benchmark_username_lookup
+
+    conn = get_db()
+    try:
+        results = benchmark_username_lookup(conn, sorted(sizes), lookups=lookups)
+    finally:
+        conn.close()
+    for row in results:
+        click.echo(f"{row['users']:>9} users  p50 {row['p50_ms']:.3f} ms  p95 {row['p95_ms']:.3f} ms  {row['plan']}")
+
+@cli.command("plans-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--designer-id", required=True, type=int, help="Designer who will own the imported plans.")
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None,
+              help="Input format (default: from the file extension).")
+@click.option("--dry-run", is_flag=True, help="Validate and report without saving.")
+def plans_import(path, designer_id, fmt, dry_run):
+    """
+    Bulk import a plan catalog (with optional BOQ lines) from CSV or NDJSON.
+    """
+    import time
+    from plans.bulk_import import import_plans, iter_records
+
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    started = time.monotonic()
+    conn = get_db()
+    try:
+        with open(path, "rb") as handle:
+            report = import_plans(conn, designer_id, iter_records(handle, fmt), dry_run=dry_run)
+    finally:
+        conn.close()
+
+    for error in report["errors"]:
+        click.echo(f"row {error['row']}: {error['error']}", err=True)
+    if report["errors_truncated"]:
+        click.echo(f"... {report['failed'] - len(report['errors'])} more error(s) not shown", err=True)
+    click.echo(
+        f"{'Validated' if dry_run else 'Imported'} {report['valid']} plan(s) "
+        f"({report['created']} new, {report['updated']} updated), "
+        f"{report['failed']} row(s) rejected in {time.monotonic() - started:.1f}s."
+    )
+    if report["failed"]:
+        sys.exit(1)
+
 if __name__ == '__main__':
     cli()
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import psycopg
 from psycopg.rows import dict_row
@@ -9,7 +9,9 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from auth.auth_utils import get_current_user, require_designer, check_plan_ownership
-from utils.download_helpers import fetch_plan_bundle, build_plan_zip
+from utils.download_helpers import fetch_plan_bundle, build_plan_zip, build_changes_zip
+from utils.file_serving import send_package
+from plans.plan_versions import diff_file_manifests, find_version, lineage_root
 
 creator_tools_bp = Blueprint('creator_tools', __name__, url_prefix='/creator')
 
@@ -313,15 +315,10 @@ def designer_download_plan(plan_id):
         if files_added == 0:
             return jsonify(message="Plan files could not be located on the server"), 404
 
-        zip_buffer.seek(0)
-        response = send_file(
+        return send_package(
             zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=download_name or f"{bundle['plan'].get('name') or 'plan'}-technical-files.zip"
+            download_name or f"{bundle['plan'].get('name') or 'plan'}-technical-files.zip"
         )
-        response.headers['Cache-Control'] = 'no-store'
-        return response
 
     except Exception as e:
         current_app.logger.error(f"Designer download failed for plan {plan_id}: {e}")
@@ -330,6 +327,46 @@ def designer_download_plan(plan_id):
         conn.close()
 
 
+@creator_tools_bp.route('/plans/<plan_id>/changes', methods=['GET'])
+@jwt_required()
+@require_designer
+def download_plan_changes(plan_id):
+    """Download only the files added or modified since version `since` (query param), as a ZIP."""
+    user_id, _ = get_current_user()
+    since = request.args.get('since', type=int)
+    if since is None or since < 1:
+        return jsonify(message="since must be a version number"), 400
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+
+    try:
+        if not check_plan_ownership(plan_id, user_id, conn):
+            return jsonify(message="Plan not found or access denied"), 403
+
+        bundle = fetch_plan_bundle(plan_id, conn)
+        if not bundle:
+            return jsonify(message="Plan not found"), 404
+        if since >= (bundle['plan'].get('version') or 1):
+            return jsonify(message="since must be lower than this plan's version"), 400
+
+        base_plan_id = find_version(cur, lineage_root(cur, plan_id), since)
+        if not base_plan_id:
+            return jsonify(message=f"Version {since} not found"), 404
+        base_bundle = fetch_plan_bundle(base_plan_id, conn)
+
+        changes = diff_file_manifests(base_bundle['files'], bundle['files'])
+        zip_buffer, download_name, _ = build_changes_zip(bundle, changes, since)
+        return send_package(zip_buffer, download_name)
+
+    except Exception as e:
+        current_app.logger.error(f"Change package failed for plan {plan_id}: {e}")
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
 @creator_tools_bp.route('/plans/<plan_id>/track-view', methods=['POST'])
 def track_plan_view(plan_id):
     """
@@ -421,19 +458,32 @@ def get_plan_versions(plan_id):
     try:
         # Verify ownership
         cur.execute("""
-            SELECT id FROM plans 
+            SELECT COALESCE(parent_plan_id, id) AS root_id FROM plans 
             WHERE id = %s AND designer_id = %s
         """, (plan_id, user_id))
         
-        if not cur.fetchone():
+        owned = cur.fetchone()
+        if not owned:
             return jsonify(message="Plan not found or access denied"), 404
+        root_id = owned['root_id']
         
-        # Get all versions
+        # Get all versions of the lineage, with per-version file change counts
         cur.execute("""
-            SELECT * FROM plans 
-            WHERE (id = %s OR parent_plan_id = %s) AND designer_id = %s
-            ORDER BY version DESC
-        """, (plan_id, plan_id, user_id))
+            SELECT p.*,
+                   COALESCE(c.changes, '{}'::jsonb) AS file_changes
+            FROM plans p
+            LEFT JOIN (
+                SELECT plan_id, jsonb_object_agg(change_type, n) AS changes
+                FROM (
+                    SELECT plan_id, change_type, COUNT(*) AS n
+                    FROM plan_version_changes
+                    GROUP BY plan_id, change_type
+                ) grouped
+                GROUP BY plan_id
+            ) c ON c.plan_id = p.id
+            WHERE (p.id = %s OR p.parent_plan_id = %s) AND p.designer_id = %s
+            ORDER BY p.version DESC
+        """, (root_id, root_id, user_id))
         
         versions = [dict(row) for row in cur.fetchall()]
         
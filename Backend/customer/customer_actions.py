@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 import psycopg
 from psycopg.rows import dict_row
@@ -10,20 +10,24 @@ import os
 import io
 import zipfile
 import json
-import requests
 import hmac
 import hashlib
-import smtplib
-from email.message import EmailMessage
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from auth.auth_utils import get_current_user, log_user_activity, increment_user_quota
+from auth.profile_cache import get_user_profile, invalidate_user_profile, conditional_json
 from utils.download_helpers import (
     fetch_plan_bundle,
     build_plan_zip,
     fetch_user_contact,
     build_manifest_pdf_html,
+    priced_deliverable_keys,
 )
+from utils.file_serving import send_package
+from utils.email_outbox import enqueue_email, schedule_outbox_flush
+from utils import http_clients
+from utils.webhook_inbox import record_webhook, process_inbox, schedule_inbox_processing
+from utils.purchase_events import notify_purchase_status, get_listener, purchase_event_stream
 
 customer_bp = Blueprint('customer', __name__, url_prefix='/customer')
 
@@ -43,6 +47,12 @@ PAYSTACK_PUBLIC_KEY = os.environ.get('PAYSTACK_PUBLIC_KEY')
 PAYSTACK_CALLBACK_URL = os.environ.get('PAYSTACK_CALLBACK_URL')
 PAYSTACK_WEBHOOK_SECRET = os.environ.get('PAYSTACK_SECRET_KEY')
 PAYSTACK_CURRENCY = os.environ.get('PAYSTACK_CURRENCY', 'USD')
+# Point at a local stand-in for development and reconciliation dry runs.
+PAYSTACK_API_BASE = os.environ.get('PAYSTACK_API_BASE', 'https://api.paystack.co').rstrip('/')
+# A pending checkout younger than this is handed back instead of starting a new one.
+PAYSTACK_AUTHORIZATION_REUSE_SECONDS = int(os.environ.get('PAYSTACK_AUTHORIZATION_REUSE_SECONDS', '1800'))
+PURCHASE_IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('PURCHASE_IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+PURCHASE_START_LOCK_TIMEOUT = os.environ.get('PURCHASE_START_LOCK_TIMEOUT', '15s')
 
 
 def _build_app_url(path: str) -> str:
@@ -79,42 +89,6 @@ def _wrap_email_html(title: str, body_html: str) -> str:
     )
 
 
-def _send_email(to_email: str, subject: str, html_body: str) -> None:
-    mail_server = os.getenv("MAIL_SERVER")
-    mail_port = int(os.getenv("MAIL_PORT", "587"))
-    mail_username = os.getenv("MAIL_USERNAME")
-    mail_password = os.getenv("MAIL_PASSWORD")
-    default_sender = os.getenv("MAIL_DEFAULT_SENDER") or mail_username
-    use_tls = (os.getenv("MAIL_USE_TLS", "true").lower() in {"1", "true", "yes", "y"})
-    use_ssl = (os.getenv("MAIL_USE_SSL", "false").lower() in {"1", "true", "yes", "y"})
-
-    if not mail_server or not mail_username or not mail_password or not default_sender:
-        raise RuntimeError("SMTP env vars not configured (MAIL_SERVER, MAIL_USERNAME, MAIL_PASSWORD, MAIL_DEFAULT_SENDER)")
-
-    msg = EmailMessage()
-    msg["From"] = default_sender
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content("This email requires an HTML-capable client.")
-    msg.add_alternative(html_body, subtype="html")
-
-    if use_ssl:
-        server = smtplib.SMTP_SSL(mail_server, mail_port, timeout=20)
-    else:
-        server = smtplib.SMTP(mail_server, mail_port, timeout=20)
-
-    try:
-        if use_tls and not use_ssl:
-            server.starttls()
-        server.login(mail_username, mail_password)
-        server.send_message(msg)
-    finally:
-        try:
-            server.quit()
-        except Exception:
-            pass
-
-
 @customer_bp.route('/custom-plan-requests', methods=['POST'])
 @jwt_required()
 def submit_custom_plan_request():
@@ -199,7 +173,6 @@ def submit_custom_plan_request():
             ),
         )
         row = cur.fetchone() or {}
-        conn.commit()
 
         admin_email = 'admin@ramanicave.com'
         subject = 'New Custom Plan Request - Ramanicave'
@@ -223,12 +196,12 @@ def submit_custom_plan_request():
             f"<pre style=\"margin:0;padding:12px 14px;border-radius:12px;background:#0b1220;color:#e2e8f0;white-space:pre-wrap;font-family:ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, 'Liberation Mono', 'Courier New', monospace;font-size:12px;line-height:1.6\">{payload['description']}</pre>"
         )
         try:
-            _send_email(admin_email, subject, _wrap_email_html('New custom plan request', html_body))
+            with conn.transaction():
+                enqueue_email(cur, admin_email, subject, _wrap_email_html('New custom plan request', html_body), kind='custom_request')
         except Exception as e:
-            try:
-                current_app.logger.error(f"Failed to send custom request email: {e}")
-            except Exception:
-                pass
+            current_app.logger.error(f"Failed to queue custom request email: {e}")
+        conn.commit()
+        schedule_outbox_flush()
 
         return jsonify({
             'message': 'Request submitted',
@@ -254,36 +227,6 @@ def _generate_order_id() -> str:
     return 'ORD-' + uuid.uuid4().hex[:10].upper()
 
 
-def resolve_plan_file_path(file_path: str) -> str | None:
-    """Resolve stored relative file paths to absolute disk locations."""
-    if not file_path:
-        return None
-
-    if os.path.isabs(file_path) and os.path.exists(file_path):
-        return file_path
-
-    normalized = file_path.lstrip('/')
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-    candidate_paths = [file_path, normalized, os.path.join('uploads', normalized)]
-
-    for candidate in candidate_paths:
-        absolute_candidate = candidate if os.path.isabs(candidate) else os.path.join(project_root, candidate)
-        if os.path.exists(absolute_candidate):
-            return absolute_candidate
-
-    return None
-
-
-def json_default(value):
-    if isinstance(value, (datetime, date)):
-        return value.isoformat()
-    if isinstance(value, Decimal):
-        return float(value)
-    if isinstance(value, uuid.UUID):
-        return str(value)
-    return value
-
-
 def _paystack_headers():
     if not PAYSTACK_SECRET_KEY:
         raise RuntimeError("PAYSTACK_SECRET_KEY is not configured")
@@ -304,13 +247,14 @@ def _paystack_signature_for(body: bytes) -> str:
 
 
 def _purchase_for_paystack_reference(cur, reference: str):
-    """Find a purchase row by matching the current transaction_id or any stored historical Paystack reference."""
+    """Find the purchase a Paystack reference (current or from an earlier attempt) belongs to.
+
+    The purchase row stays locked until the caller's transaction ends, so the
+    verify endpoints, the webhook consumer and reconciliation can't complete
+    the same purchase twice.
+    """
     if not reference:
         return None
-    try:
-        ref_list_json = json.dumps([reference])
-    except Exception:
-        ref_list_json = '[]'
 
     cur.execute(
         """
@@ -318,23 +262,35 @@ def _purchase_for_paystack_reference(cur, reference: str):
                p.transaction_id,
                COALESCE(p.payment_metadata->>'order_id', NULL) AS order_id,
                p.payment_metadata
-        FROM purchases p
-        WHERE p.transaction_id = %s
-           OR COALESCE(p.payment_metadata->'paystack_references', '[]'::jsonb) @> %s::jsonb
-        ORDER BY p.purchased_at DESC
-        LIMIT 1
+        FROM purchase_payment_references r
+        JOIN purchases p ON p.id = r.purchase_id
+        WHERE r.reference = %s
+        FOR UPDATE OF p
         """,
-        (reference, ref_list_json),
+        (reference,),
     )
     return cur.fetchone()
 
 
+def _record_paystack_reference(cur, purchase_id: str, reference: str):
+    """Index a Paystack reference to its purchase in purchase_payment_references."""
+    cur.execute(
+        """
+        INSERT INTO purchase_payment_references (reference, purchase_id, provider)
+        VALUES (%s, %s, 'paystack')
+        ON CONFLICT (reference) DO NOTHING
+        """,
+        (reference, purchase_id),
+    )
+
+
 def _append_paystack_reference_to_purchase(cur, purchase_id: str, reference: str):
-    """Ensure a Paystack reference is recorded in purchases.payment_metadata.paystack_references."""
+    """Ensure a Paystack reference is recorded in purchase_payment_references and payment_metadata."""
     if not purchase_id or not reference:
         return
     try:
         cur.execute("SAVEPOINT paystack_ref_append")
+        _record_paystack_reference(cur, purchase_id, reference)
         cur.execute(
             """
             UPDATE purchases
@@ -468,6 +424,11 @@ def _complete_paystack_purchase(reference: str, paystack_data: dict, conn, cur):
     if not updated_row or (updated_row.get('payment_status') if isinstance(updated_row, dict) else updated_row[0]) != 'completed':
         current_app.logger.error(f"Purchase {reference} failed to update to completed; row={updated_row}")
         return False, ("Failed to update purchase status", 500)
+    # Sent on commit, so a rolled-back completion never reaches a buyer's stream.
+    notify_purchase_status(
+        cur, purchase['id'], 'completed',
+        plan_id=str(purchase['plan_id']), reference=reference, download_ready=True,
+    )
 
     # Store full Paystack payload (keep our own fields too)
     try:
@@ -518,6 +479,16 @@ def _complete_paystack_purchase(reference: str, paystack_data: dict, conn, cur):
     return True, ("Payment verified and purchase activated", 200)
 
 
+def _fetch_paystack_verification(reference: str):
+    """Ask Paystack for a transaction's status. Returns (http_status, body)."""
+    resp = http_clients.request(
+        'paystack', 'GET',
+        f"{PAYSTACK_API_BASE}/transaction/verify/{reference}",
+        headers=_paystack_headers(),
+    )
+    return resp.status_code, (resp.json() if resp.content else {})
+
+
 def _init_paystack_transaction(email: str, amount: float, plan_id: str, user_id: int):
     """
     Initialize a Paystack transaction and return authorization URL + reference.
@@ -562,11 +533,11 @@ def _init_paystack_transaction(email: str, amount: float, plan_id: str, user_id:
     if callback_url:
         payload["callback_url"] = callback_url
 
-    resp = requests.post(
-        "https://api.paystack.co/transaction/initialize",
+    resp = http_clients.request(
+        'paystack', 'POST',
+        f"{PAYSTACK_API_BASE}/transaction/initialize",
         headers=_paystack_headers(),
         json=payload,
-        timeout=10,
     )
     data = resp.json() if resp.content else {}
     if resp.status_code != 200 or not data.get("status"):
@@ -576,6 +547,81 @@ def _init_paystack_transaction(email: str, amount: float, plan_id: str, user_id:
     return auth_data.get("authorization_url"), auth_data.get("reference")
 
 
+def _purchase_request_hash(plan_id, payment_method, selected_deliverables) -> str:
+    """Fingerprint of a purchase request, so an Idempotency-Key can't be reused for a different one."""
+    if isinstance(selected_deliverables, list) and all(isinstance(x, str) for x in selected_deliverables):
+        selected_deliverables = sorted(set(selected_deliverables))
+    body = json.dumps(
+        {"plan_id": str(plan_id), "payment_method": payment_method, "selected_deliverables": selected_deliverables},
+        sort_keys=True,
+    )
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _idempotent_purchase_response(cur, user_id: int, key: str):
+    cur.execute(
+        """
+        SELECT request_hash, status_code, response
+        FROM purchase_idempotency_keys
+        WHERE user_id = %s AND idempotency_key = %s
+          AND created_at > NOW() - make_interval(secs => %s)
+        """,
+        (user_id, key, PURCHASE_IDEMPOTENCY_TTL_SECONDS)
+    )
+    return cur.fetchone()
+
+
+def _store_idempotent_purchase_response(cur, user_id: int, key, request_hash: str, purchase_id: str, body: dict, status_code: int):
+    if not key:
+        return
+    cur.execute(
+        """
+        INSERT INTO purchase_idempotency_keys (user_id, idempotency_key, request_hash, purchase_id, status_code, response)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, idempotency_key) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash, purchase_id = EXCLUDED.purchase_id,
+            status_code = EXCLUDED.status_code, response = EXCLUDED.response, created_at = NOW()
+        WHERE purchase_idempotency_keys.created_at <= NOW() - make_interval(secs => %s)
+        """,
+        (user_id, key, request_hash, purchase_id, status_code, json.dumps(body), PURCHASE_IDEMPOTENCY_TTL_SECONDS)
+    )
+
+
+def _lock_purchase_start(cur, user_id: int, plan_id: str):
+    """Serialize checkout starts for one buyer and plan.
+
+    Session-level advisory lock: it survives the commit that follows, so no
+    transaction stays open across the Paystack call, and closing the
+    connection releases it.
+    """
+    cur.execute("SELECT set_config('lock_timeout', %s, true)", (PURCHASE_START_LOCK_TIMEOUT,))
+    cur.execute("SELECT pg_advisory_lock(hashtextextended(%s, 0))", (f"purchase-start:{user_id}:{plan_id}",))
+
+
+def _reusable_paystack_purchase(cur, user_id: int, plan_id: str, amount: float, selection):
+    """A pending Paystack checkout for the same plan, amount and deliverables whose authorization is still fresh."""
+    selection_json = json.dumps(selection) if selection is not None else None
+    cur.execute(
+        """
+        SELECT id, transaction_id,
+               payment_metadata->>'order_id' AS order_id,
+               payment_metadata->>'paystack_authorization_url' AS authorization_url
+        FROM purchases
+        WHERE user_id = %s AND plan_id = %s
+          AND payment_method = 'paystack' AND payment_status = 'pending'
+          AND amount = ROUND(%s::numeric, 2)
+          AND CASE WHEN %s::jsonb IS NULL THEN selected_deliverables IS NULL
+                   ELSE selected_deliverables @> %s::jsonb AND selected_deliverables <@ %s::jsonb END
+          AND payment_metadata->>'paystack_authorization_url' IS NOT NULL
+          AND (payment_metadata->>'paystack_initialized_at')::timestamptz > NOW() - make_interval(secs => %s)
+        ORDER BY purchased_at DESC
+        LIMIT 1
+        """,
+        (user_id, plan_id, amount, selection_json, selection_json, selection_json, PAYSTACK_AUTHORIZATION_REUSE_SECONDS)
+    )
+    return cur.fetchone()
+
+
 @customer_bp.route('/plans/purchase', methods=['POST'])
 @jwt_required()
 def purchase_plan():
@@ -603,13 +649,22 @@ def purchase_plan():
               type: string
               example: mpesa
               default: mpesa
+      - in: header
+        name: Idempotency-Key
+        type: string
+        required: false
+        description: Repeating a request with the same key returns the first response.
     responses:
+      200:
+        description: A pending checkout for the same selection was reused
       201:
         description: Purchase successful
       404:
         description: Plan not found
       409:
         description: Already purchased
+      422:
+        description: Idempotency-Key reused for a different request
     """
     user_id, role = get_current_user()
     data = request.get_json()
@@ -620,11 +675,23 @@ def purchase_plan():
     
     if not plan_id:
         return jsonify(message="plan_id is required"), 400
+
+    idempotency_key = (request.headers.get('Idempotency-Key') or '').strip() or None
+    if idempotency_key and len(idempotency_key) > 255:
+        return jsonify(message="Idempotency-Key must be at most 255 characters"), 400
+    request_hash = _purchase_request_hash(plan_id, payment_method, selected_deliverables)
     
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
     
     try:
+        if idempotency_key:
+            cached = _idempotent_purchase_response(cur, user_id, idempotency_key)
+            if cached:
+                if cached['request_hash'] != request_hash:
+                    return jsonify(message="Idempotency-Key was already used for a different purchase request"), 422
+                return jsonify(cached['response']), cached['status_code']
+
         # Get plan details
         cur.execute(
             "SELECT id, name, price, deliverable_prices FROM plans WHERE id = %s AND status = 'Available'",
@@ -708,8 +775,38 @@ def purchase_plan():
             if '__FULL__' in already_purchased:
                 return jsonify(message="You have already purchased this plan"), 409
 
+            if normalized_selection is not None:
+                normalized_selection = sorted(normalized_selection)
             contact = fetch_user_contact(user_id, conn)
             payer_email = (contact or {}).get('email') or f"user-{user_id}@example.com"
+            conn.rollback()
+
+            # A double click or client retry waits here for the first request,
+            # then gets its checkout back below instead of a second one.
+            try:
+                _lock_purchase_start(cur, user_id, plan_id)
+            except psycopg.errors.LockNotAvailable:
+                conn.rollback()
+                return jsonify(message="A payment for this plan is already being started"), 409
+            conn.commit()
+
+            reusable = _reusable_paystack_purchase(cur, user_id, plan_id, amount, normalized_selection)
+            if reusable:
+                body = {
+                    "message": "Paystack payment already initialized",
+                    "status": "pending",
+                    "authorization_url": reusable['authorization_url'],
+                    "reference": reusable['transaction_id'],
+                    "purchase_id": str(reusable['id']),
+                    "order_id": reusable['order_id'],
+                }
+                _store_idempotent_purchase_response(cur, user_id, idempotency_key, request_hash, str(reusable['id']), body, 200)
+                conn.commit()
+                return jsonify(body), 200
+
+            # Nothing written yet: end the read transaction so the session isn't
+            # left idle-in-transaction while Paystack answers.
+            conn.rollback()
             try:
                 authorization_url, reference = _init_paystack_transaction(
                     payer_email,
@@ -733,48 +830,30 @@ def purchase_plan():
             insert_params = (
                 purchase_id, user_id, plan_id, amount,
                 payment_method, 'pending', reference, json.dumps(normalized_selection) if normalized_selection is not None else None,
-                json.dumps({"order_id": order_id, "paystack_references": [reference], "paystack_last_reference": reference})
+                json.dumps({
+                    "order_id": order_id,
+                    "paystack_references": [reference],
+                    "paystack_last_reference": reference,
+                    "paystack_authorization_url": authorization_url,
+                    "paystack_initialized_at": datetime.utcnow().isoformat() + "Z",
+                })
             )
+            # uniq_purchases_user_plan is dropped by database/migrations.sql; upgrades
+            # need several purchase rows per (user, plan).
+            cur.execute(insert_sql, insert_params)
+            _record_paystack_reference(cur, purchase_id, reference)
 
-            try:
-                cur.execute(insert_sql, insert_params)
-            except Exception as e:
-                # Backward-compat: some DBs still have a unique constraint preventing multiple
-                # purchases per (user_id, plan_id). Upgrades require allowing multiple rows.
-                msg = str(e)
-                if 'uniq_purchases_user_plan' in msg or 'duplicate key value violates unique constraint' in msg:
-                    try:
-                        conn.rollback()
-                        cur.execute(
-                            """
-                            DO $$
-                            BEGIN
-                                IF EXISTS (
-                                    SELECT 1 FROM pg_constraint
-                                    WHERE conname = 'uniq_purchases_user_plan'
-                                ) THEN
-                                    ALTER TABLE purchases DROP CONSTRAINT uniq_purchases_user_plan;
-                                END IF;
-                            END$$;
-                            """
-                        )
-                        conn.commit()
-                        cur.execute(insert_sql, insert_params)
-                    except Exception:
-                        conn.rollback()
-                        raise
-                else:
-                    raise
-
-            conn.commit()
-            return jsonify({
+            body = {
                 "message": "Paystack payment initialized",
                 "status": "pending",
                 "authorization_url": authorization_url,
                 "reference": reference,
                 "purchase_id": purchase_id,
                 "order_id": order_id
-            }), 201
+            }
+            _store_idempotent_purchase_response(cur, user_id, idempotency_key, request_hash, purchase_id, body, 201)
+            conn.commit()
+            return jsonify(body), 201
 
         # Reject non-Paystack payment methods
         return jsonify(message="Only Paystack payments are supported"), 400
@@ -828,7 +907,7 @@ def download_plan_manifest(download_token: str):
         # Build a light organized file list for the manifest
         cur.execute(
             """
-            SELECT file_name, file_type, file_path, file_size, uploaded_at
+            SELECT file_name, file_type, file_path, file_size, uploaded_at, metadata
             FROM plan_files
             WHERE plan_id = %s
             ORDER BY uploaded_at ASC
@@ -854,14 +933,7 @@ def download_plan_manifest(download_token: str):
         safe_name = (token_row.get('plan_name') or 'plan')
         download_name = f"{safe_name}-manifest.pdf"
 
-        response = send_file(
-            manifest_pdf,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=download_name,
-        )
-        response.headers['Cache-Control'] = 'no-store'
-        return response
+        return send_package(manifest_pdf, download_name, mimetype='application/pdf')
 
     except Exception as e:
         conn.rollback()
@@ -871,9 +943,40 @@ def download_plan_manifest(download_token: str):
         conn.close()
 
 
+def _paystack_webhook_key(event: str, data: dict) -> str:
+    """Paystack's transaction id identifies a charge; fall back to the reference."""
+    return f"{event}:{data.get('id') or data.get('reference')}"
+
+
+def _apply_paystack_webhook(conn, cur, row):
+    """Webhook inbox handler: complete the purchase a successful charge event refers to."""
+    payload = row['payload']
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    ok, (msg, code) = _complete_paystack_purchase(row['reference'], payload.get('data') or {}, conn, cur)
+    if ok or code == 200:
+        return 'done', msg
+    if code == 202:
+        # Not settled yet; a later webhook or the buyer's verify call completes it.
+        return 'ignored', msg
+    if code == 400:
+        current_app.logger.warning(f"Paystack webhook {row['event_key']} rejected: {msg}")
+        return 'rejected', msg
+    raise RuntimeError(f"{msg} ({code})")
+
+
+def process_paystack_webhooks(conn, batch_size=None, log=None):
+    """Apply queued Paystack webhook events (the background consumer and manage.py use this)."""
+    return process_inbox(conn, 'paystack', _apply_paystack_webhook, batch_size=batch_size, log=log)
+
+
 @customer_bp.route('/payments/paystack/webhook', methods=['POST'])
 def paystack_webhook():
-    """Paystack webhook handler. Verifies signature and completes purchases."""
+    """Paystack webhook handler. Verifies the signature, stores the event and acknowledges it.
+
+    Purchases are completed by the background consumer (see utils/webhook_inbox.py),
+    so Paystack gets its 200 without waiting on that work.
+    """
     raw_body = request.get_data() or b''
     signature = request.headers.get('x-paystack-signature')
     expected = _paystack_signature_for(raw_body)
@@ -898,26 +1001,21 @@ def paystack_webhook():
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
     try:
-        cur.execute("BEGIN")
-        ok, (msg, code) = _complete_paystack_purchase(reference, data, conn, cur)
-        if not ok and code != 200:
-            # If Paystack says it's not completed yet, acknowledge the webhook to
-            # avoid noisy retries; we'll complete the purchase on a later webhook
-            # or user-triggered verification.
-            if int(code) == 202:
-                conn.rollback()
-                return jsonify(status="ignored"), 200
-            conn.rollback()
-            return jsonify(message=msg), code
+        inbox_id = record_webhook(cur, 'paystack', _paystack_webhook_key(event, data), event, reference, payload)
         conn.commit()
-        return jsonify(status="ok"), 200
     except Exception as e:
+        # Not stored: a non-2xx makes Paystack deliver it again.
         conn.rollback()
         return jsonify(message=str(e)), 500
     finally:
         cur.close()
         conn.close()
 
+    if inbox_id is None:
+        return jsonify(status="duplicate"), 200
+    schedule_inbox_processing('paystack', _apply_paystack_webhook)
+    return jsonify(status="queued"), 200
+
 
 @customer_bp.route('/payments/paystack/verify/<string:reference>', methods=['POST'])
 @jwt_required()
@@ -927,25 +1025,25 @@ def verify_paystack(reference: str):
     """
     user_id, role = get_current_user()
 
+    # Ask Paystack before taking a database connection, so a slow upstream
+    # doesn't pin a connection and an open transaction for the whole wait.
+    try:
+        status_code, data = _fetch_paystack_verification(reference)
+    except Exception as e:
+        current_app.logger.error(f"Paystack verification request failed for {reference}: {e}")
+        return jsonify(message="Could not reach Paystack to verify the payment"), 502
+
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
     try:
         cur.execute("BEGIN")
-        # Verify with Paystack
-        resp = requests.get(
-            f"https://api.paystack.co/transaction/verify/{reference}",
-            headers=_paystack_headers(),
-            timeout=10,
-        )
-        data = resp.json() if resp.content else {}
-        
         # Debug logging
-        current_app.logger.info(f"Paystack verification for {reference}: status={resp.status_code}, data_keys={list(data.keys()) if data else 'none'}")
+        current_app.logger.info(f"Paystack verification for {reference}: status={status_code}, data_keys={list(data.keys()) if data else 'none'}")
         if data.get('data'):
             paystack_data = data['data']
             current_app.logger.info(f"Paystack data: status={paystack_data.get('status')}, paid_at={paystack_data.get('paid_at')}, reference={paystack_data.get('reference')}")
         
-        if resp.status_code != 200 or not data.get("status"):
+        if status_code != 200 or not data.get("status"):
             conn.rollback()
             return jsonify(message=data.get("message") or "Failed to verify Paystack payment"), 400
 
@@ -986,6 +1084,9 @@ def verify_paystack(reference: str):
             if not ok and code != 200:
                 cur.execute("ROLLBACK TO SAVEPOINT complete_purchase")
                 conn.rollback()
+                if code == 202:
+                    # Not settled yet: the client can wait on the purchase's event stream.
+                    return jsonify(message=msg, purchase_id=str(purchase['id'])), code
                 return jsonify(message=msg), code
         except Exception as inner_e:
             cur.execute("ROLLBACK TO SAVEPOINT complete_purchase")
@@ -1021,26 +1122,26 @@ def admin_verify_paystack(reference: str):
     if role != 'admin':
         return jsonify(message="Admin access required"), 403
 
+    # Ask Paystack before taking a database connection, so a slow upstream
+    # doesn't pin a connection and an open transaction for the whole wait.
+    try:
+        status_code, data = _fetch_paystack_verification(reference)
+    except Exception as e:
+        current_app.logger.error(f"Paystack verification request failed for {reference}: {e}")
+        return jsonify(message="Could not reach Paystack to verify the payment"), 502
+
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
 
     try:
         cur.execute("BEGIN")
-        # Verify with Paystack
-        resp = requests.get(
-            f"https://api.paystack.co/transaction/verify/{reference}",
-            headers=_paystack_headers(),
-            timeout=10,
-        )
-        data = resp.json() if resp.content else {}
-        
         # Debug logging
-        current_app.logger.info(f"Admin Paystack verification for {reference}: status={resp.status_code}, data_keys={list(data.keys()) if data else 'none'}")
+        current_app.logger.info(f"Admin Paystack verification for {reference}: status={status_code}, data_keys={list(data.keys()) if data else 'none'}")
         if data.get('data'):
             paystack_data = data['data']
             current_app.logger.info(f"Paystack data: status={paystack_data.get('status')}, paid_at={paystack_data.get('paid_at')}, reference={paystack_data.get('reference')}")
         
-        if resp.status_code != 200 or not data.get("status"):
+        if status_code != 200 or not data.get("status"):
             conn.rollback()
             return jsonify(message=data.get("message") or "Failed to verify Paystack payment"), 400
 
@@ -1103,7 +1204,7 @@ def retry_paystack_payment(purchase_id: str):
         cur.execute(
             """
             SELECT p.id, p.user_id, p.plan_id, p.payment_status, p.payment_method,
-                   p.amount, p.transaction_id, p.selected_deliverables, u.email
+                   p.amount, p.transaction_id, p.selected_deliverables, p.payment_metadata, u.email
             FROM purchases p
             JOIN users u ON p.user_id = u.id
             WHERE p.id = %s
@@ -1132,13 +1233,8 @@ def retry_paystack_payment(purchase_id: str):
         existing_reference = purchase.get('transaction_id')
         if existing_reference:
             try:
-                resp = requests.get(
-                    f"https://api.paystack.co/transaction/verify/{existing_reference}",
-                    headers=_paystack_headers(),
-                    timeout=10,
-                )
-                data = resp.json() if resp.content else {}
-                if resp.status_code == 200 and data.get('status') and data.get('data'):
+                status_code, data = _fetch_paystack_verification(existing_reference)
+                if status_code == 200 and data.get('status') and data.get('data'):
                     paystack_data = data.get('data') or {}
                     ok, (msg, code) = _complete_paystack_purchase(existing_reference, paystack_data, conn, cur)
                     if ok or code == 200:
@@ -1182,6 +1278,8 @@ def retry_paystack_payment(purchase_id: str):
             refs.append(new_reference)
         meta['paystack_references'] = refs
         meta['paystack_last_reference'] = new_reference
+        meta['paystack_authorization_url'] = authorization_url
+        meta['paystack_initialized_at'] = datetime.utcnow().isoformat() + "Z"
 
         cur.execute(
             """
@@ -1198,6 +1296,11 @@ def retry_paystack_payment(purchase_id: str):
         if not update_row:
             conn.rollback()
             return jsonify(message="Failed to update purchase with new Paystack reference"), 500
+        _record_paystack_reference(cur, purchase_id, new_reference)
+        notify_purchase_status(
+            cur, purchase_id, 'pending',
+            plan_id=str(update_row['plan_id']), reference=new_reference, download_ready=False,
+        )
 
         conn.commit()
         return jsonify({
@@ -1224,26 +1327,26 @@ def admin_confirm_paystack(reference: str):
     if role != 'admin':
         return jsonify(message="Admin access required"), 403
 
+    # Ask Paystack before taking a database connection, so a slow upstream
+    # doesn't pin a connection and an open transaction for the whole wait.
+    try:
+        status_code, data = _fetch_paystack_verification(reference)
+    except Exception as e:
+        current_app.logger.error(f"Paystack verification request failed for {reference}: {e}")
+        return jsonify(message="Could not reach Paystack to verify the payment"), 502
+
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
 
     try:
         cur.execute("BEGIN")
-        # Verify with Paystack
-        resp = requests.get(
-            f"https://api.paystack.co/transaction/verify/{reference}",
-            headers=_paystack_headers(),
-            timeout=10,
-        )
-        data = resp.json() if resp.content else {}
-        
         # Debug logging
-        current_app.logger.info(f"Admin Paystack confirmation for {reference}: status={resp.status_code}, data_keys={list(data.keys()) if data else 'none'}")
+        current_app.logger.info(f"Admin Paystack confirmation for {reference}: status={status_code}, data_keys={list(data.keys()) if data else 'none'}")
         if data.get('data'):
             paystack_data = data['data']
             current_app.logger.info(f"Paystack data: status={paystack_data.get('status')}, paid_at={paystack_data.get('paid_at')}, reference={paystack_data.get('reference')}")
         
-        if resp.status_code != 200 or not data.get("status"):
+        if status_code != 200 or not data.get("status"):
             conn.rollback()
             return jsonify(message=data.get("message") or "Failed to verify Paystack payment"), 400
 
@@ -1340,26 +1443,7 @@ def purchase_status(plan_id: str):
             (plan_id,)
         )
         plan_row = cur.fetchone() or {}
-        raw_deliverable_prices = plan_row.get('deliverable_prices')
-        deliverable_prices = None
-        if raw_deliverable_prices is not None:
-            if isinstance(raw_deliverable_prices, str):
-                try:
-                    deliverable_prices = json.loads(raw_deliverable_prices)
-                except Exception:
-                    deliverable_prices = None
-            elif isinstance(raw_deliverable_prices, dict):
-                deliverable_prices = raw_deliverable_prices
-
-        priced_keys: set[str] = set()
-        if isinstance(deliverable_prices, dict):
-            for k, v in deliverable_prices.items():
-                try:
-                    n = 0 if v is None or v == '' else float(v)
-                except Exception:
-                    n = 0
-                if isinstance(k, str) and n > 0:
-                    priced_keys.add(k)
+        priced_keys = priced_deliverable_keys(plan_row.get('deliverable_prices'))
 
         cur.execute(
             """
@@ -1445,6 +1529,85 @@ def purchase_status(plan_id: str):
         conn.close()
 
 
+def _purchase_event_row(purchase_id: str):
+    """The purchase as a status event, read on a short-lived connection (None if it doesn't exist)."""
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            SELECT id, user_id, plan_id, payment_status, transaction_id
+            FROM purchases
+            WHERE id = %s
+            """,
+            (purchase_id,)
+        )
+        row = cur.fetchone()
+        if not row:
+            return None
+        return {
+            'purchase_id': str(row['id']),
+            'user_id': row['user_id'],
+            'plan_id': str(row['plan_id']),
+            'status': row['payment_status'],
+            'reference': row['transaction_id'],
+            'download_ready': row['payment_status'] == 'completed',
+        }
+    finally:
+        cur.close()
+        conn.close()
+
+
+@customer_bp.route('/purchases/<string:purchase_id>/events', methods=['GET'])
+@jwt_required()
+def purchase_events(purchase_id: str):
+    """Stream a purchase's status changes as server-sent events until it completes.
+
+    Replaces polling verify/purchase-status after checkout. No database
+    connection is held while the stream is open.
+    """
+    user_id, role = get_current_user()
+    try:
+        # Canonical form, so the subscription key matches the ids in notifications.
+        purchase_id = str(uuid.UUID(purchase_id))
+    except ValueError:
+        return jsonify(message="Purchase not found"), 404
+
+    # Subscribe before the first read so a completion committed in between is still heard.
+    listener = get_listener(current_app.config['DATABASE_URL'])
+    events = listener.subscribe(purchase_id)
+    try:
+        row = _purchase_event_row(purchase_id)
+    except Exception as e:
+        listener.unsubscribe(purchase_id, events)
+        return jsonify(message=str(e)), 500
+    if not row:
+        listener.unsubscribe(purchase_id, events)
+        return jsonify(message="Purchase not found"), 404
+    if int(row['user_id']) != int(user_id) and role != 'admin':
+        listener.unsubscribe(purchase_id, events)
+        return jsonify(message="Not authorized to view this purchase"), 403
+
+    def public(event):
+        return {k: v for k, v in event.items() if k != 'user_id'}
+
+    first = [public(row)]
+
+    def read_status():
+        if first:
+            return first.pop()
+        return public(_purchase_event_row(purchase_id) or row)
+
+    response = Response(
+        stream_with_context(purchase_event_stream(purchase_id, read_status, events)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # Runs when the stream ends or the client goes away, even before the first chunk.
+    response.call_on_close(lambda: listener.unsubscribe(purchase_id, events))
+    return response
+
+
 @customer_bp.route('/plans/download-link', methods=['POST'])
 @jwt_required()
 def generate_download_link():
@@ -1736,20 +1899,17 @@ def generate_download_link():
                     "</div>",
                 ]
                 html = "".join(html_parts)
-                _send_email(to_email, subject, _wrap_email_html("Your download link", html))
-                if purchase_row.get('id'):
-                    cur.execute(
-                        """
-                        UPDATE purchases
-                        SET confirmation_email_sent_at = NOW()
-                        WHERE id = %s
-                        """,
-                        (purchase_row.get('id'),)
+                # Sent once the token commits; the sender stamps confirmation_email_sent_at on delivery.
+                with conn.transaction():
+                    enqueue_email(
+                        cur, to_email, subject, _wrap_email_html("Your download link", html),
+                        kind='download_link', purchase_id=purchase_row.get('id'),
                     )
         except Exception as e:
-            current_app.logger.error(f"Failed to send download link email for user {user_id} plan {plan_id}: {e}")
+            current_app.logger.error(f"Failed to queue download link email for user {user_id} plan {plan_id}: {e}")
 
         conn.commit()
+        schedule_outbox_flush()
 
         return jsonify({
             "download_token": token,
@@ -1805,13 +1965,6 @@ def download_plan_files(download_token: str):
 
         plan_id = token_row['plan_id']
 
-        bundle = fetch_plan_bundle(plan_id, conn)
-        if not bundle:
-            return jsonify(message="Plan not found"), 404
-
-        if not bundle['files']:
-            return jsonify(message="No technical files available for this plan"), 404
-
         selected_deliverables = None
         if role != 'admin':
             purchase_id = token_row.get('purchase_id')
@@ -1839,14 +1992,18 @@ def download_plan_files(download_token: str):
             purchase_row = cur.fetchone() or {}
             selected_deliverables = purchase_row.get('selected_deliverables')
 
+        # Partial purchases load only the purchased deliverables' files.
+        bundle = fetch_plan_bundle(plan_id, conn, selected_deliverables=selected_deliverables)
+        if not bundle:
+            return jsonify(message="Plan not found"), 404
+
+        if not bundle['files']:
+            return jsonify(message="No technical files available for this plan"), 404
+
         customer_info = fetch_user_contact(token_row['user_id'], conn)
         bundle['customer'] = customer_info or {}
 
-        zip_buffer, download_name, files_added = build_plan_zip(
-            bundle,
-            customer=customer_info,
-            selected_deliverables=selected_deliverables,
-        )
+        zip_buffer, download_name, files_added = build_plan_zip(bundle, customer=customer_info)
 
         if files_added == 0:
             return jsonify(message="Plan files could not be located on the server"), 404
@@ -1883,15 +2040,7 @@ def download_plan_files(download_token: str):
         increment_user_quota(token_owner_id, 'downloads', 1, conn)
         conn.commit()
 
-        zip_buffer.seek(0)
-        response = send_file(
-            zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=download_name
-        )
-        response.headers['Cache-Control'] = 'no-store'
-        return response
+        return send_package(zip_buffer, download_name)
 
     except Exception as e:
         conn.rollback()
@@ -2471,25 +2620,16 @@ def get_profile():
     """
     user_id, role = get_current_user()
     
-    conn = get_db()
-    cur = conn.cursor(row_factory=dict_row)
-    
     try:
-        cur.execute("""
-            SELECT id, username, email, role, created_at, phone, profile_image
-            FROM users
-            WHERE id = %s
-        """, (user_id,))
-        
-        profile = dict(cur.fetchone())
-        
-        return jsonify(profile), 200
+        row = get_user_profile(user_id, connect=get_db)
+        if not row:
+            return jsonify(message="User not found"), 404
+
+        fields = ('id', 'username', 'email', 'role', 'created_at', 'phone', 'profile_image')
+        return conditional_json({field: row.get(field) for field in fields})
         
     except Exception as e:
         return jsonify(error=str(e)), 500
-    finally:
-        cur.close()
-        conn.close()
 
 
 @customer_bp.route('/profile', methods=['PUT'])
@@ -2528,6 +2668,7 @@ def update_profile():
         
         cur.execute(query, tuple(values))
         conn.commit()
+        invalidate_user_profile(user_id)
         
         return jsonify(message="Profile updated successfully"), 200
         
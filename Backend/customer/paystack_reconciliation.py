@@ -0,0 +1,186 @@
+"""
+Background reconciliation of pending Paystack purchases.
+
+Buyers who close the Paystack tab, or whose webhook never arrives, would stay
+'pending' until someone hits a verify endpoint. This job pages through pending
+purchases in batches. It asks Paystack about each of their references on a
+small thread pool, under a shared rate limit, and completes the paid ones
+through _complete_paystack_purchase, exactly as the verify endpoints do.
+
+HTTP calls run concurrently. Database work is done one reference at a time
+on the caller's connection, each in its own transaction. Set
+PAYSTACK_API_BASE to run against a local Paystack stand-in.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from psycopg.rows import dict_row
+
+from customer.customer_actions import _complete_paystack_purchase, _fetch_paystack_verification
+
+
+RECONCILE_BATCH_SIZE = int(os.getenv('PAYSTACK_RECONCILE_BATCH_SIZE', '50'))
+RECONCILE_CONCURRENCY = int(os.getenv('PAYSTACK_RECONCILE_CONCURRENCY', '4'))
+RECONCILE_RATE_PER_SECOND = float(os.getenv('PAYSTACK_RECONCILE_RATE_PER_SECOND', '5'))
+# Leave fresh purchases to the buyer's own redirect/verify flow.
+RECONCILE_MIN_AGE_SECONDS = int(os.getenv('PAYSTACK_RECONCILE_MIN_AGE_SECONDS', '120'))
+# Paystack abandons unpaid transactions; older purchases aren't worth asking about.
+RECONCILE_MAX_AGE_HOURS = int(os.getenv('PAYSTACK_RECONCILE_MAX_AGE_HOURS', '72'))
+
+OUTCOMES = ('completed', 'unpaid', 'not_found', 'mismatch', 'rate_limited', 'error')
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads (no bursts)."""
+
+    def __init__(self, rate_per_second, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self._sleep(slot - now)
+
+
+def pending_references(conn, after, limit, min_age_seconds=None, max_age_hours=None):
+    """The next `limit` references of pending Paystack purchases after the (purchased_at, reference) key."""
+    min_age_seconds = RECONCILE_MIN_AGE_SECONDS if min_age_seconds is None else min_age_seconds
+    max_age_hours = RECONCILE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            SELECT r.reference, p.id AS purchase_id, p.purchased_at
+            FROM purchases p
+            JOIN purchase_payment_references r ON r.purchase_id = p.id
+            WHERE p.payment_status = 'pending'
+              AND p.payment_method = 'paystack'
+              AND p.purchased_at <= NOW() - make_interval(secs => %s)
+              AND p.purchased_at >= NOW() - make_interval(hours => %s)
+              AND (p.purchased_at, r.reference) > (%s, %s)
+            ORDER BY p.purchased_at, r.reference
+            LIMIT %s
+            """,
+            (min_age_seconds, max_age_hours, after[0], after[1], limit)
+        )
+        return cur.fetchall()
+    finally:
+        # Don't sit idle in a transaction while Paystack is being asked.
+        conn.rollback()
+        cur.close()
+
+
+def _verify_all(references, concurrency, limiter, verify):
+    def check(reference):
+        limiter.acquire()
+        try:
+            return verify(reference)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='paystack-reconcile') as pool:
+        return dict(zip(references, pool.map(check, references)))
+
+
+def apply_verification(conn, reference, result):
+    """Complete the purchase if Paystack reports `reference` paid. Returns one of OUTCOMES."""
+    if isinstance(result, Exception):
+        return 'error'
+    status_code, body = result
+    if status_code == 404:
+        return 'not_found'
+    if status_code == 429:
+        return 'rate_limited'
+    if status_code != 200 or not body.get('status'):
+        return 'error'
+
+    data = body.get('data') or {}
+    if data.get('reference') and str(data['reference']) != str(reference):
+        return 'mismatch'
+    if (data.get('status') or '').lower() != 'success':
+        return 'unpaid'
+
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        ok, (msg, code) = _complete_paystack_purchase(reference, data, conn, cur)
+        if ok or code == 200:
+            conn.commit()
+            return 'completed'
+        conn.rollback()
+        if code == 202:
+            return 'unpaid'
+        if code == 400:
+            return 'mismatch'
+        return 'not_found' if code == 404 else 'error'
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def reconcile_pending_purchases(conn, batch_size=None, concurrency=None, rate_per_second=None,
+                                limit=None, min_age_seconds=None, max_age_hours=None,
+                                log=None, verify=None):
+    """Verify pending Paystack purchases with Paystack and complete the paid ones.
+
+    Returns counts by outcome plus 'checked'. `verify(reference)` defaults to
+    the live Paystack verify call and returns (http_status, body).
+    """
+    batch_size = batch_size or RECONCILE_BATCH_SIZE
+    concurrency = concurrency or RECONCILE_CONCURRENCY
+    limiter = RateLimiter(RECONCILE_RATE_PER_SECOND if rate_per_second is None else rate_per_second)
+    verify = verify or _fetch_paystack_verification
+
+    stats = dict.fromkeys(OUTCOMES, 0)
+    stats['checked'] = 0
+    after = (datetime.min, '')
+    completed_purchases = set()
+    batch_number = 0
+
+    while limit is None or stats['checked'] < limit:
+        size = batch_size if limit is None else min(batch_size, limit - stats['checked'])
+        rows = pending_references(conn, after, size, min_age_seconds, max_age_hours)
+        if not rows:
+            break
+        batch_number += 1
+        after = (rows[-1]['purchased_at'], rows[-1]['reference'])
+
+        # A purchase paid through one reference doesn't need its others checked.
+        rows = [row for row in rows if row['purchase_id'] not in completed_purchases]
+        started = time.perf_counter()
+        results = _verify_all([row['reference'] for row in rows], concurrency, limiter, verify)
+
+        for row in rows:
+            if row['purchase_id'] in completed_purchases:
+                continue
+            try:
+                outcome = apply_verification(conn, row['reference'], results[row['reference']])
+            except Exception as e:
+                outcome = 'error'
+                if log:
+                    log(f"{row['reference']}: {e}")
+            if outcome == 'completed':
+                completed_purchases.add(row['purchase_id'])
+            stats[outcome] += 1
+            stats['checked'] += 1
+
+        if log:
+            log(
+                f"Batch {batch_number}: {len(rows)} reference(s) in {time.perf_counter() - started:.1f}s; "
+                f"{stats['checked']} checked, {stats['completed']} completed so far"
+            )
+        if stats['rate_limited']:
+            # Paystack is pushing back; stop and let the next run continue.
+            break
+    return stats
@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from flask import Flask
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from customer import customer_actions, paystack_reconciliation  # noqa: E402
+from utils import http_clients  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+class _PaystackStandIn(BaseHTTPRequestHandler):
+    """Answers /transaction/verify/<reference> the way Paystack does, based on the reference prefix."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.auth.add(self.headers.get('Authorization'))
+        time.sleep(0.05)
+        reference = self.path.rsplit('/', 1)[-1]
+        if reference.startswith('missing'):
+            status, body = 404, {'status': False, 'message': 'Transaction reference not found'}
+        else:
+            paid = reference.startswith('paid')
+            status, body = 200, {'status': True, 'data': {
+                'reference': reference,
+                'status': 'success' if paid else 'abandoned',
+                'paid_at': '2026-01-01T00:00:00Z' if paid else None,
+                'amount': 1000, 'currency': 'USD',
+            }}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class ReconciliationTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _PaystackStandIn)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.in_flight = self.server.max_in_flight = 0
+        self.server.auth = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        http_clients.reset_http_clients()
+        self.addCleanup(http_clients.reset_http_clients)
+
+        for patcher in (
+            mock.patch.object(customer_actions, 'PAYSTACK_API_BASE', f"http://127.0.0.1:{self.server.server_address[1]}"),
+            mock.patch.object(customer_actions, 'PAYSTACK_SECRET_KEY', 'sk_test_standin'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        app = Flask(__name__)
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+    def _pages(self, references):
+        base = datetime(2026, 1, 1)
+        rows = [
+            {'reference': ref, 'purchase_id': purchase_id, 'purchased_at': base + timedelta(minutes=n)}
+            for n, (ref, purchase_id) in enumerate(references)
+        ]
+
+        def page(conn, after, limit, min_age_seconds=None, max_age_hours=None):
+            remaining = [r for r in rows if (r['purchased_at'], r['reference']) > after]
+            return remaining[:limit]
+        return page
+
+    def test_paid_references_are_completed_and_the_rest_reported(self):
+        references = [
+            ('paid-1', 'p1'), ('paid-1b', 'p1'), ('open-2', 'p2'),
+            ('missing-3', 'p3'), ('paid-4', 'p4'), ('open-5', 'p5'),
+        ]
+        completed = []
+
+        def complete(reference, data, conn, cur):
+            completed.append(reference)
+            return True, ("Payment verified and purchase activated", 200)
+
+        conn = FakeConnection()
+        with mock.patch.object(paystack_reconciliation, 'pending_references', side_effect=self._pages(references)), \
+                mock.patch.object(paystack_reconciliation, '_complete_paystack_purchase', side_effect=complete):
+            stats = paystack_reconciliation.reconcile_pending_purchases(
+                conn, batch_size=3, concurrency=3, rate_per_second=0, log=lambda msg: None,
+                verify=customer_actions._fetch_paystack_verification,
+            )
+
+        self.assertEqual(completed, ['paid-1', 'paid-4'])
+        self.assertEqual(conn.commits, 2)
+        self.assertEqual(
+            {k: stats[k] for k in ('completed', 'unpaid', 'not_found', 'checked')},
+            {'completed': 2, 'unpaid': 2, 'not_found': 1, 'checked': 5},
+        )
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertEqual(self.server.auth, {'Bearer sk_test_standin'})
+
+    def test_amount_mismatches_are_not_committed(self):
+        conn = FakeConnection()
+        with mock.patch.object(paystack_reconciliation, '_complete_paystack_purchase',
+                               return_value=(False, ("Payment amount mismatch", 400))):
+            outcome = paystack_reconciliation.apply_verification(
+                conn, 'paid-9', (200, {'status': True, 'data': {'reference': 'paid-9', 'status': 'success'}})
+            )
+
+        self.assertEqual(outcome, 'mismatch')
+        self.assertEqual(conn.commits, 0)
+
+
+class PendingReferencesTests(unittest.TestCase):
+    def test_pages_are_keyset_ordered_and_release_the_snapshot(self):
+        after = (datetime(2026, 1, 1), 'ref-3')
+        conn = FakeConnection([[{'reference': 'ref-4', 'purchase_id': 'p4', 'purchased_at': datetime(2026, 1, 2)}]])
+
+        rows = paystack_reconciliation.pending_references(conn, after, 50, min_age_seconds=120, max_age_hours=72)
+
+        sql, params = conn.executed[0]
+        self.assertIn('AND (p.purchased_at, r.reference) > (%s, %s) ORDER BY p.purchased_at, r.reference LIMIT %s', sql)
+        self.assertEqual(params, (120, 72, after[0], after[1], 50))
+        self.assertEqual([row['reference'] for row in rows], ['ref-4'])
+        # No transaction stays open while Paystack is asked about the page.
+        self.assertEqual(conn.events[-1], ('rollback',))
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_calls_are_spaced_by_the_rate(self):
+        clock = {'now': 100.0}
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(round(seconds, 3))
+
+        limiter = paystack_reconciliation.RateLimiter(4, clock=lambda: clock['now'], sleep=sleep)
+        for _ in range(3):
+            limiter.acquire()
+
+        self.assertEqual(sleeps, [0.25, 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
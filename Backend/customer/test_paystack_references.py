@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from customer import customer_actions  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+_PURCHASE_ID = '6f1c0d3e-3a8b-4c52-9d7e-2b1f0a9c4e11'
+
+
+class ReferenceLookupTests(unittest.TestCase):
+    def test_a_reference_is_found_through_the_index_and_locks_the_purchase(self):
+        purchase = {'id': _PURCHASE_ID, 'payment_status': 'pending', 'transaction_id': 'ref-2'}
+        conn = FakeConnection([purchase])
+
+        found = customer_actions._purchase_for_paystack_reference(conn.cursor(), 'ref-1')
+
+        self.assertIs(found, purchase)
+        (sql, params), = conn.executed
+        self.assertIn('FROM purchase_payment_references r JOIN purchases p ON p.id = r.purchase_id', sql)
+        self.assertIn('WHERE r.reference = %s FOR UPDATE OF p', sql)
+        self.assertEqual(params, ('ref-1',))
+
+    def test_an_unknown_or_empty_reference_finds_nothing(self):
+        conn = FakeConnection([None])
+        self.assertIsNone(customer_actions._purchase_for_paystack_reference(conn.cursor(), 'ref-x'))
+        self.assertIsNone(customer_actions._purchase_for_paystack_reference(conn.cursor(), ''))
+        self.assertEqual(len(conn.executed), 1)
+
+
+class ReferenceAppendTests(unittest.TestCase):
+    def test_the_reference_is_indexed_and_added_to_the_history(self):
+        conn = FakeConnection()
+
+        customer_actions._append_paystack_reference_to_purchase(conn.cursor(), _PURCHASE_ID, 'ref-3')
+
+        statements = [sql for sql, _ in conn.executed]
+        self.assertEqual(statements[0], 'SAVEPOINT paystack_ref_append')
+        self.assertIn('INSERT INTO purchase_payment_references (reference, purchase_id, provider)', statements[1])
+        self.assertIn('ON CONFLICT (reference) DO NOTHING', statements[1])
+        self.assertEqual(conn.executed[1][1], ('ref-3', _PURCHASE_ID))
+        self.assertTrue(statements[2].startswith('UPDATE purchases SET payment_metadata ='))
+        self.assertEqual(conn.executed[2][1], ('ref-3', 'ref-3', _PURCHASE_ID))
+        self.assertEqual(statements[3], 'RELEASE SAVEPOINT paystack_ref_append')
+
+    def test_a_bookkeeping_failure_is_rolled_back_to_the_savepoint(self):
+        def respond(sql, params):
+            if sql.startswith('UPDATE purchases'):
+                raise RuntimeError('metadata is not an object')
+
+        conn = FakeConnection(respond=respond)
+
+        customer_actions._append_paystack_reference_to_purchase(conn.cursor(), _PURCHASE_ID, 'ref-3')
+
+        self.assertEqual(conn.statements('SAVEPOINT')[-2:], [
+            'ROLLBACK TO SAVEPOINT paystack_ref_append',
+            'RELEASE SAVEPOINT paystack_ref_append',
+        ])
+
+    def test_nothing_is_recorded_without_a_purchase_or_reference(self):
+        conn = FakeConnection()
+        customer_actions._append_paystack_reference_to_purchase(conn.cursor(), None, 'ref-3')
+        customer_actions._append_paystack_reference_to_purchase(conn.cursor(), _PURCHASE_ID, '')
+        self.assertEqual(conn.executed, [])
+
+
+class RetryReferenceTests(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['JWT_SECRET_KEY'] = 'test-secret-key-that-is-long-enough-for-hs256'
+        JWTManager(app)
+        app.register_blueprint(customer_actions.customer_bp)
+        self.client = app.test_client()
+        with app.app_context():
+            token = create_access_token(identity='7', additional_claims={'role': 'customer'})
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def test_a_retry_indexes_the_new_reference(self):
+        purchase = {
+            'id': _PURCHASE_ID, 'user_id': 7, 'plan_id': 'plan-1', 'payment_status': 'pending',
+            'payment_method': 'paystack', 'amount': 100, 'transaction_id': 'ref-1',
+            'selected_deliverables': None, 'payment_metadata': {'order_id': 'RC-1'}, 'email': 'buyer@example.com',
+        }
+
+        def respond(sql, params):
+            if 'FROM purchases p JOIN users u' in sql:
+                return [purchase]
+            if sql.endswith('RETURNING plan_id'):
+                return [{'plan_id': 'plan-1'}]
+
+        conn = FakeConnection(respond=respond)
+        with mock.patch.object(customer_actions, 'get_db', return_value=conn), \
+                mock.patch.object(customer_actions, '_fetch_paystack_verification', return_value=(400, {})), \
+                mock.patch.object(customer_actions, 'fetch_user_contact', return_value={}), \
+                mock.patch.object(customer_actions, '_init_paystack_transaction',
+                                  return_value=('https://checkout/ref-2', 'ref-2')):
+            resp = self.client.post(f'/customer/payments/paystack/retry/{_PURCHASE_ID}', headers=self.headers)
+
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        self.assertEqual(resp.get_json()['reference'], 'ref-2')
+        (update_params,) = [params for sql, params in conn.executed if sql.endswith('RETURNING plan_id')]
+        self.assertEqual(json.loads(update_params[1])['paystack_references'], ['ref-1', 'ref-2'])
+        (index_params,) = [params for sql, params in conn.executed if 'INSERT INTO purchase_payment_references' in sql]
+        self.assertEqual(index_params, ('ref-2', _PURCHASE_ID))
+        self.assertTrue(conn.committed)
+        self.assertTrue(conn.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import queue
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from customer import customer_actions  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+_PURCHASE_ID = '6f1c0d3e-3a8b-4c52-9d7e-2b1f0a9c4e11'
+
+
+class PurchaseEventsEndpointTests(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['JWT_SECRET_KEY'] = 'test-secret-key-that-is-long-enough-for-hs256'
+        app.config['DATABASE_URL'] = 'postgresql://unused'
+        JWTManager(app)
+        app.register_blueprint(customer_actions.customer_bp)
+        self.client = app.test_client()
+        with app.app_context():
+            token = create_access_token(identity='7', additional_claims={'role': 'customer'})
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+        self.listener = mock.Mock()
+        self.listener.subscribe.return_value = queue.Queue()
+        self.conn = FakeConnection([{
+            'id': _PURCHASE_ID, 'user_id': 7, 'plan_id': 'plan-1',
+            'payment_status': 'completed', 'transaction_id': 'ref-1',
+        }])
+        for patcher in (
+            mock.patch.object(customer_actions, 'get_listener', return_value=self.listener),
+            mock.patch.object(customer_actions, 'get_db', return_value=self.conn),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_a_malformed_purchase_id_is_not_found(self):
+        resp = self.client.get('/customer/purchases/not-a-uuid/events', headers=self.headers)
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json()['message'], 'Purchase not found')
+        self.listener.subscribe.assert_not_called()
+        self.assertEqual(self.conn.executed, [])
+
+    def test_the_purchase_id_is_subscribed_in_canonical_form(self):
+        resp = self.client.get(f'/customer/purchases/{_PURCHASE_ID.upper()}/events', headers=self.headers)
+        body = resp.get_data(as_text=True)
+        resp.close()
+
+        self.assertEqual(resp.status_code, 200)
+        self.listener.subscribe.assert_called_once_with(_PURCHASE_ID)
+        self.assertEqual(self.conn.executed[0][1], (_PURCHASE_ID,))
+        self.assertIn('"status": "completed"', body)
+        self.listener.unsubscribe.assert_called_once_with(_PURCHASE_ID, self.listener.subscribe.return_value)
+
+
+if __name__ == '__main__':
+    unittest.main()
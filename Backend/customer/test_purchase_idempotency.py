@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from customer import customer_actions  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+class PurchaseIdempotencyTests(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['JWT_SECRET_KEY'] = 'test-secret-key-that-is-long-enough-for-hs256'
+        JWTManager(app)
+        app.register_blueprint(customer_actions.customer_bp)
+        self.client = app.test_client()
+        with app.app_context():
+            token = create_access_token(identity='7', additional_claims={'role': 'customer'})
+        self.headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': 'checkout-1'}
+        self.body = {'plan_id': 'plan-1', 'payment_method': 'paystack', 'selected_deliverables': ['b', 'a']}
+        self.cached = {'message': 'Paystack payment initialized', 'reference': 'ref-1', 'purchase_id': 'p-1'}
+
+    def _post(self, conn, body=None):
+        with mock.patch.object(customer_actions, 'get_db', return_value=conn), \
+                mock.patch.object(customer_actions, '_init_paystack_transaction') as init:
+            resp = self.client.post('/customer/plans/purchase', json=body or self.body, headers=self.headers)
+        self.assertFalse(init.called, 'Paystack must not be contacted')
+        return resp
+
+    def test_a_repeated_key_replays_the_first_response(self):
+        request_hash = customer_actions._purchase_request_hash('plan-1', 'paystack', ['a', 'b'])
+        conn = FakeConnection([{'request_hash': request_hash, 'status_code': 201, 'response': self.cached}])
+
+        resp = self._post(conn)
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.get_json(), self.cached)
+        self.assertEqual(len(conn.executed), 1, 'only the idempotency lookup runs')
+
+    def test_a_key_reused_for_another_request_is_refused(self):
+        request_hash = customer_actions._purchase_request_hash('plan-2', 'paystack', None)
+        conn = FakeConnection([{'request_hash': request_hash, 'status_code': 201, 'response': self.cached}])
+
+        resp = self._post(conn)
+
+        self.assertEqual(resp.status_code, 422)
+
+    def test_a_fresh_pending_checkout_is_reused(self):
+        conn = FakeConnection([
+            None,  # no stored idempotency key
+            {'id': 'plan-1', 'name': 'Plan', 'price': 100, 'deliverable_prices': None},
+            [],  # no earlier purchases of the plan
+            {'id': 'p-9', 'transaction_id': 'ref-9', 'order_id': 'RC-1', 'authorization_url': 'https://checkout/ref-9'},
+        ])
+
+        with mock.patch.object(customer_actions, 'fetch_user_contact', return_value={'email': 'buyer@example.com'}):
+            resp = self._post(conn, {'plan_id': 'plan-1', 'payment_method': 'paystack'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['authorization_url'], 'https://checkout/ref-9')
+        self.assertEqual(len(conn.statements('INSERT INTO purchase_idempotency_keys')), 1)
+
+    def test_the_start_lock_is_bounded_and_held_across_the_reuse_check(self):
+        conn = FakeConnection([
+            None,  # no stored idempotency key
+            {'id': 'plan-1', 'name': 'Plan', 'price': 100, 'deliverable_prices': None},
+            [],  # no earlier purchases of the plan
+            {'id': 'p-9', 'transaction_id': 'ref-9', 'order_id': 'RC-1', 'authorization_url': 'https://checkout/ref-9'},
+        ])
+
+        with mock.patch.object(customer_actions, 'fetch_user_contact', return_value={'email': 'buyer@example.com'}):
+            self._post(conn, {'plan_id': 'plan-1', 'payment_method': 'paystack'})
+
+        events = [e[1] if e[0] == 'sql' else e[0] for e in conn.events]
+        timeout_at = next(i for i, e in enumerate(events) if "set_config('lock_timeout'" in e)
+        lock_at = next(i for i, e in enumerate(events) if 'pg_advisory_lock(hashtextextended(%s, 0))' in e)
+        reuse_at = next(i for i, e in enumerate(events) if "payment_status = 'pending'" in e)
+        # The timeout is transaction-local, so it must be set in the same transaction as the lock;
+        # the lock is session-level, so committing right after it must not release it.
+        self.assertLess(timeout_at, lock_at)
+        self.assertNotIn('commit', events[timeout_at:lock_at])
+        self.assertEqual(events[lock_at + 1], 'commit')
+        self.assertLess(lock_at, reuse_at)
+        self.assertEqual(conn.events[lock_at][2], ('purchase-start:7:plan-1',))
+
+
+if __name__ == '__main__':
+    unittest.main()
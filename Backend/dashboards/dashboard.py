@@ -4,6 +4,8 @@ import psycopg
 from psycopg.rows import dict_row
 from datetime import datetime
 
+from auth.profile_cache import get_user_profile, conditional_json
+
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
 
@@ -150,21 +152,13 @@ def customer_dashboard():
 def my_profile():
     user_id, role = get_current_user()
 
-    conn = get_db_connection()
-    cur = conn.cursor(row_factory=dict_row)
-
-    try:
-        cur.execute("SELECT username, role, created_at FROM users WHERE id = %s;", (user_id,))
-        user = cur.fetchone()
-        if not user:
-            return jsonify(message="User not found"), 404
+    user = get_user_profile(user_id, connect=get_db_connection)
+    if not user:
+        return jsonify(message="User not found"), 404
 
-        return jsonify({
-            "user_id": user_id,
-            "username": user['username'],
-            "role": user['role'],
-            "created_at": user['created_at'].isoformat()
-        })
-    finally:
-        cur.close()
-        conn.close()
+    return conditional_json({
+        "user_id": user_id,
+        "username": user['username'],
+        "role": user['role'],
+        "created_at": user['created_at'].isoformat()
+    })
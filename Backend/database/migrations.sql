@@ -407,3 +407,307 @@ CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites(user_id);
 CREATE INDEX IF NOT EXISTS idx_favorites_plan_id ON favorites(plan_id);
 CREATE INDEX IF NOT EXISTS idx_plan_reviews_plan_id ON plan_reviews(plan_id);
 CREATE INDEX IF NOT EXISTS idx_plan_reviews_user_id ON plan_reviews(user_id);
+
+-- Content-addressed upload store: each distinct file is stored once by SHA-256
+-- under uploads/blobs/ and plan_files rows reference it.
+CREATE TABLE IF NOT EXISTS file_blobs (
+    storage_key TEXT PRIMARY KEY, -- relative to the uploads root, e.g. blobs/ab/cd/<sha256>.pdf
+    sha256 CHAR(64) NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_referenced_at TIMESTAMP
+);
+
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS blob_key TEXT REFERENCES file_blobs(storage_key);
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);
+
+-- Keep file_blobs.ref_count in step with plan_files (including cascaded plan deletes).
+CREATE OR REPLACE FUNCTION plan_files_blob_refcount() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_key IS NOT NULL THEN
+        UPDATE file_blobs
+        SET ref_count = GREATEST(ref_count - 1, 0)
+        WHERE storage_key = OLD.blob_key;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_key IS NOT NULL THEN
+        UPDATE file_blobs
+        SET ref_count = ref_count + 1, last_referenced_at = CURRENT_TIMESTAMP
+        WHERE storage_key = NEW.blob_key;
+    END IF;
+    RETURN NULL;
+END$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_plan_files_blob_refcount ON plan_files;
+CREATE TRIGGER trg_plan_files_blob_refcount
+    AFTER INSERT OR DELETE OR UPDATE OF blob_key ON plan_files
+    FOR EACH ROW EXECUTE FUNCTION plan_files_blob_refcount();
+
+CREATE INDEX IF NOT EXISTS idx_file_blobs_sha256 ON file_blobs(sha256);
+CREATE INDEX IF NOT EXISTS idx_file_blobs_unreferenced ON file_blobs(created_at) WHERE ref_count = 0;
+CREATE INDEX IF NOT EXISTS idx_plan_files_blob_key ON plan_files(blob_key);
+
+-- Canonical storage descriptor recorded at upload time so downloads can
+-- resolve files without probing the filesystem. Size and checksum live in
+-- file_size / content_sha256. Backfill older rows with `manage.py storage-backfill`.
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS storage_backend VARCHAR(20); -- 'local' | 'url'
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS storage_key TEXT;
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS storage_mtime TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_plan_files_missing_descriptor ON plan_files(id) WHERE storage_backend IS NULL;
+
+-- Resumable chunked uploads (/plans/upload-sessions). Chunks are appended to
+-- uploads/.staging/sessions/<id>.part and the finalized file moves into the
+-- blob store; POST /plans/upload attaches sessions via upload_session_ids.
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    plan_id UUID REFERENCES plans(id) ON DELETE SET NULL,
+    file_name VARCHAR(255) NOT NULL,
+    file_type VARCHAR(50) NOT NULL,
+    total_size BIGINT NOT NULL,
+    received_bytes BIGINT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'uploading', -- 'uploading', 'complete', 'attached', 'aborted', 'failed'
+    storage_key TEXT,
+    content_sha256 CHAR(64),
+    storage_mtime TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_user_status ON upload_sessions(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires_at ON upload_sessions(expires_at) WHERE status = 'uploading';
+
+-- Responsive image derivatives (WebP/AVIF widths + blur placeholder) per
+-- thumbnail/gallery image, keyed by the original image URL/path.
+CREATE TABLE IF NOT EXISTS media_derivatives (
+    source_url TEXT PRIMARY KEY,
+    plan_id UUID REFERENCES plans(id) ON DELETE CASCADE,
+    width INTEGER,
+    height INTEGER,
+    variants JSONB NOT NULL, -- {"webp": [{"width": 320, "url": "..."}], "avif": [...]}
+    placeholder TEXT,        -- tiny blurred data URI
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_derivatives_plan_id ON media_derivatives(plan_id);
+
+-- Extracted technical-file metadata (PDF pages/sheet sizes, CAD version,
+-- image dimensions, checksum), filled in by a background worker after upload.
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS metadata JSONB;
+CREATE INDEX IF NOT EXISTS idx_plan_files_metadata ON plan_files USING GIN (metadata jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_plan_files_metadata_pending ON plan_files(id) WHERE metadata IS NULL;
+
+-- Plan versions as deltas: each version's plan_files start as copies of the
+-- previous version's rows (sharing blobs); only the differences are logged here.
+CREATE TABLE IF NOT EXISTS plan_version_changes (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    plan_id UUID NOT NULL REFERENCES plans(id) ON DELETE CASCADE,
+    base_plan_id UUID REFERENCES plans(id) ON DELETE SET NULL,
+    change_type VARCHAR(10) NOT NULL, -- 'added', 'modified', 'removed'
+    file_name VARCHAR(255) NOT NULL,
+    file_type VARCHAR(50),
+    content_sha256 CHAR(64),
+    previous_sha256 CHAR(64),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_plan_version_changes_plan_id ON plan_version_changes(plan_id);
+CREATE INDEX IF NOT EXISTS idx_plans_parent_plan_id_version ON plans(parent_plan_id, version);
+
+-- Deliverable (plans.deliverable_prices key) each plan file belongs to, set at
+-- insert time so partial-purchase packages select only the rows they need.
+ALTER TABLE plan_files ADD COLUMN IF NOT EXISTS deliverable_key VARCHAR(20);
+
+UPDATE plan_files
+SET deliverable_key = CASE
+    WHEN upper(file_type) LIKE 'ARCH%' THEN 'architectural'
+    WHEN upper(file_type) LIKE 'STRUCT%' THEN 'structural'
+    WHEN upper(file_type) LIKE 'MEP%' THEN 'mep'
+    WHEN upper(file_type) LIKE 'CIVIL%' THEN 'civil'
+    WHEN upper(file_type) LIKE 'FIRE%' THEN 'fire_safety'
+    WHEN upper(file_type) LIKE 'INTERIOR%' THEN 'interior'
+    WHEN upper(file_type) LIKE 'BOQ%' THEN 'boq'
+    WHEN upper(file_type) LIKE 'RENDER%' THEN 'renders'
+END
+WHERE deliverable_key IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_plan_files_plan_deliverable ON plan_files(plan_id, deliverable_key);
+
+-- Watermarked page previews of architectural PDFs, rendered once per file
+-- checksum into uploads/previews/v<version>/; size-bounded (oldest evicted first).
+CREATE TABLE IF NOT EXISTS plan_file_previews (
+    content_sha256 CHAR(64) PRIMARY KEY,
+    version INTEGER NOT NULL,
+    pages JSONB NOT NULL, -- [{"page": 1, "width": 1200, "height": 848, "name": "p1.webp"}]
+    size_bytes BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_plan_file_previews_created_at ON plan_file_previews(created_at);
+
+-- Storage garbage collection: incremental walk position, quarantined orphan
+-- files (purged after a retention period) and per-plan/per-designer usage.
+CREATE TABLE IF NOT EXISTS storage_gc_state (
+    id SMALLINT PRIMARY KEY CHECK (id = 1),
+    walk_cursor TEXT, -- last storage key examined; NULL starts a new pass
+    pass_started_at TIMESTAMP,
+    last_pass_completed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS storage_quarantine (
+    storage_key TEXT PRIMARY KEY, -- original location relative to the uploads root
+    size_bytes BIGINT NOT NULL,
+    quarantined_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_storage_quarantine_quarantined_at ON storage_quarantine(quarantined_at);
+
+CREATE TABLE IF NOT EXISTS storage_usage (
+    scope VARCHAR(10) NOT NULL, -- 'plan' or 'designer'
+    scope_id TEXT NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    unique_bytes BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, scope_id)
+);
+
+-- Reference lookups made by the collector.
+CREATE INDEX IF NOT EXISTS idx_plan_files_storage_key ON plan_files(storage_key);
+CREATE INDEX IF NOT EXISTS idx_plan_files_file_path ON plan_files(file_path);
+CREATE INDEX IF NOT EXISTS idx_plans_image_url ON plans(image_url);
+CREATE INDEX IF NOT EXISTS idx_users_profile_picture_url ON users(profile_picture_url);
+
+-- Outbound email queue. Handlers insert rows in their own transaction and a
+-- background sender delivers them over pooled SMTP connections with retries.
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html_body TEXT NOT NULL,
+    kind VARCHAR(40) NOT NULL DEFAULT 'generic', -- verify_email, password_reset, custom_request, download_link
+    purchase_id UUID REFERENCES purchases(id) ON DELETE SET NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending', -- pending, sending, sent, dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(next_attempt_at, id) WHERE status IN ('pending', 'sending');
+
+-- Case-insensitive username lookups. Every auth query filters on
+-- LOWER(username) = LOWER(%s), which this expression index serves. The index
+-- is unique so "Bob@x.com" and "bob@x.com" can't both register. If such pairs
+-- already exist, a plain index is built for now; `manage.py users-dedupe-usernames
+-- --apply` resolves them (recording each renamed account below) and then
+-- swaps in the unique one.
+CREATE TABLE IF NOT EXISTS username_case_duplicates (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    original_username TEXT NOT NULL,
+    kept_user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE tablename = 'users' AND indexname = 'idx_users_username_lower') THEN
+        IF EXISTS (SELECT 1 FROM users GROUP BY LOWER(username) HAVING COUNT(*) > 1) THEN
+            RAISE NOTICE 'users has usernames that differ only by case; run manage.py users-dedupe-usernames --apply';
+            CREATE INDEX IF NOT EXISTS idx_users_username_lower_nonunique ON users (LOWER(username));
+        ELSE
+            CREATE UNIQUE INDEX idx_users_username_lower ON users (LOWER(username));
+            DROP INDEX IF EXISTS idx_users_username_lower_nonunique;
+        END IF;
+    END IF;
+END $$;
+
+-- Paystack references, one row per reference ever issued for a purchase
+-- (retries create new ones). Webhooks and verify calls look purchases up
+-- here by primary key instead of scanning purchases.payment_metadata.
+CREATE TABLE IF NOT EXISTS purchase_payment_references (
+    reference TEXT PRIMARY KEY,
+    purchase_id UUID NOT NULL REFERENCES purchases(id) ON DELETE CASCADE,
+    provider VARCHAR(20) NOT NULL DEFAULT 'paystack',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_purchase_payment_references_purchase ON purchase_payment_references(purchase_id);
+
+-- Backfill from transaction_id and the JSONB history. Like the old lookup,
+-- this does not filter on payment_method. If a reference somehow appears on
+-- several purchases, the newest wins (as the old lookup did). Safe to re-run.
+INSERT INTO purchase_payment_references (reference, purchase_id)
+SELECT DISTINCT ON (refs.reference) refs.reference, refs.purchase_id
+FROM (
+    SELECT p.transaction_id AS reference, p.id AS purchase_id, p.purchased_at
+    FROM purchases p
+    WHERE p.transaction_id IS NOT NULL AND p.transaction_id <> ''
+    UNION ALL
+    SELECT r.reference, p.id, p.purchased_at
+    FROM purchases p
+    CROSS JOIN LATERAL jsonb_array_elements_text(
+        CASE WHEN jsonb_typeof(p.payment_metadata->'paystack_references') = 'array'
+             THEN p.payment_metadata->'paystack_references' ELSE '[]'::jsonb END
+    ) AS r(reference)
+    WHERE r.reference <> ''
+) refs
+ORDER BY refs.reference, refs.purchased_at DESC NULLS LAST
+ON CONFLICT (reference) DO NOTHING;
+
+-- Incoming payment webhooks. The endpoint stores each event here and answers
+-- at once; a background consumer applies them in order per reference.
+-- (provider, event_key) makes redeliveries no-ops.
+CREATE TABLE IF NOT EXISTS webhook_inbox (
+    id BIGSERIAL PRIMARY KEY,
+    provider VARCHAR(20) NOT NULL,
+    event_key TEXT NOT NULL, -- e.g. charge.success:<paystack transaction id>
+    event_type TEXT,
+    reference TEXT,
+    payload JSONB NOT NULL,
+    status VARCHAR(12) NOT NULL DEFAULT 'pending', -- pending, processing, done, ignored, rejected, dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMPTZ,
+    last_error TEXT,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMPTZ,
+    UNIQUE (provider, event_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_inbox_due ON webhook_inbox(provider, id) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_webhook_inbox_reference_open ON webhook_inbox(provider, reference, id) WHERE status IN ('pending', 'processing');
+
+-- Pending purchases scanned by `manage.py paystack-reconcile`.
+CREATE INDEX IF NOT EXISTS idx_purchases_pending_paystack ON purchases(purchased_at) WHERE payment_status = 'pending' AND payment_method = 'paystack';
+
+-- Responses to POST /customer/plans/purchase keyed by the client's
+-- Idempotency-Key, replayed for PURCHASE_IDEMPOTENCY_TTL_SECONDS.
+CREATE TABLE IF NOT EXISTS purchase_idempotency_keys (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    purchase_id UUID REFERENCES purchases(id) ON DELETE CASCADE,
+    status_code SMALLINT NOT NULL,
+    response JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+-- Pending checkouts are reused for the same buyer, plan and selection.
+CREATE INDEX IF NOT EXISTS idx_purchases_pending_user_plan ON purchases(user_id, plan_id, purchased_at DESC) WHERE payment_status = 'pending';
+
+-- Direct uploads confirmed through POST /direct-uploads/confirm, one row per
+-- signed asset so an upload_token cannot be replayed within its TTL.
+CREATE TABLE IF NOT EXISTS direct_upload_confirmations (
+    public_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    confirmed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_direct_upload_confirmations_confirmed_at ON direct_upload_confirmations(confirmed_at);
@@ -0,0 +1,353 @@
+"""Bulk catalog import: validate rows up front, COPY them into staging tables, merge once."""
+import csv
+import io
+import json
+import os
+import uuid
+from decimal import Decimal
+
+from plans.plan_components import BOQ_COLUMNS, clean_amount, clean_boq, clean_text, validate_rows
+
+
+IMPORT_BATCH_SIZE = int(os.getenv('PLAN_IMPORT_BATCH_SIZE', '5000'))
+IMPORT_MAX_ERRORS = int(os.getenv('PLAN_IMPORT_MAX_ERRORS', '1000'))
+
+PLAN_STAGING_COLUMNS = (
+    'row_no', 'id', 'name', 'description', 'category', 'project_type', 'price', 'status',
+    'area', 'bedrooms', 'bathrooms', 'floors', 'tags', 'package_level', 'includes_boq',
+    'image_url', 'replace_boqs',
+)
+# Ids are dumped as text; the server parses them into the UUID staging columns.
+_PLAN_STAGING_TYPES = (
+    'int4', 'text', 'text', 'text', 'text', 'text', 'numeric', 'text',
+    'numeric', 'int4', 'int4', 'int4', 'text[]', 'text', 'bool',
+    'text', 'bool',
+)
+_BOQ_STAGING_TYPES = ('text', 'text', 'numeric', 'text', 'numeric', 'numeric', 'text')
+
+# Columns written to plans; the rest of the staging row is bookkeeping.
+_PLAN_COLUMNS = PLAN_STAGING_COLUMNS[1:-1]
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+_FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+def _integer(row, key, default=None, minimum=0):
+    value = row.get(key)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{key} must be a whole number")
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{key} must be a whole number")
+    if number < minimum or number > 2147483647:
+        raise ValueError(f"{key} is out of range")
+    return number
+
+
+def _boolean(row, key, default=False):
+    value = row.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return default if text == '' else False
+    raise ValueError(f"{key} must be true or false")
+
+
+def _tags(row):
+    value = row.get('tags')
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        raise ValueError("tags must be a list or a comma-separated string")
+    return [str(tag).strip() for tag in value if str(tag).strip()]
+
+
+def _boq_rows(row):
+    """BOQ lines for a plan: a list (NDJSON) or a JSON array string (CSV column)."""
+    value = row.get('boqs')
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"boqs contains invalid JSON: {exc.msg}")
+    if not isinstance(value, list):
+        raise ValueError("boqs must be a list")
+    values, errors = validate_rows('boqs', value, clean_boq)
+    if errors:
+        first = errors[0]
+        more = f" (+{len(errors) - 1} more)" if len(errors) > 1 else ''
+        raise ValueError(f"boqs[{first['index']}]: {first['error']}{more}")
+    return values
+
+
+def clean_plan(row):
+    """Validate one import record; returns (plan_values, boq_values or None)."""
+    plan_id = row.get('id')
+    if plan_id in (None, ''):
+        plan_id = str(uuid.uuid4())
+    else:
+        try:
+            plan_id = str(uuid.UUID(str(plan_id)))
+        except ValueError:
+            raise ValueError("id must be a UUID")
+
+    name = clean_text(row, 'name', 255, required=True)
+    price = clean_amount(row, 'price', required=True)
+    if price < 0:
+        raise ValueError("price must not be negative")
+    # plans.category, area and image_url are NOT NULL; catch them here so one
+    # bad row is reported instead of failing the merge for the whole import.
+    category = clean_text(row, 'category', 100, required=True)
+    image_url = clean_text(row, 'image_url', 2048, required=True)
+    area = clean_amount(row, 'area')
+    if area is None:
+        area = Decimal('0')
+    elif area < 0:
+        raise ValueError("area must not be negative")
+
+    boqs = _boq_rows(row)
+    plan = (
+        plan_id,
+        name,
+        clean_text(row, 'description'),
+        category,
+        clean_text(row, 'project_type', 50) or 'Residential',
+        price,
+        clean_text(row, 'status', 50) or 'Draft',
+        area,
+        _integer(row, 'bedrooms', 0),
+        _integer(row, 'bathrooms', 0),
+        _integer(row, 'floors', 1, minimum=1),
+        _tags(row),
+        clean_text(row, 'package_level', 20) or 'basic',
+        _boolean(row, 'includes_boq', default=bool(boqs)),
+        image_url,
+    )
+    return plan, boqs
+
+
+def iter_records(stream, fmt):
+    """Yield (row_no, record_or_None, error_or_None) from a CSV or NDJSON byte stream."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        if not reader.fieldnames:
+            return
+        for record in reader:
+            if None in record:
+                yield reader.line_num, None, "row has more columns than the header"
+                continue
+            yield reader.line_num, record, None
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_no, None, f"invalid JSON: {exc.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "each line must be a JSON object"
+            continue
+        yield line_no, record, None
+
+
+def iter_json_records(records):
+    """Adapt an in-memory list (e.g. a JSON request body) to iter_records' shape."""
+    for index, record in enumerate(records):
+        if isinstance(record, dict):
+            yield index, record, None
+        else:
+            yield index, None, "each plan must be an object"
+
+
+def _create_staging_tables(cur):
+    cur.execute("""
+        CREATE TEMP TABLE plan_import_staging (
+            row_no INTEGER NOT NULL,
+            id UUID NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            category TEXT NOT NULL,
+            project_type TEXT,
+            price NUMERIC NOT NULL,
+            status TEXT,
+            area NUMERIC NOT NULL,
+            bedrooms INTEGER,
+            bathrooms INTEGER,
+            floors INTEGER,
+            tags TEXT[],
+            package_level TEXT,
+            includes_boq BOOLEAN,
+            image_url TEXT NOT NULL,
+            replace_boqs BOOLEAN NOT NULL
+        ) ON COMMIT DROP
+    """)
+    cur.execute("""
+        CREATE TEMP TABLE boq_import_staging (
+            plan_id UUID NOT NULL,
+            item_name TEXT NOT NULL,
+            quantity NUMERIC NOT NULL,
+            unit TEXT NOT NULL,
+            unit_cost NUMERIC NOT NULL,
+            total_cost NUMERIC NOT NULL,
+            category TEXT
+        ) ON COMMIT DROP
+    """)
+
+
+def _copy_batch(cur, plans, boqs):
+    with cur.copy(f"COPY plan_import_staging ({', '.join(PLAN_STAGING_COLUMNS)}) FROM STDIN") as copy:
+        copy.set_types(_PLAN_STAGING_TYPES)
+        for row in plans:
+            copy.write_row(row)
+    if boqs:
+        with cur.copy(f"COPY boq_import_staging ({', '.join(BOQ_COLUMNS)}) FROM STDIN") as copy:
+            copy.set_types(_BOQ_STAGING_TYPES)
+            for row in boqs:
+                copy.write_row(row)
+
+
+def _merge(cur, designer_id):
+    """Move staged rows into plans/boqs; returns (created_ids, updated_ids, rejected)."""
+    # Existing ids may only be updated by the designer who owns the plan.
+    cur.execute(
+        """
+        DELETE FROM plan_import_staging s
+        USING plans p
+        WHERE p.id = s.id AND p.designer_id IS DISTINCT FROM %s
+        RETURNING s.row_no, s.name
+        """,
+        (designer_id,)
+    )
+    rejected = [
+        {'row': row_no, 'name': name, 'error': "id belongs to a plan owned by another designer"}
+        for row_no, name in cur.fetchall()
+    ]
+    if rejected:
+        cur.execute("""
+            DELETE FROM boq_import_staging b
+            WHERE NOT EXISTS (SELECT 1 FROM plan_import_staging s WHERE s.id = b.plan_id)
+        """)
+
+    update_columns = [c for c in _PLAN_COLUMNS if c != 'id']
+    cur.execute(
+        f"""
+        INSERT INTO plans ({', '.join(_PLAN_COLUMNS)}, designer_id, created_at)
+        SELECT {', '.join(_PLAN_COLUMNS)}, %s, CURRENT_TIMESTAMP
+        FROM plan_import_staging
+        ORDER BY row_no
+        ON CONFLICT (id) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in update_columns)}
+        RETURNING id, (xmax = 0) AS created
+        """,
+        (designer_id,)
+    )
+    created_ids = []
+    updated_ids = []
+    for plan_id, created in cur.fetchall():
+        (created_ids if created else updated_ids).append(str(plan_id))
+
+    if updated_ids:
+        cur.execute("""
+            DELETE FROM boqs
+            WHERE plan_id IN (SELECT id FROM plan_import_staging WHERE replace_boqs)
+        """)
+    cur.execute(f"""
+        INSERT INTO boqs ({', '.join(BOQ_COLUMNS)})
+        SELECT {', '.join(BOQ_COLUMNS)} FROM boq_import_staging
+    """)
+    return created_ids, updated_ids, rejected
+
+
+def import_plans(conn, designer_id, records, dry_run=False, batch_size=None):
+    """Import plans (with BOQ lines) for one designer.
+
+    `records` yields (row_no, record, parse_error) as produced by iter_records.
+    Invalid rows are reported and skipped; valid rows are committed together.
+    Returns a report dict with counts, created/updated ids and per-row errors.
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    errors = []
+    error_count = 0
+    valid = 0
+    seen_ids = set()
+    plan_batch = []
+    boq_batch = []
+
+    def record_error(row_no, record, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            name = record.get('name') if isinstance(record, dict) else None
+            errors.append({'row': row_no, 'name': name, 'error': message})
+
+    cur = conn.cursor()
+    try:
+        _create_staging_tables(cur)
+
+        for row_no, record, parse_error in records:
+            if parse_error:
+                record_error(row_no, None, parse_error)
+                continue
+            try:
+                plan, boqs = clean_plan(record)
+            except ValueError as exc:
+                record_error(row_no, record, str(exc))
+                continue
+            if plan[0] in seen_ids:
+                record_error(row_no, record, "duplicate id in this import")
+                continue
+            seen_ids.add(plan[0])
+
+            valid += 1
+            plan_batch.append((row_no,) + plan + (boqs is not None,))
+            boq_batch.extend((plan[0],) + boq for boq in boqs or ())
+            if len(plan_batch) >= batch_size:
+                _copy_batch(cur, plan_batch, boq_batch)
+                plan_batch, boq_batch = [], []
+
+        if plan_batch:
+            _copy_batch(cur, plan_batch, boq_batch)
+
+        created_ids, updated_ids, rejected = _merge(cur, designer_id) if valid else ([], [], [])
+        for error in rejected:
+            record_error(error['row'], error, error['error'])
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    errors.sort(key=lambda e: e['row'])
+    return {
+        'dry_run': dry_run,
+        'valid': valid - len(rejected),
+        'created': len(created_ids),
+        'updated': len(updated_ids),
+        'failed': error_count,
+        'created_ids': created_ids,
+        'updated_ids': updated_ids,
+        'errors': errors,
+        'errors_truncated': error_count > len(errors),
+    }
@@ -0,0 +1,445 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from werkzeug.utils import secure_filename
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+import os
+import json
+import time
+import uuid
+import hmac
+from datetime import datetime
+import psycopg
+from psycopg.rows import dict_row
+import sys
+
+import cloudinary
+import cloudinary.utils
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auth.auth_utils import get_current_user
+from auth.profile_cache import invalidate_user_profile
+from plans.plans import UPLOAD_FILE_TYPES, ALLOWED_EXTENSIONS_IMAGES, allowed_file
+from utils.upload_store import (
+    UPLOAD_ROOT, blob_storage_key, store_stream, insert_plan_file_records, storage_descriptor,
+)
+from utils.image_derivatives import schedule_plan_media_derivatives
+from utils.file_metadata import schedule_plan_file_metadata
+from utils.pdf_previews import schedule_plan_pdf_previews
+
+direct_uploads_bp = Blueprint('direct_uploads', __name__, url_prefix='/direct-uploads')
+
+# 'cloudinary' signs uploads for the Cloudinary upload API; 'local' signs them
+# for the stand-in below, which stores into the local blob store.  Defaults to
+# cloudinary when it is configured.
+DIRECT_UPLOAD_BACKEND = os.getenv('DIRECT_UPLOAD_BACKEND', '').strip().lower()
+DIRECT_UPLOAD_TTL_SECONDS = int(os.getenv('DIRECT_UPLOAD_TTL_SECONDS', '900'))
+DIRECT_UPLOAD_MAX_IMAGE_BYTES = int(os.getenv('DIRECT_UPLOAD_MAX_IMAGE_BYTES', str(15 * 1024 * 1024)))
+DIRECT_UPLOAD_MAX_FILE_BYTES = int(os.getenv('DIRECT_UPLOAD_MAX_FILE_BYTES', str(500 * 1024 * 1024)))
+
+AVATAR_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+PURPOSES = ('avatar', 'thumbnail', 'gallery', 'plan_file')
+
+_TOKEN_SALT = 'plancave-direct-upload'
+
+
+def get_db():
+    return psycopg.connect(
+        current_app.config['DATABASE_URL'],
+        connect_timeout=5,
+        options='-c statement_timeout=15000'
+    )
+
+
+def _backend():
+    if DIRECT_UPLOAD_BACKEND in ('cloudinary', 'local'):
+        return DIRECT_UPLOAD_BACKEND
+    config = cloudinary.config()
+    if config.cloud_name and config.api_key and config.api_secret:
+        return 'cloudinary'
+    return 'local'
+
+
+def _api_secret(backend):
+    if backend == 'cloudinary':
+        return cloudinary.config().api_secret
+    return current_app.config['SECRET_KEY']
+
+
+def _token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=_TOKEN_SALT)
+
+
+def _allowed_extensions(purpose, file_type=None):
+    if purpose == 'avatar':
+        return AVATAR_EXTENSIONS
+    if purpose in ('thumbnail', 'gallery'):
+        return ALLOWED_EXTENSIONS_IMAGES
+    return UPLOAD_FILE_TYPES[file_type][1]
+
+
+def _max_bytes(purpose):
+    return DIRECT_UPLOAD_MAX_FILE_BYTES if purpose == 'plan_file' else DIRECT_UPLOAD_MAX_IMAGE_BYTES
+
+
+def _response_signature(public_id, version, api_secret):
+    """Signature the storage backend returns with a finished upload (Cloudinary's scheme)."""
+    return cloudinary.utils.api_sign_request(
+        {'public_id': public_id, 'version': version}, api_secret, signature_version=1
+    )
+
+
+def sign_upload(user_id, purpose, plan_id=None, file_type=None, file_name=None, backend=None):
+    """Build short-lived upload parameters for the browser plus the intent token for confirm."""
+    backend = backend or _backend()
+    allowed = _allowed_extensions(purpose, file_type)
+
+    if purpose == 'avatar':
+        public_id = f"avatars/{user_id}_{uuid.uuid4().hex}"
+    elif purpose == 'plan_file':
+        public_id = f"plancave_plans/{plan_id}/files/{uuid.uuid4().hex}"
+    else:
+        public_id = f"plancave_plans/{plan_id}/{purpose}/{uuid.uuid4().hex}"
+
+    resource_type = 'raw' if purpose == 'plan_file' else 'image'
+    extension = None
+    if resource_type == 'raw':
+        # Raw assets keep their extension in the public_id, so it is covered by the signature.
+        extension = file_name.rsplit('.', 1)[1].lower()
+        public_id = f"{public_id}.{extension}"
+
+    params = {'timestamp': int(time.time()), 'public_id': public_id}
+    if resource_type == 'image':
+        params['allowed_formats'] = ','.join(sorted(allowed))
+
+    fields = dict(params)
+    if backend == 'cloudinary':
+        config = cloudinary.config()
+        fields['api_key'] = config.api_key
+        upload_prefix = (config.upload_prefix or 'https://api.cloudinary.com').rstrip('/')
+        upload_url = f"{upload_prefix}/v1_1/{config.cloud_name}/{resource_type}/upload"
+    else:
+        fields['api_key'] = 'local'
+        upload_url = f"{direct_uploads_bp.url_prefix}/local/{resource_type}/upload"
+    fields['signature'] = cloudinary.utils.api_sign_request(params, _api_secret(backend))
+
+    intent = {
+        'backend': backend,
+        'user_id': user_id,
+        'purpose': purpose,
+        'plan_id': str(plan_id) if plan_id else None,
+        'file_type': file_type,
+        'file_name': file_name,
+        'public_id': public_id,
+        'resource_type': resource_type,
+    }
+    return {
+        'backend': backend,
+        'upload_url': upload_url,
+        'method': 'POST',
+        'file_field': 'file',
+        'fields': fields,
+        'expires_in': DIRECT_UPLOAD_TTL_SECONDS,
+        'upload_token': _token_serializer().dumps(intent),
+    }
+
+
+def load_upload_intent(upload_token):
+    """Decode the token issued by sign_upload; raises ValueError when invalid or expired."""
+    try:
+        return _token_serializer().loads(upload_token, max_age=DIRECT_UPLOAD_TTL_SECONDS)
+    except SignatureExpired:
+        raise ValueError("Upload token has expired")
+    except BadSignature:
+        raise ValueError("Invalid upload token")
+
+
+def verify_upload_result(intent, result):
+    """Check the storage backend's upload response against the signed intent.
+
+    Returns {'url', 'storage_key', 'sha256', 'size', 'format'}; raises ValueError
+    if the response was not signed by the backend or is for a different asset.
+    """
+    public_id = result.get('public_id')
+    version = result.get('version')
+    signature = str(result.get('signature') or '')
+    if not public_id or version is None or not signature:
+        raise ValueError("Upload result must include public_id, version and signature")
+    if public_id != intent['public_id']:
+        raise ValueError("Upload result is for a different asset")
+
+    expected = _response_signature(public_id, version, _api_secret(intent['backend']))
+    if not hmac.compare_digest(expected, signature):
+        raise ValueError("Upload result signature is invalid")
+
+    if intent['resource_type'] == 'raw':
+        fmt = public_id.rsplit('.', 1)[-1].lower()
+    else:
+        fmt = str(result.get('format') or '').lower()
+    if fmt not in _allowed_extensions(intent['purpose'], intent.get('file_type')):
+        raise ValueError(f"File format '{fmt}' is not allowed")
+
+    size = result.get('bytes')
+    if isinstance(size, int) and size > _max_bytes(intent['purpose']):
+        raise ValueError("Uploaded file is too large")
+
+    if intent['backend'] == 'local':
+        # The stand-in reports the blob's SHA-256 as the asset version.
+        storage_key = blob_storage_key(str(version), f".{fmt}")
+        absolute_path = os.path.join(UPLOAD_ROOT, storage_key)
+        if not os.path.isfile(absolute_path):
+            raise ValueError("Uploaded file was not found in storage")
+        return {
+            'url': f"/uploads/{storage_key}",
+            'storage_key': storage_key,
+            'sha256': str(version),
+            'size': os.path.getsize(absolute_path),
+            'format': fmt,
+            'mtime': datetime.utcfromtimestamp(os.path.getmtime(absolute_path)),
+        }
+
+    url, _ = cloudinary.utils.cloudinary_url(
+        public_id,
+        resource_type=intent['resource_type'],
+        type='upload',
+        version=version,
+        format=fmt if intent['resource_type'] == 'image' else None,
+        secure=True,
+    )
+    return {'url': url, 'storage_key': None, 'sha256': None, 'size': size, 'format': fmt}
+
+
+def claim_upload_token(cur, intent):
+    """Record the token's asset as confirmed; False if it already was.
+
+    Runs in the confirm transaction, so a confirm that fails leaves the token
+    usable. Claims older than the token TTL can no longer be replayed and are
+    dropped here.
+    """
+    cur.execute(
+        "DELETE FROM direct_upload_confirmations WHERE confirmed_at < NOW() - make_interval(secs => %s)",
+        (DIRECT_UPLOAD_TTL_SECONDS,)
+    )
+    cur.execute(
+        """
+        INSERT INTO direct_upload_confirmations (public_id, user_id)
+        VALUES (%s, %s)
+        ON CONFLICT (public_id) DO NOTHING
+        RETURNING public_id
+        """,
+        (intent['public_id'], intent['user_id'])
+    )
+    return cur.fetchone() is not None
+
+
+def _fetch_owned_plan(cur, plan_id, user_id, role):
+    cur.execute("SELECT id, designer_id, file_paths FROM plans WHERE id = %s", (plan_id,))
+    plan = cur.fetchone()
+    if not plan:
+        return None, (jsonify(message="Plan not found"), 404)
+    if role != 'admin' and plan['designer_id'] != user_id:
+        return None, (jsonify(message="You do not have permission to edit this plan"), 403)
+    return plan, None
+
+
+@direct_uploads_bp.route('/sign', methods=['POST'])
+@jwt_required()
+def sign_direct_upload():
+    """Issue signed parameters so the browser can upload straight to storage.
+
+    Body: {"purpose": "avatar" | "thumbnail" | "gallery" | "plan_file",
+           "plan_id": ..., "file_type": ..., "file_name": ...}
+    POST the file plus `fields` to `upload_url`, then send the storage response
+    and `upload_token` to /direct-uploads/confirm.
+    """
+    user_id, role = get_current_user()
+    data = request.get_json(silent=True) or {}
+    purpose = str(data.get('purpose') or '').lower()
+    plan_id = data.get('plan_id')
+    file_type = str(data.get('file_type') or '').upper() or None
+    file_name = secure_filename(str(data.get('file_name') or '')) or None
+
+    if purpose not in PURPOSES:
+        return jsonify(message=f"purpose must be one of: {', '.join(PURPOSES)}"), 400
+    if purpose == 'plan_file':
+        if file_type not in UPLOAD_FILE_TYPES:
+            return jsonify(message=f"file_type must be one of: {', '.join(sorted(UPLOAD_FILE_TYPES))}"), 400
+        if not file_name or not allowed_file(file_name, UPLOAD_FILE_TYPES[file_type][1]):
+            return jsonify(message=f"File extension not allowed for {file_type}"), 400
+    elif file_name and not allowed_file(file_name, _allowed_extensions(purpose)):
+        return jsonify(message="Unsupported file type"), 400
+
+    if purpose == 'avatar':
+        return jsonify(sign_upload(user_id, purpose, file_name=file_name)), 200
+
+    if role not in ['admin', 'designer']:
+        return jsonify(message="Access denied: Admins and Designers only"), 403
+    if not plan_id:
+        return jsonify(message="plan_id is required"), 400
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        _, error = _fetch_owned_plan(cur, plan_id, user_id, role)
+        if error:
+            return error
+        return jsonify(sign_upload(user_id, purpose, plan_id, file_type, file_name)), 200
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
+@direct_uploads_bp.route('/confirm', methods=['POST'])
+@jwt_required()
+def confirm_direct_upload():
+    """Verify a finished direct upload and record it on the user or plan."""
+    user_id, role = get_current_user()
+    data = request.get_json(silent=True) or {}
+
+    try:
+        intent = load_upload_intent(str(data.get('upload_token') or ''))
+        if intent['user_id'] != user_id:
+            raise ValueError("Upload token was issued to another user")
+        stored = verify_upload_result(intent, data.get('result') or {})
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    purpose = intent['purpose']
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        if not claim_upload_token(cur, intent):
+            conn.rollback()
+            return jsonify(message="Upload has already been confirmed"), 409
+
+        if stored['storage_key']:
+            cur.execute(
+                """
+                INSERT INTO file_blobs (storage_key, sha256, size_bytes)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (storage_key) DO NOTHING
+                """,
+                (stored['storage_key'], stored['sha256'], stored['size'])
+            )
+
+        if purpose == 'avatar':
+            cur.execute(
+                "UPDATE users SET profile_picture_url = %s WHERE id = %s RETURNING id, username, role, first_name, middle_name, last_name, profile_picture_url;",
+                (stored['url'], user_id),
+            )
+            row = cur.fetchone()
+            if not row:
+                conn.rollback()
+                return jsonify(message="User not found"), 404
+            conn.commit()
+            invalidate_user_profile(user_id)
+            return jsonify({
+                "id": row["id"],
+                "email": row["username"],
+                "role": row["role"],
+                "first_name": row.get("first_name"),
+                "middle_name": row.get("middle_name"),
+                "last_name": row.get("last_name"),
+                "profile_picture_url": row.get("profile_picture_url"),
+            }), 200
+
+        plan_id = intent['plan_id']
+        plan, error = _fetch_owned_plan(cur, plan_id, user_id, role)
+        if error:
+            conn.rollback()
+            return error
+
+        file_paths = plan.get('file_paths')
+        if isinstance(file_paths, str):
+            try:
+                file_paths = json.loads(file_paths)
+            except ValueError:
+                file_paths = {}
+        if not isinstance(file_paths, dict):
+            file_paths = {}
+
+        if purpose == 'thumbnail':
+            cur.execute("UPDATE plans SET image_url = %s WHERE id = %s", (stored['url'], plan_id))
+        else:
+            if purpose == 'gallery':
+                key = 'gallery'
+            else:
+                key = UPLOAD_FILE_TYPES[intent['file_type']][0]
+                record = {
+                    'file_name': intent.get('file_name') or os.path.basename(stored['url']),
+                    'file_type': intent['file_type'],
+                    'file_path': stored['url'],
+                    'file_size': stored['size'],
+                }
+                record.update(storage_descriptor(stored['url'], stored if stored['storage_key'] else None))
+                insert_plan_file_records(cur, plan_id, [record])
+            file_paths[key] = (file_paths.get(key) or []) + [stored['url']]
+            cur.execute("UPDATE plans SET file_paths = %s WHERE id = %s", (json.dumps(file_paths), plan_id))
+
+        conn.commit()
+
+        if purpose in ('thumbnail', 'gallery'):
+            schedule_plan_media_derivatives(plan_id)
+        else:
+            schedule_plan_file_metadata(plan_id)
+            schedule_plan_pdf_previews(plan_id)
+
+        return jsonify(message="Upload recorded", purpose=purpose, plan_id=plan_id, url=stored['url']), 200
+    except Exception as e:
+        conn.rollback()
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
+@direct_uploads_bp.route('/local/<resource_type>/upload', methods=['POST'])
+def local_direct_upload(resource_type):
+    """Local stand-in for the Cloudinary upload API.
+
+    Accepts the same signed form fields (no session or JWT; the signature is
+    the authorization) and answers with a Cloudinary-style signed response.
+    """
+    if resource_type not in ('image', 'raw'):
+        return jsonify(error={'message': "Unsupported resource type"}), 400
+
+    limit = DIRECT_UPLOAD_MAX_FILE_BYTES if resource_type == 'raw' else DIRECT_UPLOAD_MAX_IMAGE_BYTES
+    if request.content_length and request.content_length > limit:
+        return jsonify(error={'message': "File size too large"}), 400
+
+    form = request.form
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify(error={'message': "Missing required parameter - file"}), 400
+
+    params = {k: form[k] for k in ('timestamp', 'public_id', 'allowed_formats') if form.get(k)}
+    expected = cloudinary.utils.api_sign_request(params, _api_secret('local'))
+    if not hmac.compare_digest(expected, form.get('signature', '')):
+        return jsonify(error={'message': "Invalid Signature"}), 401
+    try:
+        timestamp = int(params.get('timestamp', ''))
+    except ValueError:
+        return jsonify(error={'message': "Invalid timestamp"}), 400
+    if abs(time.time() - timestamp) > DIRECT_UPLOAD_TTL_SECONDS:
+        return jsonify(error={'message': "Stale request"}), 401
+
+    public_id = params.get('public_id', '')
+    if resource_type == 'raw':
+        fmt = public_id.rsplit('.', 1)[-1].lower() if '.' in public_id else ''
+    else:
+        fmt = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+        if fmt not in params.get('allowed_formats', '').split(','):
+            return jsonify(error={'message': f"Image file format {fmt} not allowed"}), 400
+
+    stored = store_stream(file.stream, f"upload.{fmt}")
+    version = stored['sha256']
+    return jsonify({
+        'public_id': public_id,
+        'version': version,
+        'signature': _response_signature(public_id, version, _api_secret('local')),
+        'resource_type': resource_type,
+        'format': fmt,
+        'bytes': stored['size'],
+        'secure_url': stored['file_path'],
+    }), 200
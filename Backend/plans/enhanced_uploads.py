@@ -8,11 +8,25 @@ from psycopg import errors
 from psycopg.rows import dict_row
 from datetime import datetime
 import json
-import shutil
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from auth.auth_utils import get_current_user, require_designer, log_user_activity, check_plan_ownership
+from utils.upload_store import store_upload, insert_plan_file_records, storage_descriptor
+from utils.image_derivatives import fetch_variant_maps, plan_image_sources, schedule_plan_media_derivatives
+from utils.file_metadata import schedule_plan_file_metadata
+from utils.pdf_previews import fetch_preview_map, schedule_plan_pdf_previews
+from utils.download_helpers import describe_file_metadata
+from plans.plan_components import (
+    clean_boq,
+    clean_structural_spec,
+    clean_compliance_note,
+    validate_rows,
+    insert_plan_components,
+)
+from plans.bulk_import import import_plans, iter_records, iter_json_records
+from plans.plan_versions import apply_version_delta, lineage_root
+from plans.plans import UPLOAD_FILE_TYPES
 
 enhanced_uploads_bp = Blueprint('enhanced_uploads', __name__, url_prefix='/plans')
 
@@ -31,22 +45,6 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 
-def save_file_locally(file, plan_id, file_type='image'):
-    """Save file to local storage"""
-    filename = secure_filename(file.filename)
-    ext = os.path.splitext(filename)[1]
-    unique_name = f"{uuid.uuid4()}{ext}"
-    
-    # Create directory structure
-    file_dir = os.path.join(UPLOAD_FOLDER, plan_id, file_type)
-    os.makedirs(file_dir, exist_ok=True)
-    
-    file_path = os.path.join(file_dir, unique_name)
-    file.save(file_path)
-    
-    return file_path, os.path.getsize(file_path)
-
-
 def parse_json_field(field_name, expected_type=list, default_value='[]'):
     """Parse JSON payloads from multipart form-data with helpful errors."""
     raw_value = request.form.get(field_name, default_value)
@@ -100,6 +98,19 @@ def detailed_upload():
         # Handle additional files (CAD, PDF, BIM)
         additional_files = request.files.getlist('files')
 
+        # Parse and validate every child row before storing files or opening
+        # the transaction, so a bad BOQ line fails fast with all row errors.
+        boqs, boq_errors = validate_rows('boqs', parse_json_field('boqs', list), clean_boq)
+        structural_specs, spec_errors = validate_rows(
+            'structural_specs', parse_json_field('structural_specs', list), clean_structural_spec
+        )
+        compliance_notes, note_errors = validate_rows(
+            'compliance_notes', parse_json_field('compliance_notes', list), clean_compliance_note
+        )
+        row_errors = boq_errors + spec_errors + note_errors
+        if row_errors:
+            return jsonify(message="Invalid plan details", errors=row_errors), 400
+
         plan_id = str(uuid.uuid4())
         image_paths = []
         file_records = []
@@ -107,8 +118,8 @@ def detailed_upload():
         # Save images
         for image in images:
             if image and allowed_file(image.filename, ALLOWED_IMAGE_EXTENSIONS):
-                file_path, file_size = save_file_locally(image, plan_id, 'images')
-                image_paths.append(file_path)
+                stored = store_upload(image)
+                image_paths.append(stored['file_path'])
 
         if not image_paths:
             return jsonify(message="No valid images provided"), 400
@@ -116,19 +127,16 @@ def detailed_upload():
         # Save additional files
         for file in additional_files:
             if file and allowed_file(file.filename, ALLOWED_FILE_EXTENSIONS):
-                file_path, file_size = save_file_locally(file, plan_id, 'files')
+                stored = store_upload(file)
                 file_ext = os.path.splitext(file.filename)[1].upper().replace('.', '')
-                file_records.append({
+                file_record = {
                     'file_name': secure_filename(file.filename),
                     'file_type': file_ext,
-                    'file_path': file_path,
-                    'file_size': file_size
-                })
-
-        # Parse JSON payloads with explicit validation so we can bubble up rich errors
-        boqs = parse_json_field('boqs', list)
-        structural_specs = parse_json_field('structural_specs', list)
-        compliance_notes = parse_json_field('compliance_notes', list)
+                    'file_path': stored['file_path'],
+                    'file_size': stored['size'],
+                }
+                file_record.update(storage_descriptor(stored['file_path'], stored))
+                file_records.append(file_record)
 
         # Database operations
         conn = get_db()
@@ -160,66 +168,18 @@ def detailed_upload():
                 plan_data['tags']
             ))
 
-            # Insert BOQs
-            for boq in boqs:
-                cur.execute("""
-                    INSERT INTO boqs (
-                        plan_id, item_name, quantity, unit, unit_cost, 
-                        total_cost, category
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    plan_id,
-                    boq.get('item_name'),
-                    boq.get('quantity'),
-                    boq.get('unit'),
-                    boq.get('unit_cost'),
-                    boq.get('total_cost'),
-                    boq.get('category')
-                ))
-
-            # Insert structural specs
-            for spec in structural_specs:
-                cur.execute("""
-                    INSERT INTO structural_specs (
-                        plan_id, spec_type, specification, standard
-                    ) VALUES (%s, %s, %s, %s)
-                """, (
-                    plan_id,
-                    spec.get('spec_type'),
-                    spec.get('specification'),
-                    spec.get('standard')
-                ))
-
-            # Insert compliance notes
-            for note in compliance_notes:
-                cur.execute("""
-                    INSERT INTO compliance_notes (
-                        plan_id, authority, requirement, status, notes
-                    ) VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    plan_id,
-                    note.get('authority'),
-                    note.get('requirement'),
-                    note.get('status', 'compliant'),
-                    note.get('notes')
-                ))
+            # Child rows: one COPY per table
+            insert_plan_components(cur, plan_id, boqs, structural_specs, compliance_notes)
 
             # Insert file records
-            for file_record in file_records:
-                cur.execute("""
-                    INSERT INTO plan_files (
-                        plan_id, file_name, file_type, file_path, file_size
-                    ) VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    plan_id,
-                    file_record['file_name'],
-                    file_record['file_type'],
-                    file_record['file_path'],
-                    file_record['file_size']
-                ))
+            insert_plan_file_records(cur, plan_id, file_records)
 
             conn.commit()
-            
+            schedule_plan_media_derivatives(plan_id)
+            if file_records:
+                schedule_plan_file_metadata(plan_id)
+                schedule_plan_pdf_previews(plan_id)
+
             # Log activity
             log_user_activity(user_id, 'upload', {
                 'plan_id': plan_id,
@@ -267,10 +227,8 @@ def detailed_upload():
             ), 400
         except Exception as e:
             conn.rollback()
-            # Cleanup files on error
-            plan_dir = os.path.join(UPLOAD_FOLDER, plan_id)
-            if os.path.exists(plan_dir):
-                shutil.rmtree(plan_dir)
+            # Stored blobs may be shared with other plans, so they are not removed
+            # here; unreferenced blobs are left for storage garbage collection.
             sqlstate = getattr(e, 'sqlstate', None)
             return jsonify(
                 message="Database error while saving plan",
@@ -294,68 +252,96 @@ def detailed_upload():
 @require_designer
 def bulk_upload():
     """
-    Bulk upload multiple plans at once for creators
+    Bulk upload multiple plans at once for creators (JSON array of plan data).
+
+    Rows are validated up front and loaded through the same COPY/merge path as
+    /plans/bulk-import; invalid rows are reported without affecting the others.
     """
     user_id, role = get_current_user()
 
+    plans_data = request.get_json(silent=True)
+    if not isinstance(plans_data, list) or len(plans_data) == 0:
+        return jsonify(message="Plans data must be a non-empty array"), 400
+
+    conn = get_db()
     try:
-        # Expects a JSON array of plan data
-        plans_data = request.get_json()
-        
-        if not isinstance(plans_data, list) or len(plans_data) == 0:
-            return jsonify(message="Plans data must be a non-empty array"), 400
+        report = import_plans(conn, user_id, iter_json_records(plans_data))
+    except Exception as e:
+        return jsonify(message=f"Bulk upload error: {str(e)}"), 500
+    finally:
+        conn.close()
 
-        conn = get_db()
-        cur = conn.cursor()
-        
-        uploaded_plans = []
-        failed_plans = []
-
-        for idx, plan in enumerate(plans_data):
-            try:
-                plan_id = str(uuid.uuid4())
-                created_at = datetime.utcnow()
-                
-                cur.execute("""
-                    INSERT INTO plans (
-                        id, name, description, category, price, status, area, 
-                        bedrooms, bathrooms, floors, designer_id, created_at, tags
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    plan_id,
-                    plan.get('name'),
-                    plan.get('description'),
-                    plan.get('category'),
-                    plan.get('price', 0),
-                    plan.get('status', 'Draft'),
-                    plan.get('area', 0),
-                    plan.get('bedrooms', 0),
-                    plan.get('bathrooms', 0),
-                    plan.get('floors', 1),
-                    user_id,
-                    created_at,
-                    plan.get('tags', [])
-                ))
-                
-                uploaded_plans.append(plan_id)
-                
-            except Exception as e:
-                failed_plans.append({"index": idx, "error": str(e), "plan": plan.get('name', 'Unknown')})
+    uploaded_ids = report['created_ids'] + report['updated_ids']
+    return jsonify({
+        "message": "Bulk upload completed",
+        "uploaded": len(uploaded_ids),
+        "failed": report['failed'],
+        "uploaded_ids": uploaded_ids,
+        "failures": [
+            {"index": e['row'], "error": e['error'], "plan": e.get('name') or 'Unknown'}
+            for e in report['errors']
+        ]
+    }), 201 if uploaded_ids else 400
 
-        conn.commit()
-        cur.close()
-        conn.close()
 
-        return jsonify({
-            "message": "Bulk upload completed",
-            "uploaded": len(uploaded_plans),
-            "failed": len(failed_plans),
-            "uploaded_ids": uploaded_plans,
-            "failures": failed_plans
-        }), 201 if len(uploaded_plans) > 0 else 400
+@enhanced_uploads_bp.route('/bulk-import', methods=['POST'])
+@jwt_required()
+@require_designer
+def bulk_import():
+    """
+    Import a designer catalog from CSV or NDJSON (one plan per row, optional BOQ lines).
 
+    Send the file as the raw body (Content-Type text/csv or application/x-ndjson)
+    or as multipart field `file`; `?format=csv|ndjson` overrides detection.
+    Rows with an existing `id` owned by the designer are updated.
+    `?dry_run=true` validates and reports without saving.
+    Admins may import on behalf of a designer with `?designer_id=`.
+    """
+    user_id, role = get_current_user()
+
+    designer_id = user_id
+    if role == 'admin' and request.args.get('designer_id'):
+        try:
+            designer_id = int(request.args['designer_id'])
+        except ValueError:
+            return jsonify(message="designer_id must be an integer"), 400
+
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = request.args.get('format') or ('csv' if (upload.filename or '').lower().endswith('.csv') else 'ndjson')
+    else:
+        stream = request.stream
+        mimetype = request.mimetype or ''
+        fmt = request.args.get('format') or ('csv' if mimetype in ('text/csv', 'application/csv') else 'ndjson')
+    fmt = fmt.lower()
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify(message="format must be csv or ndjson"), 400
+
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+
+    conn = get_db()
+    try:
+        report = import_plans(conn, designer_id, iter_records(stream, fmt), dry_run=dry_run)
+        if not dry_run and (report['created'] or report['updated']):
+            log_user_activity(user_id, 'bulk_import', {
+                'designer_id': designer_id,
+                'created': report['created'],
+                'updated': report['updated'],
+                'failed': report['failed'],
+            }, conn)
+    except UnicodeDecodeError:
+        return jsonify(message="Import file must be UTF-8 encoded"), 400
     except Exception as e:
-        return jsonify(message=f"Bulk upload error: {str(e)}"), 500
+        return jsonify(message="Bulk import failed", detail=str(e)), 500
+    finally:
+        conn.close()
+
+    # Ids are omitted here; catalogs can run to tens of thousands of rows.
+    report.pop('created_ids')
+    report.pop('updated_ids')
+    status = 200 if report['valid'] or not report['failed'] else 422
+    return jsonify(report), status
 
 
 @enhanced_uploads_bp.route('/<plan_id>/details', methods=['GET'])
@@ -450,7 +436,34 @@ def get_plan_details(plan_id):
             pass
 
         plan_dict['files'] = files
-        
+
+        # srcset-style variants for the thumbnail and gallery images
+        variant_maps = fetch_variant_maps(cur, plan_image_sources(plan_dict))
+        plan_dict['image_variants'] = variant_maps.get(plan_dict.get('image_url'))
+        for file_entry in files:
+            if file_entry.get('file_path') in variant_maps:
+                file_entry['variants'] = variant_maps[file_entry['file_path']]
+            # Page counts, sheet sizes and CAD versions come from the extracted metadata
+            if file_entry.get('metadata'):
+                file_entry['metadata_summary'] = describe_file_metadata(file_entry['metadata'])
+
+        # Watermarked page previews of the architectural PDFs (rendered in the background)
+        preview_files = [
+            f for f in files
+            if f.get('deliverable_key') == 'architectural' and f.get('content_sha256')
+            and (f.get('file_name') or f.get('file_path') or '').lower().endswith('.pdf')
+        ]
+        preview_map = fetch_preview_map(cur, [f['content_sha256'] for f in preview_files])
+        plan_dict['preview_pages'] = []
+        for file_entry in preview_files:
+            pages = preview_map.get(file_entry['content_sha256'])
+            if pages:
+                file_entry['previews'] = pages
+                plan_dict['preview_pages'].extend(dict(page, file_name=file_entry.get('file_name')) for page in pages)
+        if len(preview_map) < len({f['content_sha256'] for f in preview_files}):
+            # New upload or evicted from the preview cache
+            schedule_plan_pdf_previews(plan_id)
+
         return jsonify(plan_dict), 200
         
     except Exception as e:
@@ -465,75 +478,140 @@ def get_plan_details(plan_id):
 @require_designer
 def create_plan_version(plan_id):
     """
-    Create a new version of an existing plan
+    Create a new version of an existing plan as a delta over its latest version.
+
+    Multipart fields named after plan file types (ARCHITECTURAL, STRUCTURAL, ...)
+    add or replace files by type and name; `remove_files` is a JSON list of
+    plan_files ids, {"file_type", "file_name"} objects or unique file names to
+    drop. Unchanged files share the previous version's blobs.
     """
     user_id, role = get_current_user()
-    
+
+    try:
+        removals = parse_json_field('remove_files')
+    except ValueError as exc:
+        return jsonify(message=str(exc)), 400
+
+    uploads = []
+    for file_type, (_, extensions) in UPLOAD_FILE_TYPES.items():
+        for file in request.files.getlist(file_type):
+            if not file or not file.filename:
+                continue
+            if not allowed_file(file.filename, extensions):
+                return jsonify(message=f"{file.filename}: file type not allowed for {file_type}"), 400
+            uploads.append((file_type, file))
+
     conn = get_db()
     cur = conn.cursor(row_factory=dict_row)
-    
+
     try:
         # Check if plan exists and user owns it
         if not check_plan_ownership(plan_id, user_id, conn):
             return jsonify(message="Plan not found or access denied"), 404
-        
-        cur.execute("""
-            SELECT * FROM plans WHERE id = %s
-        """, (plan_id,))
-        
-        original_plan = cur.fetchone()
-        if not original_plan:
+
+        root_id = lineage_root(cur, plan_id)
+        if not root_id:
             return jsonify(message="Plan not found or access denied"), 404
-        
-        # Get current max version
+
+        # New versions build on the latest version of the lineage
         cur.execute("""
-            SELECT MAX(version) as max_version FROM plans 
+            SELECT * FROM plans
             WHERE id = %s OR parent_plan_id = %s
-        """, (plan_id, plan_id))
-        
-        max_version = cur.fetchone()['max_version'] or 1
-        new_version = max_version + 1
-        
-        # Create new plan version
+            ORDER BY COALESCE(version, 1) DESC, created_at DESC
+            LIMIT 1
+        """, (root_id, root_id))
+        base_plan = cur.fetchone()
+        new_version = (base_plan['version'] or 1) + 1
+
         new_plan_id = str(uuid.uuid4())
         created_at = datetime.utcnow()
-        
+
         cur.execute("""
             INSERT INTO plans (
-                id, name, description, category, price, status, area, 
-                bedrooms, bathrooms, floors, designer_id, created_at, 
+                id, name, description, category, project_type, package_level, price, status, area,
+                bedrooms, bathrooms, floors, includes_boq, image_url, designer_id, created_at,
                 version, parent_plan_id, tags
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (
             new_plan_id,
-            original_plan['name'],
-            original_plan['description'],
-            original_plan['category'],
-            original_plan['price'],
+            base_plan['name'],
+            base_plan['description'],
+            base_plan['category'],
+            base_plan.get('project_type'),
+            base_plan.get('package_level'),
+            base_plan['price'],
             'Draft',  # New versions start as draft
-            original_plan['area'],
-            original_plan['bedrooms'],
-            original_plan['bathrooms'],
-            original_plan['floors'],
+            base_plan['area'],
+            base_plan['bedrooms'],
+            base_plan['bathrooms'],
+            base_plan['floors'],
+            base_plan.get('includes_boq'),
+            base_plan.get('image_url'),
             user_id,
             created_at,
             new_version,
-            plan_id,
-            original_plan['tags']
+            root_id,
+            base_plan['tags']
         ))
-        
+
+        new_records = []
+        for file_type, file in uploads:
+            stored = store_upload(file)
+            record = {
+                'file_name': secure_filename(file.filename),
+                'file_type': file_type,
+                'file_path': stored['file_path'],
+                'file_size': stored['size'],
+            }
+            record.update(storage_descriptor(stored['file_path'], stored))
+            new_records.append(record)
+
+        changes = apply_version_delta(cur, str(base_plan['id']), new_plan_id, new_records, removals)
+        _sync_version_file_paths(cur, new_plan_id, base_plan.get('file_paths'))
+
         conn.commit()
-        
+
+        if new_records:
+            schedule_plan_file_metadata(new_plan_id)
+            schedule_plan_pdf_previews(new_plan_id)
+
         return jsonify({
             "message": "New plan version created",
             "plan_id": new_plan_id,
             "version": new_version,
-            "parent_plan_id": plan_id
+            "parent_plan_id": root_id,
+            "base_plan_id": str(base_plan['id']),
+            "changes": changes
         }), 201
-        
+
+    except ValueError as e:
+        conn.rollback()
+        return jsonify(message=str(e)), 400
     except Exception as e:
         conn.rollback()
         return jsonify(message=f"Error creating version: {str(e)}"), 500
     finally:
         cur.close()
         conn.close()
+
+
+def _sync_version_file_paths(cur, plan_id, base_file_paths):
+    """Rebuild plans.file_paths from the version's plan_files, keeping the base gallery."""
+    if isinstance(base_file_paths, str):
+        try:
+            base_file_paths = json.loads(base_file_paths)
+        except json.JSONDecodeError:
+            base_file_paths = None
+    file_paths = {key: [] for key, _ in UPLOAD_FILE_TYPES.values()}
+    if isinstance(base_file_paths, dict) and base_file_paths.get('gallery'):
+        file_paths['gallery'] = base_file_paths['gallery']
+
+    cur.execute(
+        "SELECT file_type, file_path FROM plan_files WHERE plan_id = %s ORDER BY uploaded_at ASC",
+        (plan_id,)
+    )
+    for row in cur.fetchall():
+        if row['file_type'] in UPLOAD_FILE_TYPES:
+            file_paths[UPLOAD_FILE_TYPES[row['file_type']][0]].append(row['file_path'])
+
+    cur.execute("UPDATE plans SET file_paths = %s WHERE id = %s", (json.dumps(file_paths), plan_id))
@@ -0,0 +1,110 @@
+"""Validation and batched writes for a plan's child rows (BOQs, specs, compliance notes)."""
+from decimal import Decimal, InvalidOperation
+
+
+# DECIMAL(10, 2) columns
+_MAX_AMOUNT = Decimal('99999999.99')
+
+COMPLIANCE_STATUSES = {'compliant', 'pending', 'not_applicable'}
+
+BOQ_COLUMNS = ('plan_id', 'item_name', 'quantity', 'unit', 'unit_cost', 'total_cost', 'category')
+STRUCTURAL_SPEC_COLUMNS = ('plan_id', 'spec_type', 'specification', 'standard')
+COMPLIANCE_NOTE_COLUMNS = ('plan_id', 'authority', 'requirement', 'status', 'notes')
+
+
+def clean_text(row, key, max_length=None, required=False):
+    value = row.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ValueError(f"{key} is required")
+        return None
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{key} must be at most {max_length} characters")
+    return value
+
+
+def clean_amount(row, key, required=False):
+    value = row.get(key)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f"{key} is required")
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{key} must be a number")
+    try:
+        amount = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        raise ValueError(f"{key} must be a number")
+    if not amount.is_finite() or abs(amount) > _MAX_AMOUNT:
+        raise ValueError(f"{key} is out of range")
+    return amount.quantize(Decimal('0.01'))
+
+
+def clean_boq(row):
+    quantity = clean_amount(row, 'quantity', required=True)
+    unit_cost = clean_amount(row, 'unit_cost', required=True)
+    total_cost = clean_amount(row, 'total_cost')
+    if total_cost is None:
+        total_cost = (quantity * unit_cost).quantize(Decimal('0.01'))
+        if abs(total_cost) > _MAX_AMOUNT:
+            raise ValueError("total_cost is out of range")
+    return (
+        clean_text(row, 'item_name', 255, required=True),
+        quantity,
+        clean_text(row, 'unit', 50, required=True),
+        unit_cost,
+        total_cost,
+        clean_text(row, 'category', 100),
+    )
+
+
+def clean_structural_spec(row):
+    return (
+        clean_text(row, 'spec_type', 100, required=True),
+        clean_text(row, 'specification', required=True),
+        clean_text(row, 'standard', 100),
+    )
+
+
+def clean_compliance_note(row):
+    status = (clean_text(row, 'status', 50) or 'compliant').lower()
+    if status not in COMPLIANCE_STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(sorted(COMPLIANCE_STATUSES))}")
+    return (
+        clean_text(row, 'authority', 100, required=True),
+        clean_text(row, 'requirement', required=True),
+        status,
+        clean_text(row, 'notes'),
+    )
+
+
+def validate_rows(field, rows, clean):
+    """Clean every row up front; returns (values, errors) with one error per bad row."""
+    values = []
+    errors = []
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("must be an object")
+            values.append(clean(row))
+        except ValueError as exc:
+            errors.append({'field': field, 'index': index, 'error': str(exc)})
+    return values, errors
+
+
+def copy_rows(cur, table, columns, plan_id, values):
+    """Write all rows for one table with a single COPY."""
+    if not values:
+        return 0
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in values:
+            copy.write_row((plan_id,) + tuple(row))
+    return len(values)
+
+
+def insert_plan_components(cur, plan_id, boqs=(), structural_specs=(), compliance_notes=()):
+    """Insert pre-validated child rows for a plan, one round trip per table."""
+    copy_rows(cur, 'boqs', BOQ_COLUMNS, plan_id, boqs)
+    copy_rows(cur, 'structural_specs', STRUCTURAL_SPEC_COLUMNS, plan_id, structural_specs)
+    copy_rows(cur, 'compliance_notes', COMPLIANCE_NOTE_COLUMNS, plan_id, compliance_notes)
@@ -0,0 +1,175 @@
+"""Plan versions as deltas over the previous version's file manifest.
+
+A new version copies the previous version's plan_files rows (sharing their
+blobs), then applies the uploaded and removed files. Only the differences
+are recorded in plan_version_changes.
+"""
+import uuid
+
+from utils.upload_store import insert_plan_file_records
+
+PLAN_FILE_COPY_COLUMNS = (
+    'file_name', 'file_type', 'file_path', 'file_size', 'blob_key', 'content_sha256',
+    'storage_backend', 'storage_key', 'storage_mtime', 'metadata', 'deliverable_key',
+)
+
+
+def file_fingerprint(plan_file):
+    """Content identity of a plan file: its checksum, or its storage location for legacy rows."""
+    sha256 = (plan_file.get('content_sha256') or '').strip()
+    return sha256 or plan_file.get('storage_key') or plan_file.get('file_path')
+
+
+def file_key(plan_file):
+    """Identity of a file within a version; the same name can appear under several file types."""
+    return (str(plan_file.get('file_type') or '').upper(), plan_file.get('file_name'))
+
+
+def diff_file_manifests(old_files, new_files):
+    """Compare two file manifests by (file type, file name) and checksum.
+
+    Returns {'added': [...], 'modified': [...], 'removed': [...], 'unchanged': [...]}
+    with entries taken from new_files (or old_files for 'removed').
+    """
+    old_by_key = {file_key(f): f for f in old_files}
+    new_keys = set()
+    changes = {'added': [], 'modified': [], 'removed': [], 'unchanged': []}
+
+    for plan_file in new_files:
+        key = file_key(plan_file)
+        new_keys.add(key)
+        previous = old_by_key.get(key)
+        if previous is None:
+            changes['added'].append(plan_file)
+        elif file_fingerprint(previous) != file_fingerprint(plan_file):
+            changes['modified'].append(plan_file)
+        else:
+            changes['unchanged'].append(plan_file)
+
+    changes['removed'] = [f for key, f in old_by_key.items() if key not in new_keys]
+    return changes
+
+
+def lineage_root(cur, plan_id):
+    """Id of the first version in a plan's lineage (versions point at it via parent_plan_id)."""
+    cur.execute("SELECT COALESCE(parent_plan_id, id) AS root_id FROM plans WHERE id = %s", (plan_id,))
+    row = cur.fetchone()
+    return str(row['root_id']) if row else None
+
+
+def find_version(cur, root_id, version):
+    cur.execute(
+        """
+        SELECT id FROM plans
+        WHERE (id = %s OR parent_plan_id = %s) AND COALESCE(version, 1) = %s
+        ORDER BY created_at DESC
+        LIMIT 1
+        """,
+        (root_id, root_id, version)
+    )
+    row = cur.fetchone()
+    return str(row['id']) if row else None
+
+
+def _removed_ids(base_files, removals):
+    """Resolve `removals` to ids of base files; entries that match nothing are ignored.
+
+    Each removal is a plan_files id, a {"file_type", "file_name"} object, or a
+    bare file name. Raises ValueError for a bare name that several file types share.
+    """
+    by_id = {str(f['id']): f for f in base_files}
+    by_key = {file_key(f): f for f in base_files}
+    ids = set()
+    for removal in removals:
+        if isinstance(removal, dict):
+            plan_file = by_key.get(file_key(removal))
+            if plan_file is not None:
+                ids.add(str(plan_file['id']))
+        elif str(removal) in by_id:
+            ids.add(str(removal))
+        else:
+            named = [str(f['id']) for f in base_files if f['file_name'] == str(removal)]
+            if len(named) > 1:
+                raise ValueError(
+                    f"{removal} is used by several file types; remove it as {{\"file_type\", \"file_name\"}}"
+                )
+            ids.update(named)
+    return ids
+
+
+def apply_version_delta(cur, base_plan_id, new_plan_id, new_records, removals=()):
+    """Build the new version's file manifest from the base version plus a delta.
+
+    `new_records` are plan_files records for files uploaded with this version
+    (as passed to insert_plan_file_records); an upload with the same file type
+    and name as a base file replaces it, or is dropped if its checksum is
+    unchanged. `removals` name base files to drop (see _removed_ids).
+    Returns the list of recorded changes.
+    """
+    cur.execute(
+        f"SELECT id, {', '.join(PLAN_FILE_COPY_COLUMNS)} FROM plan_files WHERE plan_id = %s",
+        (base_plan_id,)
+    )
+    base_files = [dict(row) for row in cur.fetchall()]
+    base_by_key = {file_key(f): f for f in base_files}
+    removed = _removed_ids(base_files, removals)
+
+    changes = []
+    replaced = set()
+    uploads = []
+    for record in new_records:
+        previous = base_by_key.get(file_key(record))
+        if previous is not None and str(previous['id']) not in removed:
+            if file_fingerprint(previous) == file_fingerprint(record):
+                continue
+            replaced.add(str(previous['id']))
+            changes.append(('modified', record, previous))
+        else:
+            changes.append(('added', record, None))
+        uploads.append(record)
+
+    kept_ids = []
+    for plan_file in base_files:
+        if str(plan_file['id']) in removed:
+            changes.append(('removed', plan_file, plan_file))
+        elif str(plan_file['id']) not in replaced:
+            kept_ids.append(plan_file['id'])
+
+    # Unchanged files: copy rows, sharing the same blobs (refcounts follow via trigger).
+    if kept_ids:
+        columns = ', '.join(PLAN_FILE_COPY_COLUMNS)
+        cur.execute(
+            f"""
+            INSERT INTO plan_files (plan_id, {columns})
+            SELECT %s, {columns}
+            FROM plan_files
+            WHERE id = ANY(%s)
+            """,
+            (new_plan_id, kept_ids)
+        )
+
+    insert_plan_file_records(cur, new_plan_id, uploads)
+
+    if changes:
+        cur.executemany(
+            """
+            INSERT INTO plan_version_changes (
+                id, plan_id, base_plan_id, change_type, file_name, file_type,
+                content_sha256, previous_sha256
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            [
+                (
+                    str(uuid.uuid4()), new_plan_id, base_plan_id, change_type,
+                    entry['file_name'], entry.get('file_type'),
+                    None if change_type == 'removed' else entry.get('content_sha256'),
+                    previous.get('content_sha256') if previous else None,
+                )
+                for change_type, entry, previous in changes
+            ]
+        )
+
+    return [
+        {'change': change_type, 'file_name': entry['file_name'], 'file_type': entry.get('file_type')}
+        for change_type, entry, _ in changes
+    ]
@@ -8,7 +8,15 @@ from psycopg.rows import dict_row
 from datetime import datetime
 import json
 import math
-from utils.cloudinary_config import upload_to_cloudinary
+from utils.cloudinary_config import upload_many_to_cloudinary
+from utils.upload_store import store_upload, insert_plan_file_records, storage_descriptor
+from utils.image_derivatives import (
+    fetch_variant_maps,
+    plan_image_sources,
+    schedule_plan_media_derivatives,
+)
+from utils.file_metadata import schedule_plan_file_metadata
+from utils.pdf_previews import schedule_plan_pdf_previews
 
 plans_bp = Blueprint('plans', __name__, url_prefix='/plans')
 
@@ -24,6 +32,24 @@ ALLOWED_EXTENSIONS_PLANS = {'pdf', 'dwg', 'dxf', 'rvt', 'ifc', 'skp', 'zip'}
 ALLOWED_EXTENSIONS_BOQ = {'xlsx', 'xls', 'pdf'}
 ALLOWED_EXTENSIONS_IMAGES = {'jpg', 'jpeg', 'png'}
 
+# plan_files.file_type -> (plans.file_paths key, allowed extensions) for technical
+# files that can be uploaded ahead of time through resumable upload sessions.
+UPLOAD_FILE_TYPES = {
+    'ARCHITECTURAL': ('architectural', ALLOWED_EXTENSIONS_PLANS),
+    'STRUCTURAL': ('structural', ALLOWED_EXTENSIONS_PLANS),
+    'MEP_MECHANICAL': ('mep', ALLOWED_EXTENSIONS_PLANS),
+    'MEP_ELECTRICAL': ('mep', ALLOWED_EXTENSIONS_PLANS),
+    'MEP_PLUMBING': ('mep', ALLOWED_EXTENSIONS_PLANS),
+    'CIVIL': ('civil', ALLOWED_EXTENSIONS_PLANS | ALLOWED_EXTENSIONS_IMAGES),
+    'FIRE_SAFETY': ('fire_safety', ALLOWED_EXTENSIONS_PLANS | ALLOWED_EXTENSIONS_IMAGES),
+    'INTERIOR': ('interior', ALLOWED_EXTENSIONS_PLANS | ALLOWED_EXTENSIONS_IMAGES),
+    'RENDER': ('renders', ALLOWED_EXTENSIONS_IMAGES | {'pdf'}),
+    'BOQ_ARCHITECTURAL': ('boq', ALLOWED_EXTENSIONS_BOQ),
+    'BOQ_STRUCTURAL': ('boq', ALLOWED_EXTENSIONS_BOQ),
+    'BOQ_MEP': ('boq', ALLOWED_EXTENSIONS_BOQ),
+    'BOQ_COST_SUMMARY': ('boq', ALLOWED_EXTENSIONS_BOQ),
+}
+
 def get_current_user():
     user_id = int(get_jwt_identity())
     claims = get_jwt()
@@ -54,20 +80,6 @@ def safe_int(value, default=None):
     except (ValueError, TypeError):
         return default
 
-def save_file_locally(file, plan_id, category, filename):
-    """Save file to local storage organized by discipline"""
-    safe_filename = secure_filename(filename)
-    unique_name = f"{uuid.uuid4()}_{safe_filename}"
-    
-    dir_path = os.path.join(UPLOAD_FOLDER, plan_id, category)
-    os.makedirs(dir_path, exist_ok=True)
-    
-    file_path = os.path.join(dir_path, unique_name)
-    file.save(file_path)
-    
-    return f"/uploads/plans/{plan_id}/{category}/{unique_name}"
-
-
 def resolve_upload_absolute_path(relative_path: str) -> str:
     if not relative_path:
         return ''
@@ -77,20 +89,82 @@ def resolve_upload_absolute_path(relative_path: str) -> str:
     return os.path.join(_PROJECT_ROOT, relative)
 
 
-def add_plan_file_record(records, file_type: str, relative_path: str, original_name: str | None = None):
+def add_plan_file_record(records, file_type: str, relative_path: str, original_name: str | None = None, stored: dict | None = None):
     if not relative_path:
         return
 
-    absolute_path = resolve_upload_absolute_path(relative_path)
-    file_size = os.path.getsize(absolute_path) if absolute_path and os.path.exists(absolute_path) else None
+    if stored:
+        file_size = stored['size']
+    else:
+        absolute_path = resolve_upload_absolute_path(relative_path)
+        file_size = os.path.getsize(absolute_path) if absolute_path and os.path.exists(absolute_path) else None
     file_name = secure_filename(original_name) if original_name else os.path.basename(relative_path)
 
-    records.append({
+    record = {
         'file_name': file_name,
         'file_type': file_type,
         'file_path': relative_path,
-        'file_size': file_size
-    })
+        'file_size': file_size,
+    }
+    record.update(storage_descriptor(relative_path, stored))
+    records.append(record)
+
+
+def _log_media_upload_results(plan_id, results):
+    """Log per-asset upload timings; return an error message if any asset failed."""
+    for result in results:
+        current_app.logger.info(
+            f"Cloudinary upload for plan {plan_id}: {result['name']} "
+            f"{'ok' if result['url'] else 'failed'} in {result['elapsed_ms']}ms "
+            f"({result['attempts']} attempt(s))"
+        )
+    for result in results:
+        if result['error'] is not None:
+            if isinstance(result['error'], ValueError):
+                return str(result['error'])
+            return f"Failed to upload {result['name']}: {result['error']}"
+    return None
+
+
+def _load_completed_upload_sessions(conn, session_ids, user_id):
+    """Return finalized, unattached upload sessions owned by user_id as stored-file dicts."""
+    valid_ids = []
+    for session_id in session_ids:
+        try:
+            valid_ids.append(str(uuid.UUID(str(session_id))))
+        except ValueError:
+            continue
+    if not valid_ids:
+        return []
+
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            SELECT id, file_name, file_type, total_size, storage_key, content_sha256, storage_mtime
+            FROM upload_sessions
+            WHERE id = ANY(%s::uuid[]) AND user_id = %s AND status = 'complete'
+            """,
+            (valid_ids, user_id)
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    return [
+        {
+            'id': str(row['id']),
+            'file_name': row['file_name'],
+            'file_type': row['file_type'],
+            'file_path': f"/uploads/{row['storage_key']}",
+            'storage_key': row['storage_key'],
+            'sha256': row['content_sha256'],
+            'size': row['total_size'],
+            'mtime': row['storage_mtime'],
+        }
+        for row in rows
+        if row['file_type'] in UPLOAD_FILE_TYPES
+    ]
 
 
 @plans_bp.route('/upload', methods=['POST'])
@@ -139,11 +213,32 @@ def upload_plan():
     if 'thumbnail' not in files:
         return jsonify(message="Thumbnail image is required"), 400
 
+    # Technical files already uploaded through resumable upload sessions
+    try:
+        upload_session_ids = json.loads(form.get('upload_session_ids') or '[]')
+    except ValueError:
+        upload_session_ids = None
+    if not isinstance(upload_session_ids, list):
+        return jsonify(message="upload_session_ids must be a JSON array"), 400
+
+    session_files = []
+    if upload_session_ids:
+        conn = get_db()
+        try:
+            session_files = _load_completed_upload_sessions(conn, upload_session_ids, user_id)
+        finally:
+            conn.close()
+        if len(session_files) != len(set(str(x) for x in upload_session_ids)):
+            return jsonify(message="One or more upload sessions are missing, not finalized or already attached"), 400
+    session_file_types = {session['file_type'] for session in session_files}
+
     # Enforce mandatory deliverables
-    if 'architectural_files' not in files or len(request.files.getlist('architectural_files')) == 0:
+    if ('architectural_files' not in files or len(request.files.getlist('architectural_files')) == 0) \
+            and 'ARCHITECTURAL' not in session_file_types:
         return jsonify(message="Architectural files are required"), 400
 
-    if 'renders' not in files or len(request.files.getlist('renders')) == 0:
+    if ('renders' not in files or len(request.files.getlist('renders')) == 0) \
+            and 'RENDER' not in session_file_types:
         return jsonify(message="Renders are required"), 400
 
     plan_id = str(uuid.uuid4())
@@ -168,130 +263,140 @@ def upload_plan():
             arch_files = request.files.getlist('architectural_files')
             for file in arch_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS):
-                    path = save_file_locally(file, plan_id, 'architectural', file.filename)
-                    file_paths['architectural'].append(path)
-                    add_plan_file_record(plan_file_records, 'ARCHITECTURAL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['architectural'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'ARCHITECTURAL', stored['file_path'], file.filename, stored)
 
         # Save Structural Files
         if 'structural_files' in files:
             struct_files = request.files.getlist('structural_files')
             for file in struct_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS):
-                    path = save_file_locally(file, plan_id, 'structural', file.filename)
-                    file_paths['structural'].append(path)
-                    add_plan_file_record(plan_file_records, 'STRUCTURAL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['structural'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'STRUCTURAL', stored['file_path'], file.filename, stored)
 
         # Save MEP Files
         if 'mep_mechanical_files' in files:
             mep_files = request.files.getlist('mep_mechanical_files')
             for file in mep_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS):
-                    path = save_file_locally(file, plan_id, 'mep/mechanical', file.filename)
-                    file_paths['mep'].append(path)
-                    add_plan_file_record(plan_file_records, 'MEP_MECHANICAL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['mep'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'MEP_MECHANICAL', stored['file_path'], file.filename, stored)
 
         if 'mep_electrical_files' in files:
             mep_files = request.files.getlist('mep_electrical_files')
             for file in mep_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS):
-                    path = save_file_locally(file, plan_id, 'mep/electrical', file.filename)
-                    file_paths['mep'].append(path)
-                    add_plan_file_record(plan_file_records, 'MEP_ELECTRICAL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['mep'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'MEP_ELECTRICAL', stored['file_path'], file.filename, stored)
 
         if 'mep_plumbing_files' in files:
             mep_files = request.files.getlist('mep_plumbing_files')
             for file in mep_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS):
-                    path = save_file_locally(file, plan_id, 'mep/plumbing', file.filename)
-                    file_paths['mep'].append(path)
-                    add_plan_file_record(plan_file_records, 'MEP_PLUMBING', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['mep'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'MEP_PLUMBING', stored['file_path'], file.filename, stored)
 
         # Save Civil Files
         if 'civil_files' in files:
             civil_files = request.files.getlist('civil_files')
             for file in civil_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS | ALLOWED_EXTENSIONS_IMAGES):
-                    path = save_file_locally(file, plan_id, 'civil', file.filename)
-                    file_paths['civil'].append(path)
-                    add_plan_file_record(plan_file_records, 'CIVIL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['civil'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'CIVIL', stored['file_path'], file.filename, stored)
 
         # Save Fire Safety Files
         if 'fire_safety_files' in files:
             fire_files = request.files.getlist('fire_safety_files')
             for file in fire_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS | ALLOWED_EXTENSIONS_IMAGES):
-                    path = save_file_locally(file, plan_id, 'fire_safety', file.filename)
-                    file_paths['fire_safety'].append(path)
-                    add_plan_file_record(plan_file_records, 'FIRE_SAFETY', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['fire_safety'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'FIRE_SAFETY', stored['file_path'], file.filename, stored)
 
         # Save Interior Files
         if 'interior_files' in files:
             interior_files = request.files.getlist('interior_files')
             for file in interior_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_PLANS | ALLOWED_EXTENSIONS_IMAGES):
-                    path = save_file_locally(file, plan_id, 'interior', file.filename)
-                    file_paths['interior'].append(path)
-                    add_plan_file_record(plan_file_records, 'INTERIOR', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['interior'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'INTERIOR', stored['file_path'], file.filename, stored)
 
         # Save 3D Renders
         if 'renders' in files:
             render_files = request.files.getlist('renders')
             for file in render_files:
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_IMAGES | {'pdf'}):
-                    path = save_file_locally(file, plan_id, 'renders', file.filename)
-                    file_paths['renders'].append(path)
-                    add_plan_file_record(plan_file_records, 'RENDER', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['renders'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'RENDER', stored['file_path'], file.filename, stored)
 
         # Save BOQ Files
         if form.get('includes_boq') == 'true':
             if 'boq_architectural' in files:
                 file = files['boq_architectural']
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_BOQ):
-                    path = save_file_locally(file, plan_id, 'boq', f'architectural_boq_{file.filename}')
-                    file_paths['boq'].append(path)
-                    add_plan_file_record(plan_file_records, 'BOQ_ARCHITECTURAL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['boq'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'BOQ_ARCHITECTURAL', stored['file_path'], file.filename, stored)
 
             if 'boq_structural' in files:
                 file = files['boq_structural']
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_BOQ):
-                    path = save_file_locally(file, plan_id, 'boq', f'structural_boq_{file.filename}')
-                    file_paths['boq'].append(path)
-                    add_plan_file_record(plan_file_records, 'BOQ_STRUCTURAL', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['boq'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'BOQ_STRUCTURAL', stored['file_path'], file.filename, stored)
 
             if 'boq_mep' in files:
                 file = files['boq_mep']
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_BOQ):
-                    path = save_file_locally(file, plan_id, 'boq', f'mep_boq_{file.filename}')
-                    file_paths['boq'].append(path)
-                    add_plan_file_record(plan_file_records, 'BOQ_MEP', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['boq'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'BOQ_MEP', stored['file_path'], file.filename, stored)
 
             if 'cost_summary' in files:
                 file = files['cost_summary']
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_BOQ):
-                    path = save_file_locally(file, plan_id, 'boq', f'cost_summary_{file.filename}')
-                    file_paths['boq'].append(path)
-                    add_plan_file_record(plan_file_records, 'BOQ_COST_SUMMARY', path, file.filename)
+                    stored = store_upload(file)
+                    file_paths['boq'].append(stored['file_path'])
+                    add_plan_file_record(plan_file_records, 'BOQ_COST_SUMMARY', stored['file_path'], file.filename, stored)
+
+        # Attach files from finalized upload sessions
+        for session in session_files:
+            paths_key = UPLOAD_FILE_TYPES[session['file_type']][0]
+            file_paths[paths_key].append(session['file_path'])
+            add_plan_file_record(plan_file_records, session['file_type'], session['file_path'], session['file_name'], session)
 
-        # Save Thumbnail to Cloudinary
+        # Upload thumbnail and gallery images to Cloudinary concurrently
         thumbnail = files['thumbnail']
-        try:
-            thumbnail_path = upload_to_cloudinary(thumbnail, public_id=f"{plan_id}_thumbnail")
-        except ValueError as e:
-            return jsonify(message=str(e)), 500
+        media_assets = [{'file': thumbnail, 'public_id': f"{plan_id}_thumbnail", 'name': thumbnail.filename}]
+        if 'gallery' in files:
+            for file in request.files.getlist('gallery'):
+                if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_IMAGES):
+                    media_assets.append({
+                        'file': file,
+                        'folder': f"plancave_plans/{plan_id}/gallery",
+                        'name': file.filename,
+                    })
+
+        media_results = upload_many_to_cloudinary(media_assets)
+        failed_error = _log_media_upload_results(plan_id, media_results)
+        if failed_error:
+            return jsonify(message=failed_error), 500
+
+        thumbnail_path = media_results[0]['url']
         add_plan_file_record(plan_file_records, 'THUMBNAIL', thumbnail_path, thumbnail.filename)
 
-        # Save Gallery Images
         gallery_paths = []
-        if 'gallery' in files:
-            gallery_files = request.files.getlist('gallery')
-            for file in gallery_files:
-                if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_IMAGES):
-                    try:
-                        path = upload_to_cloudinary(file, folder=f"plancave_plans/{plan_id}/gallery")
-                        gallery_paths.append(path)
-                    except ValueError as e:
-                        return jsonify(message=str(e)), 500
-                    add_plan_file_record(plan_file_records, 'GALLERY', path, file.filename)
+        for result in media_results[1:]:
+            gallery_paths.append(result['url'])
+            add_plan_file_record(plan_file_records, 'GALLERY', result['url'], result['name'])
 
         # Attach gallery paths to file_paths so details endpoint can build a gallery
         if gallery_paths:
@@ -395,22 +500,26 @@ def upload_plan():
                 'Available',
                 created_at
             ))
-            for record in plan_file_records:
+            insert_plan_file_records(cur, plan_id, plan_file_records)
+
+            if session_files:
                 cur.execute(
                     """
-                    INSERT INTO plan_files (plan_id, file_name, file_type, file_path, file_size)
-                    VALUES (%s, %s, %s, %s, %s)
+                    UPDATE upload_sessions
+                    SET status = 'attached', plan_id = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s::uuid[]) AND status = 'complete'
                     """,
-                    (
-                        plan_id,
-                        record['file_name'],
-                        record['file_type'],
-                        record['file_path'],
-                        record['file_size']
-                    )
+                    (plan_id, [session['id'] for session in session_files])
                 )
+                if cur.rowcount != len(session_files):
+                    conn.rollback()
+                    return jsonify(message="Upload sessions were attached to another plan"), 409
 
             conn.commit()
+            schedule_plan_media_derivatives(plan_id)
+            if plan_file_records:
+                schedule_plan_file_metadata(plan_id)
+                schedule_plan_pdf_previews(plan_id)
 
             return jsonify({
                 "message": "Professional plan uploaded successfully!",
@@ -549,27 +658,39 @@ def update_plan(plan_id):
         if not isinstance(file_paths, dict):
             file_paths = {}
 
-        # Replace thumbnail if provided
+        # Replace thumbnail and/or add gallery images (uploaded concurrently)
+        media_assets = []
         if 'thumbnail' in files:
             thumb = files['thumbnail']
             if thumb and allowed_file(thumb.filename, ALLOWED_EXTENSIONS_IMAGES):
-                try:
-                    thumb_path = upload_to_cloudinary(thumb, public_id=f"{plan_id}_thumbnail_updated")
-                    update_fields['image_url'] = thumb_path
-                except ValueError as e:
-                    return jsonify(message=str(e)), 500
-
-        # Add extra gallery images if provided
+                media_assets.append({
+                    'file': thumb,
+                    'public_id': f"{plan_id}_thumbnail_updated",
+                    'name': thumb.filename,
+                    'kind': 'thumbnail',
+                })
         if 'gallery' in files:
-            gallery_files = request.files.getlist('gallery')
-            new_gallery_paths = []
-            for file in gallery_files:
+            for file in request.files.getlist('gallery'):
                 if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_IMAGES):
-                    try:
-                        path = upload_to_cloudinary(file, folder=f"plancave_plans/{plan_id}/gallery")
-                        new_gallery_paths.append(path)
-                    except ValueError as e:
-                        return jsonify(message=str(e)), 500
+                    media_assets.append({
+                        'file': file,
+                        'folder': f"plancave_plans/{plan_id}/gallery",
+                        'name': file.filename,
+                        'kind': 'gallery',
+                    })
+
+        if media_assets:
+            media_results = upload_many_to_cloudinary(media_assets)
+            failed_error = _log_media_upload_results(plan_id, media_results)
+            if failed_error:
+                return jsonify(message=failed_error), 500
+
+            new_gallery_paths = []
+            for asset, result in zip(media_assets, media_results):
+                if asset['kind'] == 'thumbnail':
+                    update_fields['image_url'] = result['url']
+                else:
+                    new_gallery_paths.append(result['url'])
 
             if new_gallery_paths:
                 existing_gallery = file_paths.get('gallery') or []
@@ -593,6 +714,9 @@ def update_plan(plan_id):
         cur.execute(sql, tuple(values))
         conn.commit()
 
+        if media_assets:
+            schedule_plan_media_derivatives(plan_id)
+
         return jsonify(message="Plan updated successfully"), 200
 
     except Exception as e:
@@ -666,6 +790,10 @@ def get_trending():
                     plan_dict['certifications'] = json.loads(plan_dict['certifications']) if isinstance(plan_dict['certifications'], str) else plan_dict['certifications']
                 plans.append(plan_dict)
 
+            variant_maps = fetch_variant_maps(cur, [p.get('image_url') for p in plans])
+            for plan_dict in plans:
+                plan_dict['image_variants'] = variant_maps.get(plan_dict.get('image_url'))
+
         return jsonify({
             'top_types': top_types,
             'top_type': top_type,
@@ -771,6 +899,10 @@ def browse_plans():
                 plan_dict['certifications'] = json.loads(plan_dict['certifications']) if isinstance(plan_dict['certifications'], str) else plan_dict['certifications']
             plans.append(plan_dict)
 
+        variant_maps = fetch_variant_maps(cur, [p.get('image_url') for p in plans])
+        for plan_dict in plans:
+            plan_dict['image_variants'] = variant_maps.get(plan_dict.get('image_url'))
+
         return jsonify({
             "metadata": {
                 "total": total_count,
@@ -833,6 +965,11 @@ def get_simple_plan_details(plan_id):
         if plan.get('file_paths') and isinstance(plan['file_paths'], str):
             plan['file_paths'] = json.loads(plan['file_paths'])
 
+        # srcset-style variants keyed by the original image URL
+        variant_maps = fetch_variant_maps(cur, plan_image_sources(plan))
+        plan['image_variants'] = variant_maps.get(plan.get('image_url'))
+        plan['media_variants'] = variant_maps
+
         return jsonify(plan), 200
 
     except Exception as e:
@@ -0,0 +1,123 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from plans import bulk_import  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+def _import_connection():
+    """Answers the merge statements like PostgreSQL would: every staged plan is a new row."""
+    conn = FakeConnection()
+
+    def respond(sql, params):
+        if 'RETURNING id, (xmax = 0)' in sql:
+            return [(row[1], True) for row in conn.copied.get('plan_import_staging', [])]
+        return []
+    conn.respond = respond
+    return conn
+
+
+_REQUIRED = {'category': 'Residential', 'image_url': '/uploads/plans/cover.jpg'}
+
+
+class BulkImportTests(unittest.TestCase):
+    def test_csv_rows_are_parsed_with_line_numbers(self):
+        data = (
+            'name,price,category,image_url,bedrooms,tags,boqs\n'
+            'Villa,25000,Residential,/uploads/villa.jpg,4,"modern, coastal","[{""item_name"": ""Cement"", ""quantity"": 10, ""unit"": ""bag"", ""unit_cost"": 5}]"\n'
+            'Cabin,abc,Residential,/uploads/cabin.jpg,2,,\n'
+        ).encode()
+        rows = list(bulk_import.iter_records(io.BytesIO(data), 'csv'))
+
+        self.assertEqual([row_no for row_no, _, _ in rows], [2, 3])
+        plan, boqs = bulk_import.clean_plan(rows[0][1])
+        self.assertEqual(plan[1], 'Villa')
+        self.assertEqual(plan[11], ['modern', 'coastal'])
+        self.assertTrue(plan[13])  # includes_boq defaults to True when BOQ lines are given
+        self.assertEqual(len(boqs), 1)
+
+        with self.assertRaisesRegex(ValueError, 'price'):
+            bulk_import.clean_plan(rows[1][1])
+
+    def test_columns_the_plans_table_requires_are_checked_per_row(self):
+        with self.assertRaisesRegex(ValueError, 'category is required'):
+            bulk_import.clean_plan({'name': 'A', 'price': 1, 'image_url': '/uploads/a.jpg'})
+        with self.assertRaisesRegex(ValueError, 'image_url is required'):
+            bulk_import.clean_plan({'name': 'A', 'price': 1, 'category': 'Residential'})
+
+        plan, _ = bulk_import.clean_plan({**_REQUIRED, 'name': 'A', 'price': 1})
+        columns = dict(zip(bulk_import.PLAN_STAGING_COLUMNS[1:], plan))
+        self.assertEqual(columns['area'], 0)
+        self.assertEqual(columns['image_url'], _REQUIRED['image_url'])
+
+    def test_ndjson_reports_bad_lines(self):
+        data = b'{"name": "A", "price": 1}\n\nnot json\n[1, 2]\n'
+        rows = list(bulk_import.iter_records(io.BytesIO(data), 'ndjson'))
+
+        self.assertEqual([(row_no, error is None) for row_no, _, error in rows], [(1, True), (3, False), (4, False)])
+
+    def test_invalid_boq_line_rejects_the_plan(self):
+        with self.assertRaisesRegex(ValueError, r'boqs\[1\]: unit is required'):
+            bulk_import.clean_plan({**_REQUIRED, 'name': 'A', 'price': 1, 'boqs': [
+                {'item_name': 'x', 'quantity': 1, 'unit': 'm', 'unit_cost': 1},
+                {'item_name': 'y', 'quantity': 1, 'unit_cost': 1},
+            ]})
+
+    def test_valid_rows_are_copied_and_merged_and_errors_reported(self):
+        lines = [json.dumps({**_REQUIRED, 'name': f'Plan {i}', 'price': 100 + i,
+                             'boqs': [{'item_name': 'Sand', 'quantity': 1, 'unit': 't', 'unit_cost': 3}]})
+                 for i in range(5)]
+        lines.insert(2, json.dumps({'price': 10}))
+        lines.insert(4, json.dumps({'name': 'No category', 'price': 10, 'image_url': '/uploads/x.jpg'}))
+        conn = _import_connection()
+
+        report = bulk_import.import_plans(
+            conn, 42, bulk_import.iter_records(io.BytesIO('\n'.join(lines).encode()), 'ndjson'), batch_size=2
+        )
+
+        self.assertTrue(conn.committed)
+        self.assertEqual(report['created'], 5)
+        self.assertEqual(report['failed'], 2)
+        self.assertEqual(report['errors'], [
+            {'row': 3, 'name': None, 'error': 'name is required'},
+            {'row': 5, 'name': 'No category', 'error': 'category is required'},
+        ])
+        self.assertEqual(len(conn.copied['plan_import_staging']), 5)
+        self.assertEqual(len(conn.copied['boq_import_staging']), 5)
+        self.assertEqual(
+            len(conn.copy_types['plan_import_staging']), len(bulk_import.PLAN_STAGING_COLUMNS)
+        )
+        merges = conn.statements('INSERT INTO')
+        self.assertEqual(len(merges), 2)
+
+    def test_duplicate_ids_in_one_import_are_rejected(self):
+        plan_id = '6f1c1d3e-2b7a-4c1e-9f57-0a4f3f0c2d11'
+        conn = _import_connection()
+        report = bulk_import.import_plans(conn, 1, bulk_import.iter_json_records([
+            {**_REQUIRED, 'id': plan_id, 'name': 'A', 'price': 1},
+            {**_REQUIRED, 'id': plan_id, 'name': 'B', 'price': 2},
+        ]))
+
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['errors'][0]['error'], 'duplicate id in this import')
+
+    def test_dry_run_rolls_back(self):
+        conn = _import_connection()
+        report = bulk_import.import_plans(
+            conn, 1, bulk_import.iter_json_records([{**_REQUIRED, 'name': 'A', 'price': 1}]), dry_run=True
+        )
+
+        self.assertTrue(report['dry_run'])
+        self.assertTrue(conn.rolled_back)
+        self.assertFalse(conn.committed)
+
+
+if __name__ == '__main__':
+    unittest.main()
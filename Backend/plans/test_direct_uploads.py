@@ -0,0 +1,185 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from flask import Flask  # noqa: E402
+from flask_jwt_extended import JWTManager, create_access_token  # noqa: E402
+
+from plans import direct_uploads  # noqa: E402
+from utils import upload_store  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+class _LocalStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = self._tmp.name
+        self._patches = [
+            mock.patch.multiple(
+                upload_store,
+                UPLOAD_ROOT=root,
+                BLOB_FOLDER=os.path.join(root, 'blobs'),
+                STAGING_FOLDER=os.path.join(root, '.staging'),
+            ),
+            mock.patch.object(direct_uploads, 'UPLOAD_ROOT', root),
+        ]
+        for patch in self._patches:
+            patch.start()
+
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = 'test-secret'
+        self.app.register_blueprint(direct_uploads.direct_uploads_bp)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        for patch in reversed(self._patches):
+            patch.stop()
+        self._tmp.cleanup()
+
+    def _sign(self, purpose='avatar', **kwargs):
+        with self.app.app_context():
+            return direct_uploads.sign_upload(7, purpose, backend='local', **kwargs)
+
+    def _upload(self, signed, payload, filename):
+        data = dict(signed['fields'])
+        data['file'] = (io.BytesIO(payload), filename)
+        return self.client.post(signed['upload_url'], data=data, content_type='multipart/form-data')
+
+    def _verify(self, signed, result):
+        with self.app.app_context():
+            intent = direct_uploads.load_upload_intent(signed['upload_token'])
+            return direct_uploads.verify_upload_result(intent, result)
+
+
+class LocalDirectUploadTests(_LocalStoreTestCase):
+    """Exercise the signed-upload contract against the local storage stand-in."""
+
+    def test_signed_image_upload_round_trip(self):
+        signed = self._sign()
+        resp = self._upload(signed, b'\x89PNG avatar bytes', 'me.png')
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        result = resp.get_json()
+
+        stored = self._verify(signed, result)
+        self.assertEqual(stored['url'], result['secure_url'])
+        self.assertTrue(stored['storage_key'].startswith('blobs/'))
+        self.assertEqual(stored['size'], len(b'\x89PNG avatar bytes'))
+
+    def test_raw_upload_keeps_the_signed_extension(self):
+        signed = self._sign('plan_file', plan_id='p1', file_type='STRUCTURAL', file_name='frame.dwg')
+        resp = self._upload(signed, b'AC1032 drawing', 'anything.bin')
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+
+        stored = self._verify(signed, resp.get_json())
+        self.assertTrue(stored['storage_key'].endswith('.dwg'))
+
+    def test_tampered_fields_are_rejected_by_the_stand_in(self):
+        signed = self._sign()
+        signed['fields']['public_id'] = 'avatars/someone_else'
+        resp = self._upload(signed, b'\x89PNG', 'me.png')
+        self.assertEqual(resp.status_code, 401)
+
+    def test_disallowed_format_is_rejected(self):
+        signed = self._sign()
+        resp = self._upload(signed, b'<svg/>', 'me.svg')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_forged_result_fails_verification(self):
+        signed = self._sign()
+        result = self._upload(signed, b'\x89PNG avatar bytes', 'me.png').get_json()
+
+        with self.assertRaises(ValueError):
+            self._verify(signed, dict(result, signature='0' * 40))
+
+        other = self._sign()
+        with self.assertRaises(ValueError):
+            self._verify(other, result)
+
+    def test_invalid_upload_token(self):
+        with self.app.app_context(), self.assertRaises(ValueError):
+            direct_uploads.load_upload_intent('not-a-token')
+
+
+class ConfirmDirectUploadTests(_LocalStoreTestCase):
+    """Confirm a plan file uploaded through the local stand-in."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['JWT_SECRET_KEY'] = 'test-secret-key-that-is-long-enough-for-hs256'
+        JWTManager(self.app)
+        with self.app.app_context():
+            token = create_access_token(identity='7', additional_claims={'role': 'designer'})
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+        self.claimed = set()
+        self.connections = []
+        for patch in (
+            mock.patch.object(direct_uploads, 'get_db', side_effect=self._connect),
+            mock.patch.object(direct_uploads, 'schedule_plan_file_metadata'),
+            mock.patch.object(direct_uploads, 'schedule_plan_pdf_previews'),
+        ):
+            patch.start()
+            self._patches.append(patch)
+
+    def _respond(self, sql, params):
+        if sql.startswith('INSERT INTO direct_upload_confirmations'):
+            if params[0] in self.claimed:
+                return []
+            self.claimed.add(params[0])
+            return [{'public_id': params[0]}]
+        if sql.startswith('SELECT id, designer_id, file_paths FROM plans'):
+            return [{'id': 'p1', 'designer_id': 7, 'file_paths': {}}]
+        return None
+
+    def _connect(self):
+        conn = FakeConnection(respond=self._respond)
+        self.connections.append(conn)
+        return conn
+
+    def _confirm(self, signed, result):
+        return self.client.post(
+            '/direct-uploads/confirm',
+            json={'upload_token': signed['upload_token'], 'result': result},
+            headers=self.headers,
+        )
+
+    def test_plan_file_is_recorded_with_its_blob_and_descriptor(self):
+        signed = self._sign('plan_file', plan_id='p1', file_type='STRUCTURAL', file_name='frame.dwg')
+        result = self._upload(signed, b'AC1032 drawing', 'frame.dwg').get_json()
+
+        resp = self._confirm(signed, result)
+
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        conn = self.connections[0]
+        self.assertTrue(conn.committed)
+        (sql, rows), = [entry for entry in conn.executed_many if entry[0].startswith('INSERT INTO plan_files')]
+        (row,) = rows
+        storage_key = upload_store.blob_storage_key(result['version'], '.dwg')
+        self.assertEqual(row[3], f"/uploads/{storage_key}")
+        self.assertEqual(row[5:9], (storage_key, result['version'], 'local', storage_key))
+        self.assertIsNotNone(row[9], 'storage_mtime')
+
+    def test_a_replayed_token_is_refused(self):
+        signed = self._sign('plan_file', plan_id='p1', file_type='STRUCTURAL', file_name='frame.dwg')
+        result = self._upload(signed, b'AC1032 drawing', 'frame.dwg').get_json()
+
+        self.assertEqual(self._confirm(signed, result).status_code, 200)
+        resp = self._confirm(signed, result)
+
+        self.assertEqual(resp.status_code, 409)
+        replay = self.connections[1]
+        self.assertTrue(replay.rolled_back)
+        self.assertFalse(replay.committed)
+        self.assertEqual(replay.executed_many, [], 'no plan_files rows on replay')
+        self.assertEqual(replay.statements('UPDATE plans'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
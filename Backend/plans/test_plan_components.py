@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+from decimal import Decimal
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from plans import plan_components  # noqa: E402
+
+
+class _RecordingCopy:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write_row(self, row):
+        self.sink.append(row)
+
+
+class _RecordingCursor:
+    def __init__(self):
+        self.statements = []
+        self.rows = []
+
+    def copy(self, statement):
+        self.statements.append(statement)
+        return _RecordingCopy(self.rows)
+
+
+class PlanComponentTests(unittest.TestCase):
+    def test_boq_rows_are_cleaned_and_total_is_derived(self):
+        values, errors = plan_components.validate_rows('boqs', [
+            {'item_name': ' Cement ', 'quantity': '120', 'unit': 'bags', 'unit_cost': '1,250.5'},
+        ], plan_components.clean_boq)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(values, [
+            ('Cement', Decimal('120.00'), 'bags', Decimal('1250.50'), Decimal('150060.00'), None),
+        ])
+
+    def test_every_bad_row_is_reported(self):
+        rows = [
+            {'item_name': 'Sand', 'quantity': 'lots', 'unit': 't', 'unit_cost': 10},
+            {'item_name': 'Steel', 'quantity': 1, 'unit': 't', 'unit_cost': 10},
+            'not a row',
+            {'quantity': 1, 'unit': 't', 'unit_cost': 1e12},
+        ]
+        values, errors = plan_components.validate_rows('boqs', rows, plan_components.clean_boq)
+
+        self.assertEqual(len(values), 1)
+        self.assertEqual([e['index'] for e in errors], [0, 2, 3])
+        self.assertIn('quantity', errors[0]['error'])
+
+    def test_compliance_status_defaults_and_is_checked(self):
+        values, errors = plan_components.validate_rows('compliance_notes', [
+            {'authority': 'NCA', 'requirement': 'Registration'},
+            {'authority': 'NEMA', 'requirement': 'EIA', 'status': 'maybe'},
+        ], plan_components.clean_compliance_note)
+
+        self.assertEqual(values[0][2], 'compliant')
+        self.assertEqual(errors[0]['index'], 1)
+
+    def test_one_copy_per_non_empty_table(self):
+        cur = _RecordingCursor()
+        plan_components.insert_plan_components(
+            cur, 'plan-1',
+            boqs=[('A', 1, 'u', 1, 1, None)] * 400,
+            structural_specs=[],
+            compliance_notes=[('NCA', 'Registration', 'compliant', None)],
+        )
+
+        self.assertEqual(len(cur.statements), 2)
+        self.assertTrue(cur.statements[0].startswith('COPY boqs (plan_id, item_name'))
+        self.assertEqual(len(cur.rows), 401)
+        self.assertEqual(cur.rows[0][0], 'plan-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import io
+import json
+import os
+import sys
+import unittest
+import zipfile
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from plans import plan_versions  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+from utils.download_helpers import build_changes_zip  # noqa: E402
+
+
+def _file(name, sha, file_id=None, file_type='ARCHITECTURAL'):
+    return {
+        'id': file_id or f'id-{name}',
+        'file_name': name,
+        'file_type': file_type,
+        'file_path': f'/uploads/blobs/{sha}.pdf',
+        'file_size': 10,
+        'blob_key': f'blobs/{sha}.pdf',
+        'content_sha256': sha,
+        'storage_backend': 'local',
+        'storage_key': f'blobs/{sha}.pdf',
+        'storage_mtime': None,
+        'metadata': None,
+    }
+
+
+class DiffManifestTests(unittest.TestCase):
+    def test_files_are_compared_by_name_and_checksum(self):
+        old = [_file('a.pdf', 'a' * 64), _file('b.pdf', 'b' * 64), _file('c.pdf', 'c' * 64)]
+        new = [_file('a.pdf', 'a' * 64), _file('b.pdf', 'd' * 64), _file('e.pdf', 'e' * 64)]
+
+        changes = plan_versions.diff_file_manifests(old, new)
+
+        self.assertEqual([f['file_name'] for f in changes['unchanged']], ['a.pdf'])
+        self.assertEqual([f['file_name'] for f in changes['modified']], ['b.pdf'])
+        self.assertEqual([f['file_name'] for f in changes['added']], ['e.pdf'])
+        self.assertEqual([f['file_name'] for f in changes['removed']], ['c.pdf'])
+
+    def test_legacy_rows_fall_back_to_storage_location(self):
+        old = [dict(_file('a.pdf', ''), storage_key='plans/a.pdf')]
+        new = [dict(_file('a.pdf', ''), storage_key='plans/a.pdf')]
+
+        self.assertEqual(len(plan_versions.diff_file_manifests(old, new)['unchanged']), 1)
+
+    def test_same_named_files_of_different_types_are_separate(self):
+        old = [_file('drawings.pdf', 'a' * 64), _file('drawings.pdf', 'b' * 64, file_type='STRUCTURAL')]
+        new = [_file('drawings.pdf', 'a' * 64), _file('drawings.pdf', 'c' * 64, file_type='STRUCTURAL')]
+
+        changes = plan_versions.diff_file_manifests(old, new)
+
+        self.assertEqual([f['file_type'] for f in changes['unchanged']], ['ARCHITECTURAL'])
+        self.assertEqual([f['file_type'] for f in changes['modified']], ['STRUCTURAL'])
+        self.assertEqual(changes['removed'], [])
+
+
+class ApplyVersionDeltaTests(unittest.TestCase):
+    def test_unchanged_rows_are_copied_and_only_the_delta_is_recorded(self):
+        base = [_file('a.pdf', 'a' * 64, 'f1'), _file('b.pdf', 'b' * 64, 'f2'), _file('c.pdf', 'c' * 64, 'f3')]
+        conn = FakeConnection([base])
+        uploads = [
+            _file('a.pdf', 'a' * 64),  # same content re-uploaded: ignored
+            _file('b.pdf', 'd' * 64),  # replaces b.pdf
+            _file('new.pdf', 'e' * 64),
+        ]
+
+        changes = plan_versions.apply_version_delta(conn.cursor(), 'base', 'next', uploads, removals=['c.pdf'])
+
+        self.assertEqual(
+            sorted((c['change'], c['file_name']) for c in changes),
+            [('added', 'new.pdf'), ('modified', 'b.pdf'), ('removed', 'c.pdf')]
+        )
+        copy_sql, copy_params = next((sql, p) for sql, p in conn.executed if 'INSERT INTO plan_files' in sql and 'SELECT' in sql)
+        self.assertEqual(copy_params, ('next', ['f1']))
+
+        inserted = [p for sql, rows in conn.executed_many if 'INSERT INTO plan_files' in sql for p in rows]
+        self.assertEqual(sorted(row[1] for row in inserted), ['b.pdf', 'new.pdf'])
+
+        logged = [row for sql, rows in conn.executed_many if 'plan_version_changes' in sql for row in rows]
+        modified = next(row for row in logged if row[3] == 'modified')
+        self.assertEqual((modified[6], modified[7]), ('d' * 64, 'b' * 64))
+
+    def test_removal_by_id(self):
+        conn = FakeConnection([[_file('a.pdf', 'a' * 64, 'f1')]])
+
+        changes = plan_versions.apply_version_delta(conn.cursor(), 'base', 'next', [], removals=['f1'])
+
+        self.assertEqual(changes, [{'change': 'removed', 'file_name': 'a.pdf', 'file_type': 'ARCHITECTURAL'}])
+        self.assertFalse(any('INSERT INTO plan_files' in sql for sql, _ in conn.executed))
+
+    def _shared_name_base(self):
+        return [
+            _file('drawings.pdf', 'a' * 64, 'f1'),
+            _file('drawings.pdf', 'b' * 64, 'f2', file_type='STRUCTURAL'),
+        ]
+
+    def test_an_upload_replaces_only_the_file_of_its_own_type(self):
+        conn = FakeConnection([self._shared_name_base()])
+        uploads = [_file('drawings.pdf', 'c' * 64, file_type='STRUCTURAL')]
+
+        changes = plan_versions.apply_version_delta(conn.cursor(), 'base', 'next', uploads)
+
+        self.assertEqual(changes, [{'change': 'modified', 'file_name': 'drawings.pdf', 'file_type': 'STRUCTURAL'}])
+        _, copy_params = next((sql, p) for sql, p in conn.executed if 'INSERT INTO plan_files' in sql)
+        self.assertEqual(copy_params, ('next', ['f1']), 'the architectural drawings are carried over')
+
+    def test_removals_name_the_file_type(self):
+        conn = FakeConnection([self._shared_name_base()])
+
+        changes = plan_versions.apply_version_delta(
+            conn.cursor(), 'base', 'next', [], removals=[{'file_type': 'structural', 'file_name': 'drawings.pdf'}]
+        )
+
+        self.assertEqual(changes, [{'change': 'removed', 'file_name': 'drawings.pdf', 'file_type': 'STRUCTURAL'}])
+        _, copy_params = next((sql, p) for sql, p in conn.executed if 'INSERT INTO plan_files' in sql)
+        self.assertEqual(copy_params, ('next', ['f1']))
+
+    def test_a_bare_name_shared_by_several_types_is_refused(self):
+        conn = FakeConnection([self._shared_name_base()])
+
+        with self.assertRaises(ValueError):
+            plan_versions.apply_version_delta(conn.cursor(), 'base', 'next', [], removals=['drawings.pdf'])
+        self.assertFalse(any('INSERT' in sql for sql, _ in conn.executed))
+
+
+class ChangesPackageTests(unittest.TestCase):
+    def test_package_lists_all_changes(self):
+        changes = plan_versions.diff_file_manifests(
+            [_file('a.pdf', 'a' * 64), _file('gone.pdf', 'b' * 64)],
+            [_file('a.pdf', 'a' * 64), dict(_file('remote.pdf', ''), storage_backend=None, storage_key=None)],
+        )
+        bundle = {'plan': {'id': 'p2', 'name': 'Villa', 'version': 3}, 'files': []}
+
+        buffer, download_name, files_added = build_changes_zip(bundle, changes, 1)
+
+        self.assertEqual(download_name, 'Villa-v1-to-v3-changes.zip')
+        self.assertEqual(files_added, 0)  # remote.pdf is not on disk here
+        with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as archive:
+            report = json.loads(archive.read('CHANGES.json'))
+        self.assertEqual(report['unchanged'], 1)
+        self.assertEqual(
+            [(c['change'], c['file_name']) for c in report['changes']],
+            [('added', 'remote.pdf'), ('removed', 'gone.pdf')]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
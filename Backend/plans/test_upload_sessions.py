@@ -0,0 +1,308 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from flask import Flask  # noqa: E402
+from flask_jwt_extended import JWTManager, create_access_token  # noqa: E402
+
+from plans import plans, upload_sessions  # noqa: E402
+from utils import upload_store  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+_SESSION_ID = '3b6f2a1e-8c4d-4e7a-9f10-5d2c7b8a9e01'
+_PAYLOAD = b'plan-bytes-' * 10
+
+
+class _SessionTable:
+    """Just enough of upload_sessions / file_blobs for the session endpoints."""
+
+    def __init__(self, received=0, status='uploading'):
+        self.row = {
+            'id': _SESSION_ID, 'user_id': 7, 'file_name': 'plan.pdf', 'file_type': 'ARCHITECTURAL',
+            'total_size': len(_PAYLOAD), 'received_bytes': received, 'status': status,
+            'content_sha256': None, 'storage_key': None, 'storage_mtime': None,
+            'expires_at': datetime.utcnow() + timedelta(hours=1),
+        }
+        self.blobs = []
+        self.fail_on = None
+
+    def respond(self, sql, params):
+        if self.fail_on and self.fail_on in sql:
+            self.fail_on = None
+            raise RuntimeError('connection lost')
+        row = self.row
+        if sql.startswith('SELECT * FROM upload_sessions'):
+            return [dict(row)] if params == (_SESSION_ID, 7) else []
+        if 'SET received_bytes' in sql:
+            written, _, _, offset, _, _ = params
+            if row['status'] != 'uploading' or row['received_bytes'] != offset:
+                return []
+            row['received_bytes'] += written
+            return [dict(row)]
+        if "SET status = 'failed'" in sql:
+            if row['status'] == 'uploading':
+                row['status'] = 'failed'
+            return []
+        if 'SET content_sha256' in sql:
+            row['content_sha256'] = params[0]
+            return []
+        if sql.startswith('INSERT INTO file_blobs'):
+            self.blobs.append(params)
+            return []
+        if "SET status = 'complete'" in sql:
+            if row['status'] != 'uploading':
+                return []
+            row.update(status='complete', storage_key=params[0], content_sha256=params[1], storage_mtime=params[2])
+            return [dict(row)]
+        return []
+
+
+class _UploadSessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = self._tmp.name
+        self.session_folder = os.path.join(root, '.staging', 'sessions')
+        self._patches = [
+            mock.patch.multiple(
+                upload_store,
+                UPLOAD_ROOT=root,
+                BLOB_FOLDER=os.path.join(root, 'blobs'),
+                STAGING_FOLDER=os.path.join(root, '.staging'),
+            ),
+            mock.patch.object(upload_sessions, 'UPLOAD_SESSION_FOLDER', self.session_folder),
+            mock.patch.object(upload_sessions, 'get_db', side_effect=self._connect),
+        ]
+        for patch in self._patches:
+            patch.start()
+        os.makedirs(self.session_folder)
+        self.connections = []
+
+        app = Flask(__name__)
+        app.config['JWT_SECRET_KEY'] = 'test-secret-key-that-is-long-enough-for-hs256'
+        JWTManager(app)
+        app.register_blueprint(upload_sessions.upload_sessions_bp)
+        self.client = app.test_client()
+        with app.app_context():
+            token = create_access_token(identity='7', additional_claims={'role': 'designer'})
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        for patch in reversed(self._patches):
+            patch.stop()
+        self._tmp.cleanup()
+
+    def _connect(self):
+        conn = FakeConnection(respond=self.table.respond)
+        self.connections.append(conn)
+        return conn
+
+    def _write_part(self, data):
+        with open(upload_sessions._part_path(_SESSION_ID), 'wb') as handle:
+            handle.write(data)
+
+    def _read_part(self):
+        with open(upload_sessions._part_path(_SESSION_ID), 'rb') as handle:
+            return handle.read()
+
+    def _put(self, data, offset, content_length=None):
+        # The test client sets Content-Length from the body; override it to send a short body.
+        return self.client.put(
+            f'/plans/upload-sessions/{_SESSION_ID}?offset={offset}', headers=self.headers,
+            environ_overrides={'wsgi.input': io.BytesIO(data), 'CONTENT_LENGTH': str(content_length or len(data))}
+        )
+
+    def _complete(self, sha256=None):
+        return self.client.post(
+            f'/plans/upload-sessions/{_SESSION_ID}/complete',
+            json={'sha256': sha256} if sha256 else {}, headers=self.headers
+        )
+
+    def _chunk_files(self):
+        return [name for name in os.listdir(self.session_folder) if name.endswith('.chunk')]
+
+
+class UploadChunkTests(_UploadSessionTestCase):
+    def test_a_chunk_at_the_current_offset_is_appended(self):
+        self.table = _SessionTable(received=10)
+        self._write_part(_PAYLOAD[:10])
+
+        resp = self._put(_PAYLOAD[10:40], 10)
+
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        self.assertEqual(resp.get_json()['received_bytes'], 40)
+        self.assertEqual(self._read_part(), _PAYLOAD[:40])
+        self.assertEqual(self._chunk_files(), [])
+
+    def test_the_body_is_read_before_any_transaction_holds_the_session(self):
+        self.table = _SessionTable()
+        self._write_part(b'')
+
+        self._put(_PAYLOAD[:10], 0)
+
+        for conn in self.connections:
+            self.assertEqual(conn.statements('FOR UPDATE'), [])
+        (cas,) = [sql for conn in self.connections for sql in conn.statements('SET received_bytes')]
+        self.assertIn('AND received_bytes = %s', cas)
+
+    def test_a_chunk_at_the_wrong_offset_conflicts_and_reports_the_current_offset(self):
+        self.table = _SessionTable(received=10)
+        self._write_part(_PAYLOAD[:10])
+
+        resp = self._put(_PAYLOAD[20:30], 20)
+
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.get_json()['received_bytes'], 10)
+        self.assertEqual(self._read_part(), _PAYLOAD[:10])
+
+    def test_losing_the_offset_race_conflicts_without_touching_the_part_file(self):
+        self.table = _SessionTable(received=10)
+        self._write_part(_PAYLOAD[:20])
+        respond = self.table.respond
+
+        def race(sql, params):
+            if 'SET received_bytes' in sql:
+                # Another PUT for the same offset committed after this one read the session.
+                self.table.row['received_bytes'] = 20
+            return respond(sql, params)
+
+        self.table.respond = race
+
+        resp = self._put(b'x' * 10, 10)
+
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.get_json()['received_bytes'], 20)
+        self.assertEqual(self._read_part(), _PAYLOAD[:20])
+        self.assertEqual(self._chunk_files(), [])
+
+    def test_a_short_body_is_rejected_and_not_recorded(self):
+        self.table = _SessionTable()
+        self._write_part(b'')
+
+        resp = self._put(_PAYLOAD[:5], 0, content_length=10)
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.get_json()['received_bytes'], 0)
+        self.assertEqual(self.table.row['received_bytes'], 0)
+        self.assertEqual(self._read_part(), b'')
+        self.assertEqual(self._chunk_files(), [])
+
+
+class CompleteUploadSessionTests(_UploadSessionTestCase):
+    def _blob_path(self, sha256):
+        return os.path.join(upload_store.UPLOAD_ROOT, upload_store.blob_storage_key(sha256, '.pdf'))
+
+    def test_an_incomplete_session_cannot_be_completed(self):
+        self.table = _SessionTable(received=10)
+        self._write_part(_PAYLOAD[:10])
+
+        resp = self._complete()
+
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.table.row['status'], 'uploading')
+        self.assertTrue(os.path.exists(upload_sessions._part_path(_SESSION_ID)))
+
+    def test_a_completed_session_is_stored_and_recorded_in_one_transaction(self):
+        self.table = _SessionTable(received=len(_PAYLOAD))
+        self._write_part(_PAYLOAD)
+        sha256 = hashlib.sha256(_PAYLOAD).hexdigest()
+
+        resp = self._complete(sha256)
+
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        self.assertEqual(resp.get_json()['status'], 'complete')
+        self.assertTrue(os.path.isfile(self._blob_path(sha256)))
+        self.assertFalse(os.path.exists(upload_sessions._part_path(_SESSION_ID)))
+        final = self.connections[-1]
+        self.assertEqual(len(final.statements('INSERT INTO file_blobs')), 1)
+        self.assertEqual(len(final.statements("SET status = 'complete'")), 1)
+        self.assertEqual(final.commits, 1)
+
+    def test_a_checksum_mismatch_fails_the_session_without_storing_a_blob(self):
+        self.table = _SessionTable(received=len(_PAYLOAD))
+        self._write_part(_PAYLOAD)
+        actual = hashlib.sha256(_PAYLOAD).hexdigest()
+
+        resp = self._complete('0' * 64)
+
+        self.assertEqual(resp.status_code, 422)
+        self.assertEqual(resp.get_json()['sha256'], actual)
+        self.assertEqual(self.table.row['status'], 'failed')
+        self.assertFalse(os.path.exists(self._blob_path(actual)))
+        self.assertFalse(os.path.exists(upload_sessions._part_path(_SESSION_ID)))
+        self.assertEqual(self.table.blobs, [])
+
+    def test_completing_twice_returns_the_finished_session(self):
+        self.table = _SessionTable(received=len(_PAYLOAD))
+        self._write_part(_PAYLOAD)
+
+        first = self._complete()
+        second = self._complete()
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(len(self.table.blobs), 1)
+
+    def test_a_retry_after_a_failed_commit_uses_the_already_moved_blob(self):
+        self.table = _SessionTable(received=len(_PAYLOAD))
+        self._write_part(_PAYLOAD)
+        self.table.fail_on = "SET status = 'complete'"
+
+        failed = self._complete()
+        self.assertEqual(failed.status_code, 500)
+        self.assertFalse(os.path.exists(upload_sessions._part_path(_SESSION_ID)))
+
+        retry = self._complete()
+
+        self.assertEqual(retry.status_code, 200, retry.get_json())
+        self.assertEqual(self.table.row['status'], 'complete')
+        self.assertEqual(self.table.row['content_sha256'], hashlib.sha256(_PAYLOAD).hexdigest())
+
+    def test_missing_data_without_a_stored_blob_fails_the_session(self):
+        self.table = _SessionTable(received=len(_PAYLOAD))
+
+        resp = self._complete()
+
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.table.row['status'], 'failed')
+
+
+class LoadCompletedUploadSessionsTests(unittest.TestCase):
+    def test_completed_sessions_become_stored_file_dicts(self):
+        mtime = datetime(2026, 1, 2, 3, 4, 5)
+        conn = FakeConnection([[
+            {'id': _SESSION_ID, 'file_name': 'plan.pdf', 'file_type': 'ARCHITECTURAL', 'total_size': 110,
+             'storage_key': 'blobs/ab/cd/abcd.pdf', 'content_sha256': 'abcd', 'storage_mtime': mtime},
+            {'id': 'c0ffee00-0000-4000-8000-000000000000', 'file_name': 'x.exe', 'file_type': 'EXE',
+             'total_size': 1, 'storage_key': 'blobs/x.exe', 'content_sha256': 'ef', 'storage_mtime': mtime},
+        ]])
+
+        files = plans._load_completed_upload_sessions(conn, [_SESSION_ID, 'not-a-uuid'], 7)
+
+        self.assertEqual(files, [{
+            'id': _SESSION_ID, 'file_name': 'plan.pdf', 'file_type': 'ARCHITECTURAL',
+            'file_path': '/uploads/blobs/ab/cd/abcd.pdf', 'storage_key': 'blobs/ab/cd/abcd.pdf',
+            'sha256': 'abcd', 'size': 110, 'mtime': mtime,
+        }])
+        (sql, params), = conn.executed
+        self.assertIn("AND user_id = %s AND status = 'complete'", sql)
+        self.assertEqual(params, ([_SESSION_ID], 7))
+
+    def test_no_valid_ids_means_no_query(self):
+        conn = FakeConnection()
+        self.assertEqual(plans._load_completed_upload_sessions(conn, ['nope', ''], 7), [])
+        self.assertEqual(conn.executed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
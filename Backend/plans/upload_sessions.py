@@ -0,0 +1,458 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.utils import secure_filename
+import os
+import uuid
+import shutil
+import tempfile
+import psycopg
+from psycopg.rows import dict_row
+from datetime import datetime, timedelta
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auth.auth_utils import get_current_user, require_designer
+from plans.plans import UPLOAD_FILE_TYPES, allowed_file
+from utils.upload_store import STAGING_FOLDER, hash_file, store_hashed_file, existing_blob
+
+upload_sessions_bp = Blueprint('upload_sessions', __name__, url_prefix='/plans/upload-sessions')
+
+UPLOAD_SESSION_FOLDER = os.path.join(STAGING_FOLDER, 'sessions')
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE_BYTES', str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('UPLOAD_CHUNK_MAX_SIZE_BYTES', str(32 * 1024 * 1024)))
+UPLOAD_SESSION_MAX_FILE_SIZE = int(os.getenv('UPLOAD_SESSION_MAX_FILE_SIZE_BYTES', str(2 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv('UPLOAD_SESSION_TTL_HOURS', '24'))
+
+_STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+def get_db():
+    return psycopg.connect(
+        current_app.config['DATABASE_URL'],
+        connect_timeout=5,
+        options='-c statement_timeout=15000'
+    )
+
+
+def _part_path(session_id):
+    return os.path.join(UPLOAD_SESSION_FOLDER, f"{session_id}.part")
+
+
+def _session_payload(row):
+    return {
+        "upload_id": str(row['id']),
+        "file_name": row['file_name'],
+        "file_type": row['file_type'],
+        "total_size": row['total_size'],
+        "received_bytes": row['received_bytes'],
+        "status": row['status'],
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "sha256": row.get('content_sha256'),
+        "expires_at": row['expires_at'].isoformat() if row.get('expires_at') else None,
+    }
+
+
+def _chunk_offset():
+    """Read the chunk offset from `Content-Range: bytes start-end/total` or `?offset=`."""
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        try:
+            unit, _, spec = content_range.partition(' ')
+            start = spec.split('-', 1)[0]
+            if unit.strip().lower() != 'bytes':
+                raise ValueError
+            return int(start)
+        except (ValueError, IndexError):
+            return None
+    try:
+        return int(request.args.get('offset', ''))
+    except ValueError:
+        return None
+
+
+def _is_uuid(value):
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+def _fetch_session(cur, upload_id, user_id, for_update=False):
+    if not _is_uuid(upload_id):
+        return None
+    cur.execute(
+        f"""
+        SELECT *
+        FROM upload_sessions
+        WHERE id = %s AND user_id = %s
+        {'FOR UPDATE' if for_update else ''}
+        """,
+        (upload_id, user_id)
+    )
+    return cur.fetchone()
+
+
+@upload_sessions_bp.route('', methods=['POST'])
+@jwt_required()
+@require_designer
+def create_upload_session():
+    """Start a resumable upload for one technical file."""
+    user_id, _ = get_current_user()
+    data = request.get_json(silent=True) or {}
+
+    file_name = secure_filename(str(data.get('file_name') or ''))
+    file_type = str(data.get('file_type') or '').upper()
+    try:
+        total_size = int(data.get('file_size'))
+    except (TypeError, ValueError):
+        return jsonify(message="file_size must be an integer"), 400
+
+    if not file_name:
+        return jsonify(message="file_name is required"), 400
+    if file_type not in UPLOAD_FILE_TYPES:
+        return jsonify(message=f"file_type must be one of: {', '.join(sorted(UPLOAD_FILE_TYPES))}"), 400
+    if not allowed_file(file_name, UPLOAD_FILE_TYPES[file_type][1]):
+        return jsonify(message=f"File extension not allowed for {file_type}"), 400
+    if total_size <= 0 or total_size > UPLOAD_SESSION_MAX_FILE_SIZE:
+        return jsonify(message=f"file_size must be between 1 and {UPLOAD_SESSION_MAX_FILE_SIZE} bytes"), 400
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            INSERT INTO upload_sessions (user_id, file_name, file_type, total_size, expires_at)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING *
+            """,
+            (user_id, file_name, file_type, total_size,
+             datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS))
+        )
+        row = cur.fetchone()
+
+        os.makedirs(UPLOAD_SESSION_FOLDER, exist_ok=True)
+        open(_part_path(row['id']), 'wb').close()
+
+        conn.commit()
+        return jsonify(_session_payload(row)), 201
+    except Exception as e:
+        conn.rollback()
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
+@upload_sessions_bp.route('/<upload_id>', methods=['GET'])
+@jwt_required()
+@require_designer
+def get_upload_session(upload_id):
+    """Report how many bytes have been received so a client can resume."""
+    user_id, _ = get_current_user()
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        row = _fetch_session(cur, upload_id, user_id)
+        if not row:
+            return jsonify(message="Upload session not found"), 404
+        return jsonify(_session_payload(row)), 200
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _read_session(upload_id, user_id):
+    """Read a session on a short-lived connection, so nothing is held while a client streams."""
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        return _fetch_session(cur, upload_id, user_id)
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _chunk_conflict(row, offset, length):
+    """The error response for a chunk that cannot be appended to this session, or None."""
+    if not row:
+        return jsonify(message="Upload session not found"), 404
+    if row['status'] != 'uploading':
+        return jsonify(message=f"Upload session is {row['status']}", **_session_payload(row)), 409
+    if row['expires_at'] and row['expires_at'] < datetime.utcnow():
+        return jsonify(message="Upload session has expired"), 410
+    if offset != row['received_bytes']:
+        return jsonify(message="Offset does not match received bytes", **_session_payload(row)), 409
+    if offset + length > row['total_size']:
+        return jsonify(message="Chunk exceeds the declared file size", **_session_payload(row)), 416
+    return None
+
+
+def _receive_chunk(upload_id, content_length):
+    """Stream the request body to its own temp file; returns (path, bytes written)."""
+    os.makedirs(UPLOAD_SESSION_FOLDER, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_SESSION_FOLDER, prefix=f"{upload_id}.", suffix='.chunk')
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            while written < content_length:
+                try:
+                    chunk = request.stream.read(min(_STREAM_BUFFER_SIZE, content_length - written))
+                except ClientDisconnected:
+                    break
+                if not chunk:
+                    break
+                handle.write(chunk)
+                written += len(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, written
+
+
+@upload_sessions_bp.route('/<upload_id>', methods=['PUT'])
+@jwt_required()
+@require_designer
+def upload_chunk(upload_id):
+    """Append one chunk at the given offset.
+
+    The offset must equal the bytes already received; otherwise 409 is returned
+    with the current offset so the client can resume from there. The body is
+    streamed to disk before any transaction starts; the append is then recorded
+    with a compare-and-set on received_bytes, so of two concurrent PUTs for the
+    same offset only one wins.
+    """
+    user_id, _ = get_current_user()
+
+    offset = _chunk_offset()
+    if offset is None or offset < 0:
+        return jsonify(message="Chunk offset is required (Content-Range or ?offset=)"), 400
+
+    content_length = request.content_length
+    if content_length is None:
+        return jsonify(message="Content-Length is required"), 411
+    if content_length > UPLOAD_CHUNK_MAX_SIZE:
+        return jsonify(message=f"Chunks may not exceed {UPLOAD_CHUNK_MAX_SIZE} bytes"), 413
+
+    try:
+        row = _read_session(upload_id, user_id)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    conflict = _chunk_conflict(row, offset, content_length)
+    if conflict:
+        return conflict
+
+    chunk_path, written = _receive_chunk(row['id'], content_length)
+    try:
+        if written != content_length:
+            return jsonify(message="Chunk body was shorter than Content-Length", **_session_payload(row)), 400
+
+        conn = get_db()
+        cur = conn.cursor(row_factory=dict_row)
+        try:
+            cur.execute(
+                """
+                UPDATE upload_sessions
+                SET received_bytes = received_bytes + %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND user_id = %s AND status = 'uploading'
+                  AND received_bytes = %s AND received_bytes + %s <= total_size
+                  AND (expires_at IS NULL OR expires_at >= %s)
+                RETURNING *
+                """,
+                (written, row['id'], user_id, offset, written, datetime.utcnow())
+            )
+            updated = cur.fetchone()
+            if not updated:
+                # Another PUT won the race, or the session changed since it was read.
+                conn.rollback()
+                current = _fetch_session(cur, upload_id, user_id)
+                conn.rollback()
+                return _chunk_conflict(current, offset, written) or (
+                    jsonify(message="Offset does not match received bytes"), 409
+                )
+
+            # The row stays locked by the UPDATE until commit, so the append can't interleave.
+            with open(_part_path(row['id']), 'r+b') as part, open(chunk_path, 'rb') as chunk:
+                # Drop bytes from any earlier attempt that never got recorded.
+                part.truncate(offset)
+                part.seek(offset)
+                shutil.copyfileobj(chunk, part, _STREAM_BUFFER_SIZE)
+            conn.commit()
+            return jsonify(_session_payload(updated)), 200
+        except Exception as e:
+            conn.rollback()
+            return jsonify(error=str(e)), 500
+        finally:
+            cur.close()
+            conn.close()
+    finally:
+        os.remove(chunk_path)
+
+
+def _fail_session(upload_id, user_id):
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE upload_sessions SET status = 'failed', updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND user_id = %s AND status = 'uploading'
+            """,
+            (upload_id, user_id)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _record_session_checksum(upload_id, user_id, sha256):
+    """Persist the part file's checksum before it is moved, so a retry can find the blob."""
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE upload_sessions SET content_sha256 = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND user_id = %s AND status = 'uploading'
+            """,
+            (sha256, upload_id, user_id)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@upload_sessions_bp.route('/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+@require_designer
+def complete_upload_session(upload_id):
+    """Finalize a fully received upload into the content-addressed blob store.
+
+    Pass the returned upload_id in `upload_session_ids` on POST /plans/upload to
+    attach the file to a plan. The part file is hashed before it is moved, so a
+    checksum mismatch leaves nothing in the blob store. Completing again, or
+    retrying after a failed commit, returns the finished session.
+    """
+    user_id, _ = get_current_user()
+    data = request.get_json(silent=True) or {}
+    expected_sha256 = (data.get('sha256') or '').strip().lower() or None
+
+    try:
+        row = _read_session(upload_id, user_id)
+        if not row:
+            return jsonify(message="Upload session not found"), 404
+        if row['status'] == 'complete':
+            return jsonify(_session_payload(row)), 200
+        if row['status'] != 'uploading':
+            return jsonify(message=f"Upload session is {row['status']}", **_session_payload(row)), 409
+        if row['received_bytes'] != row['total_size']:
+            return jsonify(message="Upload is incomplete", **_session_payload(row)), 409
+
+        part_path = _part_path(row['id'])
+        if os.path.exists(part_path):
+            sha256, size = hash_file(part_path)
+            if size != row['total_size']:
+                return jsonify(message="Upload is incomplete", **_session_payload(row)), 409
+            if expected_sha256 and sha256 != expected_sha256:
+                _fail_session(row['id'], user_id)
+                os.remove(part_path)
+                return jsonify(message="Checksum mismatch", sha256=sha256), 422
+            _record_session_checksum(row['id'], user_id, sha256)
+            stored = store_hashed_file(part_path, sha256, size, row['file_name'])
+        else:
+            # An earlier attempt moved the file but did not commit; its checksum was recorded first.
+            stored = existing_blob(row['content_sha256'], row['file_name']) if row.get('content_sha256') else None
+            if stored is None:
+                _fail_session(row['id'], user_id)
+                return jsonify(message="Upload data is missing; start a new upload session"), 409
+            if expected_sha256 and stored['sha256'] != expected_sha256:
+                return jsonify(message="Checksum mismatch", sha256=stored['sha256']), 422
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            INSERT INTO file_blobs (storage_key, sha256, size_bytes)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (storage_key) DO NOTHING
+            """,
+            (stored['storage_key'], stored['sha256'], stored['size'])
+        )
+        cur.execute(
+            """
+            UPDATE upload_sessions
+            SET status = 'complete',
+                storage_key = %s,
+                content_sha256 = %s,
+                storage_mtime = %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND user_id = %s AND status = 'uploading'
+            RETURNING *
+            """,
+            (stored['storage_key'], stored['sha256'], stored['mtime'], row['id'], user_id)
+        )
+        completed = cur.fetchone()
+        if not completed:
+            # A concurrent complete finished first.
+            conn.rollback()
+            completed = _fetch_session(cur, upload_id, user_id)
+            conn.rollback()
+            if not completed or completed['status'] != 'complete':
+                return jsonify(message="Upload session changed while completing"), 409
+            return jsonify(_session_payload(completed)), 200
+        conn.commit()
+        return jsonify(_session_payload(completed)), 200
+    except Exception as e:
+        conn.rollback()
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
+
+
+@upload_sessions_bp.route('/<upload_id>', methods=['DELETE'])
+@jwt_required()
+@require_designer
+def abort_upload_session(upload_id):
+    """Abandon an in-progress upload and discard the received bytes."""
+    user_id, _ = get_current_user()
+    if not _is_uuid(upload_id):
+        return jsonify(message="No in-progress upload session found"), 404
+
+    conn = get_db()
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            UPDATE upload_sessions
+            SET status = 'aborted', updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND user_id = %s AND status = 'uploading'
+            RETURNING id
+            """,
+            (upload_id, user_id)
+        )
+        row = cur.fetchone()
+        if not row:
+            return jsonify(message="No in-progress upload session found"), 404
+
+        part_path = _part_path(row['id'])
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+        conn.commit()
+        return jsonify(message="Upload session aborted"), 200
+    except Exception as e:
+        conn.rollback()
+        return jsonify(error=str(e)), 500
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,90 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '2'))
+# Tasks beyond this many queued/running ones are dropped (and logged); every
+# background stage has a manage.py command to catch up on skipped work.
+BACKGROUND_QUEUE_LIMIT = int(os.getenv('BACKGROUND_QUEUE_LIMIT', '200'))
+
+
+class BackgroundPool:
+    """A small per-process thread pool, started on first use.
+
+    Tasks run inside an application context so they can use current_app
+    (config, logger). Work that must not wait behind slow tasks on the shared
+    pool gets a pool of its own.
+    """
+
+    def __init__(self, name, workers, queue_limit):
+        self.name = name
+        self.workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(queue_limit)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue `fn`; returns the Future, or None if the queue is full."""
+        app = current_app._get_current_object()
+
+        if not self._slots.acquire(blocking=False):
+            app.logger.warning(f"Background queue {self.name} full; skipped {fn.__name__}")
+            return None
+
+        def run():
+            try:
+                with app.app_context():
+                    fn(*args, **kwargs)
+            except Exception:
+                app.logger.exception(f"Background task {fn.__name__} failed")
+            finally:
+                self._slots.release()
+
+        try:
+            return self._get_executor().submit(run)
+        except RuntimeError:
+            # Interpreter shutdown
+            self._slots.release()
+            return None
+
+
+_pool = BackgroundPool('plancave-background', BACKGROUND_WORKERS, BACKGROUND_QUEUE_LIMIT)
+
+
+def submit_background(fn, *args, **kwargs):
+    """Run `fn` off the request path on the shared per-process thread pool.
+
+    Returns the Future, or None if the queue is full.
+    """
+    return _pool.submit(fn, *args, **kwargs)
+
+
+def call_later(delay, fn, *args, **kwargs):
+    """Run `fn` in an application context after `delay` seconds, on a daemon timer thread.
+
+    Returns the started threading.Timer; cancel() it to drop the call. Meant
+    for short calls that hand the real work to a pool.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                fn(*args, **kwargs)
+        except Exception:
+            app.logger.exception(f"Delayed task {fn.__name__} failed")
+
+    timer = threading.Timer(max(delay, 0), run)
+    timer.daemon = True
+    timer.start()
+    return timer
@@ -1,6 +1,9 @@
 import cloudinary
 import cloudinary.uploader
+from cloudinary.exceptions import Error as CloudinaryError, GeneralError, RateLimited
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -25,6 +28,15 @@ cloudinary.config(
     secure=True
 )
 
+# Point uploads at a local stand-in of the Cloudinary upload API (tests, offline dev).
+if os.getenv("CLOUDINARY_UPLOAD_PREFIX"):
+    cloudinary.config(upload_prefix=os.getenv("CLOUDINARY_UPLOAD_PREFIX"))
+
+CLOUDINARY_UPLOAD_WORKERS = int(os.getenv("CLOUDINARY_UPLOAD_WORKERS", "6"))
+CLOUDINARY_UPLOAD_RETRIES = int(os.getenv("CLOUDINARY_UPLOAD_RETRIES", "2"))
+CLOUDINARY_UPLOAD_BACKOFF_SECONDS = float(os.getenv("CLOUDINARY_UPLOAD_BACKOFF_SECONDS", "0.5"))
+CLOUDINARY_UPLOAD_TIMEOUT_SECONDS = int(os.getenv("CLOUDINARY_UPLOAD_TIMEOUT_SECONDS", "60"))
+
 def upload_to_cloudinary(file_stream, public_id=None, folder="plancave_plans"):
     """Uploads a file stream to Cloudinary and returns the secure URL."""
     if not all([os.getenv("CLOUDINARY_CLOUD_NAME"), os.getenv("CLOUDINARY_API_KEY"), os.getenv("CLOUDINARY_API_SECRET")]):
@@ -35,6 +47,68 @@ def upload_to_cloudinary(file_stream, public_id=None, folder="plancave_plans"):
         file_stream,
         public_id=public_id,
         folder=folder,
-        resource_type="auto"
+        resource_type="auto",
+        timeout=CLOUDINARY_UPLOAD_TIMEOUT_SECONDS
     )
     return result.get('secure_url')
+
+
+def _is_transient_upload_error(exc):
+    # The SDK raises the base Error for socket/HTTP/parse failures and unmapped
+    # 5xx responses; RateLimited (420) and GeneralError (500) are also worth retrying.
+    # Other subclasses (BadRequest, NotAllowed, ...) will not succeed on retry.
+    if isinstance(exc, (RateLimited, GeneralError)):
+        return True
+    return type(exc) is CloudinaryError
+
+
+def _upload_with_retries(asset, retries, backoff_seconds, uploader):
+    started = time.monotonic()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            if attempts > 1 and hasattr(asset['file'], 'seek'):
+                asset['file'].seek(0)
+            url = uploader(asset['file'], public_id=asset.get('public_id'), folder=asset.get('folder', "plancave_plans"))
+            error = None
+            break
+        except Exception as exc:
+            if attempts <= retries and _is_transient_upload_error(exc):
+                time.sleep(backoff_seconds * (2 ** (attempts - 1)))
+                continue
+            url = None
+            error = exc
+            break
+
+    return {
+        'url': url,
+        'error': error,
+        'attempts': attempts,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        'name': asset.get('name'),
+    }
+
+
+def upload_many_to_cloudinary(assets, max_workers=None, retries=None, backoff_seconds=None, uploader=None):
+    """Upload several assets concurrently on a bounded thread pool.
+
+    `assets` is a list of dicts with `file` plus optional `public_id`, `folder`
+    and `name`. Results come back in the same order as `assets`, each with the
+    URL (or the final error), the number of attempts and the elapsed time.
+    Transient failures are retried with exponential backoff.
+    """
+    if not assets:
+        return []
+
+    uploader = uploader or upload_to_cloudinary
+    retries = CLOUDINARY_UPLOAD_RETRIES if retries is None else retries
+    backoff_seconds = CLOUDINARY_UPLOAD_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+    workers = max(1, min(max_workers or CLOUDINARY_UPLOAD_WORKERS, len(assets)))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cloudinary-upload") as executor:
+        futures = [
+            executor.submit(_upload_with_retries, asset, retries, backoff_seconds, uploader)
+            for asset in assets
+        ]
+        return [future.result() for future in futures]
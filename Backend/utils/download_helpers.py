@@ -5,11 +5,13 @@ import zipfile
 import uuid
 import re
 import textwrap
-import requests
 from datetime import datetime, date
 from decimal import Decimal
 from psycopg.rows import dict_row
 
+from utils import http_clients
+from utils.upload_store import UPLOAD_ROOT, deliverable_key_for_file_type
+
 
 def _normalize_selected_deliverables(selected_deliverables) -> set[str] | None:
     if selected_deliverables is None:
@@ -27,43 +29,19 @@ def _normalize_selected_deliverables(selected_deliverables) -> set[str] | None:
     return None
 
 
-def _deliverable_key_for_file_type(file_type: str | None) -> str | None:
-    if not file_type:
-        return None
-    ft = str(file_type).upper()
-    if ft.startswith('ARCH'):
-        return 'architectural'
-    if ft.startswith('STRUCT'):
-        return 'structural'
-    if ft.startswith('MEP'):
-        return 'mep'
-    if ft.startswith('CIVIL'):
-        return 'civil'
-    if ft.startswith('FIRE'):
-        return 'fire_safety'
-    if ft.startswith('INTERIOR'):
-        return 'interior'
-    if ft.startswith('BOQ'):
-        return 'boq'
-    if ft.startswith('RENDER'):
-        return 'renders'
-    return None
-
-
-def _free_deliverables_from_prices(deliverable_prices) -> set[str]:
+def _parse_deliverable_prices(deliverable_prices) -> dict | None:
     prices = deliverable_prices
-    if prices is None:
-        return set()
     if isinstance(prices, str):
         try:
             prices = json.loads(prices)
         except Exception:
-            prices = None
-    if not isinstance(prices, dict):
-        return set()
+            return None
+    return prices if isinstance(prices, dict) else None
+
 
+def _free_deliverables_from_prices(deliverable_prices) -> set[str]:
     free: set[str] = set()
-    for k, v in prices.items():
+    for k, v in (_parse_deliverable_prices(deliverable_prices) or {}).items():
         if not isinstance(k, str):
             continue
         if v is None or v == '':
@@ -76,22 +54,42 @@ def _free_deliverables_from_prices(deliverable_prices) -> set[str]:
     return free
 
 
-def _filter_files_by_selected_deliverables(files: list[dict], selected_deliverables, deliverable_prices=None) -> list[dict]:
+def priced_deliverable_keys(deliverable_prices) -> set[str]:
+    """Deliverables that cost something (buying all of them counts as a full purchase)."""
+    priced: set[str] = set()
+    for k, v in (_parse_deliverable_prices(deliverable_prices) or {}).items():
+        try:
+            n = 0 if v is None or v == '' else float(v)
+        except Exception:
+            n = 0
+        if isinstance(k, str) and n > 0:
+            priced.add(k)
+    return priced
+
+
+def deliverable_keys_for_selection(selected_deliverables, deliverable_prices=None) -> set[str] | None:
+    """plan_files.deliverable_key values a purchase covers, or None for every file."""
     allowed = _normalize_selected_deliverables(selected_deliverables)
     if allowed is None:
         # Full plan purchase / admin / designer downloads
-        return files
+        return None
 
     # Option A: always include deliverables priced at 0 (free add-ons)
     allowed = set(allowed)
     allowed |= _free_deliverables_from_prices(deliverable_prices)
 
-    if not allowed:
+    return allowed or None
+
+
+def _filter_files_by_selected_deliverables(files: list[dict], selected_deliverables, deliverable_prices=None) -> list[dict]:
+    allowed = deliverable_keys_for_selection(selected_deliverables, deliverable_prices)
+    if allowed is None:
         return files
 
     filtered: list[dict] = []
     for f in files or []:
-        key = _deliverable_key_for_file_type((f or {}).get('file_type'))
+        f = f or {}
+        key = f.get('deliverable_key') or deliverable_key_for_file_type(f.get('file_type'))
         if key is None:
             continue
         if key in allowed:
@@ -119,6 +117,28 @@ def resolve_plan_file_path(file_path: str) -> str | None:
     return None
 
 
+def resolve_plan_file_location(plan_file: dict) -> tuple[str | None, str | None]:
+    """Return ('local', absolute_path) or ('url', url) for a plan_files row.
+
+    Rows carrying a storage descriptor are resolved without touching the
+    filesystem; older rows fall back to probing candidate paths.
+    """
+    backend = plan_file.get('storage_backend')
+    storage_key = plan_file.get('storage_key')
+    if backend == 'local' and storage_key:
+        return 'local', os.path.join(UPLOAD_ROOT, storage_key)
+    if backend == 'url' and storage_key:
+        return 'url', storage_key
+
+    file_path = plan_file.get('file_path')
+    resolved_path = resolve_plan_file_path(file_path)
+    if resolved_path:
+        return 'local', resolved_path
+    if isinstance(file_path, str) and re.match(r'^https?://', file_path, re.IGNORECASE):
+        return 'url', file_path
+    return None, None
+
+
 def json_default(value):
     if isinstance(value, (datetime, date)):
         return value.isoformat()
@@ -159,7 +179,12 @@ def fetch_user_contact(user_id: int | None, conn):
         cur.close()
 
 
-def fetch_plan_bundle(plan_id: str, conn):
+def fetch_plan_bundle(plan_id: str, conn, selected_deliverables=None):
+    """Load a plan with its BOQ, specs, notes and files.
+
+    With `selected_deliverables` (a partial purchase) only the files of those
+    deliverables, plus free ones, are loaded, via the plan_files deliverable index.
+    """
     cur = conn.cursor(row_factory=dict_row)
     try:
         cur.execute(
@@ -199,14 +224,22 @@ def fetch_plan_bundle(plan_id: str, conn):
         cur.execute("SELECT * FROM compliance_notes WHERE plan_id = %s ORDER BY created_at ASC", (plan_id,))
         compliance_notes = [dict(row) for row in cur.fetchall()]
 
+        deliverable_keys = deliverable_keys_for_selection(
+            selected_deliverables, plan_dict.get('deliverable_prices')
+        )
+        if deliverable_keys is not None:
+            deliverable_keys = sorted(deliverable_keys)
         cur.execute(
             """
-            SELECT file_name, file_type, file_path, file_size, uploaded_at
+            SELECT file_name, file_type, file_path, file_size, uploaded_at,
+                   content_sha256, storage_backend, storage_key, storage_mtime, metadata,
+                   deliverable_key
             FROM plan_files
             WHERE plan_id = %s
+              AND (%s::text[] IS NULL OR deliverable_key = ANY(%s::text[]))
             ORDER BY uploaded_at ASC
             """,
-            (plan_id,)
+            (plan_id, deliverable_keys, deliverable_keys)
         )
         files = [dict(row) for row in cur.fetchall()]
 
@@ -259,6 +292,32 @@ def resolve_archive_path(plan_file: dict, default_folder: str = 'files') -> str:
     return f"{base_folder}/{filename}"
 
 
+def describe_file_metadata(metadata) -> str:
+    """One-line summary of extracted plan_files.metadata (pages, sheet size, CAD version, dimensions)."""
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return ''
+    if not isinstance(metadata, dict):
+        return ''
+
+    parts = []
+    pdf = metadata.get('pdf') or {}
+    if pdf.get('page_count'):
+        parts.append(f"{pdf['page_count']} page{'s' if pdf['page_count'] != 1 else ''}")
+    sizes = [size.get('name') or f"{size.get('width_mm')}x{size.get('height_mm')} mm" for size in pdf.get('page_sizes') or []]
+    if sizes:
+        parts.append(', '.join(sizes[:3]))
+    cad = metadata.get('cad') or {}
+    if cad.get('version') or cad.get('version_code'):
+        parts.append(cad.get('version') or cad['version_code'])
+    image = metadata.get('image') or {}
+    if image.get('width') and image.get('height'):
+        parts.append(f"{image['width']}x{image['height']} px")
+    return ' · '.join(parts)
+
+
 def build_manifest_pdf(bundle, organized_files, customer=None):
     raise RuntimeError('ReportLab manifest generation has been removed. Use build_manifest_pdf_html (WeasyPrint).')
 
@@ -481,7 +540,7 @@ def build_manifest_pdf_html(bundle, organized_files, customer=None):
     """
 
     file_rows = "".join(
-        f"<tr><td><span class='pill'>{esc(f.get('file_type') or '')}</span></td><td>{esc(f.get('file_name') or os.path.basename(f.get('file_path') or '') or '')}</td><td class='small muted'>{esc(f.get('archive_path') or '')}</td></tr>"
+        f"<tr><td><span class='pill'>{esc(f.get('file_type') or '')}</span></td><td>{esc(f.get('file_name') or os.path.basename(f.get('file_path') or '') or '')}</td><td class='small'>{esc(describe_file_metadata(f.get('metadata')))}</td><td class='small muted'>{esc(f.get('archive_path') or '')}</td></tr>"
         for f in files
     )
 
@@ -611,7 +670,7 @@ def build_manifest_pdf_html(bundle, organized_files, customer=None):
           <h2>Files & deliverables (full inventory)</h2>
           <div class='card'>
             {'<div class="muted">No files found.</div>' if not files else ''}
-            {'<table class="table"><thead><tr><th>Type</th><th>File</th><th>Archive path</th></tr></thead><tbody>' + file_rows + '</tbody></table>' if files else ''}
+            {'<table class="table"><thead><tr><th>Type</th><th>File</th><th>Details</th><th>Archive path</th></tr></thead><tbody>' + file_rows + '</tbody></table>' if files else ''}
           </div>
         </div>
 
@@ -655,6 +714,31 @@ def build_manifest_pdf_html(bundle, organized_files, customer=None):
         raise RuntimeError(f"Failed to generate PDF: {str(e)}")
 
 
+def _write_plan_file(zip_file, plan_file) -> str | None:
+    """Add one plan file to an open archive; returns its archive path, or None if unavailable."""
+    location_kind, location = resolve_plan_file_location(plan_file)
+    archive_path = resolve_archive_path(plan_file)
+
+    if location_kind == 'local':
+        try:
+            zip_file.write(location, archive_path)
+        except OSError:
+            return None
+        return archive_path
+
+    if location_kind == 'url':
+        try:
+            resp = http_clients.request('assets', 'GET', location, timeout=15)
+            if resp.status_code != 200:
+                return None
+            zip_file.writestr(archive_path, resp.content)
+            return archive_path
+        except Exception:
+            return None
+
+    return None
+
+
 def build_plan_zip(bundle, customer=None, selected_deliverables=None):
     zip_buffer = io.BytesIO()
     files_added = 0
@@ -668,33 +752,13 @@ def build_plan_zip(bundle, customer=None, selected_deliverables=None):
             deliverable_prices=deliverable_prices,
         )
         for plan_file in files_to_package:
-            resolved_path = resolve_plan_file_path(plan_file.get('file_path'))
-            archive_path = resolve_archive_path(plan_file)
-
-            if resolved_path and os.path.exists(resolved_path):
-                zip_file.write(resolved_path, archive_path)
-                organized_entry = dict(plan_file)
-                organized_entry['archive_path'] = archive_path
-                organized_files.append(organized_entry)
-                files_added += 1
-                continue
-
-            file_url = plan_file.get('file_path')
-            if isinstance(file_url, str) and re.match(r'^https?://', file_url, re.IGNORECASE):
-                try:
-                    resp = requests.get(file_url, timeout=15)
-                    if resp.status_code != 200:
-                        continue
-                    zip_file.writestr(archive_path, resp.content)
-                    organized_entry = dict(plan_file)
-                    organized_entry['archive_path'] = archive_path
-                    organized_files.append(organized_entry)
-                    files_added += 1
-                except Exception:
-                    continue
+            archive_path = _write_plan_file(zip_file, plan_file)
+            if archive_path is None:
                 continue
-
-            continue
+            organized_entry = dict(plan_file)
+            organized_entry['archive_path'] = archive_path
+            organized_files.append(organized_entry)
+            files_added += 1
 
         manifest_pdf = build_manifest_pdf_html(bundle, organized_files, customer=customer)
         safe_plan_name = re.sub(r"[^A-Za-z0-9]+", "-", (bundle['plan'].get('name') or 'plan')).strip('-') or 'plan'
@@ -703,3 +767,49 @@ def build_plan_zip(bundle, customer=None, selected_deliverables=None):
     zip_buffer.seek(0)
     download_name = f"{bundle['plan'].get('name') or 'plan'}-technical-files.zip"
     return zip_buffer, download_name, files_added
+
+
+def build_changes_zip(bundle, changes, since_version):
+    """Package only the files added or modified since `since_version`, plus CHANGES.json.
+
+    `changes` is the result of plans.plan_versions.diff_file_manifests.
+    """
+    zip_buffer = io.BytesIO()
+    files_added = 0
+    entries = []
+
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for change_type in ('added', 'modified'):
+            for plan_file in changes.get(change_type) or []:
+                archive_path = _write_plan_file(zip_file, plan_file)
+                if archive_path is not None:
+                    files_added += 1
+                entries.append({
+                    'change': change_type,
+                    'file_name': plan_file.get('file_name'),
+                    'file_type': plan_file.get('file_type'),
+                    'sha256': plan_file.get('content_sha256'),
+                    'archive_path': archive_path,
+                })
+        for plan_file in changes.get('removed') or []:
+            entries.append({
+                'change': 'removed',
+                'file_name': plan_file.get('file_name'),
+                'file_type': plan_file.get('file_type'),
+                'sha256': plan_file.get('content_sha256'),
+                'archive_path': None,
+            })
+
+        plan = bundle.get('plan') or {}
+        zip_file.writestr('CHANGES.json', json.dumps({
+            'plan_id': plan.get('id'),
+            'version': plan.get('version'),
+            'since_version': since_version,
+            'unchanged': len(changes.get('unchanged') or []),
+            'changes': entries,
+        }, indent=2, default=json_default))
+
+    zip_buffer.seek(0)
+    safe_plan_name = re.sub(r"[^A-Za-z0-9]+", "-", (plan.get('name') or 'plan')).strip('-') or 'plan'
+    download_name = f"{safe_plan_name}-v{since_version}-to-v{plan.get('version') or 1}-changes.zip"
+    return zip_buffer, download_name, files_added
@@ -0,0 +1,396 @@
+import os
+import time
+import smtplib
+import threading
+from contextlib import contextmanager
+from email.message import EmailMessage
+
+import psycopg
+from flask import current_app
+from psycopg.rows import dict_row
+
+from utils.background import submit_background, call_later
+
+
+OUTBOX_BATCH_SIZE = int(os.getenv('MAIL_OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('MAIL_OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE_SECONDS = int(os.getenv('MAIL_OUTBOX_RETRY_BASE_SECONDS', '60'))
+OUTBOX_RETRY_MAX_SECONDS = int(os.getenv('MAIL_OUTBOX_RETRY_MAX_SECONDS', str(6 * 3600)))
+# A row claimed by a sender that died is picked up again after this long.
+OUTBOX_LEASE_SECONDS = int(os.getenv('MAIL_OUTBOX_LEASE_SECONDS', '300'))
+# Lower bound for the retry wake-up timer, so rows leased by another sender don't spin it.
+OUTBOX_MIN_WAKE_SECONDS = 5
+SMTP_POOL_SIZE = int(os.getenv('MAIL_SMTP_POOL_SIZE', '2'))
+SMTP_IDLE_SECONDS = int(os.getenv('MAIL_SMTP_IDLE_SECONDS', '60'))
+SMTP_TIMEOUT_SECONDS = int(os.getenv('MAIL_SMTP_TIMEOUT_SECONDS', '20'))
+
+_flush_lock = threading.Lock()
+_flush_pending = False
+_wakeup = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _env_bool(name, default):
+    val = os.getenv(name)
+    if val is None:
+        return default
+    return val.strip().lower() in {'1', 'true', 'yes', 'y', 'on'}
+
+
+def smtp_settings():
+    settings = {
+        'server': os.getenv('MAIL_SERVER'),
+        'port': int(os.getenv('MAIL_PORT', '587')),
+        'username': os.getenv('MAIL_USERNAME'),
+        'password': os.getenv('MAIL_PASSWORD'),
+        'sender': os.getenv('MAIL_DEFAULT_SENDER') or os.getenv('MAIL_USERNAME'),
+        'use_tls': _env_bool('MAIL_USE_TLS', True),
+        'use_ssl': _env_bool('MAIL_USE_SSL', False),
+    }
+    if not settings['server'] or not settings['username'] or not settings['password'] or not settings['sender']:
+        raise RuntimeError("SMTP env vars not configured (MAIL_SERVER, MAIL_USERNAME, MAIL_PASSWORD, MAIL_DEFAULT_SENDER)")
+    return settings
+
+
+def build_message(sender, to_email, subject, html_body):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    msg.set_content("This email requires an HTML-capable client.")
+    msg.add_alternative(html_body, subtype="html")
+    return msg
+
+
+class SmtpConnectionPool:
+    """Keeps a few authenticated SMTP sessions open between sends.
+
+    A connection is returned to the pool only after a successful send, so one
+    that hit an error is always discarded. Idle connections are checked with
+    NOOP before reuse, since servers drop quiet sessions.
+    """
+
+    def __init__(self, settings, size=SMTP_POOL_SIZE, idle_seconds=SMTP_IDLE_SECONDS):
+        self.settings = settings
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+    def _connect(self):
+        s = self.settings
+        if s['use_ssl']:
+            server = smtplib.SMTP_SSL(s['server'], s['port'], timeout=SMTP_TIMEOUT_SECONDS)
+        else:
+            server = smtplib.SMTP(s['server'], s['port'], timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            if s['use_tls'] and not s['use_ssl']:
+                server.starttls()
+            server.login(s['username'], s['password'])
+        except Exception:
+            _close_quietly(server)
+            raise
+        self.connections_opened += 1
+        return server
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, released_at = self._idle.pop()
+            if time.monotonic() - released_at <= self.idle_seconds:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            _close_quietly(server)
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        server = self._checkout()
+        try:
+            yield server
+        except BaseException:
+            _close_quietly(server)
+            raise
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, time.monotonic()))
+                server = None
+        if server is not None:
+            _close_quietly(server)
+
+    def send(self, msg):
+        with self.connection() as server:
+            server.send_message(msg)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _close_quietly(server)
+
+
+def _close_quietly(server):
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def get_smtp_pool():
+    """Process-wide pool, rebuilt if the MAIL_* settings change."""
+    global _pool
+    settings = smtp_settings()
+    with _pool_lock:
+        if _pool is None or _pool.settings != settings:
+            if _pool is not None:
+                _pool.close()
+            _pool = SmtpConnectionPool(settings)
+        return _pool
+
+
+def enqueue_email(cur, to_email, subject, html_body, kind='generic', purchase_id=None):
+    """Add a message to the outbox in the caller's transaction.
+
+    Nothing is sent until the transaction commits and a flush runs; call
+    schedule_outbox_flush() after the commit.
+    """
+    cur.execute(
+        """
+        INSERT INTO email_outbox (to_email, subject, html_body, kind, purchase_id)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id
+        """,
+        (to_email, subject, html_body, kind, purchase_id)
+    )
+    row = cur.fetchone()
+    return row['id'] if isinstance(row, dict) else row[0]
+
+
+def retry_delay(attempts):
+    """Exponential backoff: base, 2x base, 4x base, ... capped at the maximum."""
+    return min(OUTBOX_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), OUTBOX_RETRY_MAX_SECONDS)
+
+
+def _is_permanent(error):
+    """The server rejected this message itself (not our login or connection); retrying won't help."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPDataError) and 500 <= error.smtp_code < 600
+
+
+def claim_batch(conn, limit):
+    """Lease up to `limit` due messages to this sender; SKIP LOCKED lets several senders run side by side."""
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sending', attempts = attempts + 1,
+                locked_until = NOW() + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                   OR (status = 'sending' AND locked_until < NOW())
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, to_email, subject, html_body, kind, purchase_id, attempts
+            """,
+            (OUTBOX_LEASE_SECONDS, limit)
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        return sorted(rows, key=lambda r: r['id'])
+    finally:
+        cur.close()
+
+
+def _record_result(cur, row, error):
+    if error is None:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = NOW(), locked_until = NULL, last_error = NULL
+            WHERE id = %s
+            """,
+            (row['id'],)
+        )
+        if row.get('kind') == 'download_link' and row.get('purchase_id'):
+            cur.execute(
+                "UPDATE purchases SET confirmation_email_sent_at = NOW() WHERE id = %s",
+                (row['purchase_id'],)
+            )
+        return 'sent'
+
+    if _is_permanent(error) or row['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'dead', locked_until = NULL, last_error = %s
+            WHERE id = %s
+            """,
+            (str(error)[:1000], row['id'])
+        )
+        return 'dead'
+
+    cur.execute(
+        """
+        UPDATE email_outbox
+        SET status = 'pending', locked_until = NULL, last_error = %s,
+            next_attempt_at = NOW() + make_interval(secs => %s)
+        WHERE id = %s
+        """,
+        (str(error)[:1000], retry_delay(row['attempts']), row['id'])
+    )
+    return 'retry'
+
+
+def next_due_in(conn):
+    """Seconds until the earliest unsent message can be claimed again, or None if there are none."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT EXTRACT(EPOCH FROM MIN(
+                CASE WHEN status = 'sending' THEN locked_until ELSE next_attempt_at END
+            ) - NOW())
+            FROM email_outbox
+            WHERE status IN ('pending', 'sending')
+            """
+        )
+        row = cur.fetchone()
+        conn.commit()
+        if not row or row[0] is None:
+            return None
+        return max(float(row[0]), 0.0)
+    finally:
+        cur.close()
+
+
+def flush_outbox(conn, batch_size=None, pool=None, max_batches=None, log=None):
+    """Send due outbox messages in batches over pooled SMTP connections.
+
+    Each result is committed as soon as it is known, so a crash mid-batch
+    resends at most the message in flight. Returns counts by outcome.
+    """
+    batch_size = batch_size or OUTBOX_BATCH_SIZE
+    stats = {'sent': 0, 'retry': 0, 'dead': 0}
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        rows = claim_batch(conn, batch_size)
+        if not rows:
+            break
+        batches += 1
+
+        config_error = None
+        try:
+            pool = pool or get_smtp_pool()
+            sender = pool.settings['sender']
+        except Exception as e:
+            # Not configured: hand the batch back for a later attempt.
+            pool, sender, config_error = None, None, e
+
+        cur = conn.cursor()
+        try:
+            for row in rows:
+                error = config_error
+                if pool is not None:
+                    try:
+                        pool.send(build_message(sender, row['to_email'], row['subject'], row['html_body']))
+                    except Exception as e:
+                        error = e
+                if error is not None and log:
+                    log(f"Email {row['id']} to {row['to_email']} failed (attempt {row['attempts']}): {error}")
+                stats[_record_result(cur, row, error)] += 1
+                conn.commit()
+        finally:
+            cur.close()
+
+        if pool is None or len(rows) < batch_size:
+            break
+    return stats
+
+
+def _arm_wakeup(delay):
+    """Flush again after `delay` seconds, replacing any earlier wake-up."""
+    global _wakeup
+    with _flush_lock:
+        if _wakeup is not None:
+            _wakeup.cancel()
+            _wakeup = None
+        if delay is not None:
+            _wakeup = call_later(max(delay, OUTBOX_MIN_WAKE_SECONDS), schedule_outbox_flush)
+
+
+def _flush_outbox_task():
+    global _flush_pending
+    with _flush_lock:
+        _flush_pending = False
+    with psycopg.connect(current_app.config['DATABASE_URL'], connect_timeout=5) as conn:
+        stats = flush_outbox(conn, log=current_app.logger.warning)
+        delay = next_due_in(conn)
+    if stats['retry'] or stats['dead']:
+        current_app.logger.warning(
+            f"Email outbox: {stats['sent']} sent, {stats['retry']} will retry, {stats['dead']} gave up"
+        )
+    _arm_wakeup(delay)
+
+
+def schedule_outbox_flush():
+    """Ask the background pool to drain the outbox (call after committing enqueued mail).
+
+    Requests made while a flush is already queued are folded into it. Each
+    flush sets a timer for the next retry that falls due; `manage.py
+    email-outbox` runs on a systemd timer for retries that outlive the process.
+    """
+    global _flush_pending
+    with _flush_lock:
+        if _flush_pending:
+            return None
+        _flush_pending = True
+    future = submit_background(_flush_outbox_task)
+    if future is None:
+        with _flush_lock:
+            _flush_pending = False
+    return future
+
+
+def requeue_dead(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'pending', attempts = 0, next_attempt_at = NOW(), last_error = NULL
+            WHERE status = 'dead'
+            """
+        )
+        count = cur.rowcount
+        conn.commit()
+        return count
+    finally:
+        cur.close()
+
+
+def outbox_counts(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status ORDER BY status")
+        return {status: count for status, count in cur.fetchall()}
+    finally:
+        cur.close()
@@ -0,0 +1,147 @@
+"""
+In-memory stand-ins for psycopg connections, shared by the colocated tests.
+
+There is no database in the test environment. A FakeConnection records every
+statement and hands back rows either from a script (one entry per fetch, in
+order) or from a `respond(sql, params)` callable. Statements are stored with
+their whitespace collapsed, so tests can assert on the SQL contract that
+matters (locks, ordering clauses, conflict targets) without depending on
+layout.
+"""
+import psycopg
+
+
+def normalize_sql(sql):
+    return ' '.join(str(sql).split())
+
+
+class FakeCopy:
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_types(self, types):
+        self.conn.copy_types[self.table] = types
+
+    def write_row(self, row):
+        self.conn.copied.setdefault(self.table, []).append(row)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self.conn._check_open()
+        sql = normalize_sql(sql)
+        self.conn.executed.append((sql, params))
+        self.conn.events.append(('sql', sql, params))
+        self._rows = self.conn.respond(sql, params) if self.conn.respond else None
+        if isinstance(self._rows, list):
+            self.rowcount = len(self._rows)
+        return self
+
+    def executemany(self, sql, rows):
+        self.conn._check_open()
+        rows = list(rows)
+        sql = normalize_sql(sql)
+        self.conn.executed_many.append((sql, rows))
+        self.conn.events.append(('sql_many', sql, rows))
+
+    def _next(self):
+        if self.conn.respond:
+            rows, self._rows = self._rows, None
+            return rows
+        return self.conn.results.pop(0) if self.conn.results else None
+
+    def fetchone(self):
+        rows = self._next()
+        if isinstance(rows, list):
+            return rows[0] if rows else None
+        return rows
+
+    def fetchall(self):
+        rows = self._next()
+        if rows is None:
+            return []
+        return rows if isinstance(rows, list) else [rows]
+
+    def copy(self, statement):
+        self.conn._check_open()
+        statement = normalize_sql(statement)
+        self.conn.executed.append((statement, None))
+        return FakeCopy(self.conn, statement.split()[1])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    """A psycopg connection double.
+
+    `results` is consumed one entry per fetchone()/fetchall(): a row (or None)
+    for fetchone, a list of rows for fetchall. With `respond`, each execute
+    asks respond(sql, params) for its rows instead.
+    """
+
+    def __init__(self, results=None, respond=None):
+        self.results = list(results or [])
+        self.respond = respond
+        self.executed = []
+        self.executed_many = []
+        self.events = []
+        self.copied = {}
+        self.copy_types = {}
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def _check_open(self):
+        if self.closed:
+            raise psycopg.OperationalError('the connection is closed')
+
+    def cursor(self, *args, **kwargs):
+        self._check_open()
+        return FakeCursor(self)
+
+    def execute(self, sql, params=None):
+        return self.cursor().execute(sql, params)
+
+    def commit(self):
+        self._check_open()
+        self.commits += 1
+        self.events.append(('commit',))
+
+    def rollback(self):
+        self._check_open()
+        self.rollbacks += 1
+        self.events.append(('rollback',))
+
+    def close(self):
+        self.closed = True
+
+    @property
+    def committed(self):
+        return self.commits > 0
+
+    @property
+    def rolled_back(self):
+        return self.rollbacks > 0
+
+    def statements(self, fragment=''):
+        """Executed SQL containing `fragment`, in order."""
+        return [sql for sql, _ in self.executed if fragment in sql]
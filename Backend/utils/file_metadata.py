@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import tempfile
+from datetime import datetime
+
+import psycopg
+from flask import current_app
+from psycopg.rows import dict_row
+
+from utils import http_clients
+from utils.background import submit_background
+from utils.download_helpers import resolve_plan_file_location
+from utils.upload_store import hash_file
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional; the byte scanner below covers simple PDFs
+    PdfReader = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# Bump when the extracted fields change so `manage.py file-metadata --force` is worth re-running.
+METADATA_VERSION = 1
+REMOTE_FETCH_MAX_BYTES = int(os.getenv('FILE_METADATA_REMOTE_MAX_BYTES', str(200 * 1024 * 1024)))
+_HEADER_SCAN_BYTES = 256 * 1024
+# The PDF scanner reads this much from each end; the page tree and trailer live there.
+_PDF_SCAN_WINDOW_BYTES = int(os.getenv('FILE_METADATA_PDF_SCAN_WINDOW_BYTES', str(4 * 1024 * 1024)))
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+# Drawing-sheet sizes in millimetres (short side, long side).
+PAPER_SIZES = {
+    'A0': (841, 1189),
+    'A1': (594, 841),
+    'A2': (420, 594),
+    'A3': (297, 420),
+    'A4': (210, 297),
+    'Letter': (216, 279),
+    'Tabloid': (279, 432),
+    'ARCH D': (610, 914),
+    'ARCH E': (914, 1219),
+}
+
+ACAD_VERSIONS = {
+    'AC1009': 'AutoCAD R11/R12',
+    'AC1012': 'AutoCAD R13',
+    'AC1014': 'AutoCAD R14',
+    'AC1015': 'AutoCAD 2000',
+    'AC1018': 'AutoCAD 2004',
+    'AC1021': 'AutoCAD 2007',
+    'AC1024': 'AutoCAD 2010',
+    'AC1027': 'AutoCAD 2013',
+    'AC1032': 'AutoCAD 2018',
+}
+
+_POINTS_PER_MM = 72 / 25.4
+_MEDIABOX_RE = re.compile(rb'/MediaBox\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]')
+_PAGE_OBJECT_RE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+_PAGES_COUNT_RE = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b', re.S)
+_DXF_ASCII_VERSION_RE = re.compile(r'\$ACADVER\s*\r?\n\s*1\s*\r?\n\s*(AC\d{4})')
+_DXF_BINARY_VERSION_RE = re.compile(rb'\$ACADVER\x00.{1,2}?(AC\d{4})', re.S)
+
+
+def paper_size_name(width_mm, height_mm, tolerance=0.02):
+    short_side, long_side = sorted((width_mm, height_mm))
+    for name, (short_ref, long_ref) in PAPER_SIZES.items():
+        if abs(short_side - short_ref) <= short_ref * tolerance and abs(long_side - long_ref) <= long_ref * tolerance:
+            return name
+    return None
+
+
+def _summarize_page_sizes(sizes_pt):
+    """Group page sizes (in points) into [{width_mm, height_mm, name, orientation, pages}]."""
+    groups = {}
+    for width_pt, height_pt in sizes_pt:
+        width_mm = round(abs(width_pt) / _POINTS_PER_MM)
+        height_mm = round(abs(height_pt) / _POINTS_PER_MM)
+        groups[(width_mm, height_mm)] = groups.get((width_mm, height_mm), 0) + 1
+    return [
+        {
+            'width_mm': width_mm,
+            'height_mm': height_mm,
+            'name': paper_size_name(width_mm, height_mm),
+            'orientation': 'landscape' if width_mm > height_mm else 'portrait',
+            'pages': pages,
+        }
+        for (width_mm, height_mm), pages in sorted(groups.items(), key=lambda item: -item[1])
+    ]
+
+
+def _pdf_metadata_pypdf(path):
+    reader = PdfReader(path)
+    sizes = []
+    for page in reader.pages:
+        box = page.mediabox
+        width, height = float(box.width), float(box.height)
+        if (page.get('/Rotate') or 0) % 180:
+            width, height = height, width
+        sizes.append((width, height))
+    return {'page_count': len(sizes), 'page_sizes': _summarize_page_sizes(sizes), 'parser': 'pypdf'}
+
+
+def _read_pdf_windows(path):
+    """Return (data, complete): the whole file if small, else its head and tail windows."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        if size <= 2 * _PDF_SCAN_WINDOW_BYTES:
+            return handle.read(), True
+        head = handle.read(_PDF_SCAN_WINDOW_BYTES)
+        handle.seek(-_PDF_SCAN_WINDOW_BYTES, os.SEEK_END)
+        tail = handle.read()
+    # The newline keeps a pattern from matching across the gap.
+    return head + b'\n' + tail, False
+
+
+def _pdf_metadata_scan(path):
+    """Best-effort scan of uncompressed PDF structure when pypdf is unavailable or fails.
+
+    Large files are only scanned at both ends, so page sizes come from the
+    pages found there; the page count is left unknown unless the page tree
+    reports it.
+    """
+    data, complete = _read_pdf_windows(path)
+    counts = [int(a or b) for a, b in _PAGES_COUNT_RE.findall(data)]
+    if counts:
+        page_count = max(counts)
+    else:
+        page_count = len(_PAGE_OBJECT_RE.findall(data)) if complete else None
+    sizes = [
+        (float(x1) - float(x0), float(y1) - float(y0))
+        for x0, y0, x1, y1 in _MEDIABOX_RE.findall(data)
+    ]
+    return {
+        'page_count': page_count or None,
+        'page_sizes': _summarize_page_sizes(sizes[:page_count] if page_count else sizes),
+        'parser': 'scan',
+    }
+
+
+def _pdf_metadata(path):
+    if PdfReader is not None:
+        try:
+            return _pdf_metadata_pypdf(path)
+        except Exception:
+            # Damaged xref tables etc.; the scanner is more forgiving.
+            pass
+    return _pdf_metadata_scan(path)
+
+
+def _cad_version(code):
+    return {'version_code': code, 'version': ACAD_VERSIONS.get(code)} if code else {'version_code': None, 'version': None}
+
+
+def _dxf_metadata(path):
+    with open(path, 'rb') as handle:
+        head = handle.read(_HEADER_SCAN_BYTES)
+    if head.startswith(b'AutoCAD Binary DXF'):
+        match = _DXF_BINARY_VERSION_RE.search(head)
+        return dict(_cad_version(match.group(1).decode() if match else None), encoding='binary')
+    match = _DXF_ASCII_VERSION_RE.search(head.decode('latin-1'))
+    return dict(_cad_version(match.group(1) if match else None), encoding='ascii')
+
+
+def _dwg_metadata(path):
+    with open(path, 'rb') as handle:
+        magic = handle.read(6)
+    code = magic.decode('ascii', 'replace')
+    return _cad_version(code if re.fullmatch(r'AC\d{4}', code) else None)
+
+
+def _image_metadata(path):
+    if Image is None:
+        return None
+    with Image.open(path) as image:
+        return {'width': image.width, 'height': image.height, 'format': image.format, 'mode': image.mode}
+
+
+def extract_file_metadata(path, file_name=None, sha256=None):
+    """Inspect one file on disk and return its metadata document.
+
+    Pass `sha256` when the checksum is already known to skip re-hashing the file.
+    """
+    extension = os.path.splitext(file_name or path)[1].lower()
+    if sha256:
+        size = os.path.getsize(path)
+    else:
+        sha256, size = hash_file(path)
+    metadata = {
+        'version': METADATA_VERSION,
+        'extracted_at': datetime.utcnow().isoformat() + 'Z',
+        'sha256': sha256,
+        'size_bytes': size,
+        'kind': 'other',
+    }
+
+    try:
+        if extension == '.pdf':
+            metadata['kind'] = 'pdf'
+            metadata['pdf'] = _pdf_metadata(path)
+        elif extension == '.dxf':
+            metadata['kind'] = 'cad'
+            metadata['cad'] = dict(_dxf_metadata(path), format='DXF')
+        elif extension == '.dwg':
+            metadata['kind'] = 'cad'
+            metadata['cad'] = dict(_dwg_metadata(path), format='DWG')
+        elif extension in IMAGE_EXTENSIONS:
+            metadata['kind'] = 'image'
+            metadata['image'] = _image_metadata(path)
+    except Exception as exc:
+        # Keep the checksum and size even when the format parser chokes.
+        metadata['error'] = f"{type(exc).__name__}: {exc}"
+
+    return metadata
+
+
+def fetch_remote_file(url):
+    """Download a remote plan file to a temp path (caller removes it), capped at REMOTE_FETCH_MAX_BYTES."""
+    response = http_clients.request('assets', 'GET', url, stream=True)
+    response.raise_for_status()
+    handle = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        received = 0
+        for chunk in response.iter_content(1024 * 1024):
+            received += len(chunk)
+            if received > REMOTE_FETCH_MAX_BYTES:
+                raise ValueError(f"remote file exceeds {REMOTE_FETCH_MAX_BYTES} bytes")
+            handle.write(chunk)
+        handle.close()
+        return handle.name
+    except Exception:
+        handle.close()
+        os.remove(handle.name)
+        raise
+    finally:
+        response.close()
+
+
+def metadata_for_plan_file(plan_file):
+    location_kind, location = resolve_plan_file_location(plan_file)
+    sha256 = (plan_file.get('content_sha256') or '').strip() or None
+    if location_kind == 'local':
+        return extract_file_metadata(location, plan_file.get('file_name'), sha256=sha256)
+    if location_kind == 'url':
+        path = fetch_remote_file(location)
+        try:
+            return extract_file_metadata(
+                path, plan_file.get('file_name') or location.split('?', 1)[0], sha256=sha256
+            )
+        finally:
+            os.remove(path)
+    return None
+
+
+def extract_plan_file_metadata(conn, plan_id=None, force=False, batch_size=100, log=None):
+    """Fill plan_files.metadata for rows that have none (or all rows with force).
+
+    Safe to re-run; rows are processed in id order and committed per batch.
+    """
+    cur = conn.cursor(row_factory=dict_row)
+    processed = 0
+    failed = 0
+    last_id = None
+    try:
+        while True:
+            cur.execute(
+                """
+                SELECT id, file_name, file_type, file_path, content_sha256,
+                       storage_backend, storage_key, storage_mtime
+                FROM plan_files
+                WHERE (%s::uuid IS NULL OR plan_id = %s::uuid)
+                  AND (%s OR metadata IS NULL)
+                  AND (%s::uuid IS NULL OR id > %s::uuid)
+                ORDER BY id
+                LIMIT %s
+                """,
+                (plan_id, plan_id, force, last_id, last_id, batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            for row in rows:
+                try:
+                    metadata = metadata_for_plan_file(row)
+                    if metadata is None:
+                        raise FileNotFoundError(row['file_path'])
+                except Exception as exc:
+                    failed += 1
+                    metadata = {
+                        'version': METADATA_VERSION,
+                        'extracted_at': datetime.utcnow().isoformat() + 'Z',
+                        'error': f"{type(exc).__name__}: {exc}",
+                    }
+                    if log:
+                        log(f"plan_file {row['id']}: {metadata['error']}")
+
+                cur.execute(
+                    """
+                    UPDATE plan_files
+                    SET metadata = %s,
+                        content_sha256 = COALESCE(content_sha256, %s)
+                    WHERE id = %s
+                    """,
+                    (json.dumps(metadata), metadata.get('sha256'), row['id'])
+                )
+                processed += 1
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {'processed': processed, 'failed': failed}
+
+
+def _extract_plan_file_metadata_task(plan_id):
+    with psycopg.connect(current_app.config['DATABASE_URL'], connect_timeout=5) as conn:
+        result = extract_plan_file_metadata(conn, plan_id, log=current_app.logger.warning)
+    current_app.logger.info(
+        f"Extracted metadata for {result['processed']} file(s) of plan {plan_id} ({result['failed']} failed)"
+    )
+
+
+def schedule_plan_file_metadata(plan_id):
+    """Queue metadata extraction for a plan's technical files after the upload commits."""
+    return submit_background(_extract_plan_file_metadata_task, str(plan_id))
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import uuid
+import mimetypes
+from urllib.parse import quote
+
+from flask import current_app, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.abspath(os.path.join(_HERE, '..', '..'))
+UPLOAD_ROOT = os.path.join(_PROJECT_ROOT, 'uploads')
+
+# send_file (default, local dev) | x-accel-redirect (nginx) | x-sendfile (apache/lighttpd)
+FILE_SERVING_BACKEND = (os.getenv('FILE_SERVING_BACKEND') or 'send_file').strip().lower()
+# nginx `internal` location that aliases UPLOAD_ROOT.
+X_ACCEL_REDIRECT_PREFIX = '/' + (os.getenv('X_ACCEL_REDIRECT_PREFIX') or '/protected-uploads/').strip('/') + '/'
+UPLOADS_CACHE_MAX_AGE_SECONDS = int(os.getenv('UPLOADS_CACHE_MAX_AGE_SECONDS', '31536000'))
+UPLOADS_MUTABLE_MAX_AGE_SECONDS = int(os.getenv('UPLOADS_MUTABLE_MAX_AGE_SECONDS', '300'))
+
+# Generated packages (ZIPs) are spooled here when a proxy backend is enabled so
+# nginx can stream them; stale spool files are pruned on the next write.
+PACKAGE_SPOOL_DIR = os.path.join(UPLOAD_ROOT, '.packages')
+PACKAGE_SPOOL_TTL_SECONDS = int(os.getenv('PACKAGE_SPOOL_TTL_SECONDS', '3600'))
+
+_UUID_NAME_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE)
+_BLOB_NAME_RE = re.compile(r'^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$')
+
+
+def _offload_backend():
+    if FILE_SERVING_BACKEND in ('x-accel-redirect', 'x-accel', 'nginx'):
+        return 'x-accel-redirect'
+    if FILE_SERVING_BACKEND in ('x-sendfile', 'sendfile'):
+        return 'x-sendfile'
+    return None
+
+
+def blob_sha256_for_path(relative_path):
+    """Return the SHA-256 of a content-addressed blob path, or None."""
+    match = _BLOB_NAME_RE.match(os.path.basename(relative_path or ''))
+    return match.group(1) if match else None
+
+
+def is_immutable_upload(relative_path):
+    """Uploaded files are written once under unique names and never rewritten."""
+    if blob_sha256_for_path(relative_path):
+        return True
+    # Image derivatives live under derivatives/<aa>/<sha256>/.
+    if re.search(r'(^|/)[0-9a-f]{64}/', relative_path or ''):
+        return True
+    return bool(_UUID_NAME_RE.search(os.path.basename(relative_path or '')))
+
+
+def _content_disposition(download_name, as_attachment):
+    kind = 'attachment' if as_attachment else 'inline'
+    try:
+        download_name.encode('ascii')
+        return f'{kind}; filename="{download_name}"'
+    except UnicodeEncodeError:
+        fallback = download_name.encode('ascii', 'ignore').decode('ascii') or 'download'
+        return f"{kind}; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name)}"
+
+
+def _offloaded_response(absolute_path, mimetype=None, as_attachment=False, download_name=None):
+    """Build an empty response that tells the proxy which file to stream."""
+    backend = _offload_backend()
+    mimetype = mimetype or mimetypes.guess_type(download_name or absolute_path)[0] or 'application/octet-stream'
+    response = current_app.response_class(mimetype=mimetype)
+
+    if backend == 'x-accel-redirect':
+        relative = os.path.relpath(absolute_path, UPLOAD_ROOT).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = absolute_path
+
+    if as_attachment or download_name:
+        response.headers['Content-Disposition'] = _content_disposition(
+            download_name or os.path.basename(absolute_path), as_attachment
+        )
+    return response
+
+
+def _apply_cache_headers(response, immutable):
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={UPLOADS_CACHE_MAX_AGE_SECONDS}, immutable'
+    else:
+        response.headers['Cache-Control'] = f'public, max-age={UPLOADS_MUTABLE_MAX_AGE_SECONDS}'
+    return response
+
+
+def serve_upload(relative_path):
+    """Serve a file below UPLOAD_ROOT, offloading the transfer when configured."""
+    absolute_path = safe_join(UPLOAD_ROOT, relative_path)
+    # Dot-directories (spooled packages, staging areas) are never public.
+    if absolute_path is None or any(part.startswith('.') for part in relative_path.split('/')):
+        raise NotFound()
+
+    immutable = is_immutable_upload(relative_path)
+    # Blob names are their SHA-256, which doubles as a strong validator for clients.
+    content_hash = blob_sha256_for_path(relative_path)
+
+    if _offload_backend():
+        # nginx answers 404 itself for missing files, so skip the stat here.
+        response = _offloaded_response(absolute_path)
+    else:
+        if not os.path.isfile(absolute_path):
+            raise NotFound()
+        response = send_file(
+            absolute_path,
+            max_age=UPLOADS_CACHE_MAX_AGE_SECONDS if immutable else UPLOADS_MUTABLE_MAX_AGE_SECONDS,
+            etag=content_hash or True,
+        )
+
+    if content_hash:
+        response.headers['X-Content-SHA256'] = content_hash
+
+    return _apply_cache_headers(response, immutable)
+
+
+def _prune_package_spool():
+    cutoff = time.time() - PACKAGE_SPOOL_TTL_SECONDS
+    try:
+        entries = os.listdir(PACKAGE_SPOOL_DIR)
+    except FileNotFoundError:
+        return
+    for name in entries:
+        path = os.path.join(PACKAGE_SPOOL_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def send_package(buffer, download_name, mimetype='application/zip'):
+    """Send a generated in-memory package (ZIP/PDF) as a non-cacheable attachment.
+
+    With a proxy backend the package is spooled to disk first so the worker is
+    released as soon as the file is written instead of after the client has
+    downloaded every byte.
+    """
+    buffer.seek(0)
+
+    if _offload_backend():
+        os.makedirs(PACKAGE_SPOOL_DIR, exist_ok=True)
+        _prune_package_spool()
+        extension = os.path.splitext(download_name or '')[1] or '.bin'
+        spool_path = os.path.join(PACKAGE_SPOOL_DIR, f"{uuid.uuid4()}{extension}")
+        with open(spool_path, 'wb') as handle:
+            while True:
+                chunk = buffer.read(1024 * 1024)
+                if not chunk:
+                    break
+                handle.write(chunk)
+        response = _offloaded_response(
+            spool_path, mimetype=mimetype, as_attachment=True, download_name=download_name
+        )
+    else:
+        response = send_file(
+            buffer,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+        )
+
+    response.headers['Cache-Control'] = 'no-store'
+    return response
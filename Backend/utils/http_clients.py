@@ -0,0 +1,183 @@
+"""
+Pooled HTTP sessions for the services the backend calls out to.
+
+Each upstream (Paystack, the LLM server, the asset CDN / remote plan files)
+gets one requests.Session per worker process. Its connection pool keeps
+TCP+TLS connections alive between calls, and its own timeouts and retry
+policy apply to every request. Call request() rather than module-level
+requests.get/post: it fills in the upstream's timeout and records per-upstream
+latency, status and error counts (see http_client_metrics()).
+
+Retries cover connection failures for any method, since nothing was sent.
+Read errors and 502/503/504 answers are retried only for idempotent methods,
+so a Paystack initialize POST is never sent twice.
+"""
+import os
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.metrics import LatencyHistogram
+
+
+HTTP_RETRY_BACKOFF_SECONDS = float(os.getenv('HTTP_RETRY_BACKOFF_SECONDS', '0.3'))
+
+_DEFAULTS = {
+    'paystack': {'pool_size': 10, 'connect_timeout': 5, 'read_timeout': 10, 'retries': 2},
+    'llm': {'pool_size': 4, 'connect_timeout': 3, 'read_timeout': 12, 'retries': 0},
+    'assets': {'pool_size': 8, 'connect_timeout': 5, 'read_timeout': 30, 'retries': 2},
+}
+
+_RETRY_STATUSES = (502, 503, 504)
+_LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def _setting(upstream, key, default):
+    cast = float if key.endswith('timeout') else int
+    return cast(os.getenv(f"HTTP_{upstream.upper()}_{key.upper()}", default))
+
+
+UPSTREAMS = {
+    name: {key: _setting(name, key, value) for key, value in settings.items()}
+    for name, settings in _DEFAULTS.items()
+}
+
+
+class _UpstreamStats:
+    def __init__(self):
+        self.latency = LatencyHistogram(buckets_ms=_LATENCY_BUCKETS_MS)
+        self.statuses = {}
+        self.errors = {}
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def response(self, status_code, retries):
+        key = f"{status_code // 100}xx"
+        with self._lock:
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            self.retries += retries
+
+    def error(self, kind):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = {'statuses': dict(self.statuses), 'errors': dict(self.errors), 'retries': self.retries}
+        return dict(counts, latency=self.latency.snapshot())
+
+
+_sessions = {}  # upstream -> (pid, session)
+_stats = {name: _UpstreamStats() for name in UPSTREAMS}
+_lock = threading.Lock()
+
+
+def _build_session(upstream):
+    settings = UPSTREAMS[upstream]
+    retry = Retry(
+        total=settings['retries'],
+        connect=settings['retries'],
+        read=settings['retries'],
+        status=settings['retries'],
+        status_forcelist=_RETRY_STATUSES,
+        backoff_factor=HTTP_RETRY_BACKOFF_SECONDS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=settings['pool_size'],
+        pool_block=False,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(upstream):
+    """The pooled session for `upstream`, built on first use in this process."""
+    if upstream not in UPSTREAMS:
+        raise KeyError(f"unknown upstream {upstream!r}")
+    pid = os.getpid()
+    with _lock:
+        entry = _sessions.get(upstream)
+        # Sockets inherited across a fork belong to the parent; start afresh.
+        if entry is None or entry[0] != pid:
+            entry = (pid, _build_session(upstream))
+            _sessions[upstream] = entry
+        return entry[1]
+
+
+def request(upstream, method, url, **kwargs):
+    """Send a request through `upstream`'s session, recording latency and outcome.
+
+    Takes the same keyword arguments as requests.request; `timeout` defaults to
+    the upstream's (connect, read) pair. Responses opened with stream=True must
+    be closed by the caller so the connection goes back to the pool.
+    """
+    settings = UPSTREAMS[upstream]
+    kwargs.setdefault('timeout', (settings['connect_timeout'], settings['read_timeout']))
+    stats = _stats[upstream]
+    started = time.perf_counter()
+    try:
+        resp = get_session(upstream).request(method, url, **kwargs)
+    except requests.Timeout:
+        stats.error('timeout')
+        raise
+    except requests.ConnectionError:
+        stats.error('connection')
+        raise
+    except requests.RequestException:
+        stats.error('other')
+        raise
+    finally:
+        stats.latency.observe(time.perf_counter() - started)
+
+    history = getattr(getattr(resp.raw, 'retries', None), 'history', None) or ()
+    stats.response(resp.status_code, len(history))
+    return resp
+
+
+def _pool_counts(session):
+    opened = served = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                served += pool.num_requests
+    return opened, served
+
+
+def http_client_metrics():
+    """Per-upstream counters for this worker process.
+
+    `connections_opened` staying well below `requests_sent` means keep-alive
+    is doing its job.
+    """
+    pid = os.getpid()
+    with _lock:
+        sessions = {name: entry[1] for name, entry in _sessions.items() if entry[0] == pid}
+    metrics = {}
+    for name, settings in UPSTREAMS.items():
+        snapshot = _stats[name].snapshot()
+        opened, served = _pool_counts(sessions[name]) if name in sessions else (0, 0)
+        metrics[name] = dict(snapshot, settings=dict(settings), connections_opened=opened, requests_sent=served)
+    return metrics
+
+
+def reset_http_clients():
+    """Close every session and zero the counters."""
+    with _lock:
+        sessions = [entry[1] for entry in _sessions.values()]
+        _sessions.clear()
+        for name in UPSTREAMS:
+            _stats[name] = _UpstreamStats()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,227 @@
+import os
+import io
+import re
+import json
+import base64
+
+import psycopg
+import requests
+from flask import current_app
+from psycopg.rows import dict_row
+
+from utils import http_clients
+from utils.background import submit_background
+from utils.upload_store import UPLOAD_ROOT, hash_file
+
+try:
+    from PIL import Image, ImageFilter, ImageOps, features
+    _AVIF_SUPPORTED = features.check('avif')
+except ImportError:  # Pillow ships with WeasyPrint, but keep uploads working without it
+    Image = None
+    _AVIF_SUPPORTED = False
+
+
+DERIVATIVE_WIDTHS = tuple(
+    int(w) for w in os.getenv('IMAGE_DERIVATIVE_WIDTHS', '320,640,1024,1600').split(',') if w.strip()
+)
+DERIVATIVE_QUALITY = {'webp': 78, 'avif': 55}
+PLACEHOLDER_WIDTH = 16
+DERIVATIVE_FOLDER = os.path.join(UPLOAD_ROOT, 'derivatives')
+
+_CLOUDINARY_UPLOAD_RE = re.compile(r'^(https?://res\.cloudinary\.com/[^/]+/image/upload/)(.+)$', re.IGNORECASE)
+
+
+def _derivative_formats():
+    return ('webp', 'avif') if _AVIF_SUPPORTED else ('webp',)
+
+
+def _local_source_path(source):
+    """Map an image reference to a file under UPLOAD_ROOT, or None for remote/unknown sources."""
+    if not isinstance(source, str) or not source:
+        return None
+    if source.startswith('/uploads/'):
+        path = os.path.join(UPLOAD_ROOT, source[len('/uploads/'):])
+    elif os.path.isabs(source):
+        path = source
+    else:
+        return None
+    path = os.path.abspath(path)
+    return path if path.startswith(UPLOAD_ROOT + os.sep) else None
+
+
+def _placeholder_data_uri(image):
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'WEBP', quality=30)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _local_derivatives(absolute_path):
+    if Image is None:
+        return None
+
+    sha256, _ = hash_file(absolute_path)
+    relative_dir = f"derivatives/{sha256[:2]}/{sha256}"
+    out_dir = os.path.join(UPLOAD_ROOT, relative_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with Image.open(absolute_path) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        width, height = image.size
+
+        variants = {fmt: [] for fmt in _derivative_formats()}
+        # Never upscale: widths beyond the original collapse to the original width.
+        for target_width in sorted({min(w, width) for w in DERIVATIVE_WIDTHS}):
+            target_height = max(1, round(height * target_width / width))
+            resized = image if target_width == width else image.resize((target_width, target_height), Image.LANCZOS)
+            for fmt in variants:
+                name = f"w{target_width}.{fmt}"
+                output_path = os.path.join(out_dir, name)
+                if not os.path.exists(output_path):
+                    resized.save(output_path, fmt.upper(), quality=DERIVATIVE_QUALITY[fmt])
+                variants[fmt].append({'width': target_width, 'url': f"/uploads/{relative_dir}/{name}"})
+
+        placeholder = _placeholder_data_uri(image)
+
+    return {'width': width, 'height': height, 'variants': variants, 'placeholder': placeholder}
+
+
+def _cloudinary_derivatives(source):
+    """Cloudinary renders resized/re-encoded variants on its CDN, so only URLs are needed."""
+    match = _CLOUDINARY_UPLOAD_RE.match(source)
+    if not match:
+        return None
+    prefix, rest = match.groups()
+
+    variants = {
+        fmt: [
+            {'width': w, 'url': f"{prefix}w_{w},c_limit,q_auto,f_{fmt}/{rest}"}
+            for w in sorted(DERIVATIVE_WIDTHS)
+        ]
+        for fmt in ('webp', 'avif')
+    }
+
+    placeholder = None
+    try:
+        resp = http_clients.request('assets', 'GET', f"{prefix}w_{PLACEHOLDER_WIDTH},e_blur:200,q_30,f_webp/{rest}", timeout=10)
+        if resp.status_code == 200:
+            placeholder = 'data:image/webp;base64,' + base64.b64encode(resp.content).decode('ascii')
+    except requests.RequestException:
+        pass
+
+    return {'width': None, 'height': None, 'variants': variants, 'placeholder': placeholder}
+
+
+def build_derivatives(source):
+    local_path = _local_source_path(source)
+    if local_path:
+        return _local_derivatives(local_path) if os.path.isfile(local_path) else None
+    if isinstance(source, str) and source.lower().startswith(('http://', 'https://')):
+        return _cloudinary_derivatives(source)
+    return None
+
+
+def plan_image_sources(plan_row):
+    """Thumbnail plus gallery images referenced by a plans row."""
+    sources = []
+    if plan_row.get('image_url'):
+        sources.append(plan_row['image_url'])
+    file_paths = plan_row.get('file_paths')
+    if isinstance(file_paths, str):
+        try:
+            file_paths = json.loads(file_paths)
+        except ValueError:
+            file_paths = None
+    if isinstance(file_paths, dict):
+        for path in file_paths.get('gallery') or []:
+            if isinstance(path, str) and path not in sources:
+                sources.append(path)
+    return sources
+
+
+def generate_plan_media_derivatives(conn, plan_id, force=False):
+    """Create and record derivatives for every image of a plan. Safe to re-run."""
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute("SELECT id, image_url, file_paths FROM plans WHERE id = %s", (plan_id,))
+        plan = cur.fetchone()
+        if not plan:
+            return 0
+
+        sources = plan_image_sources(plan)
+        if not force and sources:
+            cur.execute("SELECT source_url FROM media_derivatives WHERE source_url = ANY(%s)", (sources,))
+            done = {row['source_url'] for row in cur.fetchall()}
+            sources = [s for s in sources if s not in done]
+
+        generated = 0
+        for source in sources:
+            derivatives = build_derivatives(source)
+            if not derivatives:
+                continue
+            cur.execute(
+                """
+                INSERT INTO media_derivatives (source_url, plan_id, width, height, variants, placeholder)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (source_url) DO UPDATE SET
+                    plan_id = EXCLUDED.plan_id,
+                    width = EXCLUDED.width,
+                    height = EXCLUDED.height,
+                    variants = EXCLUDED.variants,
+                    placeholder = EXCLUDED.placeholder,
+                    created_at = CURRENT_TIMESTAMP
+                """,
+                (source, plan_id, derivatives['width'], derivatives['height'],
+                 json.dumps(derivatives['variants']), derivatives['placeholder'])
+            )
+            conn.commit()
+            generated += 1
+        return generated
+    finally:
+        cur.close()
+
+
+def _generate_plan_media_derivatives_task(plan_id):
+    with psycopg.connect(current_app.config['DATABASE_URL'], connect_timeout=5) as conn:
+        generated = generate_plan_media_derivatives(conn, plan_id)
+    current_app.logger.info(f"Generated image derivatives for {generated} asset(s) of plan {plan_id}")
+
+
+def schedule_plan_media_derivatives(plan_id):
+    """Queue derivative generation for a plan after its upload/update has committed."""
+    return submit_background(_generate_plan_media_derivatives_task, str(plan_id))
+
+
+def _variant_map(row):
+    variants = row['variants']
+    if isinstance(variants, str):
+        variants = json.loads(variants)
+    variant_map = {
+        fmt: ', '.join(f"{entry['url']} {entry['width']}w" for entry in entries)
+        for fmt, entries in (variants or {}).items()
+        if entries
+    }
+    variant_map['placeholder'] = row.get('placeholder')
+    variant_map['width'] = row.get('width')
+    variant_map['height'] = row.get('height')
+    return variant_map
+
+
+def fetch_variant_maps(cur, sources):
+    """Return {source_url: {'webp': srcset, 'avif': srcset, 'placeholder': ..., ...}}."""
+    sources = [s for s in dict.fromkeys(sources) if isinstance(s, str) and s]
+    if not sources:
+        return {}
+    cur.execute(
+        """
+        SELECT source_url, width, height, variants, placeholder
+        FROM media_derivatives
+        WHERE source_url = ANY(%s)
+        """,
+        (sources,)
+    )
+    rows = cur.fetchall()
+    return {row['source_url']: _variant_map(row) for row in rows}
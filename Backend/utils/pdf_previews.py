@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import shutil
+import threading
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import psycopg
+from flask import current_app
+from psycopg.rows import dict_row
+
+from utils.background import BackgroundPool
+from utils.download_helpers import resolve_plan_file_location
+from utils.file_metadata import fetch_remote_file
+from utils.upload_store import UPLOAD_ROOT
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+try:
+    import fitz  # PyMuPDF; optional, pdftoppm (poppler-utils) is used otherwise
+except ImportError:
+    fitz = None
+
+
+PREVIEW_PAGES = int(os.getenv('PDF_PREVIEW_PAGES', '3'))
+PREVIEW_DPI = int(os.getenv('PDF_PREVIEW_DPI', '50'))
+PREVIEW_MAX_WIDTH = int(os.getenv('PDF_PREVIEW_MAX_WIDTH', '1200'))
+PREVIEW_WATERMARK = os.getenv('PDF_PREVIEW_WATERMARK', 'PREVIEW - NOT FOR CONSTRUCTION')
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv('PDF_PREVIEW_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+PREVIEW_PROCESSES = int(os.getenv('PDF_PREVIEW_PROCESSES', '1'))
+PREVIEW_TIMEOUT_SECONDS = int(os.getenv('PDF_PREVIEW_TIMEOUT_SECONDS', '120'))
+# Files that failed to render are not retried on every page view.
+PREVIEW_RETRY_SECONDS = int(os.getenv('PDF_PREVIEW_RETRY_SECONDS', '3600'))
+# Bump when rendering settings change; previews live under previews/v<N>/ so old URLs stay valid until evicted.
+PREVIEW_VERSION = 1
+PREVIEW_FOLDER = os.path.join(UPLOAD_ROOT, 'previews')
+
+# Renders are handed to the process pool from a thread of their own, so a slow
+# file holds up other previews but not the shared background pool.
+_preview_pool = BackgroundPool('plancave-pdf-previews', workers=1, queue_limit=50)
+_process_pool = None
+_state_lock = threading.Lock()
+_pending_plans = set()
+_recent_failures = {}
+
+
+def rasterizer_available():
+    return Image is not None and (fitz is not None or shutil.which('pdftoppm') is not None)
+
+
+def _rasterize(pdf_path, page_limit, dpi):
+    """Yield (page_number, PIL image) for the first `page_limit` pages."""
+    if fitz is not None:
+        with fitz.open(pdf_path) as document:
+            for index in range(min(page_limit, document.page_count)):
+                pixmap = document[index].get_pixmap(dpi=dpi)
+                yield index + 1, Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        subprocess.run(
+            ['pdftoppm', '-png', '-r', str(dpi), '-f', '1', '-l', str(page_limit), pdf_path,
+             os.path.join(work_dir, 'page')],
+            check=True, capture_output=True, timeout=PREVIEW_TIMEOUT_SECONDS,
+        )
+        # Output is page-<N>.png, with N zero-padded to the page count's width.
+        numbered = sorted((int(os.path.splitext(name)[0].rsplit('-', 1)[1]), name) for name in os.listdir(work_dir))
+        for page_number, name in numbered:
+            with Image.open(os.path.join(work_dir, name)) as image:
+                yield page_number, image.convert('RGB')
+
+
+def _watermark(image, text):
+    """Tile a translucent diagonal label across the page."""
+    font_size = max(14, image.width // 24)
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+
+    side = int((image.width ** 2 + image.height ** 2) ** 0.5)
+    overlay = Image.new('RGBA', (side, side), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    step_x, step_y = (right - left) + font_size * 3, (bottom - top) + font_size * 4
+    for row, y in enumerate(range(0, side, step_y)):
+        for x in range(-step_x + (row % 2) * step_x // 2, side, step_x):
+            draw.text((x, y), text, font=font, fill=(200, 30, 30, 70))
+
+    overlay = overlay.rotate(30, resample=Image.BICUBIC)
+    offset = ((side - image.width) // 2, (side - image.height) // 2)
+    overlay = overlay.crop((offset[0], offset[1], offset[0] + image.width, offset[1] + image.height))
+    return Image.alpha_composite(image.convert('RGBA'), overlay).convert('RGB')
+
+
+def render_pdf_previews(pdf_path, out_dir, page_limit=PREVIEW_PAGES, dpi=PREVIEW_DPI,
+                        max_width=PREVIEW_MAX_WIDTH, watermark=PREVIEW_WATERMARK):
+    """Rasterize, downscale and watermark the first pages of a PDF into out_dir/p<N>.webp.
+
+    Runs in a worker process; pages are written to a sibling temp directory and
+    moved into place at the end so readers never see a half-written set.
+    """
+    parent = os.path.dirname(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    pages = []
+    try:
+        for page_number, image in _rasterize(pdf_path, page_limit, dpi):
+            if image.width > max_width:
+                image = image.resize((max_width, max(1, round(image.height * max_width / image.width))), Image.LANCZOS)
+            if watermark:
+                image = _watermark(image, watermark)
+            name = f"p{page_number}.webp"
+            image.save(os.path.join(staging, name), 'WEBP', quality=70)
+            pages.append({'page': page_number, 'width': image.width, 'height': image.height, 'name': name})
+
+        if os.path.isdir(out_dir):
+            shutil.rmtree(out_dir)
+        os.rename(staging, out_dir)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    size_bytes = sum(os.path.getsize(os.path.join(out_dir, p['name'])) for p in pages)
+    return {'pages': pages, 'size_bytes': size_bytes}
+
+
+def _get_process_pool():
+    """Separate processes keep the rasterizer's CPU and memory use out of the web workers."""
+    global _process_pool
+    with _state_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PREVIEW_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                max_tasks_per_child=50,
+            )
+        return _process_pool
+
+
+def _discard_process_pool(pool, terminate=False):
+    """Start a fresh pool for the next file; with `terminate`, stop the render still running in this one."""
+    global _process_pool
+    with _state_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    if terminate:
+        # shutdown() alone waits for the running task, so stop the workers first.
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_pool(pdf_path, out_dir):
+    pool = _get_process_pool()
+    try:
+        return pool.submit(render_pdf_previews, pdf_path, out_dir).result(PREVIEW_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        _discard_process_pool(pool, terminate=True)
+        raise TimeoutError(f"Rendering took longer than {PREVIEW_TIMEOUT_SECONDS}s")
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge sheet).
+        _discard_process_pool(pool)
+        raise
+
+
+def preview_relative_dir(sha256):
+    return f"previews/v{PREVIEW_VERSION}/{sha256[:2]}/{sha256}"
+
+
+def _preview_pages(row):
+    pages = row['pages']
+    if isinstance(pages, str):
+        pages = json.loads(pages)
+    relative_dir = preview_relative_dir(row['content_sha256'])
+    return [
+        {'page': p['page'], 'width': p['width'], 'height': p['height'], 'url': f"/uploads/{relative_dir}/{p['name']}"}
+        for p in pages or []
+    ]
+
+
+def fetch_preview_map(cur, sha256s):
+    """Return {content_sha256: [{'page', 'width', 'height', 'url'}, ...]} for cached previews."""
+    sha256s = [s for s in dict.fromkeys(sha256s) if s]
+    if not sha256s:
+        return {}
+    cur.execute(
+        """
+        SELECT content_sha256, pages
+        FROM plan_file_previews
+        WHERE content_sha256 = ANY(%s) AND version = %s
+        """,
+        (sha256s, PREVIEW_VERSION)
+    )
+    return {row['content_sha256']: _preview_pages(row) for row in cur.fetchall()}
+
+
+def _render_plan_file(plan_file):
+    location_kind, location = resolve_plan_file_location(plan_file)
+    out_dir = os.path.join(UPLOAD_ROOT, preview_relative_dir(plan_file['content_sha256']))
+    if location_kind == 'local':
+        return _run_in_pool(location, out_dir)
+    if location_kind == 'url':
+        path = fetch_remote_file(location)
+        try:
+            return _run_in_pool(path, out_dir)
+        finally:
+            os.remove(path)
+    return None
+
+
+def enforce_preview_cache_limit(conn, max_bytes=None, log=None):
+    """Evict the oldest previews until the cache fits in max_bytes; returns the number evicted.
+
+    Evicted previews are re-rendered on demand the next time the plan is viewed.
+    """
+    max_bytes = PREVIEW_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute("SELECT COALESCE(SUM(size_bytes), 0) AS total FROM plan_file_previews")
+        total = int(cur.fetchone()['total'])
+        if total <= max_bytes:
+            return 0
+
+        cur.execute("SELECT content_sha256, version, size_bytes FROM plan_file_previews ORDER BY created_at ASC")
+        evicted = []
+        for row in cur.fetchall():
+            if total <= max_bytes:
+                break
+            evicted.append(row['content_sha256'])
+            total -= row['size_bytes'] or 0
+            shutil.rmtree(
+                os.path.join(PREVIEW_FOLDER, f"v{row['version']}", row['content_sha256'][:2], row['content_sha256']),
+                ignore_errors=True,
+            )
+        cur.execute("DELETE FROM plan_file_previews WHERE content_sha256 = ANY(%s)", (evicted,))
+        conn.commit()
+        if log:
+            log(f"Evicted {len(evicted)} preview set(s); cache now {total} bytes")
+        return len(evicted)
+    finally:
+        cur.close()
+
+
+def generate_plan_pdf_previews(conn, plan_id=None, force=False, log=None):
+    """Render previews for architectural PDFs (once per checksum) and record them. Safe to re-run."""
+    if not rasterizer_available():
+        if log:
+            log("No PDF rasterizer available (install PyMuPDF or poppler-utils)")
+        return {'generated': 0, 'failed': 0}
+
+    cur = conn.cursor(row_factory=dict_row)
+    generated = 0
+    failed = 0
+    try:
+        cur.execute(
+            """
+            SELECT DISTINCT ON (f.content_sha256)
+                   f.content_sha256, f.file_name, f.file_path, f.storage_backend, f.storage_key, f.storage_mtime
+            FROM plan_files f
+            LEFT JOIN plan_file_previews pv
+                   ON pv.content_sha256 = f.content_sha256 AND pv.version = %s
+            WHERE f.deliverable_key = 'architectural'
+              AND f.content_sha256 IS NOT NULL
+              AND (lower(f.file_name) LIKE '%%.pdf' OR lower(f.file_path) LIKE '%%.pdf')
+              AND (%s::uuid IS NULL OR f.plan_id = %s::uuid)
+              AND (%s OR pv.content_sha256 IS NULL)
+            ORDER BY f.content_sha256
+            """,
+            (PREVIEW_VERSION, plan_id, plan_id, force)
+        )
+        for plan_file in cur.fetchall():
+            failed_at = _recent_failures.get(plan_file['content_sha256'])
+            if not force and failed_at and time.monotonic() - failed_at < PREVIEW_RETRY_SECONDS:
+                continue
+            try:
+                result = _render_plan_file(plan_file)
+                if result is None:
+                    raise FileNotFoundError(plan_file['file_path'])
+            except Exception as exc:
+                failed += 1
+                with _state_lock:
+                    _recent_failures[plan_file['content_sha256']] = time.monotonic()
+                if log:
+                    log(f"{plan_file['file_name']} ({plan_file['content_sha256'][:12]}): {type(exc).__name__}: {exc}")
+                continue
+
+            cur.execute(
+                """
+                INSERT INTO plan_file_previews (content_sha256, version, pages, size_bytes)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (content_sha256) DO UPDATE SET
+                    version = EXCLUDED.version,
+                    pages = EXCLUDED.pages,
+                    size_bytes = EXCLUDED.size_bytes,
+                    created_at = CURRENT_TIMESTAMP
+                """,
+                (plan_file['content_sha256'], PREVIEW_VERSION, json.dumps(result['pages']), result['size_bytes'])
+            )
+            conn.commit()
+            generated += 1
+    finally:
+        cur.close()
+
+    if generated:
+        enforce_preview_cache_limit(conn, log=log)
+    return {'generated': generated, 'failed': failed}
+
+
+def _generate_plan_pdf_previews_task(plan_id):
+    try:
+        with psycopg.connect(current_app.config['DATABASE_URL'], connect_timeout=5) as conn:
+            result = generate_plan_pdf_previews(conn, plan_id, log=current_app.logger.warning)
+    finally:
+        with _state_lock:
+            _pending_plans.discard(plan_id)
+    current_app.logger.info(
+        f"Rendered PDF previews for {result['generated']} file(s) of plan {plan_id} ({result['failed']} failed)"
+    )
+
+
+def schedule_plan_pdf_previews(plan_id):
+    """Queue preview rendering for a plan's architectural PDFs (after upload, or when a view finds none).
+
+    At most one job per plan is queued at a time in this process.
+    """
+    plan_id = str(plan_id)
+    if not rasterizer_available():
+        return None
+    with _state_lock:
+        if plan_id in _pending_plans:
+            return None
+        _pending_plans.add(plan_id)
+    future = _preview_pool.submit(_generate_plan_pdf_previews_task, plan_id)
+    if future is None:
+        with _state_lock:
+            _pending_plans.discard(plan_id)
+    return future
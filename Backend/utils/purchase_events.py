@@ -0,0 +1,185 @@
+"""
+Server-pushed purchase status.
+
+Code that changes a purchase's payment_status calls notify_purchase_status()
+inside its own transaction. Postgres delivers the NOTIFY only if that
+transaction commits, and delivers it to every listening connection. So a
+buyer's stream on any worker hears about a purchase completed by the webhook
+consumer, the reconciliation job or another worker's verify call.
+
+Each process keeps one LISTEN connection, on a daemon thread started by the
+first subscriber. The thread fans notifications out to in-process queues
+keyed by purchase id. Notifications sent while the listener is reconnecting
+are lost, so subscribers are told to re-read the row whenever it comes back.
+Streams also re-read it every PURCHASE_EVENTS_RECHECK_SECONDS as a backstop.
+"""
+import os
+import json
+import time
+import queue
+import threading
+
+import psycopg
+
+
+PURCHASE_EVENTS_CHANNEL = 'purchase_status'
+PURCHASE_EVENTS_HEARTBEAT_SECONDS = int(os.getenv('PURCHASE_EVENTS_HEARTBEAT_SECONDS', '15'))
+PURCHASE_EVENTS_RECHECK_SECONDS = int(os.getenv('PURCHASE_EVENTS_RECHECK_SECONDS', '30'))
+# Streams end after this long; EventSource-style clients reconnect on their own.
+PURCHASE_EVENTS_MAX_SECONDS = int(os.getenv('PURCHASE_EVENTS_MAX_SECONDS', '300'))
+PURCHASE_EVENTS_RETRY_MS = int(os.getenv('PURCHASE_EVENTS_RETRY_MS', '3000'))
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# Put on every queue when the listener (re)connects: "you may have missed something".
+RESYNC = object()
+
+
+def notify_purchase_status(cur, purchase_id, status, **fields):
+    """Queue a status notification in the caller's transaction; it is sent on commit."""
+    payload = {'purchase_id': str(purchase_id), 'status': status, **fields}
+    cur.execute(
+        "SELECT pg_notify(%s, %s)",
+        (PURCHASE_EVENTS_CHANNEL, json.dumps(payload, default=str))
+    )
+
+
+class PurchaseListener:
+    """One LISTEN connection per process, dispatching to per-purchase queues."""
+
+    def __init__(self, dsn, connect=None, reconnect_seconds=(1, 30)):
+        self.dsn = dsn
+        self._connect = connect or (lambda dsn: psycopg.connect(dsn, autocommit=True, connect_timeout=5))
+        self._reconnect_seconds = reconnect_seconds
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def subscribe(self, purchase_id):
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(str(purchase_id), set()).add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='purchase-events', daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, purchase_id, q):
+        with self._lock:
+            queues = self._subscribers.get(str(purchase_id))
+            if queues is None:
+                return
+            queues.discard(q)
+            if not queues:
+                del self._subscribers[str(purchase_id)]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def dispatch(self, payload):
+        """Hand a raw notification payload to the subscribers of its purchase."""
+        try:
+            event = json.loads(payload)
+            purchase_id = str(event['purchase_id'])
+        except (TypeError, ValueError, KeyError):
+            return
+        with self._lock:
+            queues = list(self._subscribers.get(purchase_id, ()))
+        for q in queues:
+            q.put(event)
+
+    def _resync_all(self):
+        with self._lock:
+            queues = [q for queues in self._subscribers.values() for q in queues]
+        for q in queues:
+            q.put(RESYNC)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        delay = self._reconnect_seconds[0]
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect(self.dsn)
+                conn.execute(f"LISTEN {PURCHASE_EVENTS_CHANNEL}")
+                delay = self._reconnect_seconds[0]
+                self._resync_all()
+                while not self._stopped.is_set():
+                    for notify in conn.notifies(timeout=1.0):
+                        self.dispatch(notify.payload)
+            except Exception:
+                self._resync_all()
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self._reconnect_seconds[1])
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+_listener_lock = threading.Lock()
+_listener = None
+
+
+def get_listener(dsn):
+    """This process's listener, rebuilt after a fork (the thread and socket stay with the parent)."""
+    global _listener
+    pid = os.getpid()
+    with _listener_lock:
+        if _listener is None or _listener[0] != pid or _listener[1].dsn != dsn:
+            _listener = (pid, PurchaseListener(dsn))
+        return _listener[1]
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def purchase_event_stream(purchase_id, read_status, events, max_seconds=None,
+                          heartbeat_seconds=None, recheck_seconds=None, clock=time.monotonic):
+    """Yield SSE chunks for one purchase until it reaches a terminal status or time runs out.
+
+    `events` is a queue from PurchaseListener.subscribe(), taken before the
+    first read so nothing committed in between is missed. `read_status()`
+    returns the purchase's current event dict from the database.
+    """
+    max_seconds = PURCHASE_EVENTS_MAX_SECONDS if max_seconds is None else max_seconds
+    heartbeat_seconds = heartbeat_seconds or PURCHASE_EVENTS_HEARTBEAT_SECONDS
+    recheck_seconds = recheck_seconds or PURCHASE_EVENTS_RECHECK_SECONDS
+
+    started = clock()
+    deadline = started + max_seconds
+    next_recheck = started + recheck_seconds
+
+    current = read_status()
+    yield f"retry: {PURCHASE_EVENTS_RETRY_MS}\n" + format_sse('status', current)
+    if current.get('status') in TERMINAL_STATUSES:
+        return
+
+    while True:
+        now = clock()
+        if now >= deadline:
+            return
+        try:
+            event = events.get(timeout=max(min(heartbeat_seconds, next_recheck - now, deadline - now), 0))
+        except queue.Empty:
+            event = None
+
+        if event is RESYNC or (event is None and clock() >= next_recheck):
+            event = read_status()
+            next_recheck = clock() + recheck_seconds
+        if event is None:
+            yield ": keep-alive\n\n"
+            continue
+        if event.get('status') == current.get('status'):
+            continue
+        current = {**current, **event}
+        yield format_sse('status', current)
+        if current.get('status') in TERMINAL_STATUSES:
+            return
@@ -0,0 +1,342 @@
+"""Garbage collection of unreferenced upload files, and per-plan/per-designer disk usage.
+
+The collector walks the upload roots in a stable order and persists its
+position in storage_gc_state, so each run examines a bounded slice and the
+next run resumes where it stopped. Files that no database row references and
+that are older than the grace period are moved to uploads/.quarantine/ (not
+deleted); quarantined files are purged after a retention period.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+from psycopg.rows import dict_row
+
+from utils.upload_store import UPLOAD_ROOT, STAGING_FOLDER
+
+
+GC_ROOTS = ('blobs', 'plans')
+QUARANTINE_FOLDER = os.path.join(UPLOAD_ROOT, '.quarantine')
+GC_GRACE_SECONDS = int(os.getenv('STORAGE_GC_GRACE_SECONDS', str(7 * 24 * 3600)))
+GC_QUARANTINE_RETENTION_SECONDS = int(os.getenv('STORAGE_GC_QUARANTINE_RETENTION_SECONDS', str(30 * 24 * 3600)))
+GC_BATCH_SIZE = 500
+
+
+def _path_key(relative_path):
+    return tuple(relative_path.split('/'))
+
+
+def iter_storage_files(root=None, start_after=None, roots=GC_ROOTS):
+    """Yield relative paths of files under `roots`, in sorted walk order, after `start_after`.
+
+    Directories that sort entirely before `start_after` are skipped without
+    being listed, so resuming deep into a pass stays cheap.
+    """
+    root = root or UPLOAD_ROOT
+    after = _path_key(start_after) if start_after else None
+
+    def walk(relative_dir):
+        parts = _path_key(relative_dir)
+        if after is not None and parts < after[:len(parts)]:
+            return
+        try:
+            entries = sorted(os.scandir(os.path.join(root, relative_dir)), key=lambda e: e.name)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            relative_path = f"{relative_dir}/{entry.name}"
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(relative_path)
+            elif entry.is_file(follow_symlinks=False):
+                if after is None or _path_key(relative_path) > after:
+                    yield relative_path
+
+    for top in sorted(roots):
+        yield from walk(top)
+
+
+def _path_variants(storage_key):
+    """Ways a file under the uploads root is referenced in the database."""
+    return [storage_key, f"/uploads/{storage_key}", f"uploads/{storage_key}", os.path.join(UPLOAD_ROOT, storage_key)]
+
+
+def load_json_references(cur):
+    """Paths referenced from plans.file_paths; JSON arrays are not indexable, so load them once per run."""
+    cur.execute(
+        """
+        SELECT DISTINCT v.path
+        FROM plans p
+        CROSS JOIN LATERAL jsonb_each(CASE WHEN jsonb_typeof(p.file_paths) = 'object' THEN p.file_paths ELSE '{}'::jsonb END) e
+        CROSS JOIN LATERAL jsonb_array_elements_text(CASE WHEN jsonb_typeof(e.value) = 'array' THEN e.value ELSE '[]'::jsonb END) v(path)
+        """
+    )
+    return {row['path'] for row in cur.fetchall()}
+
+
+def find_referenced(cur, storage_keys, json_references=frozenset()):
+    """Return the subset of storage_keys still referenced by any table."""
+    variants = {}
+    for key in storage_keys:
+        for variant in _path_variants(key):
+            variants[variant] = key
+
+    cur.execute(
+        """
+        SELECT storage_key AS ref FROM file_blobs WHERE storage_key = ANY(%(keys)s) AND ref_count > 0
+        UNION
+        SELECT storage_key FROM plan_files WHERE storage_key = ANY(%(keys)s)
+        UNION
+        SELECT file_path FROM plan_files WHERE file_path = ANY(%(paths)s)
+        UNION
+        SELECT storage_key FROM upload_sessions WHERE storage_key = ANY(%(keys)s)
+        UNION
+        SELECT image_url FROM plans WHERE image_url = ANY(%(paths)s)
+        UNION
+        SELECT profile_picture_url FROM users WHERE profile_picture_url = ANY(%(paths)s)
+        """,
+        {'keys': list(storage_keys), 'paths': list(variants)}
+    )
+    referenced = {variants[row['ref']] for row in cur.fetchall() if row['ref'] in variants}
+    referenced.update(key for variant, key in variants.items() if variant in json_references)
+    return referenced
+
+
+def _load_walk_cursor(cur):
+    cur.execute("SELECT walk_cursor FROM storage_gc_state WHERE id = 1")
+    row = cur.fetchone()
+    if row is None:
+        cur.execute("INSERT INTO storage_gc_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING")
+        return None
+    return row['walk_cursor']
+
+
+def _save_walk_cursor(cur, walk_cursor):
+    cur.execute(
+        "UPDATE storage_gc_state SET walk_cursor = %s, updated_at = CURRENT_TIMESTAMP WHERE id = 1",
+        (walk_cursor,)
+    )
+
+
+def _finish_pass(cur):
+    cur.execute(
+        """
+        UPDATE storage_gc_state
+        SET walk_cursor = NULL, last_pass_completed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        """
+    )
+
+
+def _quarantine(cur, storage_key, grace_seconds):
+    """Move one unreferenced file into quarantine; returns its size, or None if it was skipped."""
+    absolute_path = os.path.join(UPLOAD_ROOT, storage_key)
+    try:
+        stat = os.stat(absolute_path)
+    except FileNotFoundError:
+        return None
+    # Re-check right before moving: a new upload of identical content touches the blob.
+    if time.time() - stat.st_mtime < grace_seconds:
+        return None
+
+    target = os.path.join(QUARANTINE_FOLDER, storage_key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(absolute_path, target)
+    cur.execute(
+        """
+        INSERT INTO storage_quarantine (storage_key, size_bytes, quarantined_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (storage_key) DO UPDATE SET
+            size_bytes = EXCLUDED.size_bytes,
+            quarantined_at = EXCLUDED.quarantined_at
+        """,
+        (storage_key, stat.st_size)
+    )
+    cur.execute("DELETE FROM file_blobs WHERE storage_key = %s AND ref_count = 0", (storage_key,))
+    return stat.st_size
+
+
+def collect_garbage(conn, limit=5000, grace_seconds=None, dry_run=False, log=None):
+    """Examine up to `limit` files from where the previous run stopped and quarantine orphans.
+
+    When a pass over all files completes, expired quarantine entries are
+    purged, stale staging files removed and the usage counters refreshed.
+    """
+    grace_seconds = GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    now = time.time()
+    stats = {'examined': 0, 'quarantined': 0, 'quarantined_bytes': 0, 'pass_completed': False}
+
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        walk_cursor = _load_walk_cursor(cur)
+        if walk_cursor is None and not dry_run:
+            cur.execute("UPDATE storage_gc_state SET pass_started_at = CURRENT_TIMESTAMP WHERE id = 1")
+        conn.commit()
+
+        json_references = load_json_references(cur)
+        files = iter_storage_files(start_after=walk_cursor)
+        exhausted = False
+        while stats['examined'] < limit:
+            batch = []
+            for relative_path in files:
+                batch.append(relative_path)
+                if len(batch) >= min(GC_BATCH_SIZE, limit - stats['examined']):
+                    break
+            if not batch:
+                exhausted = True
+                break
+            stats['examined'] += len(batch)
+
+            candidates = []
+            for storage_key in batch:
+                try:
+                    if now - os.stat(os.path.join(UPLOAD_ROOT, storage_key)).st_mtime >= grace_seconds:
+                        candidates.append(storage_key)
+                except FileNotFoundError:
+                    continue
+
+            orphans = sorted(set(candidates) - find_referenced(cur, candidates, json_references)) if candidates else []
+            for storage_key in orphans:
+                if dry_run:
+                    if log:
+                        log(f"would quarantine {storage_key}")
+                    stats['quarantined'] += 1
+                    continue
+                size = _quarantine(cur, storage_key, grace_seconds)
+                if size is not None:
+                    stats['quarantined'] += 1
+                    stats['quarantined_bytes'] += size
+                    if log:
+                        log(f"quarantined {storage_key} ({size} bytes)")
+
+            if not dry_run:
+                _save_walk_cursor(cur, batch[-1])
+                conn.commit()
+
+        # Stopping at the limit leaves the cursor in place; the next run resumes there.
+        if exhausted and not dry_run:
+            _finish_pass(cur)
+            conn.commit()
+            stats['pass_completed'] = True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    if stats['pass_completed']:
+        stats['purged'] = purge_quarantine(conn, log=log)
+        stats['staging_removed'] = clean_staging(grace_seconds)
+        refresh_storage_usage(conn)
+    return stats
+
+
+def purge_quarantine(conn, retention_seconds=None, log=None):
+    """Permanently delete files that have been in quarantine longer than the retention period."""
+    retention_seconds = GC_QUARANTINE_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+    cutoff = datetime.utcnow() - timedelta(seconds=retention_seconds)
+    cur = conn.cursor(row_factory=dict_row)
+    purged = 0
+    try:
+        cur.execute("SELECT storage_key FROM storage_quarantine WHERE quarantined_at < %s", (cutoff,))
+        for row in cur.fetchall():
+            try:
+                os.remove(os.path.join(QUARANTINE_FOLDER, row['storage_key']))
+            except FileNotFoundError:
+                pass
+            cur.execute("DELETE FROM storage_quarantine WHERE storage_key = %s", (row['storage_key'],))
+            purged += 1
+            if log:
+                log(f"purged {row['storage_key']}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return purged
+
+
+def restore_quarantined(conn, storage_key):
+    """Move a quarantined file back to its original location. Returns False if it is not quarantined."""
+    source = os.path.join(QUARANTINE_FOLDER, storage_key)
+    if not os.path.isfile(source):
+        return False
+    target = os.path.join(UPLOAD_ROOT, storage_key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(source, target)
+    # Restart the grace period so the next pass does not quarantine it again straight away.
+    os.utime(target)
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM storage_quarantine WHERE storage_key = %s", (storage_key,))
+    conn.commit()
+    return True
+
+
+def clean_staging(grace_seconds=None):
+    """Remove abandoned .part files left in the staging folder by interrupted uploads."""
+    grace_seconds = GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(STAGING_FOLDER))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        # Resumable upload sessions (staging/sessions/) expire through their own table.
+        if not entry.is_file(follow_symlinks=False) or not entry.name.endswith('.part'):
+            continue
+        try:
+            if time.time() - entry.stat().st_mtime >= grace_seconds:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def refresh_storage_usage(conn):
+    """Recompute per-plan and per-designer usage.
+
+    `bytes` counts every plan file; `unique_bytes` counts each stored object
+    once per scope, which is what that scope actually occupies on disk.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM storage_usage")
+        cur.execute(
+            """
+            WITH files AS (
+                SELECT f.plan_id::text AS plan_id,
+                       p.designer_id::text AS designer_id,
+                       COALESCE(f.file_size, b.size_bytes, 0) AS size_bytes,
+                       COALESCE(f.blob_key, f.storage_key, f.file_path) AS object_key
+                FROM plan_files f
+                JOIN plans p ON p.id = f.plan_id
+                LEFT JOIN file_blobs b ON b.storage_key = f.blob_key
+            ),
+            scoped AS (
+                SELECT 'plan' AS scope, plan_id AS scope_id, size_bytes, object_key FROM files
+                UNION ALL
+                SELECT 'designer', designer_id, size_bytes, object_key FROM files WHERE designer_id IS NOT NULL
+            ),
+            totals AS (
+                SELECT scope, scope_id, COUNT(*) AS file_count, SUM(size_bytes) AS bytes
+                FROM scoped
+                GROUP BY scope, scope_id
+            ),
+            unique_totals AS (
+                SELECT scope, scope_id, SUM(size_bytes) AS unique_bytes
+                FROM (SELECT DISTINCT scope, scope_id, object_key, size_bytes FROM scoped) objects
+                GROUP BY scope, scope_id
+            )
+            INSERT INTO storage_usage (scope, scope_id, file_count, bytes, unique_bytes, updated_at)
+            SELECT t.scope, t.scope_id, t.file_count, t.bytes, u.unique_bytes, CURRENT_TIMESTAMP
+            FROM totals t
+            JOIN unique_totals u ON u.scope = t.scope AND u.scope_id = t.scope_id
+            """
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
@@ -0,0 +1,173 @@
+import os
+from datetime import datetime
+
+from psycopg.rows import dict_row
+
+from utils.download_helpers import resolve_plan_file_path
+from utils.upload_store import UPLOAD_ROOT, hash_file, storage_descriptor
+
+
+# Recorded mtimes may lose sub-second precision on some filesystems.
+_MTIME_TOLERANCE_SECONDS = 1
+
+
+def _describe_legacy_file(plan_file):
+    """Build the descriptor for a plan_files row written before descriptors existed."""
+    descriptor = storage_descriptor(plan_file['file_path'])
+    if descriptor['storage_backend'] == 'url':
+        return descriptor, None
+
+    absolute_path = resolve_plan_file_path(plan_file['file_path'])
+    if not absolute_path:
+        return None, 'file not found'
+
+    storage_key = os.path.relpath(absolute_path, UPLOAD_ROOT).replace(os.sep, '/')
+    if storage_key.startswith('..'):
+        return None, f'file outside uploads root: {absolute_path}'
+
+    sha256, size = hash_file(absolute_path)
+    return {
+        'storage_backend': 'local',
+        'storage_key': storage_key,
+        'storage_mtime': datetime.utcfromtimestamp(os.stat(absolute_path).st_mtime),
+        'blob_key': storage_key,
+        'content_sha256': sha256,
+        'file_size': size,
+    }, None
+
+
+def backfill_storage_descriptors(conn, batch_size=200, log=print):
+    """Persist storage descriptors on plan_files rows that do not have one yet.
+
+    Legacy files stay where they are; each one is registered in file_blobs under
+    its existing key so reference counting covers it as well.
+    """
+    cur = conn.cursor(row_factory=dict_row)
+    updated = 0
+    missing = 0
+    last_id = None
+    try:
+        while True:
+            cur.execute(
+                """
+                SELECT id, file_path
+                FROM plan_files
+                WHERE storage_backend IS NULL
+                  AND (%s::uuid IS NULL OR id > %s::uuid)
+                ORDER BY id
+                LIMIT %s
+                """,
+                (last_id, last_id, batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            for row in rows:
+                descriptor, problem = _describe_legacy_file(row)
+                if problem:
+                    missing += 1
+                    log(f"plan_file {row['id']} ({row['file_path']}): {problem}")
+                    continue
+
+                if descriptor['blob_key']:
+                    cur.execute(
+                        """
+                        INSERT INTO file_blobs (storage_key, sha256, size_bytes)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (storage_key) DO NOTHING
+                        """,
+                        (descriptor['blob_key'], descriptor['content_sha256'], descriptor['file_size'])
+                    )
+                cur.execute(
+                    """
+                    UPDATE plan_files
+                    SET storage_backend = %s,
+                        storage_key = %s,
+                        storage_mtime = %s,
+                        blob_key = COALESCE(blob_key, %s),
+                        content_sha256 = COALESCE(content_sha256, %s),
+                        file_size = COALESCE(%s, file_size)
+                    WHERE id = %s
+                    """,
+                    (
+                        descriptor['storage_backend'],
+                        descriptor['storage_key'],
+                        descriptor['storage_mtime'],
+                        descriptor['blob_key'],
+                        descriptor['content_sha256'],
+                        descriptor.get('file_size'),
+                        row['id'],
+                    )
+                )
+                updated += 1
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {'updated': updated, 'missing': missing}
+
+
+def verify_storage_descriptors(conn, check_checksums=False, batch_size=500, log=print):
+    """Check that local descriptors still point at files of the recorded size (and hash).
+
+    A changed mtime is reported separately rather than as a problem: storing
+    identical content again, or a GC grace-period reset, touches the blob.
+    """
+    cur = conn.cursor(row_factory=dict_row)
+    checked = 0
+    problems = 0
+    mtime_changed = 0
+    last_id = None
+    try:
+        while True:
+            cur.execute(
+                """
+                SELECT id, storage_key, file_size, content_sha256, storage_mtime
+                FROM plan_files
+                WHERE storage_backend = 'local'
+                  AND (%s::uuid IS NULL OR id > %s::uuid)
+                ORDER BY id
+                LIMIT %s
+                """,
+                (last_id, last_id, batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            for row in rows:
+                checked += 1
+                absolute_path = os.path.join(UPLOAD_ROOT, row['storage_key'])
+                try:
+                    stat = os.stat(absolute_path)
+                except OSError:
+                    problems += 1
+                    log(f"plan_file {row['id']}: missing {row['storage_key']}")
+                    continue
+
+                if row['file_size'] is not None and stat.st_size != row['file_size']:
+                    problems += 1
+                    log(f"plan_file {row['id']}: size {stat.st_size} != recorded {row['file_size']}")
+                    continue
+
+                mtime = datetime.utcfromtimestamp(stat.st_mtime)
+                if row['storage_mtime'] and abs((mtime - row['storage_mtime']).total_seconds()) > _MTIME_TOLERANCE_SECONDS:
+                    mtime_changed += 1
+                    log(f"plan_file {row['id']}: mtime {mtime.isoformat()} != recorded {row['storage_mtime'].isoformat()}")
+
+                if check_checksums and row['content_sha256']:
+                    sha256, _ = hash_file(absolute_path)
+                    if sha256 != row['content_sha256'].strip():
+                        problems += 1
+                        log(f"plan_file {row['id']}: checksum mismatch for {row['storage_key']}")
+            conn.rollback()
+    finally:
+        cur.close()
+
+    return {'checked': checked, 'problems': problems, 'mtime_changed': mtime_changed}
@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+import unittest
+
+from flask import Flask, current_app
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import background  # noqa: E402
+
+
+class BackgroundPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask('background-test')
+        self.app.config['MARKER'] = 'from-the-app'
+
+    def test_tasks_run_inside_the_submitting_apps_context(self):
+        seen = []
+        pool = background.BackgroundPool('test-background', workers=1, queue_limit=4)
+
+        with self.app.app_context():
+            future = pool.submit(lambda: seen.append((current_app.name, current_app.config['MARKER'])))
+        future.result(timeout=5)
+
+        self.assertEqual(seen, [('background-test', 'from-the-app')])
+
+    def test_tasks_beyond_the_queue_limit_are_dropped(self):
+        release = threading.Event()
+        pool = background.BackgroundPool('test-background', workers=1, queue_limit=2)
+
+        with self.app.app_context(), self.assertLogs(self.app.logger, 'WARNING') as logs:
+            running = pool.submit(release.wait, 5)
+            queued = pool.submit(release.wait, 5)
+            dropped = pool.submit(release.wait, 5)
+        release.set()
+        running.result(timeout=5)
+        queued.result(timeout=5)
+
+        self.assertIsNone(dropped)
+        self.assertIn('full; skipped wait', logs.output[0])
+        with self.app.app_context():
+            self.assertIsNotNone(pool.submit(release.wait, 0), 'finished tasks give their slots back')
+
+    def test_a_failing_task_is_logged_and_frees_its_slot(self):
+        pool = background.BackgroundPool('test-background', workers=1, queue_limit=1)
+
+        def explode():
+            raise RuntimeError('boom')
+
+        with self.app.app_context(), self.assertLogs(self.app.logger, 'ERROR') as logs:
+            pool.submit(explode).result(timeout=5)
+        self.assertIn('Background task explode failed', logs.output[0])
+
+        with self.app.app_context():
+            self.assertIsNotNone(pool.submit(lambda: None))
+
+    def test_delayed_calls_run_in_the_app_context(self):
+        seen = threading.Event()
+
+        def check():
+            if current_app.config['MARKER'] == 'from-the-app':
+                seen.set()
+
+        with self.app.app_context():
+            timer = background.call_later(0.01, check)
+        timer.join(timeout=5)
+
+        self.assertTrue(seen.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+import cloudinary  # noqa: E402
+
+from utils import cloudinary_config  # noqa: E402
+
+
+class _StandInState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failures_left = {}
+
+
+class _CloudinaryStandIn(BaseHTTPRequestHandler):
+    """Minimal stand-in for POST /v1_1/<cloud>/auto/upload."""
+
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        match = re.search(rb'name="public_id"\r\n\r\n([^\r]+)', body)
+        public_id = match.group(1).decode() if match else 'unnamed'
+
+        with self.state.lock:
+            self.state.in_flight += 1
+            self.state.max_in_flight = max(self.state.max_in_flight, self.state.in_flight)
+            fail = self.state.failures_left.get(public_id, 0) > 0
+            if fail:
+                self.state.failures_left[public_id] -= 1
+        time.sleep(0.05)
+        with self.state.lock:
+            self.state.in_flight -= 1
+
+        if fail:
+            status, payload = 500, {'error': {'message': 'temporary failure'}}
+        elif public_id.startswith('bad'):
+            status, payload = 400, {'error': {'message': 'Invalid image file'}}
+        else:
+            status, payload = 200, {'secure_url': f'https://res.cloudinary.com/demo/image/upload/{public_id}.png'}
+
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ConcurrentCloudinaryUploadTests(unittest.TestCase):
+    def setUp(self):
+        self.state = _StandInState()
+        handler = type('Handler', (_CloudinaryStandIn,), {'state': self.state})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        config = cloudinary.config()
+        self._saved = {k: getattr(config, k, None) for k in ('cloud_name', 'api_key', 'api_secret', 'upload_prefix')}
+        cloudinary.config(
+            cloud_name='demo',
+            api_key='key',
+            api_secret='secret',
+            upload_prefix=f'http://127.0.0.1:{self.server.server_port}',
+        )
+        self._env = mock.patch.dict(os.environ, {
+            'CLOUDINARY_CLOUD_NAME': 'demo',
+            'CLOUDINARY_API_KEY': 'key',
+            'CLOUDINARY_API_SECRET': 'secret',
+        })
+        self._env.start()
+
+    def tearDown(self):
+        self._env.stop()
+        cloudinary.config(**self._saved)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _assets(self, *public_ids):
+        return [
+            {'file': io.BytesIO(b'\x89PNG fake image'), 'public_id': public_id, 'name': f'{public_id}.png'}
+            for public_id in public_ids
+        ]
+
+    def test_results_keep_input_order_and_run_concurrently(self):
+        ids = [f'img{i}' for i in range(8)]
+        results = cloudinary_config.upload_many_to_cloudinary(self._assets(*ids), max_workers=4)
+
+        self.assertEqual(
+            [r['url'] for r in results],
+            [f'https://res.cloudinary.com/demo/image/upload/{i}.png' for i in ids],
+        )
+        self.assertTrue(all(r['error'] is None and r['attempts'] == 1 for r in results))
+        self.assertTrue(all(r['elapsed_ms'] > 0 for r in results))
+        self.assertGreater(self.state.max_in_flight, 1)
+        self.assertLessEqual(self.state.max_in_flight, 4)
+
+    def test_transient_failures_are_retried_with_backoff(self):
+        self.state.failures_left['flaky'] = 2
+        results = cloudinary_config.upload_many_to_cloudinary(
+            self._assets('flaky'), retries=2, backoff_seconds=0.01
+        )
+
+        self.assertIsNone(results[0]['error'])
+        self.assertEqual(results[0]['attempts'], 3)
+
+    def test_client_errors_are_not_retried(self):
+        results = cloudinary_config.upload_many_to_cloudinary(
+            self._assets('ok', 'bad'), retries=3, backoff_seconds=0.01
+        )
+
+        self.assertIsNotNone(results[0]['url'])
+        self.assertIsNone(results[1]['url'])
+        self.assertEqual(results[1]['attempts'], 1)
+        self.assertIn('Invalid image file', str(results[1]['error']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import download_helpers  # noqa: E402
+
+
+class ResolvePlanFileLocationTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.root = os.path.realpath(self._tmp.name)
+        patcher = mock.patch.object(download_helpers, 'UPLOAD_ROOT', self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_a_local_descriptor_resolves_under_the_upload_root_without_probing(self):
+        with mock.patch.object(download_helpers, 'resolve_plan_file_path') as probe:
+            location = download_helpers.resolve_plan_file_location({
+                'storage_backend': 'local', 'storage_key': 'blobs/ab/cd/abcd.pdf', 'file_path': '/uploads/old.pdf',
+            })
+
+        self.assertEqual(location, ('local', os.path.join(self.root, 'blobs/ab/cd/abcd.pdf')))
+        probe.assert_not_called()
+
+    def test_a_url_descriptor_is_returned_as_is(self):
+        url = 'https://res.cloudinary.com/demo/raw/upload/plan.pdf'
+        location = download_helpers.resolve_plan_file_location({'storage_backend': 'url', 'storage_key': url})
+        self.assertEqual(location, ('url', url))
+
+    def test_rows_without_a_descriptor_fall_back_to_the_legacy_file_path(self):
+        legacy = os.path.join(self.root, 'plan.pdf')
+        open(legacy, 'wb').close()
+
+        self.assertEqual(
+            download_helpers.resolve_plan_file_location({'storage_backend': None, 'file_path': legacy}),
+            ('local', legacy)
+        )
+        self.assertEqual(
+            download_helpers.resolve_plan_file_location({'file_path': 'HTTPS://cdn.example.com/plan.pdf'}),
+            ('url', 'HTTPS://cdn.example.com/plan.pdf')
+        )
+
+    def test_a_descriptor_without_a_key_falls_back_as_well(self):
+        legacy = os.path.join(self.root, 'plan.pdf')
+        open(legacy, 'wb').close()
+
+        location = download_helpers.resolve_plan_file_location({
+            'storage_backend': 'local', 'storage_key': None, 'file_path': legacy,
+        })
+
+        self.assertEqual(location, ('local', legacy))
+
+    def test_a_missing_legacy_file_resolves_to_nothing(self):
+        location = download_helpers.resolve_plan_file_location({'file_path': '/uploads/never-uploaded.pdf'})
+        self.assertEqual(location, (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import smtplib
+import socketserver
+import sys
+import threading
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import email_outbox  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server: accepts AUTH PLAIN and records each message."""
+
+    def _reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        self._reply('220 sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith('EHLO'):
+                self.wfile.write(b'250-sink\r\n250 AUTH PLAIN\r\n')
+            elif command.startswith('AUTH'):
+                with sink.lock:
+                    sink.logins += 1
+                self._reply('235 ok')
+            elif command.startswith('RCPT') and 'BOUNCE@' in command:
+                self._reply('550 no such user')
+            elif command == 'DATA':
+                self._reply('354 go ahead')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b'.\r\n', b''):
+                        break
+                    data.append(chunk)
+                with sink.lock:
+                    sink.messages.append(b''.join(data).decode())
+                self._reply('250 queued')
+            elif command == 'QUIT':
+                self._reply('221 bye')
+                return
+            else:
+                self._reply('250 ok')
+
+
+class _SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SinkHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+
+
+def _outbox_connection(batches):
+    conn = FakeConnection()
+    conn.batches = list(batches)
+    return conn
+
+
+def _row(row_id, to_email='buyer@example.com', attempts=1, **extra):
+    return dict({'id': row_id, 'to_email': to_email, 'subject': f'Message {row_id}',
+                 'html_body': '<p>Hello</p>', 'kind': 'generic', 'purchase_id': None,
+                 'attempts': attempts}, **extra)
+
+
+class SmtpPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.sink = _SmtpSink()
+        threading.Thread(target=self.sink.serve_forever, daemon=True).start()
+        self.pool = email_outbox.SmtpConnectionPool({
+            'server': '127.0.0.1', 'port': self.sink.server_address[1],
+            'username': 'mailer', 'password': 'secret', 'sender': 'noreply@example.com',
+            'use_tls': False, 'use_ssl': False,
+        })
+
+    def tearDown(self):
+        self.pool.close()
+        self.sink.shutdown()
+        self.sink.server_close()
+
+    def test_one_authenticated_connection_carries_a_batch(self):
+        for n in range(3):
+            self.pool.send(email_outbox.build_message('noreply@example.com', 'a@example.com', f'n{n}', '<p>x</p>'))
+
+        self.assertEqual(len(self.sink.messages), 3)
+        self.assertIn('Subject: n2', self.sink.messages[2])
+        self.assertEqual((self.sink.connections, self.sink.logins), (1, 1))
+
+    def test_failed_send_discards_the_connection(self):
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.pool.send(email_outbox.build_message('noreply@example.com', 'bounce@example.com', 's', '<p>x</p>'))
+        self.pool.send(email_outbox.build_message('noreply@example.com', 'a@example.com', 's', '<p>x</p>'))
+
+        self.assertEqual(self.sink.connections, 2)
+        self.assertEqual(len(self.sink.messages), 1)
+
+    def test_flush_records_each_outcome(self):
+        rows = [_row(1, kind='download_link', purchase_id='p-1'), _row(2, 'bounce@example.com'), _row(3)]
+        conn = _outbox_connection([rows])
+
+        with mock.patch.object(email_outbox, 'claim_batch', side_effect=lambda c, limit: c.batches.pop(0) if c.batches else []):
+            stats = email_outbox.flush_outbox(conn, batch_size=10, pool=self.pool)
+
+        self.assertEqual(stats, {'sent': 2, 'retry': 0, 'dead': 1})
+        self.assertEqual(len(self.sink.messages), 2)
+        updates = [(sql.split()[1], sql) for sql, _ in conn.executed]
+        self.assertEqual([table for table, _ in updates], ['email_outbox', 'purchases', 'email_outbox', 'email_outbox'])
+        self.assertIn("status = 'dead'", updates[2][1])
+        self.assertEqual(conn.commits, 3)
+
+
+class RetryTests(unittest.TestCase):
+    def test_backoff_doubles_and_is_capped(self):
+        with mock.patch.multiple(email_outbox, OUTBOX_RETRY_BASE_SECONDS=60, OUTBOX_RETRY_MAX_SECONDS=600):
+            self.assertEqual([email_outbox.retry_delay(n) for n in (1, 2, 3, 4, 5)], [60, 120, 240, 480, 600])
+
+    def test_unconfigured_smtp_leaves_messages_for_later(self):
+        conn = _outbox_connection([[_row(1, attempts=2)]])
+
+        with mock.patch.object(email_outbox, 'claim_batch', side_effect=lambda c, limit: c.batches.pop(0) if c.batches else []), \
+                mock.patch.dict(os.environ, {'MAIL_SERVER': ''}):
+            stats = email_outbox.flush_outbox(conn, batch_size=1)
+
+        self.assertEqual(stats, {'sent': 0, 'retry': 1, 'dead': 0})
+        sql, params = conn.executed[0]
+        self.assertIn("status = 'pending'", sql)
+        self.assertEqual(params[1], email_outbox.retry_delay(2))
+
+    def test_next_due_in_reads_the_earliest_retry_or_lease(self):
+        self.assertEqual(email_outbox.next_due_in(FakeConnection([(120.0,)])), 120.0)
+        conn = FakeConnection([(None,)])
+        self.assertIsNone(email_outbox.next_due_in(conn))
+        self.assertIn("CASE WHEN status = 'sending' THEN locked_until ELSE next_attempt_at END", conn.executed[0][0])
+
+    def test_a_flush_wakes_itself_when_the_next_retry_is_due(self):
+        app = Flask(__name__)
+        app.config['DATABASE_URL'] = 'postgresql://unused'
+        earlier = mock.Mock()
+        self.addCleanup(setattr, email_outbox, '_wakeup', None)
+        email_outbox._wakeup = earlier
+
+        with app.app_context(), \
+                mock.patch.object(email_outbox.psycopg, 'connect'), \
+                mock.patch.object(email_outbox, 'flush_outbox', return_value={'sent': 0, 'retry': 1, 'dead': 0}), \
+                mock.patch.object(email_outbox, 'next_due_in', return_value=0.5), \
+                mock.patch.object(email_outbox, 'call_later') as call_later:
+            email_outbox._flush_outbox_task()
+
+        earlier.cancel.assert_called_once_with()
+        call_later.assert_called_once_with(email_outbox.OUTBOX_MIN_WAKE_SECONDS, email_outbox.schedule_outbox_flush)
+        self.assertIs(email_outbox._wakeup, call_later.return_value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import file_metadata  # noqa: E402
+from utils.download_helpers import describe_file_metadata  # noqa: E402
+
+
+def _build_pdf(media_boxes, padding=0):
+    """Minimal valid PDF with one empty page per MediaBox, after `padding` bytes of comment."""
+    count = len(media_boxes)
+    kids = ' '.join(f"{3 + i} 0 R" for i in range(count))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {count} >>".encode(),
+    ] + [
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [{box}] >>".encode()
+        for box in media_boxes
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    if padding:
+        out += b"%" + b"x" * padding + b"\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer << /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+# Two A1 landscape sheets and one A4 portrait page.
+_SAMPLE_PDF = _build_pdf(['0 0 2384 1684', '0 0 2384 1684', '0 0 595.28 841.89'])
+
+_SAMPLE_DXF = b"""  0
+SECTION
+  2
+HEADER
+  9
+$ACADVER
+  1
+AC1027
+  0
+ENDSEC
+  0
+EOF
+"""
+
+
+class FileMetadataTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, name, data):
+        path = os.path.join(self._tmp.name, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def test_pdf_page_count_and_sheet_sizes(self):
+        path = self._write('sheets.pdf', _SAMPLE_PDF)
+        metadata = file_metadata.extract_file_metadata(path)
+
+        self.assertEqual(metadata['kind'], 'pdf')
+        self.assertEqual(metadata['sha256'], hashlib.sha256(_SAMPLE_PDF).hexdigest())
+        self.assertEqual(metadata['pdf']['page_count'], 3)
+        sizes = {(s['name'], s['orientation']): s['pages'] for s in metadata['pdf']['page_sizes']}
+        self.assertEqual(sizes, {('A1', 'landscape'): 2, ('A4', 'portrait'): 1})
+
+    def test_pdf_scanner_fallback(self):
+        path = self._write('sheets.pdf', _SAMPLE_PDF)
+        result = file_metadata._pdf_metadata_scan(path)
+
+        self.assertEqual(result['page_count'], 3)
+        self.assertEqual(result['parser'], 'scan')
+
+    def test_pdf_scanner_reads_only_both_ends_of_large_files(self):
+        path = self._write('large.pdf', _build_pdf(['0 0 2384 1684', '0 0 2384 1684'], padding=64 * 1024))
+
+        with mock.patch.object(file_metadata, '_PDF_SCAN_WINDOW_BYTES', 4096):
+            data, complete = file_metadata._read_pdf_windows(path)
+            result = file_metadata._pdf_metadata_scan(path)
+
+        self.assertFalse(complete)
+        self.assertLessEqual(len(data), 2 * 4096 + 1)
+        self.assertEqual(result['page_count'], 2)
+        self.assertEqual([(s['name'], s['pages']) for s in result['page_sizes']], [('A1', 2)])
+
+    def test_pdf_scanner_does_not_guess_a_page_count_from_a_partial_scan(self):
+        data = b"%PDF-1.4\n" + b"%" + b"x" * 8192 + b"\n<< /Type /Page /MediaBox [0 0 595 842] >>\n" + b"%" + b"x" * 8192
+        path = self._write('no-tree.pdf', data)
+
+        with mock.patch.object(file_metadata, '_PDF_SCAN_WINDOW_BYTES', 4096):
+            self.assertIsNone(file_metadata._pdf_metadata_scan(path)['page_count'])
+        self.assertEqual(file_metadata._pdf_metadata_scan(path)['page_count'], 1)
+
+    def test_a_known_checksum_is_not_recomputed(self):
+        path = self._write('sheets.pdf', _SAMPLE_PDF)
+
+        with mock.patch.object(file_metadata, 'hash_file') as hash_file:
+            metadata = file_metadata.extract_file_metadata(path, sha256='ab' * 32)
+
+        hash_file.assert_not_called()
+        self.assertEqual(metadata['sha256'], 'ab' * 32)
+        self.assertEqual(metadata['size_bytes'], len(_SAMPLE_PDF))
+
+    def test_plan_files_reuse_their_stored_checksum(self):
+        path = self._write('sheets.pdf', _SAMPLE_PDF)
+        sha256 = hashlib.sha256(_SAMPLE_PDF).hexdigest()
+
+        with mock.patch.object(file_metadata, 'hash_file') as hash_file:
+            metadata = file_metadata.metadata_for_plan_file({
+                'file_name': 'sheets.pdf', 'file_path': path, 'content_sha256': sha256,
+            })
+
+        hash_file.assert_not_called()
+        self.assertEqual(metadata['sha256'], sha256)
+        self.assertEqual(metadata['pdf']['page_count'], 3)
+
+    def test_dxf_and_dwg_versions(self):
+        dxf = file_metadata.extract_file_metadata(self._write('site.dxf', _SAMPLE_DXF))
+        self.assertEqual(dxf['cad'], {'version_code': 'AC1027', 'version': 'AutoCAD 2013',
+                                      'encoding': 'ascii', 'format': 'DXF'})
+
+        dwg = file_metadata.extract_file_metadata(self._write('frame.dwg', b'AC1032\x00\x00\x00\x00binary'))
+        self.assertEqual(dwg['cad']['version'], 'AutoCAD 2018')
+
+    @unittest.skipIf(file_metadata.Image is None, 'Pillow is not installed')
+    def test_image_dimensions(self):
+        path = os.path.join(self._tmp.name, 'render.png')
+        file_metadata.Image.new('RGB', (64, 48)).save(path)
+
+        metadata = file_metadata.extract_file_metadata(path)
+        self.assertEqual((metadata['image']['width'], metadata['image']['height']), (64, 48))
+
+    def test_unparseable_file_keeps_checksum(self):
+        metadata = file_metadata.extract_file_metadata(self._write('broken.png', b'not an image'))
+
+        self.assertIn('error', metadata)
+        self.assertEqual(metadata['size_bytes'], len(b'not an image'))
+
+    def test_summary_for_manifest(self):
+        path = self._write('sheets.pdf', _SAMPLE_PDF)
+        summary = describe_file_metadata(file_metadata.extract_file_metadata(path))
+
+        self.assertEqual(summary, '3 pages · A1, A4')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+from werkzeug.exceptions import NotFound
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import file_serving  # noqa: E402
+
+
+_SHA = 'ab' * 32
+_BLOB = f'blobs/ab/ab/{_SHA}.pdf'
+_MUTABLE = 'avatars/profile.png'
+
+
+class _FileServingTestCase(unittest.TestCase):
+    backend = 'send_file'
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.root = os.path.realpath(self._tmp.name)
+        patcher = mock.patch.multiple(
+            file_serving,
+            UPLOAD_ROOT=self.root,
+            PACKAGE_SPOOL_DIR=os.path.join(self.root, '.packages'),
+            FILE_SERVING_BACKEND=self.backend,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for relative in (_BLOB, _MUTABLE, '.staging/upload.part'):
+            path = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as handle:
+                handle.write(b'content')
+
+        self.app = Flask(__name__)
+        context = self.app.test_request_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def _serve(self, relative_path):
+        response = file_serving.serve_upload(relative_path)
+        response.direct_passthrough = False
+        self.addCleanup(response.close)
+        return response
+
+
+class ServeUploadTests(_FileServingTestCase):
+    def test_dot_directories_are_never_served(self):
+        for relative in ('.staging/upload.part', 'blobs/.hidden/x.pdf', '.packages/x.zip'):
+            with self.subTest(relative=relative), self.assertRaises(NotFound):
+                file_serving.serve_upload(relative)
+
+    def test_paths_escaping_the_upload_root_are_rejected(self):
+        for relative in ('../secrets.env', 'blobs/../../etc/passwd', '/etc/passwd'):
+            with self.subTest(relative=relative), self.assertRaises(NotFound):
+                file_serving.serve_upload(relative)
+
+    def test_a_missing_file_is_not_found(self):
+        with self.assertRaises(NotFound):
+            file_serving.serve_upload('blobs/missing.pdf')
+
+    def test_blobs_are_cached_as_immutable_with_their_hash(self):
+        response = self._serve(_BLOB)
+
+        self.assertEqual(response.get_data(), b'content')
+        self.assertEqual(response.headers['Cache-Control'], f'public, max-age={file_serving.UPLOADS_CACHE_MAX_AGE_SECONDS}, immutable')
+        self.assertEqual(response.headers['X-Content-SHA256'], _SHA)
+        self.assertEqual(response.get_etag()[0], _SHA)
+
+    def test_other_uploads_get_a_short_revalidated_lifetime(self):
+        response = self._serve(_MUTABLE)
+
+        self.assertEqual(response.headers['Cache-Control'], f'public, max-age={file_serving.UPLOADS_MUTABLE_MAX_AGE_SECONDS}')
+        self.assertNotIn('X-Content-SHA256', response.headers)
+
+    def test_uuid_names_and_derivatives_count_as_immutable(self):
+        self.assertTrue(file_serving.is_immutable_upload('plans/3b6f2a1e-8c4d-4e7a-9f10-5d2c7b8a9e01.png'))
+        self.assertTrue(file_serving.is_immutable_upload(f'derivatives/ab/{_SHA}/640.webp'))
+        self.assertFalse(file_serving.is_immutable_upload(_MUTABLE))
+
+
+class XAccelRedirectTests(_FileServingTestCase):
+    backend = 'x-accel-redirect'
+
+    def test_the_proxy_is_told_which_file_to_stream(self):
+        response = self._serve(_BLOB)
+
+        self.assertEqual(response.headers['X-Accel-Redirect'], f'{file_serving.X_ACCEL_REDIRECT_PREFIX}{_BLOB}')
+        self.assertNotIn('X-Sendfile', response.headers)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_dot_directories_are_rejected_before_offloading(self):
+        with self.assertRaises(NotFound):
+            file_serving.serve_upload('.packages/x.zip')
+
+
+class XSendfileTests(_FileServingTestCase):
+    backend = 'x-sendfile'
+
+    def test_the_server_is_given_the_absolute_path(self):
+        response = self._serve(_MUTABLE)
+
+        self.assertEqual(response.headers['X-Sendfile'], os.path.join(self.root, _MUTABLE))
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+
+class SendPackageTests(_FileServingTestCase):
+    backend = 'x-accel-redirect'
+
+    def test_a_package_is_spooled_and_offloaded_as_an_uncached_attachment(self):
+        response = file_serving.send_package(io.BytesIO(b'zip-bytes'), 'Plan Package.zip')
+
+        (spooled,) = os.listdir(file_serving.PACKAGE_SPOOL_DIR)
+        self.assertTrue(spooled.endswith('.zip'))
+        with open(os.path.join(file_serving.PACKAGE_SPOOL_DIR, spooled), 'rb') as handle:
+            self.assertEqual(handle.read(), b'zip-bytes')
+        self.assertEqual(response.headers['X-Accel-Redirect'], f'{file_serving.X_ACCEL_REDIRECT_PREFIX}.packages/{spooled}')
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="Plan Package.zip"')
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+
+    def test_stale_spool_files_are_pruned_on_the_next_write(self):
+        os.makedirs(file_serving.PACKAGE_SPOOL_DIR)
+        stale = os.path.join(file_serving.PACKAGE_SPOOL_DIR, 'stale.zip')
+        fresh = os.path.join(file_serving.PACKAGE_SPOOL_DIR, 'fresh.zip')
+        for path in (stale, fresh):
+            open(path, 'wb').close()
+        expired = time.time() - file_serving.PACKAGE_SPOOL_TTL_SECONDS - 60
+        os.utime(stale, (expired, expired))
+
+        file_serving.send_package(io.BytesIO(b'zip-bytes'), 'plan.zip')
+
+        remaining = os.listdir(file_serving.PACKAGE_SPOOL_DIR)
+        self.assertNotIn('stale.zip', remaining)
+        self.assertIn('fresh.zip', remaining)
+        self.assertEqual(len(remaining), 2)
+
+    def test_non_ascii_names_get_an_encoded_filename(self):
+        response = file_serving.send_package(io.BytesIO(b'zip-bytes'), 'Plän.zip')
+
+        self.assertEqual(
+            response.headers['Content-Disposition'],
+            "attachment; filename=\"Pln.zip\"; filename*=UTF-8''Pl%C3%A4n.zip"
+        )
+
+
+class SendPackageWithoutProxyTests(_FileServingTestCase):
+    def test_the_package_is_sent_directly_and_nothing_is_spooled(self):
+        response = file_serving.send_package(io.BytesIO(b'zip-bytes'), 'plan.zip')
+        response.direct_passthrough = False
+
+        self.assertEqual(response.get_data(), b'zip-bytes')
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        self.assertFalse(os.path.exists(file_serving.PACKAGE_SPOOL_DIR))
+
+
+if __name__ == '__main__':
+    unittest.main()
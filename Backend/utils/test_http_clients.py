@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import http_clients  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        with self.server.lock:
+            self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+            hits = self.server.hits[self.path]
+        status = 503 if self.path == '/flaky' and hits == 1 else 200
+        if self.path == '/down':
+            status = 503
+        body = b'{"status": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientsTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.server.hits = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self._stop_server)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        patcher = mock.patch.object(http_clients, 'HTTP_RETRY_BACKOFF_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        http_clients.reset_http_clients()
+        self.addCleanup(http_clients.reset_http_clients)
+
+    def _stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def test_calls_to_one_upstream_share_a_connection(self):
+        for _ in range(5):
+            resp = http_clients.request('paystack', 'GET', f"{self.base}/verify")
+            self.assertEqual(resp.json(), {'status': True})
+
+        metrics = http_clients.http_client_metrics()['paystack']
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(metrics['connections_opened'], 1)
+        self.assertEqual(metrics['statuses'], {'2xx': 5})
+        self.assertEqual(metrics['latency']['count'], 5)
+
+    def test_idempotent_requests_retry_a_503_but_posts_do_not(self):
+        resp = http_clients.request('paystack', 'GET', f"{self.base}/flaky")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(http_clients.http_client_metrics()['paystack']['retries'], 1)
+
+        resp = http_clients.request('paystack', 'POST', f"{self.base}/down", json={})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.hits['/down'], 1)
+
+    def test_connection_failures_are_counted_per_upstream(self):
+        self._stop_server()
+        with self.assertRaises(requests.ConnectionError):
+            http_clients.request('llm', 'POST', f"{self.base}/v1/chat/completions", json={})
+
+        metrics = http_clients.http_client_metrics()
+        self.assertEqual(metrics['llm']['errors'], {'connection': 1})
+        self.assertEqual(metrics['paystack']['errors'], {})
+
+    def test_unknown_upstreams_are_rejected(self):
+        with self.assertRaises(KeyError):
+            http_clients.get_session('nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import image_derivatives  # noqa: E402
+
+
+@unittest.skipIf(image_derivatives.Image is None, "Pillow is not installed")
+class LocalDerivativeTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.root = os.path.realpath(self._tmp.name)
+        patcher = mock.patch.object(image_derivatives, 'UPLOAD_ROOT', self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        os.makedirs(os.path.join(self.root, 'blobs'))
+        image_derivatives.Image.new('RGB', (800, 400), (20, 120, 110)).save(os.path.join(self.root, 'blobs', 'cover.png'))
+
+    def test_an_upload_round_trips_through_every_format(self):
+        result = image_derivatives.build_derivatives('/uploads/blobs/cover.png')
+
+        self.assertEqual((result['width'], result['height']), (800, 400))
+        self.assertTrue(result['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertEqual(set(result['variants']), set(image_derivatives._derivative_formats()))
+
+        for fmt, variants in result['variants'].items():
+            # Never upscaled: the widths above 800 collapse into the original width.
+            self.assertEqual([v['width'] for v in variants], [320, 640, 800])
+            for variant in variants:
+                path = os.path.join(self.root, variant['url'][len('/uploads/'):])
+                with image_derivatives.Image.open(path) as image:
+                    self.assertEqual(image.format, fmt.upper())
+                    self.assertEqual(image.size, (variant['width'], variant['width'] // 2))
+
+    @unittest.skipUnless(image_derivatives._AVIF_SUPPORTED, "Pillow was built without AVIF")
+    def test_avif_variants_are_made_when_supported(self):
+        result = image_derivatives.build_derivatives('/uploads/blobs/cover.png')
+
+        self.assertIn('avif', result['variants'])
+
+    def test_sources_outside_the_upload_root_are_ignored(self):
+        self.assertIsNone(image_derivatives.build_derivatives('/uploads/../../etc/passwd'))
+        self.assertIsNone(image_derivatives.build_derivatives('/uploads/blobs/missing.png'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import pdf_previews  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+_SHA = 'ab' + 'c' * 62
+
+
+@unittest.skipIf(pdf_previews.Image is None, 'Pillow is not installed')
+class RenderPreviewTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _pages(self, pdf_path, page_limit, dpi):
+        for number in range(1, 6)[:page_limit]:
+            yield number, pdf_previews.Image.new('RGB', (2400, 1700), 'white')
+
+    def test_pages_are_downscaled_watermarked_and_limited(self):
+        out_dir = os.path.join(self._tmp.name, 'v1', 'ab', _SHA)
+        with mock.patch.object(pdf_previews, '_rasterize', self._pages):
+            result = pdf_previews.render_pdf_previews('plan.pdf', out_dir, page_limit=2, max_width=600)
+
+        self.assertEqual([p['name'] for p in result['pages']], ['p1.webp', 'p2.webp'])
+        self.assertEqual((result['pages'][0]['width'], result['pages'][0]['height']), (600, 425))
+        self.assertEqual(sorted(os.listdir(out_dir)), ['p1.webp', 'p2.webp'])
+        self.assertEqual(result['size_bytes'], sum(os.path.getsize(os.path.join(out_dir, n)) for n in os.listdir(out_dir)))
+        # Only the finished set is left in the parent directory.
+        self.assertEqual(os.listdir(os.path.dirname(out_dir)), [_SHA])
+
+        with pdf_previews.Image.open(os.path.join(out_dir, 'p1.webp')) as image:
+            colors = image.convert('RGB').getcolors(maxcolors=1 << 16)
+        self.assertGreater(len(colors), 1, 'watermark should mark the blank page')
+
+    def test_failed_render_leaves_no_partial_output(self):
+        def broken(pdf_path, page_limit, dpi):
+            yield 1, pdf_previews.Image.new('RGB', (100, 100), 'white')
+            raise RuntimeError('corrupt page')
+
+        out_dir = os.path.join(self._tmp.name, 'ab', _SHA)
+        with mock.patch.object(pdf_previews, '_rasterize', broken):
+            with self.assertRaises(RuntimeError):
+                pdf_previews.render_pdf_previews('plan.pdf', out_dir)
+
+        self.assertEqual(os.listdir(os.path.dirname(out_dir)), [])
+
+
+class PreviewCacheTests(unittest.TestCase):
+    def test_preview_urls_are_built_from_the_checksum(self):
+        conn = FakeConnection([[{'content_sha256': _SHA, 'pages': '[{"page": 1, "width": 10, "height": 7, "name": "p1.webp"}]'}]])
+
+        previews = pdf_previews.fetch_preview_map(conn.cursor(), [_SHA, _SHA, None])
+
+        self.assertEqual(previews[_SHA][0]['url'], f"/uploads/previews/v{pdf_previews.PREVIEW_VERSION}/ab/{_SHA}/p1.webp")
+        self.assertEqual(conn.executed[0][1][0], [_SHA])
+
+    def test_oldest_previews_are_evicted_until_under_the_limit(self):
+        old, mid, new = 'a' * 64, 'b' * 64, 'c' * 64
+        conn = FakeConnection([
+            {'total': 300},
+            [{'content_sha256': sha, 'version': 1, 'size_bytes': 100} for sha in (old, mid, new)],
+        ])
+
+        with mock.patch.object(pdf_previews.shutil, 'rmtree') as rmtree:
+            evicted = pdf_previews.enforce_preview_cache_limit(conn, max_bytes=150)
+
+        self.assertEqual(evicted, 2)
+        self.assertIn('ORDER BY created_at ASC', conn.executed[1][0])
+        self.assertEqual(conn.executed[-1][1], ([old, mid],))
+        self.assertEqual(rmtree.call_count, 2)
+        self.assertTrue(conn.committed)
+
+    def test_cache_under_limit_is_left_alone(self):
+        conn = FakeConnection([{'total': 10}])
+
+        self.assertEqual(pdf_previews.enforce_preview_cache_limit(conn, max_bytes=100), 0)
+        self.assertEqual(len(conn.executed), 1)
+
+
+class _StuckPool:
+    """A process pool whose render never finishes."""
+
+    def __init__(self):
+        self._processes = {1: mock.Mock()}
+        self.shutdown = mock.Mock()
+
+    def submit(self, fn, *args):
+        return Future()
+
+
+class RenderTimeoutTests(unittest.TestCase):
+    def test_a_render_that_times_out_is_stopped_and_the_pool_replaced(self):
+        pool = _StuckPool()
+        with mock.patch.object(pdf_previews, '_process_pool', pool), \
+                mock.patch.object(pdf_previews, 'PREVIEW_TIMEOUT_SECONDS', 0.01):
+            with self.assertRaises(TimeoutError):
+                pdf_previews._run_in_pool('/tmp/plan.pdf', '/tmp/out')
+            self.assertIsNone(pdf_previews._process_pool)
+
+        pool._processes[1].terminate.assert_called_once_with()
+        pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+    def test_previews_do_not_run_on_the_shared_background_pool(self):
+        self.addCleanup(pdf_previews._pending_plans.discard, 'plan-1')
+        with mock.patch.object(pdf_previews, 'rasterizer_available', return_value=True), \
+                mock.patch.object(pdf_previews._preview_pool, 'submit') as submit:
+            pdf_previews.schedule_plan_pdf_previews('plan-1')
+
+        submit.assert_called_once_with(pdf_previews._generate_plan_pdf_previews_task, 'plan-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from types import SimpleNamespace
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import purchase_events  # noqa: E402
+
+
+def _payload(purchase_id, status):
+    return json.dumps({'purchase_id': purchase_id, 'status': status})
+
+
+class _FakeListenConnection:
+    def __init__(self, listener, payloads):
+        self.listener = listener
+        self.payloads = payloads
+        self.executed = []
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def notifies(self, timeout=None):
+        for payload in self.payloads:
+            yield SimpleNamespace(payload=payload)
+        self.listener.stop()
+
+    def close(self):
+        pass
+
+
+class PurchaseListenerTests(unittest.TestCase):
+    def test_notifications_reach_only_that_purchases_subscribers(self):
+        listener = purchase_events.PurchaseListener('postgresql://unused')
+        listener._thread = threading.current_thread()  # keep subscribe() from starting the real thread
+        first, second = listener.subscribe('p1'), listener.subscribe('p1')
+        other = listener.subscribe('p2')
+
+        listener.dispatch(_payload('p1', 'completed'))
+        listener.dispatch('not json')
+        listener.unsubscribe('p1', second)
+        listener.dispatch(_payload('p1', 'failed'))
+
+        self.assertEqual([first.get_nowait()['status'], first.get_nowait()['status']], ['completed', 'failed'])
+        self.assertEqual(second.get_nowait()['status'], 'completed')
+        self.assertTrue(second.empty())
+        self.assertTrue(other.empty())
+        self.assertEqual(listener.subscriber_count(), 2)
+
+    def test_subscribers_resync_after_the_listener_reconnects(self):
+        attempts = []
+
+        def connect(dsn):
+            attempts.append(dsn)
+            if len(attempts) == 1:
+                raise OSError('connection refused')
+            return conn
+
+        listener = purchase_events.PurchaseListener('postgresql://db', connect=connect, reconnect_seconds=(0, 0))
+        conn = _FakeListenConnection(listener, [_payload('p1', 'completed')])
+        events = listener.subscribe('p1')
+        listener._thread.join(timeout=5)
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(conn.executed, ['LISTEN purchase_status'])
+        received = [events.get_nowait() for _ in range(events.qsize())]
+        self.assertIs(received[0], purchase_events.RESYNC)
+        self.assertIs(received[1], purchase_events.RESYNC)
+        self.assertEqual(received[2]['status'], 'completed')
+
+
+class PurchaseEventStreamTests(unittest.TestCase):
+    def _stream(self, reads, events, **kwargs):
+        reads = list(reads)
+        kwargs.setdefault('max_seconds', 5)
+        kwargs.setdefault('heartbeat_seconds', 0.01)
+        kwargs.setdefault('recheck_seconds', 60)
+        return purchase_events.purchase_event_stream('p1', lambda: reads.pop(0), events, **kwargs)
+
+    def _statuses(self, chunks):
+        return [json.loads(chunk.split('data: ', 1)[1])['status'] for chunk in chunks if 'event: status' in chunk]
+
+    def test_a_pushed_completion_ends_the_stream(self):
+        listener = purchase_events.PurchaseListener('postgresql://unused')
+        listener._thread = threading.current_thread()
+        events = listener.subscribe('p1')
+        listener.dispatch(_payload('p1', 'pending'))
+        listener.dispatch(json.dumps({'purchase_id': 'p1', 'status': 'completed', 'download_ready': True}))
+
+        chunks = list(self._stream([{'purchase_id': 'p1', 'status': 'pending', 'download_ready': False}], events))
+
+        self.assertTrue(chunks[0].startswith('retry: '))
+        self.assertEqual(self._statuses(chunks), ['pending', 'completed'])
+        self.assertIn('"download_ready": true', chunks[-1])
+
+    def test_an_already_completed_purchase_sends_one_event(self):
+        chunks = list(self._stream([{'status': 'completed'}], purchase_events.queue.Queue()))
+
+        self.assertEqual(self._statuses(chunks), ['completed'])
+
+    def test_a_resync_rereads_the_purchase(self):
+        events = purchase_events.queue.Queue()
+        events.put(purchase_events.RESYNC)
+
+        chunks = list(self._stream([{'status': 'pending'}, {'status': 'completed'}], events))
+
+        self.assertEqual(self._statuses(chunks), ['pending', 'completed'])
+
+    def test_quiet_streams_send_heartbeats_until_the_deadline(self):
+        chunks = list(self._stream([{'status': 'pending'}], purchase_events.queue.Queue(), max_seconds=0.05))
+
+        self.assertEqual(self._statuses(chunks), ['pending'])
+        self.assertIn(': keep-alive\n\n', chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
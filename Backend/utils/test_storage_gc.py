@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import storage_gc  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+class _Catalogue:
+    """What the database knows about stored files, patched in behind the collector's queries."""
+
+    def __init__(self, referenced=(), json_references=(), walk_cursor=None):
+        self.referenced = set(referenced)
+        self.json_references = set(json_references)
+        self.walk_cursor = walk_cursor
+        self.passes_completed = 0
+
+    def patch(self):
+        def find_referenced(cur, storage_keys, json_references=frozenset()):
+            return {key for key in storage_keys
+                    if key in self.referenced or f'/uploads/{key}' in json_references}
+
+        def save(cur, walk_cursor):
+            self.walk_cursor = walk_cursor
+
+        def finish(cur):
+            self.walk_cursor = None
+            self.passes_completed += 1
+
+        return mock.patch.multiple(
+            storage_gc,
+            find_referenced=find_referenced,
+            load_json_references=lambda cur: set(self.json_references),
+            _load_walk_cursor=lambda cur: self.walk_cursor,
+            _save_walk_cursor=save,
+            _finish_pass=finish,
+        )
+
+
+class StorageGcTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = self._tmp.name
+        self._patch = mock.patch.multiple(
+            storage_gc,
+            UPLOAD_ROOT=root,
+            QUARANTINE_FOLDER=os.path.join(root, '.quarantine'),
+            STAGING_FOLDER=os.path.join(root, '.staging'),
+        )
+        self._patch.start()
+        self.root = root
+
+    def tearDown(self):
+        self._patch.stop()
+        self._tmp.cleanup()
+
+    def _write(self, relative_path, age_seconds=30 * 86400):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(b'x' * 10)
+        stamp = time.time() - age_seconds
+        os.utime(path, (stamp, stamp))
+        return relative_path
+
+    def test_walk_is_ordered_and_resumable(self):
+        for relative_path in ('plans/b/2.pdf', 'plans/a/1.pdf', 'plans/a-b/3.pdf', 'blobs/ab/cd/x.pdf', 'previews/p1.webp'):
+            self._write(relative_path)
+
+        everything = list(storage_gc.iter_storage_files())
+        self.assertEqual(everything, ['blobs/ab/cd/x.pdf', 'plans/a/1.pdf', 'plans/a-b/3.pdf', 'plans/b/2.pdf'])
+        self.assertEqual(list(storage_gc.iter_storage_files(start_after='plans/a/1.pdf')),
+                         ['plans/a-b/3.pdf', 'plans/b/2.pdf'])
+
+    def _quarantined(self):
+        quarantine = os.path.join(self.root, '.quarantine')
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, name), quarantine)
+            for dirpath, _, names in os.walk(quarantine) for name in names
+        )
+
+    def test_only_old_unreferenced_files_are_quarantined(self):
+        orphan = self._write('plans/old/orphan.pdf')
+        kept = self._write('blobs/aa/bb/kept.pdf')
+        gallery = self._write('plans/p1/images/gallery.jpg')
+        recent = self._write('plans/new/recent.pdf', age_seconds=60)
+        catalogue = _Catalogue(referenced={kept}, json_references={f'/uploads/{gallery}'})
+        conn = FakeConnection()
+
+        with catalogue.patch():
+            stats = storage_gc.collect_garbage(conn, grace_seconds=86400)
+
+        self.assertEqual(self._quarantined(), [orphan])
+        self.assertFalse(os.path.exists(os.path.join(self.root, orphan)))
+        for still_there in (kept, gallery, recent):
+            self.assertTrue(os.path.exists(os.path.join(self.root, still_there)))
+        self.assertEqual(stats['examined'], 4)
+        self.assertEqual(stats['quarantined'], 1)
+        # The quarantine row is written, and the orphan's blob row dropped only if nothing holds it.
+        inserts = [params for sql, params in conn.executed if sql.startswith('INSERT INTO storage_quarantine')]
+        self.assertEqual(inserts, [(orphan, 10)])
+        self.assertIn('ref_count = 0', conn.statements('DELETE FROM file_blobs')[0])
+
+    def test_dry_runs_move_nothing(self):
+        orphan = self._write('plans/old/orphan.pdf')
+        conn = FakeConnection()
+
+        with _Catalogue().patch():
+            stats = storage_gc.collect_garbage(conn, grace_seconds=0, dry_run=True)
+
+        self.assertEqual(stats['quarantined'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.root, orphan)))
+        self.assertEqual(conn.executed, [])
+
+    def test_limit_persists_the_walk_position(self):
+        for name in ('a', 'b', 'c'):
+            self._write(f'plans/{name}/file.pdf')
+        catalogue = _Catalogue(referenced={'plans/a/file.pdf', 'plans/b/file.pdf', 'plans/c/file.pdf'})
+
+        with catalogue.patch(), \
+                mock.patch.object(storage_gc, 'refresh_storage_usage'), \
+                mock.patch.object(storage_gc, 'purge_quarantine', return_value=0):
+            first = storage_gc.collect_garbage(FakeConnection(), limit=2)
+            self.assertFalse(first['pass_completed'])
+            self.assertEqual(catalogue.walk_cursor, 'plans/b/file.pdf')
+
+            second = storage_gc.collect_garbage(FakeConnection(), limit=2)
+        self.assertEqual(second['examined'], 1)
+        self.assertTrue(second['pass_completed'])
+        self.assertIsNone(catalogue.walk_cursor)
+        self.assertEqual(catalogue.passes_completed, 1)
+
+    def test_references_are_matched_under_every_path_spelling(self):
+        key = 'plans/p1/plan.pdf'
+        conn = FakeConnection([[{'ref': f'/uploads/{key}'}]])
+
+        referenced = storage_gc.find_referenced(conn.cursor(), [key, 'plans/p2/gone.pdf'])
+
+        self.assertEqual(referenced, {key})
+        params = conn.executed[0][1]
+        self.assertEqual(params['keys'], [key, 'plans/p2/gone.pdf'])
+        self.assertIn(os.path.join(self.root, key), params['paths'])
+
+    def test_restore_moves_the_file_back(self):
+        orphan = self._write('plans/old/orphan.pdf')
+        with _Catalogue().patch():
+            storage_gc.collect_garbage(FakeConnection(), grace_seconds=0, dry_run=False, limit=10)
+
+        conn = FakeConnection()
+        self.assertTrue(storage_gc.restore_quarantined(conn, orphan))
+        self.assertTrue(os.path.exists(os.path.join(self.root, orphan)))
+        self.assertEqual(conn.executed[0][1], (orphan,))
+        self.assertFalse(storage_gc.restore_quarantined(conn, orphan))
+
+if __name__ == '__main__':
+    unittest.main()
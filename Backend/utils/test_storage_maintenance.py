@@ -0,0 +1,141 @@
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import storage_maintenance  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+_FILE_ID = '3b6f2a1e-8c4d-4e7a-9f10-5d2c7b8a9e01'
+_CONTENT = b'legacy plan'
+
+
+class _StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.root = os.path.realpath(self._tmp.name)
+        patcher = mock.patch.object(storage_maintenance, 'UPLOAD_ROOT', self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.logged = []
+
+    def _write(self, relative, content=_CONTENT):
+        path = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        return path
+
+    def _recorded_mtime(self, path):
+        return datetime.utcfromtimestamp(os.stat(path).st_mtime)
+
+
+class BackfillStorageDescriptorsTests(_StorageTestCase):
+    def test_a_row_without_a_descriptor_gets_one_and_its_blob_is_registered(self):
+        path = self._write('plans/legacy.pdf')
+        conn = FakeConnection([[{'id': _FILE_ID, 'file_path': path}], []])
+
+        result = storage_maintenance.backfill_storage_descriptors(conn, log=self.logged.append)
+
+        self.assertEqual(result, {'updated': 1, 'missing': 0})
+        sha256 = hashlib.sha256(_CONTENT).hexdigest()
+        (blob,) = [params for sql, params in conn.executed if sql.startswith('INSERT INTO file_blobs')]
+        self.assertEqual(blob, ('plans/legacy.pdf', sha256, len(_CONTENT)))
+        (update,) = [params for sql, params in conn.executed if sql.startswith('UPDATE plan_files')]
+        self.assertEqual(update, (
+            'local', 'plans/legacy.pdf', self._recorded_mtime(path), 'plans/legacy.pdf', sha256, len(_CONTENT), _FILE_ID,
+        ))
+        self.assertTrue(conn.committed)
+
+    def test_url_rows_are_described_without_a_blob(self):
+        url = 'https://res.cloudinary.com/demo/raw/upload/plan.pdf'
+        conn = FakeConnection([[{'id': _FILE_ID, 'file_path': url}], []])
+
+        result = storage_maintenance.backfill_storage_descriptors(conn, log=self.logged.append)
+
+        self.assertEqual(result, {'updated': 1, 'missing': 0})
+        self.assertEqual(conn.statements('INSERT INTO file_blobs'), [])
+        (update,) = [params for sql, params in conn.executed if sql.startswith('UPDATE plan_files')]
+        self.assertEqual(update[:2], ('url', url))
+
+    def test_missing_files_are_counted_and_left_for_later(self):
+        conn = FakeConnection([[{'id': _FILE_ID, 'file_path': '/uploads/gone.pdf'}], []])
+
+        result = storage_maintenance.backfill_storage_descriptors(conn, log=self.logged.append)
+
+        self.assertEqual(result, {'updated': 0, 'missing': 1})
+        self.assertEqual(conn.statements('UPDATE plan_files'), [])
+        self.assertIn('file not found', self.logged[0])
+
+    def test_batches_page_by_id(self):
+        path = self._write('plans/legacy.pdf')
+        conn = FakeConnection([[{'id': _FILE_ID, 'file_path': path}], []])
+
+        storage_maintenance.backfill_storage_descriptors(conn, batch_size=1, log=self.logged.append)
+
+        selects = [params for sql, params in conn.executed if sql.startswith('SELECT id, file_path')]
+        self.assertEqual(selects, [(None, None, 1), (_FILE_ID, _FILE_ID, 1)])
+
+
+class VerifyStorageDescriptorsTests(_StorageTestCase):
+    def _row(self, storage_key, **overrides):
+        row = {'id': _FILE_ID, 'storage_key': storage_key, 'file_size': len(_CONTENT),
+               'content_sha256': hashlib.sha256(_CONTENT).hexdigest(), 'storage_mtime': None}
+        row.update(overrides)
+        return row
+
+    def _verify(self, rows, **kwargs):
+        conn = FakeConnection([rows, []])
+        return storage_maintenance.verify_storage_descriptors(conn, log=self.logged.append, **kwargs)
+
+    def test_a_matching_file_passes(self):
+        path = self._write('blobs/plan.pdf')
+
+        result = self._verify([self._row('blobs/plan.pdf', storage_mtime=self._recorded_mtime(path))], check_checksums=True)
+
+        self.assertEqual(result, {'checked': 1, 'problems': 0, 'mtime_changed': 0})
+        self.assertEqual(self.logged, [])
+
+    def test_a_missing_file_is_a_problem(self):
+        result = self._verify([self._row('blobs/gone.pdf')])
+
+        self.assertEqual(result, {'checked': 1, 'problems': 1, 'mtime_changed': 0})
+        self.assertEqual(self.logged, [f'plan_file {_FILE_ID}: missing blobs/gone.pdf'])
+
+    def test_a_size_mismatch_is_a_problem(self):
+        self._write('blobs/plan.pdf', b'truncated')
+
+        result = self._verify([self._row('blobs/plan.pdf')])
+
+        self.assertEqual(result['problems'], 1)
+        self.assertIn('size 9 != recorded 11', self.logged[0])
+
+    def test_an_mtime_mismatch_is_reported_separately(self):
+        path = self._write('blobs/plan.pdf')
+        recorded = self._recorded_mtime(path) - timedelta(hours=1)
+
+        result = self._verify([self._row('blobs/plan.pdf', storage_mtime=recorded)])
+
+        self.assertEqual(result, {'checked': 1, 'problems': 0, 'mtime_changed': 1})
+        self.assertIn(f'!= recorded {recorded.isoformat()}', self.logged[0])
+
+    def test_a_checksum_mismatch_is_only_found_when_asked_for(self):
+        self._write('blobs/plan.pdf', b'tampered!!!')
+        row = self._row('blobs/plan.pdf')
+
+        self.assertEqual(self._verify([row])['problems'], 0)
+        self.assertEqual(self._verify([row], check_checksums=True)['problems'], 1)
+        self.assertIn('checksum mismatch', self.logged[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import upload_store  # noqa: E402
+
+
+class UploadStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = self._tmp.name
+        self._patch = mock.patch.multiple(
+            upload_store,
+            UPLOAD_ROOT=root,
+            BLOB_FOLDER=os.path.join(root, 'blobs'),
+            STAGING_FOLDER=os.path.join(root, '.staging'),
+        )
+        self._patch.start()
+
+    def tearDown(self):
+        self._patch.stop()
+        self._tmp.cleanup()
+
+    def test_stream_is_hashed_and_stored_by_sha256(self):
+        payload = b'%PDF-1.4 plan sheet' * 1000
+        stored = upload_store.store_stream(io.BytesIO(payload), 'Ground Floor.PDF')
+
+        expected = hashlib.sha256(payload).hexdigest()
+        self.assertEqual(stored['sha256'], expected)
+        self.assertEqual(stored['size'], len(payload))
+        self.assertEqual(stored['storage_key'], f"blobs/{expected[:2]}/{expected[2:4]}/{expected}.pdf")
+        self.assertEqual(stored['file_path'], f"/uploads/{stored['storage_key']}")
+        with open(stored['absolute_path'], 'rb') as handle:
+            self.assertEqual(handle.read(), payload)
+
+    def test_identical_content_is_stored_once(self):
+        first = upload_store.store_stream(io.BytesIO(b'same dwg bytes'), 'a.dwg')
+        second = upload_store.store_stream(io.BytesIO(b'same dwg bytes'), 'b.dwg')
+
+        self.assertTrue(first['created'])
+        self.assertFalse(second['created'])
+        self.assertEqual(first['storage_key'], second['storage_key'])
+        self.assertEqual(os.listdir(upload_store.STAGING_FOLDER), [])
+
+
+class _RecordingCursor:
+    def __init__(self):
+        self.calls = []
+
+    def executemany(self, sql, rows):
+        self.calls.append((sql, rows))
+
+
+class DeliverableKeyTests(unittest.TestCase):
+    def test_file_types_map_to_deliverables(self):
+        self.assertEqual(upload_store.deliverable_key_for_file_type('MEP_PLUMBING'), 'mep')
+        self.assertEqual(upload_store.deliverable_key_for_file_type('boq_cost_summary'), 'boq')
+        self.assertIsNone(upload_store.deliverable_key_for_file_type('png'))
+        self.assertIsNone(upload_store.deliverable_key_for_file_type(None))
+
+    def test_deliverable_key_is_stored_at_insert_time(self):
+        cur = _RecordingCursor()
+        upload_store.insert_plan_file_records(cur, 'plan-1', [
+            {'file_name': 'floor.pdf', 'file_type': 'ARCHITECTURAL', 'file_path': 'plans/floor.pdf'},
+            {'file_name': 'extra.zip', 'file_type': 'OTHER', 'file_path': 'plans/extra.zip'},
+        ])
+
+        sql, rows = cur.calls[-1]
+        self.assertIn('deliverable_key', sql)
+        self.assertEqual([row[-1] for row in rows], ['architectural', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
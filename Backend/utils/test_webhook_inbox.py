@@ -0,0 +1,142 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from utils import webhook_inbox  # noqa: E402
+from utils.fake_db import FakeConnection  # noqa: E402
+
+
+def _inbox_connection(batches):
+    conn = FakeConnection()
+    conn.batches = list(batches)
+    return conn
+
+
+def _row(row_id, attempts=1):
+    return {'id': row_id, 'event_key': f'charge.success:{row_id}', 'event_type': 'charge.success',
+            'reference': f'ref-{row_id}', 'payload': {'data': {}}, 'attempts': attempts}
+
+
+def _claim(conn, provider, limit):
+    return conn.batches.pop(0) if conn.batches else []
+
+
+class WebhookInboxTests(unittest.TestCase):
+    def test_redelivered_events_are_not_stored_twice(self):
+        conn = FakeConnection([{'id': 41}, None])
+        cur = conn.cursor()
+        self.assertEqual(webhook_inbox.record_webhook(cur, 'paystack', 'k', 'charge.success', 'r', {}), 41)
+        self.assertIsNone(webhook_inbox.record_webhook(cur, 'paystack', 'k', 'charge.success', 'r', {}))
+        self.assertIn('ON CONFLICT (provider, event_key) DO NOTHING', conn.executed[0][0])
+
+    def test_handler_work_commits_only_with_a_done_outcome(self):
+        def handler(conn, cur, row):
+            cur.execute(f"UPDATE purchases SET payment_status = 'completed' -- {row['id']}")
+            return {1: ('done', 'ok'), 2: ('ignored', 'not settled'), 3: ('rejected', 'amount mismatch')}[row['id']]
+
+        conn = _inbox_connection([[_row(1), _row(2), _row(3)]])
+        with mock.patch.object(webhook_inbox, 'claim_batch', side_effect=_claim):
+            stats = webhook_inbox.process_inbox(conn, 'paystack', handler, batch_size=10)
+
+        self.assertEqual((stats['done'], stats['ignored'], stats['rejected']), (1, 1, 1))
+        kinds = [entry[0] if entry[0] != 'sql' else entry[1].split()[1] for entry in conn.events]
+        self.assertEqual(kinds, [
+            'purchases', 'webhook_inbox', 'commit',
+            'purchases', 'rollback', 'webhook_inbox', 'commit',
+            'purchases', 'rollback', 'webhook_inbox', 'commit',
+        ])
+
+    def test_failures_back_off_then_go_dead(self):
+        def handler(conn, cur, row):
+            raise RuntimeError('database went away')
+
+        conn = _inbox_connection([[_row(1, attempts=1), _row(2, attempts=webhook_inbox.WEBHOOK_INBOX_MAX_ATTEMPTS)]])
+        with mock.patch.object(webhook_inbox, 'claim_batch', side_effect=_claim):
+            stats = webhook_inbox.process_inbox(conn, 'paystack', handler, batch_size=10)
+
+        self.assertEqual((stats['retry'], stats['dead']), (1, 1))
+        updates = [entry for entry in conn.events if entry[0] == 'sql']
+        self.assertIn("status = 'pending'", updates[0][1])
+        self.assertEqual(updates[0][2][1], webhook_inbox.retry_delay(1))
+        self.assertIn("status = 'dead'", updates[1][1])
+
+    def test_claims_wait_for_earlier_events_on_the_same_reference(self):
+        conn = FakeConnection([[{'id': 5}, {'id': 3}]])
+
+        rows = webhook_inbox.claim_batch(conn, 'paystack', 10)
+
+        sql, params = conn.executed[0]
+        self.assertIn('earlier.reference = w.reference AND earlier.id < w.id', sql)
+        self.assertIn("earlier.status IN ('pending', 'processing')", sql)
+        self.assertIn('ORDER BY w.id LIMIT %s FOR UPDATE SKIP LOCKED', sql)
+        self.assertIn("SET status = 'processing', attempts = attempts + 1", sql)
+        self.assertEqual(params, (webhook_inbox.WEBHOOK_INBOX_LEASE_SECONDS, 'paystack', 10))
+        # The lease is committed before any handler runs, so a second consumer skips these rows.
+        self.assertEqual(conn.events[-1], ('commit',))
+        self.assertEqual([row['id'] for row in rows], [3, 5])
+
+
+class InboxWakeupTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['DATABASE_URL'] = 'postgresql://unused'
+        self.addCleanup(webhook_inbox._wakeups.clear)
+
+    def test_next_due_in_reads_the_earliest_retry_or_lease(self):
+        self.assertEqual(webhook_inbox.next_due_in(FakeConnection([(42.5,)]), 'paystack'), 42.5)
+        self.assertEqual(webhook_inbox.next_due_in(FakeConnection([(-3.0,)]), 'paystack'), 0.0)
+        conn = FakeConnection([(None,)])
+        self.assertIsNone(webhook_inbox.next_due_in(conn, 'paystack'))
+
+        sql, params = conn.executed[0]
+        self.assertIn("CASE WHEN status = 'processing' THEN locked_until ELSE next_attempt_at END", sql)
+        self.assertIn("status IN ('pending', 'processing')", sql)
+        self.assertEqual(params, ('paystack',))
+
+    def _drain(self, delay):
+        handler = mock.Mock()
+        with self.app.app_context(), \
+                mock.patch.object(webhook_inbox.psycopg, 'connect'), \
+                mock.patch.object(webhook_inbox, 'process_inbox', return_value={'retry': 1, 'dead': 0, 'rejected': 0}), \
+                mock.patch.object(webhook_inbox, 'next_due_in', return_value=delay), \
+                mock.patch.object(webhook_inbox, 'call_later') as call_later:
+            webhook_inbox._process_task('paystack', handler)
+        return handler, call_later
+
+    def test_a_drain_wakes_the_consumer_when_the_next_retry_is_due(self):
+        earlier = mock.Mock()
+        webhook_inbox._wakeups['paystack'] = earlier
+
+        handler, call_later = self._drain(90.0)
+
+        earlier.cancel.assert_called_once_with()
+        call_later.assert_called_once_with(90.0, webhook_inbox.schedule_inbox_processing, 'paystack', handler)
+        self.assertIs(webhook_inbox._wakeups['paystack'], call_later.return_value)
+
+    def test_wakeups_are_spaced_out_and_dropped_when_nothing_is_left(self):
+        _, call_later = self._drain(0.0)
+        self.assertEqual(call_later.call_args[0][0], webhook_inbox.WEBHOOK_INBOX_MIN_WAKE_SECONDS)
+
+        _, call_later = self._drain(None)
+        call_later.assert_not_called()
+        self.assertNotIn('paystack', webhook_inbox._wakeups)
+
+    def test_the_consumer_does_not_share_the_background_pool(self):
+        with self.app.app_context(), \
+                mock.patch.object(webhook_inbox._consumer_pool, 'submit') as submit:
+            webhook_inbox.schedule_inbox_processing('paystack', mock.Mock())
+        self.addCleanup(webhook_inbox._pending.discard, 'paystack')
+
+        submit.assert_called_once()
+        self.assertEqual(webhook_inbox._consumer_pool.workers, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+import os
+import hashlib
+import tempfile
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.abspath(os.path.join(_HERE, '..', '..'))
+UPLOAD_ROOT = os.path.join(_PROJECT_ROOT, 'uploads')
+BLOB_FOLDER = os.path.join(UPLOAD_ROOT, 'blobs')
+# Same volume as BLOB_FOLDER so finished uploads can be renamed into place atomically.
+STAGING_FOLDER = os.path.join(UPLOAD_ROOT, '.staging')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# plan_files.file_type prefix -> purchasable deliverable (plans.deliverable_prices key).
+# Keep in sync with the plan_files.deliverable_key backfill in database/migrations.sql.
+DELIVERABLE_KEY_PREFIXES = (
+    ('ARCH', 'architectural'),
+    ('STRUCT', 'structural'),
+    ('MEP', 'mep'),
+    ('CIVIL', 'civil'),
+    ('FIRE', 'fire_safety'),
+    ('INTERIOR', 'interior'),
+    ('BOQ', 'boq'),
+    ('RENDER', 'renders'),
+)
+
+
+def _normalized_extension(filename):
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return ext if 1 < len(ext) <= 12 else ''
+
+
+def blob_storage_key(sha256, extension=''):
+    """Storage key (relative to UPLOAD_ROOT) for a blob: blobs/ab/cd/<sha256><ext>."""
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def hash_file(absolute_path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(absolute_path, 'rb') as handle:
+        while True:
+            chunk = handle.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _commit_staged_file(staged_path, sha256, size, extension):
+    storage_key = blob_storage_key(sha256, extension)
+    absolute_path = os.path.join(UPLOAD_ROOT, storage_key)
+
+    created = False
+    if os.path.exists(absolute_path):
+        # Identical content is already stored; keep a single copy. Touching it
+        # restarts the storage GC grace period for a blob that is about to be referenced.
+        os.remove(staged_path)
+        os.utime(absolute_path)
+    else:
+        os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+        os.chmod(staged_path, 0o644)
+        os.replace(staged_path, absolute_path)
+        created = True
+
+    return _blob_record(storage_key, sha256, size, created)
+
+
+def _blob_record(storage_key, sha256, size, created=False):
+    absolute_path = os.path.join(UPLOAD_ROOT, storage_key)
+    return {
+        'sha256': sha256,
+        'size': size,
+        'storage_key': storage_key,
+        'file_path': f"/uploads/{storage_key}",
+        'absolute_path': absolute_path,
+        'mtime': datetime.utcfromtimestamp(os.stat(absolute_path).st_mtime),
+        'created': created,
+    }
+
+
+def store_stream(stream, filename):
+    """Stream `stream` to disk while hashing it and store the bytes once by SHA-256."""
+    os.makedirs(STAGING_FOLDER, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, staged_path = tempfile.mkstemp(dir=STAGING_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            while True:
+                chunk = stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                handle.write(chunk)
+        return _commit_staged_file(staged_path, digest.hexdigest(), size, _normalized_extension(filename))
+    except BaseException:
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+        raise
+
+
+def store_upload(file):
+    """Store a werkzeug FileStorage in the content-addressed blob store."""
+    return store_stream(file.stream, file.filename)
+
+
+def store_hashed_file(path, sha256, size, filename):
+    """Move an already-written file whose checksum the caller computed (e.g. an
+    assembled chunked upload) into the blob store."""
+    return _commit_staged_file(path, sha256, size, _normalized_extension(filename))
+
+
+def existing_blob(sha256, filename):
+    """The stored-file dict for a blob already in the store, or None if it is not there."""
+    storage_key = blob_storage_key(sha256, _normalized_extension(filename))
+    absolute_path = os.path.join(UPLOAD_ROOT, storage_key)
+    if not os.path.isfile(absolute_path):
+        return None
+    return _blob_record(storage_key, sha256, os.path.getsize(absolute_path))
+
+
+def storage_descriptor(file_path, stored=None):
+    """Canonical storage location persisted on plan_files at upload time.
+
+    `local` keys are relative to UPLOAD_ROOT; `url` keys are absolute URLs
+    (Cloudinary). Downloads resolve files from this without probing the disk.
+    """
+    if stored:
+        return {
+            'storage_backend': 'local',
+            'storage_key': stored['storage_key'],
+            'storage_mtime': stored.get('mtime'),
+            'blob_key': stored['storage_key'],
+            'content_sha256': stored['sha256'],
+        }
+    if isinstance(file_path, str) and file_path.lower().startswith(('http://', 'https://')):
+        return {
+            'storage_backend': 'url',
+            'storage_key': file_path,
+            'storage_mtime': None,
+            'blob_key': None,
+            'content_sha256': None,
+        }
+    return {
+        'storage_backend': None,
+        'storage_key': None,
+        'storage_mtime': None,
+        'blob_key': None,
+        'content_sha256': None,
+    }
+
+
+def deliverable_key_for_file_type(file_type):
+    """Deliverable a plan file belongs to, stored on plan_files.deliverable_key at insert time."""
+    if not file_type:
+        return None
+    ft = str(file_type).upper()
+    for prefix, key in DELIVERABLE_KEY_PREFIXES:
+        if ft.startswith(prefix):
+            return key
+    return None
+
+
+def insert_plan_file_records(cur, plan_id, records):
+    """Insert plan_files rows, registering referenced blobs first.
+
+    Blob reference counts are maintained by the plan_files trigger, so callers
+    only need to insert or delete rows.
+    """
+    if not records:
+        return
+
+    rows = []
+    blobs = {}
+    for record in records:
+        descriptor = storage_descriptor(record['file_path'])
+        descriptor.update({k: record[k] for k in descriptor if record.get(k) is not None})
+        if descriptor['blob_key']:
+            blobs[descriptor['blob_key']] = (
+                descriptor['blob_key'], descriptor['content_sha256'], record.get('file_size')
+            )
+        rows.append((
+            plan_id,
+            record['file_name'],
+            record['file_type'],
+            record['file_path'],
+            record.get('file_size'),
+            descriptor['blob_key'],
+            descriptor['content_sha256'],
+            descriptor['storage_backend'],
+            descriptor['storage_key'],
+            descriptor['storage_mtime'],
+            deliverable_key_for_file_type(record['file_type']),
+        ))
+
+    if blobs:
+        cur.executemany(
+            """
+            INSERT INTO file_blobs (storage_key, sha256, size_bytes)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (storage_key) DO NOTHING
+            """,
+            list(blobs.values())
+        )
+
+    cur.executemany(
+        """
+        INSERT INTO plan_files (
+            plan_id, file_name, file_type, file_path, file_size, blob_key, content_sha256,
+            storage_backend, storage_key, storage_mtime, deliverable_key
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        rows
+    )
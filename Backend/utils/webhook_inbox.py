@@ -0,0 +1,276 @@
+"""
+Inbox for incoming payment webhooks.
+
+The webhook endpoint only checks the signature, stores the event, and
+answers 200. Events are keyed by (provider, event_key), so a redelivery is
+acknowledged without being stored twice. A background consumer then applies
+them. Events for the same payment reference are applied strictly in arrival
+order: an event is only claimed once every earlier event for its reference
+has finished.
+
+A handler runs inside the consumer's transaction and returns (status, note):
+- 'done' commits its work together with the inbox update.
+- 'ignored' or 'rejected' rolls its work back and records the note.
+If the handler raises, the event is retried with backoff and becomes 'dead'
+after WEBHOOK_INBOX_MAX_ATTEMPTS. replay() puts any events back in the queue.
+
+The consumer has its own single-thread pool, so events are not held up by
+slow work (PDF rendering, image derivatives) on the shared background pool.
+After a drain it sets a timer for the next retry that falls due, and
+`manage.py paystack-webhooks` runs on a systemd timer as a backstop for
+retries whose process restarted in the meantime.
+"""
+import os
+import json
+import threading
+
+import psycopg
+from flask import current_app
+from psycopg.rows import dict_row
+
+from utils.background import BackgroundPool, call_later
+
+
+WEBHOOK_INBOX_BATCH_SIZE = int(os.getenv('WEBHOOK_INBOX_BATCH_SIZE', '50'))
+WEBHOOK_INBOX_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_INBOX_MAX_ATTEMPTS', '10'))
+WEBHOOK_INBOX_RETRY_BASE_SECONDS = int(os.getenv('WEBHOOK_INBOX_RETRY_BASE_SECONDS', '30'))
+WEBHOOK_INBOX_RETRY_MAX_SECONDS = int(os.getenv('WEBHOOK_INBOX_RETRY_MAX_SECONDS', str(3600)))
+# An event claimed by a consumer that died is picked up again after this long.
+WEBHOOK_INBOX_LEASE_SECONDS = int(os.getenv('WEBHOOK_INBOX_LEASE_SECONDS', '120'))
+# Lower bound for the wake-up timer, so events waiting behind another worker's lease don't spin it.
+WEBHOOK_INBOX_MIN_WAKE_SECONDS = 5
+
+FINAL_STATUSES = ('done', 'ignored', 'rejected')
+
+_consumer_pool = BackgroundPool('plancave-webhook-inbox', workers=1, queue_limit=16)
+_schedule_lock = threading.Lock()
+_pending = set()
+_wakeups = {}
+
+
+def record_webhook(cur, provider, event_key, event_type, reference, payload):
+    """Store an event in the caller's transaction. Returns its id, or None if it was already stored."""
+    cur.execute(
+        """
+        INSERT INTO webhook_inbox (provider, event_key, event_type, reference, payload)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (provider, event_key) DO NOTHING
+        RETURNING id
+        """,
+        (provider, event_key, event_type, reference, json.dumps(payload))
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row['id'] if isinstance(row, dict) else row[0]
+
+
+def retry_delay(attempts):
+    return min(WEBHOOK_INBOX_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), WEBHOOK_INBOX_RETRY_MAX_SECONDS)
+
+
+def claim_batch(conn, provider, limit):
+    """Lease up to `limit` due events, each the oldest unfinished one for its reference."""
+    cur = conn.cursor(row_factory=dict_row)
+    try:
+        cur.execute(
+            """
+            UPDATE webhook_inbox
+            SET status = 'processing', attempts = attempts + 1,
+                locked_until = NOW() + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT w.id FROM webhook_inbox w
+                WHERE w.provider = %s
+                  AND ((w.status = 'pending' AND w.next_attempt_at <= NOW())
+                       OR (w.status = 'processing' AND w.locked_until < NOW()))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM webhook_inbox earlier
+                      WHERE earlier.provider = w.provider
+                        AND earlier.reference = w.reference
+                        AND earlier.id < w.id
+                        AND earlier.status IN ('pending', 'processing')
+                  )
+                ORDER BY w.id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, event_key, event_type, reference, payload, attempts
+            """,
+            (WEBHOOK_INBOX_LEASE_SECONDS, provider, limit)
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        return sorted(rows, key=lambda r: r['id'])
+    finally:
+        cur.close()
+
+
+def _finish(cur, row, status, note):
+    cur.execute(
+        """
+        UPDATE webhook_inbox
+        SET status = %s, processed_at = NOW(), locked_until = NULL, last_error = %s
+        WHERE id = %s
+        """,
+        (status, note, row['id'])
+    )
+
+
+def _fail(cur, row, error):
+    if row['attempts'] >= WEBHOOK_INBOX_MAX_ATTEMPTS:
+        cur.execute(
+            "UPDATE webhook_inbox SET status = 'dead', locked_until = NULL, last_error = %s WHERE id = %s",
+            (str(error)[:1000], row['id'])
+        )
+        return 'dead'
+    cur.execute(
+        """
+        UPDATE webhook_inbox
+        SET status = 'pending', locked_until = NULL, last_error = %s,
+            next_attempt_at = NOW() + make_interval(secs => %s)
+        WHERE id = %s
+        """,
+        (str(error)[:1000], retry_delay(row['attempts']), row['id'])
+    )
+    return 'retry'
+
+
+def next_due_in(conn, provider):
+    """Seconds until the earliest unfinished event can be claimed again, or None if there are none."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT EXTRACT(EPOCH FROM MIN(
+                CASE WHEN status = 'processing' THEN locked_until ELSE next_attempt_at END
+            ) - NOW())
+            FROM webhook_inbox
+            WHERE provider = %s AND status IN ('pending', 'processing')
+            """,
+            (provider,)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        if not row or row[0] is None:
+            return None
+        return max(float(row[0]), 0.0)
+    finally:
+        cur.close()
+
+
+def process_inbox(conn, provider, handler, batch_size=None, max_batches=None, log=None):
+    """Apply due events with `handler(conn, cur, row)`. Returns counts by outcome."""
+    batch_size = batch_size or WEBHOOK_INBOX_BATCH_SIZE
+    stats = {'done': 0, 'ignored': 0, 'rejected': 0, 'retry': 0, 'dead': 0}
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        rows = claim_batch(conn, provider, batch_size)
+        if not rows:
+            break
+        batches += 1
+
+        for row in rows:
+            cur = conn.cursor(row_factory=dict_row)
+            try:
+                try:
+                    status, note = handler(conn, cur, row)
+                    if status not in FINAL_STATUSES:
+                        raise ValueError(f"handler returned unknown status {status!r}")
+                except Exception as e:
+                    conn.rollback()
+                    outcome = _fail(cur, row, e)
+                    if log:
+                        log(f"Webhook {row['id']} ({row['event_key']}) failed on attempt {row['attempts']}: {e}")
+                else:
+                    if status != 'done':
+                        conn.rollback()
+                    _finish(cur, row, status, note)
+                    outcome = status
+                conn.commit()
+                stats[outcome] += 1
+            finally:
+                cur.close()
+
+        if len(rows) < batch_size:
+            break
+    return stats
+
+
+def _arm_wakeup(provider, handler, delay):
+    """Drain `provider` again after `delay` seconds, replacing any earlier wake-up."""
+    with _schedule_lock:
+        timer = _wakeups.pop(provider, None)
+        if timer is not None:
+            timer.cancel()
+        if delay is not None:
+            delay = max(delay, WEBHOOK_INBOX_MIN_WAKE_SECONDS)
+            _wakeups[provider] = call_later(delay, schedule_inbox_processing, provider, handler)
+
+
+def _process_task(provider, handler):
+    with _schedule_lock:
+        _pending.discard(provider)
+    with psycopg.connect(current_app.config['DATABASE_URL'], connect_timeout=5) as conn:
+        stats = process_inbox(conn, provider, handler, log=current_app.logger.warning)
+        delay = next_due_in(conn, provider)
+    if stats['retry'] or stats['dead'] or stats['rejected']:
+        current_app.logger.warning(f"Webhook inbox ({provider}): {stats}")
+    _arm_wakeup(provider, handler, delay)
+
+
+def schedule_inbox_processing(provider, handler):
+    """Ask the inbox consumer to drain `provider`'s inbox (call after committing a new event).
+
+    Requests made while a run is already queued are folded into it.
+    """
+    with _schedule_lock:
+        if provider in _pending:
+            return None
+        _pending.add(provider)
+    future = _consumer_pool.submit(_process_task, provider, handler)
+    if future is None:
+        with _schedule_lock:
+            _pending.discard(provider)
+    return future
+
+
+def replay(conn, provider, ids=None, statuses=('dead',)):
+    """Put events back in the queue: the given ids, or every event in `statuses`. Returns how many."""
+    cur = conn.cursor()
+    try:
+        if ids:
+            cur.execute(
+                """
+                UPDATE webhook_inbox
+                SET status = 'pending', attempts = 0, next_attempt_at = NOW(), locked_until = NULL
+                WHERE provider = %s AND id = ANY(%s)
+                """,
+                (provider, list(ids))
+            )
+        else:
+            cur.execute(
+                """
+                UPDATE webhook_inbox
+                SET status = 'pending', attempts = 0, next_attempt_at = NOW(), locked_until = NULL
+                WHERE provider = %s AND status = ANY(%s)
+                """,
+                (provider, list(statuses))
+            )
+        count = cur.rowcount
+        conn.commit()
+        return count
+    finally:
+        cur.close()
+
+
+def inbox_counts(conn, provider):
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT status, COUNT(*) FROM webhook_inbox WHERE provider = %s GROUP BY status ORDER BY status",
+            (provider,)
+        )
+        return {status: count for status, count in cur.fetchall()}
+    finally:
+        cur.close()
@@ -7,7 +7,8 @@
 #   * Create/refresh Python virtualenv and install backend deps
 #   * Build the frontend bundle
 #   * Ensure uploads directory ownership
-#   * Configure systemd service for Gunicorn
+#   * Configure systemd services for Gunicorn (sync workers, plus a gevent
+#     "outbound" tier for endpoints that wait on Paystack/LLM/Cloudinary)
 #   * Configure nginx site proxying /api to Gunicorn and serving frontend
 #   * Open firewall ports 80/443 if ufw is available
 #
@@ -16,8 +17,9 @@
 #
 # Optional environment overrides:
 #   PLANCAVE_SERVICE_NAME, PLANCAVE_SERVER_NAME, PLANCAVE_API_PREFIX,
-#   PLANCAVE_BACKEND_PORT, PLANCAVE_BACKEND_HOST, PLANCAVE_APP_USER,
-#   PLANCAVE_APP_GROUP, PLANCAVE_ENV_FILE, PLANCAVE_UPLOAD_DIR,
+#   PLANCAVE_BACKEND_PORT, PLANCAVE_OUTBOUND_PORT, PLANCAVE_BACKEND_HOST, PLANCAVE_APP_USER,
+#   PLANCAVE_APP_GROUP, PLANCAVE_ENV_FILE, PLANCAVE_UPLOAD_DIR, PLANCAVE_RECONCILE_INTERVAL,
+#   PLANCAVE_WEBHOOK_DRAIN_INTERVAL, PLANCAVE_EMAIL_OUTBOX_INTERVAL,
 #   PLANCAVE_NODE_MAJOR, PLANCAVE_CONFIGURE_UFW
 
 set -euo pipefail
@@ -38,6 +40,7 @@ SERVICE_NAME="${PLANCAVE_SERVICE_NAME:-plancave}"
 SERVER_NAME="${PLANCAVE_SERVER_NAME:-_}"
 API_PREFIX="${PLANCAVE_API_PREFIX:-/api}"
 BACKEND_PORT="${PLANCAVE_BACKEND_PORT:-8000}"
+OUTBOUND_PORT="${PLANCAVE_OUTBOUND_PORT:-8001}"
 BACKEND_HOST="${PLANCAVE_BACKEND_HOST:-127.0.0.1}"
 APP_USER="${PLANCAVE_APP_USER:-$DEFAULT_USER}"
 APP_GROUP="${PLANCAVE_APP_GROUP:-$DEFAULT_GROUP}"
@@ -47,6 +50,14 @@ NODE_MAJOR="${PLANCAVE_NODE_MAJOR:-20}"
 CONFIGURE_UFW="${PLANCAVE_CONFIGURE_UFW:-true}"
 
 SYSTEMD_UNIT="/etc/systemd/system/${SERVICE_NAME}.service"
+OUTBOUND_SERVICE_NAME="${SERVICE_NAME}-outbound"
+OUTBOUND_SYSTEMD_UNIT="/etc/systemd/system/${OUTBOUND_SERVICE_NAME}.service"
+RECONCILE_SERVICE_NAME="${SERVICE_NAME}-paystack-reconcile"
+RECONCILE_INTERVAL="${PLANCAVE_RECONCILE_INTERVAL:-2min}"
+WEBHOOKS_SERVICE_NAME="${SERVICE_NAME}-paystack-webhooks"
+WEBHOOK_DRAIN_INTERVAL="${PLANCAVE_WEBHOOK_DRAIN_INTERVAL:-1min}"
+EMAIL_OUTBOX_SERVICE_NAME="${SERVICE_NAME}-email-outbox"
+EMAIL_OUTBOX_INTERVAL="${PLANCAVE_EMAIL_OUTBOX_INTERVAL:-2min}"
 NGINX_SITE="/etc/nginx/sites-available/${SERVICE_NAME}"
 NGINX_SITE_ENABLED="/etc/nginx/sites-enabled/${SERVICE_NAME}"
 METADATA_HEADER="Metadata-Flavor: Google"
@@ -126,6 +137,108 @@ Restart=always
 
 [Install]
 WantedBy=multi-user.target
+EOF
+
+  log "Writing systemd unit $OUTBOUND_SYSTEMD_UNIT"
+  cat >"$OUTBOUND_SYSTEMD_UNIT" <<EOF
+[Unit]
+Description=Ramanicave Backend (outbound tier)
+After=network.target
+
+[Service]
+User=$APP_USER
+Group=$APP_GROUP
+WorkingDirectory=$BACKEND_DIR
+EnvironmentFile=$ENV_FILE
+ExecStart=$VENV_DIR/bin/gunicorn -c gunicorn_outbound.conf.py -b $BACKEND_HOST:$OUTBOUND_PORT app:app
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+  # Completes pending Paystack purchases whose buyer never came back to verify.
+  log "Writing systemd timer ${RECONCILE_SERVICE_NAME}.timer"
+  cat >"/etc/systemd/system/${RECONCILE_SERVICE_NAME}.service" <<EOF
+[Unit]
+Description=Ramanicave Paystack reconciliation
+After=network.target
+
+[Service]
+Type=oneshot
+User=$APP_USER
+Group=$APP_GROUP
+WorkingDirectory=$BACKEND_DIR
+EnvironmentFile=$ENV_FILE
+ExecStart=$VENV_DIR/bin/python manage.py paystack-reconcile
+EOF
+
+  cat >"/etc/systemd/system/${RECONCILE_SERVICE_NAME}.timer" <<EOF
+[Unit]
+Description=Run Ramanicave Paystack reconciliation every $RECONCILE_INTERVAL
+
+[Timer]
+OnBootSec=5min
+OnUnitInactiveSec=$RECONCILE_INTERVAL
+
+[Install]
+WantedBy=timers.target
+EOF
+
+  # Retries Paystack webhook events whose backoff outlived the process that scheduled them.
+  log "Writing systemd timer ${WEBHOOKS_SERVICE_NAME}.timer"
+  cat >"/etc/systemd/system/${WEBHOOKS_SERVICE_NAME}.service" <<EOF
+[Unit]
+Description=Ramanicave Paystack webhook inbox drain
+After=network.target
+
+[Service]
+Type=oneshot
+User=$APP_USER
+Group=$APP_GROUP
+WorkingDirectory=$BACKEND_DIR
+EnvironmentFile=$ENV_FILE
+ExecStart=$VENV_DIR/bin/python manage.py paystack-webhooks
+EOF
+
+  cat >"/etc/systemd/system/${WEBHOOKS_SERVICE_NAME}.timer" <<EOF
+[Unit]
+Description=Drain the Ramanicave Paystack webhook inbox every $WEBHOOK_DRAIN_INTERVAL
+
+[Timer]
+OnBootSec=2min
+OnUnitInactiveSec=$WEBHOOK_DRAIN_INTERVAL
+
+[Install]
+WantedBy=timers.target
+EOF
+
+  # Sends queued emails whose retry outlived the process that scheduled it.
+  log "Writing systemd timer ${EMAIL_OUTBOX_SERVICE_NAME}.timer"
+  cat >"/etc/systemd/system/${EMAIL_OUTBOX_SERVICE_NAME}.service" <<EOF
+[Unit]
+Description=Ramanicave email outbox flush
+After=network.target
+
+[Service]
+Type=oneshot
+User=$APP_USER
+Group=$APP_GROUP
+WorkingDirectory=$BACKEND_DIR
+EnvironmentFile=$ENV_FILE
+ExecStart=$VENV_DIR/bin/python manage.py email-outbox
+EOF
+
+  cat >"/etc/systemd/system/${EMAIL_OUTBOX_SERVICE_NAME}.timer" <<EOF
+[Unit]
+Description=Flush the Ramanicave email outbox every $EMAIL_OUTBOX_INTERVAL
+
+[Timer]
+OnBootSec=3min
+OnUnitInactiveSec=$EMAIL_OUTBOX_INTERVAL
+
+[Install]
+WantedBy=timers.target
 EOF
 }
 
@@ -144,6 +257,44 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
     }
 
+    # Endpoints that mostly wait on Paystack, the LLM or Cloudinary run on the
+    # gevent tier, so a slow upstream can't tie up the sync workers.
+    # Regex locations win over the prefix location above.
+    location ~ ^$API_PREFIX/(customer/plans/purchase|customer/payments/paystack/(verify|retry)/.+|customer/admin/payments/paystack/(verify|confirm)/.+|ai/chat|me/avatar)\$ {
+        rewrite ^$API_PREFIX/(.*)\$ /\$1 break;
+        proxy_pass http://$BACKEND_HOST:$OUTBOUND_PORT;
+        proxy_read_timeout 90s;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+    }
+
+    # Purchase status streams (server-sent events) are long-lived and idle
+    # between heartbeats; the gevent tier holds them without pinning a worker.
+    location ~ ^$API_PREFIX/customer/purchases/[^/]+/events\$ {
+        rewrite ^$API_PREFIX/(.*)\$ /\$1 break;
+        proxy_pass http://$BACKEND_HOST:$OUTBOUND_PORT;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_buffering off;
+        proxy_cache off;
+        proxy_read_timeout 360s;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+    }
+
+    # Flask authorizes file requests and answers with X-Accel-Redirect
+    # (FILE_SERVING_BACKEND=x-accel-redirect); nginx streams the bytes.
+    location /protected-uploads/ {
+        internal;
+        alias $UPLOAD_DIR/;
+        sendfile on;
+        tcp_nopush on;
+    }
+
     root $FRONTEND_DIR/dist;
     index index.html;
 
@@ -186,6 +337,11 @@ get_external_ip() {
 reload_services() {
   systemctl daemon-reload
   systemctl enable --now "$SERVICE_NAME"
+  systemctl enable --now "$OUTBOUND_SERVICE_NAME"
+  systemctl enable --now "${RECONCILE_SERVICE_NAME}.timer"
+  systemctl enable --now "${WEBHOOKS_SERVICE_NAME}.timer"
+  systemctl enable --now "${EMAIL_OUTBOX_SERVICE_NAME}.timer"
+  systemctl restart "$SERVICE_NAME" "$OUTBOUND_SERVICE_NAME"
   systemctl reload nginx
 }
 
@@ -197,6 +353,7 @@ print_summary() {
 
 [deploy] Done!
 Backend service : systemctl status $SERVICE_NAME
+Outbound tier   : systemctl status $OUTBOUND_SERVICE_NAME
 Nginx site      : $NGINX_SITE
 Frontend URL    : http://$external_ip/
 API base URL    : http://$external_ip$API_PREFIX/
@@ -102,16 +102,38 @@ export const getMyProfile = () =>
 export const updateMyProfile = (data: any) =>
   api.put('/me', data);
 
-export const uploadMyAvatar = (file: File) => {
+// Direct uploads: the browser sends the file straight to storage using
+// short-lived signed parameters, then the API records the result.
+export const directUpload = async (
+  file: File,
+  purpose: 'avatar' | 'thumbnail' | 'gallery' | 'plan_file',
+  options: { plan_id?: string; file_type?: string } = {},
+) => {
+  const { data: signed } = await api.post('/direct-uploads/sign', {
+    purpose,
+    file_name: file.name,
+    ...options,
+  });
+
   const formData = new FormData();
-  formData.append('avatar', file);
-  return api.post('/me/avatar', formData, {
-    headers: {
-      'Content-Type': 'multipart/form-data',
-    },
+  Object.entries(signed.fields as Record<string, string | number>).forEach(([key, value]) =>
+    formData.append(key, String(value)),
+  );
+  formData.append(signed.file_field, file);
+
+  // The local stand-in lives on the API; Cloudinary gets a plain, credential-less request.
+  const uploadResponse = signed.backend === 'local'
+    ? await api.post(signed.upload_url, formData, { headers: { 'Content-Type': 'multipart/form-data' }, timeout: 0 })
+    : await axios.post(signed.upload_url, formData, { timeout: 0 });
+
+  return api.post('/direct-uploads/confirm', {
+    upload_token: signed.upload_token,
+    result: uploadResponse.data,
   });
 };
 
+export const uploadMyAvatar = (file: File) => directUpload(file, 'avatar');
+
 // Plans
 export const browsePlans = (params?: Record<string, any>) =>
   // Use trailing slash to avoid HTTP->HTTPS redirect issues in production
@@ -167,6 +189,86 @@ export const adminDownloadPlan = (plan_id: string) =>
 export const verifyPurchase = (plan_id: string) =>
   api.get(`/customer/plans/${plan_id}/purchase-status`);
 
+export type PurchaseStatusEvent = {
+  purchase_id: string;
+  plan_id?: string;
+  status: string;
+  reference?: string | null;
+  download_ready?: boolean;
+};
+
+// Follows a purchase's server-sent status events until it completes or fails.
+// Uses fetch rather than EventSource so the access token stays in a header
+// (not in URLs that end up in proxy logs). Reconnects when the server ends
+// the stream. Returns a function that stops watching.
+export const watchPurchaseStatus = (
+  purchaseId: string,
+  onStatus: (event: PurchaseStatusEvent) => void,
+  onError?: (httpStatus?: number) => void
+) => {
+  const controller = new AbortController();
+  let retryMs = 3000;
+  let finished = false;
+
+  const handleChunk = (chunk: string) => {
+    let eventName = 'message';
+    const dataLines: string[] = [];
+    for (const line of chunk.split('\n')) {
+      if (line.startsWith('retry:')) retryMs = Number(line.slice(6).trim()) || retryMs;
+      else if (line.startsWith('event:')) eventName = line.slice(6).trim();
+      else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+    }
+    if (eventName !== 'status' || dataLines.length === 0) return;
+    try {
+      const event = JSON.parse(dataLines.join('\n')) as PurchaseStatusEvent;
+      if (event.status === 'completed' || event.status === 'failed') finished = true;
+      onStatus(event);
+    } catch {
+      // ignore malformed events
+    }
+  };
+
+  const connect = async () => {
+    while (!finished && !controller.signal.aborted) {
+      try {
+        const headers: Record<string, string> = { Accept: 'text/event-stream' };
+        if (memoryAccessToken) headers.Authorization = `Bearer ${memoryAccessToken}`;
+        const resp = await fetch(`${getApiBaseUrl()}/customer/purchases/${purchaseId}/events`, {
+          headers,
+          credentials: 'include',
+          signal: controller.signal,
+        });
+        if (!resp.ok || !resp.body) {
+          onError?.(resp.status);
+          return;
+        }
+        const reader = resp.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let boundary = buffer.indexOf('\n\n');
+          while (boundary !== -1) {
+            handleChunk(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            boundary = buffer.indexOf('\n\n');
+          }
+        }
+      } catch {
+        if (controller.signal.aborted) return;
+      }
+      if (!finished && !controller.signal.aborted) {
+        await new Promise((r) => window.setTimeout(r, retryMs));
+      }
+    }
+  };
+
+  connect();
+  return () => controller.abort();
+};
+
 export const getFavorites = () =>
   api.get('/customer/favorites');
 
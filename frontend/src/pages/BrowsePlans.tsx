@@ -20,6 +20,7 @@ interface Plan {
   includes_boq: boolean;
   disciplines_included: any;
   image_url: string;
+  image_variants?: { webp?: string; avif?: string; placeholder?: string | null };
   sales_count: number;
   certifications?: string[];
   created_at: string;
@@ -669,11 +670,21 @@ export default function BrowsePlans() {
                 >
                   {/* Image */}
                   <div className="relative aspect-[4/3] overflow-hidden bg-slate-100">
-                    <img
-                      src={(plan.image_url ? resolveMediaUrl(plan.image_url) : '/vite.svg')}
-                      alt={plan.name}
-                      className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-[1.06]"
-                    />
+                    <picture>
+                      {plan.image_variants?.avif && (
+                        <source type="image/avif" srcSet={plan.image_variants.avif} sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw" />
+                      )}
+                      {plan.image_variants?.webp && (
+                        <source type="image/webp" srcSet={plan.image_variants.webp} sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw" />
+                      )}
+                      <img
+                        src={(plan.image_url ? resolveMediaUrl(plan.image_url) : '/vite.svg')}
+                        loading="lazy"
+                        style={plan.image_variants?.placeholder ? { backgroundImage: `url(${plan.image_variants.placeholder})`, backgroundSize: 'cover' } : undefined}
+                        alt={plan.name}
+                        className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-[1.06]"
+                      />
+                    </picture>
                     <div className="absolute inset-0 bg-gradient-to-t from-black/70 via-black/20 to-transparent" />
                     <div className="absolute bottom-3 left-4 right-4 flex items-end justify-between gap-2">
                       <h3 className="text-lg font-semibold text-white drop-shadow-lg line-clamp-2">
@@ -19,6 +19,7 @@ interface Plan {
   includes_boq: boolean;
   disciplines_included: any;
   image_url: string;
+  image_variants?: { webp?: string; avif?: string; placeholder?: string | null };
   sales_count: number;
   total_views?: number;
   certifications?: string[];
@@ -62,11 +63,21 @@ const PlanShowcase = ({ title, subtitle, plans, cta, ctaLink, badge, metric }: P
           {plans.map((plan) => (
             <div key={plan.id} className="group relative rounded-2xl overflow-hidden bg-gradient-to-b from-slate-800/50 to-slate-900/80 border border-white/5 hover:border-white/20 transition-all hover:shadow-xl hover:shadow-purple-500/10">
               <div className="relative aspect-[4/3] overflow-hidden">
-                <img
-                  src={plan.image_url ? resolveMediaUrl(plan.image_url) : '/vite.svg'}
-                  alt={plan.name}
-                  className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-105"
-                />
+                <picture>
+                  {plan.image_variants?.avif && (
+                    <source type="image/avif" srcSet={plan.image_variants.avif} sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw" />
+                  )}
+                  {plan.image_variants?.webp && (
+                    <source type="image/webp" srcSet={plan.image_variants.webp} sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw" />
+                  )}
+                  <img
+                    src={plan.image_url ? resolveMediaUrl(plan.image_url) : '/vite.svg'}
+                    loading="lazy"
+                    style={plan.image_variants?.placeholder ? { backgroundImage: `url(${plan.image_variants.placeholder})`, backgroundSize: 'cover' } : undefined}
+                    alt={plan.name}
+                    className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-105"
+                  />
+                </picture>
                 <div className="absolute inset-0 bg-gradient-to-t from-black/80 via-black/30 to-transparent"></div>
                 
                 <div className="absolute top-4 left-4 flex gap-2">
@@ -1,6 +1,6 @@
 import { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { verifyPaystackPayment } from '../api';
+import { verifyPaystackPayment, watchPurchaseStatus } from '../api';
 
 export default function PaystackCallback() {
   const navigate = useNavigate();
@@ -34,13 +34,40 @@ export default function PaystackCallback() {
     }
 
     let cancelled = false;
+    let stopWatching: (() => void) | null = null;
 
     const sleep = (ms: number) => new Promise((r) => window.setTimeout(r, ms));
 
+    const succeed = (planId: string | null) => {
+      setStatus('success');
+      setMessage('Payment verified. Finishing up…');
+      notifyOpener({ reference, planId });
+      // Try to close immediately (best UX: user never sees this page).
+      try {
+        window.close();
+      } catch {
+        // ignore
+      }
+
+      // If close() is blocked, show minimal info + redirect.
+      window.setTimeout(() => {
+        if (!window.closed) {
+          setCloseBlocked(true);
+          if (planId) {
+            navigate(`/plans/${planId}`);
+          } else {
+            navigate('/purchases');
+          }
+        }
+      }, 250);
+    };
+
     const run = async () => {
-      // Paystack can be eventually consistent for a few seconds even after "success".
-      // Also, the backend may return 202 while waiting for paid_at.
-      const delays = [800, 1200, 2000, 3000, 4000];
+      // Paystack can be eventually consistent for a few seconds even after "success", so the
+      // backend may answer 202. Rather than polling, wait for the server to push the completion
+      // (it arrives through Paystack's webhook or the reconciliation job).
+      // Only transient failures are retried here.
+      const delays = [800, 2000, 4000];
 
       for (let attempt = 0; attempt < delays.length; attempt++) {
         if (cancelled) return;
@@ -52,27 +79,36 @@ export default function PaystackCallback() {
           const planId = resp.data?.plan_id;
           if (cancelled) return;
 
-          setStatus('success');
-          setMessage('Payment verified. Finishing up…');
-          notifyOpener({ reference, planId: planId ? String(planId) : null });
-          // Try to close immediately (best UX: user never sees this page).
-          try {
-            window.close();
-          } catch {
-            // ignore
+          if (resp.status === 202) {
+            const purchaseId: string | undefined = resp.data?.purchase_id;
+            setMessage(resp.data?.message || 'Payment is being confirmed…');
+            if (!purchaseId) {
+              setStatus('error');
+              return;
+            }
+            stopWatching = watchPurchaseStatus(
+              purchaseId,
+              (event) => {
+                if (cancelled) return;
+                if (event.status === 'completed') {
+                  succeed(event.plan_id ? String(event.plan_id) : null);
+                } else if (event.status === 'failed') {
+                  setStatus('error');
+                  setMessage('Payment failed. Please try again.');
+                }
+              },
+              (httpStatus) => {
+                if (cancelled) return;
+                setStatus('error');
+                setMessage(httpStatus === 401
+                  ? 'Please sign in again to complete verification.'
+                  : 'Payment is still being confirmed. Check your purchases in a moment.');
+              }
+            );
+            return;
           }
 
-          // If close() is blocked, show minimal info + redirect.
-          window.setTimeout(() => {
-            if (!window.closed) {
-              setCloseBlocked(true);
-              if (planId) {
-                navigate(`/plans/${planId}`);
-              } else {
-                navigate('/purchases');
-              }
-            }
-          }, 250);
+          succeed(planId ? String(planId) : null);
           return;
         } catch (err: any) {
           if (cancelled) return;
@@ -90,9 +126,8 @@ export default function PaystackCallback() {
             return;
           }
 
-          // Retry on "not completed yet" (202), rate limiting, or transient server errors.
+          // Retry on rate limiting or transient server errors.
           const shouldRetry =
-            httpStatus === 202 ||
             httpStatus === 429 ||
             (typeof httpStatus === 'number' && httpStatus >= 500);
 
@@ -113,6 +148,7 @@ export default function PaystackCallback() {
     run();
     return () => {
       cancelled = true;
+      stopWatching?.();
     };
   }, [navigate]);
 
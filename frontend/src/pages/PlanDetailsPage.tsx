@@ -1,6 +1,6 @@
 import { useEffect, useRef, useState } from 'react';
 import { useParams, useNavigate, useLocation } from 'react-router-dom';
-import { getPlanDetails, adminDownloadPlan, designerDownloadPlan, purchasePlan, verifyPurchase, verifyPaystackPayment, trackPlanView } from '../api';
+import { getPlanDetails, adminDownloadPlan, designerDownloadPlan, purchasePlan, verifyPurchase, verifyPaystackPayment, watchPurchaseStatus, trackPlanView } from '../api';
 import { useAuth } from '../contexts/AuthContext';
 import { useCustomerData } from '../contexts/CustomerDataContext';
 import {
@@ -28,6 +28,14 @@ interface PlanFile {
   file_path: string;
 }
 
+interface PreviewPage {
+  page: number;
+  width: number;
+  height: number;
+  url: string;
+  file_name?: string;
+}
+
 interface StructuralSpec {
   spec_type: string;
   specification: string;
@@ -65,6 +73,7 @@ interface PlanDetailsData {
   sales_count?: number;
   created_at?: string;
   files?: PlanFile[];
+  preview_pages?: PreviewPage[];
   structural_specs?: StructuralSpec[];
   designer_id?: number;
   designer_name?: string | null;
@@ -208,7 +217,8 @@ export default function PlanDetailsPage() {
   }, [isAuthenticated]);
 
   // Auto-verify when we have a pending reference (e.g. user paid in Paystack tab and returned).
-  // This avoids needing a manual "I have paid" click.
+  // This avoids needing a manual "I have paid" click. If Paystack hasn't settled yet, the
+  // server pushes the completion (from its webhook or reconciliation) instead of us polling.
   useEffect(() => {
     if (!isAuthenticated) return;
     if (purchaseStatus !== 'processing') {
@@ -222,29 +232,53 @@ export default function PlanDetailsPage() {
     autoVerifyProcessingRef.current = true;
 
     let cancelled = false;
+    let stopWatching: (() => void) | null = null;
     const sleep = (ms: number) => new Promise((r) => window.setTimeout(r, ms));
 
+    const finish = () => {
+      setPurchaseStatus('purchased');
+      setPurchaseSuccess(true);
+      setPendingReference(null);
+      navigate('/purchases', { state: { refresh: true } });
+    };
+
     const run = async () => {
-      const delays = [800, 1200, 2000, 3000, 4000];
+      // Only transient failures are retried; "not settled yet" waits on the status stream.
+      const delays = [800, 2000, 4000];
 
       for (let attempt = 0; attempt < delays.length; attempt++) {
         if (cancelled) return;
         setDownloadError(null);
-        setIsPurchasing(true);
         try {
-          await verifyPaystackPayment(pendingReference);
+          const resp = await verifyPaystackPayment(pendingReference);
           if (cancelled) return;
-          setPurchaseStatus('purchased');
-          setPurchaseSuccess(true);
-          setPendingReference(null);
-          navigate('/purchases', { state: { refresh: true } });
+          const purchaseId: string | undefined = resp.data?.purchase_id;
+          if (resp.status !== 202) {
+            finish();
+            return;
+          }
+          setDownloadError(resp.data?.message || 'Payment is being confirmed…');
+          if (!purchaseId) return;
+          stopWatching = watchPurchaseStatus(
+            purchaseId,
+            (event) => {
+              if (cancelled) return;
+              if (event.status === 'completed') {
+                finish();
+              } else if (event.status === 'failed') {
+                setDownloadError('Payment failed. Please try again.');
+              }
+            },
+            () => {
+              if (!cancelled) setDownloadError('Lost track of the payment. Use "Retry verification" once you have paid.');
+            }
+          );
           return;
         } catch (err: any) {
           if (cancelled) return;
           const httpStatus: number | undefined = err?.response?.status;
           const serverMsg: string | undefined = err?.response?.data?.message;
           const shouldRetry =
-            httpStatus === 202 ||
             httpStatus === 429 ||
             (typeof httpStatus === 'number' && httpStatus >= 500);
 
@@ -256,8 +290,6 @@ export default function PlanDetailsPage() {
 
           setDownloadError(serverMsg || 'Payment verification failed. If you just paid, please wait a moment and retry.');
           return;
-        } finally {
-          if (!cancelled) setIsPurchasing(false);
         }
       }
     };
@@ -265,6 +297,7 @@ export default function PlanDetailsPage() {
     run();
     return () => {
       cancelled = true;
+      stopWatching?.();
     };
   }, [isAuthenticated, purchaseStatus, pendingReference, isPurchasing, navigate]);
 
@@ -619,7 +652,12 @@ export default function PlanDetailsPage() {
     setDownloadError(null);
     setIsPurchasing(true);
     try {
-      await verifyPaystackPayment(ref);
+      const resp = await verifyPaystackPayment(ref);
+      if (resp.status === 202) {
+        // Not settled yet; the status stream picks up the completion.
+        setDownloadError(resp.data?.message || 'Payment is being confirmed…');
+        return;
+      }
       setPurchaseStatus('purchased');
       setPurchaseSuccess(true);
       setPendingReference(null);
@@ -872,6 +910,32 @@ export default function PlanDetailsPage() {
                 ))}
               </div>
             )}
+
+            {plan.preview_pages && plan.preview_pages.length > 0 && (
+              <div className="mt-5">
+                <h3 className="text-sm font-semibold text-slate-700 mb-2">Drawing previews</h3>
+                <div className="flex gap-3 overflow-x-auto">
+                  {plan.preview_pages.map((preview) => (
+                    <a
+                      key={preview.url}
+                      href={resolveMediaUrl(preview.url)}
+                      target="_blank"
+                      rel="noreferrer"
+                      className="flex-shrink-0 rounded-xl border border-slate-200 bg-white overflow-hidden hover:border-teal-300 transition-colors"
+                    >
+                      <img
+                        src={resolveMediaUrl(preview.url)}
+                        alt={`${preview.file_name || 'Drawing'} page ${preview.page}`}
+                        width={preview.width}
+                        height={preview.height}
+                        loading="lazy"
+                        className="h-40 w-auto object-contain"
+                      />
+                    </a>
+                  ))}
+                </div>
+              </div>
+            )}
           </div>
 
           <div className="rounded-2xl border border-slate-200/70 bg-white/80 backdrop-blur shadow-sm p-5 sm:p-6">